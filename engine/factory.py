@@ -85,7 +85,9 @@ class EngineFactory(IBus.Factory): # type: ignore
                     m17n_ime_name = match.group('name')
                     user_db_file = f'user-{m17n_ime_lang}-{m17n_ime_name}.db'
                 self.database = tabsqlitedb.TabSqliteDb(
-                    user_db_file=user_db_file)
+                    user_db_file=user_db_file,
+                    write_behind=True,
+                    ngram_model=True)
                 self.database_dict[engine_name] = self.database
             if engine_name in self.enginedict:
                 engine = self.enginedict[engine_name]
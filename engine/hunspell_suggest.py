@@ -28,8 +28,15 @@ from typing import Tuple
 from typing import List
 from typing import Iterable
 from typing import Any
+from typing import Optional
 import os
 import sys
+import bisect
+import array
+import mmap
+import json
+import threading
+import fnmatch
 import unicodedata
 import logging
 import itb_util
@@ -77,6 +84,146 @@ except (ImportError,):
 # letter of a word until the candidate lookup table pops up.
 MAX_WORDS = 100
 
+# Spellchecking suggestions are only looked up for input of at least
+# this length:
+SPELLCHECK_MIN_LENGTH = 4
+
+# Version of the format of the files used to cache the parsed
+# dictionaries in $XDG_CACHE_HOME/ibus-typing-booster/hunspell/.
+# Increase this whenever the format or the way the cached data
+# is computed changes, then all existing cache files are ignored
+# and rewritten.
+DICTIONARY_CACHE_VERSION = 1
+DICTIONARY_CACHE_MAGIC = b'ibus-typing-booster dictionary cache\n'
+
+# Parameters of the optional fast correction index of a dictionary,
+# see Dictionary.build_correction_index(). Only the first
+# CORRECTION_PREFIX_LENGTH characters of the words are indexed, which
+# keeps the index small, the complete words are compared when
+# verifying the candidates. Verifying at most
+# CORRECTION_MAX_CANDIDATES words bounds the time for a lookup.
+CORRECTION_MAX_DISTANCE = 2
+CORRECTION_PREFIX_LENGTH = 7
+CORRECTION_MAX_CANDIDATES = 500
+CORRECTION_MAX_RESULTS = 10
+
+def _deletes(text: str, max_distance: int) -> List[str]:
+    '''Returns the strings which can be made from text by deleting
+    up to max_distance characters
+
+    :param text: The string to delete characters from
+    :param max_distance: The maximum number of characters to delete
+    :return: List of strings without duplicates, ordered by the number
+             of characters deleted, starting with text itself.
+
+    Examples:
+
+    >>> _deletes('abc', 1)
+    ['abc', 'bc', 'ac', 'ab']
+
+    >>> _deletes('aab', 2)
+    ['aab', 'ab', 'aa', 'b', 'a']
+    '''
+    result = [text]
+    seen = {text}
+    frontier = [text]
+    for _distance in range(max_distance):
+        next_frontier = []
+        for string in frontier:
+            for index in range(len(string)):
+                deleted = string[:index] + string[index + 1:]
+                if deleted not in seen:
+                    seen.add(deleted)
+                    next_frontier.append(deleted)
+        result += next_frontier
+        frontier = next_frontier
+    return result
+
+def edit_distance(string1: str, string2: str, max_distance: int) -> int:
+    '''Returns the Damerau-Levenshtein distance between two strings
+    (optimal string alignment variant) if it is not greater than
+    max_distance
+
+    :param string1: First string to compare
+    :param string2: Second string to compare
+    :param max_distance: The maximum distance of interest
+    :return: The distance if it is less than or equal to max_distance,
+             max_distance + 1 otherwise.
+
+    Only a band of width 2 * max_distance + 1 around the diagonal is
+    computed and the computation stops as soon as the distance is
+    known to be too big, which makes this cheap enough to verify
+    hundreds of candidates per keystroke.
+
+    Examples:
+
+    >>> edit_distance('kissa', 'kissa', 2)
+    0
+
+    >>> edit_distance('kisssa', 'kissa', 2)
+    1
+
+    >>> edit_distance('ksisa', 'kissa', 2)
+    1
+
+    >>> edit_distance('kisa', 'kissat', 2)
+    2
+
+    >>> edit_distance('abcdefgh', 'hgfedcba', 2)
+    3
+    '''
+    too_far = max_distance + 1
+    if abs(len(string1) - len(string2)) > max_distance:
+        return too_far
+    # Common prefixes and suffixes do not change the distance:
+    start = 0
+    shorter = min(len(string1), len(string2))
+    while start < shorter and string1[start] == string2[start]:
+        start += 1
+    end = 0
+    while (end < shorter - start
+           and string1[-1 - end] == string2[-1 - end]):
+        end += 1
+    string1 = string1[start:len(string1) - end]
+    string2 = string2[start:len(string2) - end]
+    len1 = len(string1)
+    len2 = len(string2)
+    if not len1 or not len2:
+        return max(len1, len2)
+    previous2: List[int] = []
+    previous = [x if x <= max_distance else too_far for x in range(len2 + 1)]
+    for index1 in range(1, len1 + 1):
+        current = [too_far] * (len2 + 1)
+        if index1 <= max_distance:
+            current[0] = index1
+        char1 = string1[index1 - 1]
+        row_minimum = too_far
+        for index2 in range(max(1, index1 - max_distance),
+                            min(len2, index1 + max_distance) + 1):
+            # Comparisons instead of min() because this is the
+            # innermost loop:
+            distance = previous[index2 - 1]
+            if char1 != string2[index2 - 1]:
+                distance = previous[index2]
+                if current[index2 - 1] < distance:
+                    distance = current[index2 - 1]
+                if previous[index2 - 1] < distance:
+                    distance = previous[index2 - 1]
+                if (index1 > 1 and index2 > 1
+                        and char1 == string2[index2 - 2]
+                        and string1[index1 - 2] == string2[index2 - 1]
+                        and previous2[index2 - 2] < distance):
+                    distance = previous2[index2 - 2]
+                distance += 1
+            current[index2] = distance
+            if distance < row_minimum:
+                row_minimum = distance
+        if row_minimum > max_distance:
+            return too_far
+        previous2 = previous
+        previous = current
+    return min(previous[len2], too_far)
+
 # pylint: disable=attribute-defined-outside-init
 class Dictionary():
     '''A class to hold a hunspell dictionary'''
@@ -108,10 +255,23 @@ class Dictionary():
         self.encoding = 'UTF-8'
         self.words: List[str]= []
         self.word_pairs: List[Tuple[str, str]] = []
+        # Casefolded match keys sorted for prefix lookups with bisect
+        # and the indexes into self.words of the words they belong to:
+        self.prefix_keys: List[str] = []
+        self.prefix_indexes: 'array.array[int]' = array.array('I')
         self.max_word_len = 0 # maximum length of words in this dictionary
         self.enchant_dict = None
         self.pyhunspell_object = None
         self.voikko: libvoikko.Voikko = None
+        # The spellchecker objects are not thread safe but candidates
+        # may be computed in a worker thread while the main thread
+        # spellchecks the preedit:
+        self._spellcheck_lock = threading.RLock()
+        # Optional index to find corrections fast, only built by
+        # build_correction_index() when needed:
+        self.correction_group_starts: 'array.array[int]' = array.array('I')
+        self.correction_index: 'array.array[int]' = array.array('Q')
+        self._correction_index_lock = threading.Lock()
         if self.name != 'None':
             self.load_dictionary()
 
@@ -122,18 +282,27 @@ class Dictionary():
         '''
         if DEBUG_LEVEL > 0:
             LOGGER.debug('load_dictionary() ...\n')
-        (self.dic_path,
-         self.encoding,
-         self.words) = itb_util.get_hunspell_dictionary_wordlist(self.name)
+        (dic_path, _aff_path) = itb_util.find_hunspell_dictionary(self.name)
+        if dic_path and not self.load_from_cache(dic_path):
+            (self.dic_path,
+             self.encoding,
+             self.words) = itb_util.get_hunspell_dictionary_wordlist(
+                 self.name)
+            self.word_pairs = []
+            self.max_word_len = 0
+            if self.words:
+                if self.language in itb_util.ACCENT_LANGUAGES:
+                    self.word_pairs = [
+                        (x, itb_util.remove_accents(
+                            x,
+                            keep=itb_util.ACCENT_LANGUAGES[self.language]))
+                        for x in self.words
+                    ]
+                self.build_prefix_index()
+                for word in self.words:
+                    self.max_word_len = max(self.max_word_len, len(word))
+                self.save_to_cache()
         if self.words:
-            if self.language in itb_util.ACCENT_LANGUAGES:
-                self.word_pairs = [
-                    (x, itb_util.remove_accents(
-                        x, keep=itb_util.ACCENT_LANGUAGES[self.language]))
-                    for x in self.words
-                ]
-            for word in self.words:
-                self.max_word_len = max(self.max_word_len, len(word))
             if DEBUG_LEVEL > 1:
                 LOGGER.debug(
                     'max_word_len = %s\n', self.max_word_len)
@@ -183,6 +352,370 @@ class Dictionary():
                         self.name, error.__class__.__name__, error)
                     self.pyhunspell_object = None
 
+    def build_prefix_index(self) -> None:
+        '''Build a sorted index of the casefolded match keys of the words
+
+        The match keys are the accent stripped words for languages in
+        itb_util.ACCENT_LANGUAGES and the words themselves for other
+        languages. Keeping them casefolded and sorted makes it
+        possible to find all candidates for a prefix completion with
+        a binary search instead of matching a regular expression
+        against every word in the dictionary.
+        '''
+        if self.word_pairs:
+            folded_keys = [x[1].casefold() for x in self.word_pairs]
+        else:
+            folded_keys = [x.casefold() for x in self.words]
+        self.prefix_indexes = array.array('I', sorted(
+            range(len(folded_keys)), key=folded_keys.__getitem__))
+        self.prefix_keys = [folded_keys[x] for x in self.prefix_indexes]
+
+    def _cache_path(self) -> str:
+        '''Returns the path of the file caching the parsed dictionary'''
+        return os.path.join(
+            itb_util.xdg_save_cache_path('ibus-typing-booster', 'hunspell'),
+            f'{self.name}.cache')
+
+    def _cache_key(self, dic_path: str) -> Dict[str, Any]:
+        '''Returns what a cache file must match to be usable
+
+        :param dic_path: Full path of the .dic file of this dictionary
+        :return: A dictionary describing the .dic and .aff files and
+                 everything else which changes the parsed data. If
+                 any of the files cannot be accessed, an empty
+                 dictionary is returned.
+        '''
+        aff_path = dic_path.replace('.dic', '.aff')
+        try:
+            dic_stat = os.stat(dic_path)
+        except OSError:
+            return {}
+        try:
+            aff_stat: Optional[os.stat_result] = os.stat(aff_path)
+        except OSError:
+            aff_stat = None
+        return {
+            'version': DICTIONARY_CACHE_VERSION,
+            'dic_path': dic_path,
+            'dic_mtime_ns': dic_stat.st_mtime_ns,
+            'dic_size': dic_stat.st_size,
+            'aff_mtime_ns': aff_stat.st_mtime_ns if aff_stat else 0,
+            'aff_size': aff_stat.st_size if aff_stat else 0,
+            'normalization_form': itb_util.NORMALIZATION_FORM_INTERNAL,
+            'accents_keep': itb_util.ACCENT_LANGUAGES.get(self.language),
+        }
+
+    def load_from_cache(self, dic_path: str) -> bool:
+        '''Try to load the parsed dictionary from the cache file
+
+        :param dic_path: Full path of the .dic file of this dictionary
+        :return: True if the words, the accent stripped match keys,
+                 the prefix index and the maximum word length could
+                 be restored from an up to date cache file, False if
+                 the dictionary needs to be parsed.
+
+        The cache file starts with a magic line and a JSON header
+        line describing the files the data was parsed from, followed
+        by sections of UTF-8 encoded, newline separated strings and a
+        binary array of the prefix indexes. The file is memory mapped
+        and only the sections are decoded, no parsing is needed.
+        '''
+        cache_key = self._cache_key(dic_path)
+        if not cache_key:
+            return False
+        cache_path = self._cache_path()
+        if not os.path.isfile(cache_path):
+            return False
+        try:
+            with open(cache_path, 'rb') as cache_file, mmap.mmap(
+                    cache_file.fileno(), 0,
+                    access=mmap.ACCESS_READ) as cache_map:
+                if (cache_map[:len(DICTIONARY_CACHE_MAGIC)]
+                        != DICTIONARY_CACHE_MAGIC):
+                    return False
+                header_end = cache_map.find(b'\n', len(DICTIONARY_CACHE_MAGIC))
+                header = json.loads(
+                    cache_map[len(DICTIONARY_CACHE_MAGIC):header_end])
+                if header.get('key') != cache_key:
+                    if DEBUG_LEVEL > 0:
+                        LOGGER.debug('Cache %s is outdated.', cache_path)
+                    return False
+                sections: Dict[str, bytes] = {}
+                offset = header_end + 1
+                for (section, length) in header['sections']:
+                    sections[section] = cache_map[offset:offset + length]
+                    offset += length
+        except (OSError, ValueError, KeyError, TypeError) as error:
+            LOGGER.warning('Cannot read dictionary cache %s: %s: %s',
+                           cache_path, error.__class__.__name__, error)
+            return False
+        count = header['count']
+        words = sections['words'].decode('UTF-8').split('\n') if count else []
+        prefix_keys = (
+            sections['prefix_keys'].decode('UTF-8').split('\n')
+            if count else [])
+        prefix_indexes = array.array('I')
+        prefix_indexes.frombytes(sections['prefix_indexes'])
+        word_pairs: List[Tuple[str, str]] = []
+        if 'keys' in sections:
+            word_pairs = list(zip(
+                words,
+                sections['keys'].decode('UTF-8').split('\n')
+                if count else []))
+        if (len(words) != count
+                or len(prefix_keys) != count
+                or len(prefix_indexes) != count
+                or ('keys' in sections and len(word_pairs) != count)):
+            LOGGER.warning('Dictionary cache %s is corrupt.', cache_path)
+            return False
+        self.dic_path = dic_path
+        self.encoding = header['encoding']
+        self.words = words
+        self.word_pairs = word_pairs
+        self.prefix_keys = prefix_keys
+        self.prefix_indexes = prefix_indexes
+        self.max_word_len = header['max_word_len']
+        LOGGER.info('Loaded %s words for %s from cache %s',
+                    count, self.name, cache_path)
+        return True
+
+    def save_to_cache(self) -> bool:
+        '''Write the parsed dictionary to the cache file
+
+        :return: True if the cache file could be written, False if not.
+
+        The file is written to a temporary file first and then
+        renamed, other processes reading the cache at the same time
+        never see a partially written file.
+        '''
+        if not self.dic_path or not self.words:
+            return False
+        cache_key = self._cache_key(self.dic_path)
+        if not cache_key:
+            return False
+        sections = [
+            ('words', '\n'.join(self.words).encode('UTF-8')),
+            ('prefix_keys', '\n'.join(self.prefix_keys).encode('UTF-8')),
+            ('prefix_indexes', self.prefix_indexes.tobytes()),
+        ]
+        if self.word_pairs:
+            sections.append(
+                ('keys',
+                 '\n'.join([x[1] for x in self.word_pairs]).encode('UTF-8')))
+        header = {
+            'key': cache_key,
+            'encoding': self.encoding,
+            'max_word_len': self.max_word_len,
+            'count': len(self.words),
+            'sections': [(section, len(data)) for (section, data) in sections],
+        }
+        cache_path = self._cache_path()
+        tmp_path = f'{cache_path}.{os.getpid()}.tmp'
+        try:
+            with open(tmp_path, 'wb') as cache_file:
+                cache_file.write(DICTIONARY_CACHE_MAGIC)
+                cache_file.write(json.dumps(header).encode('UTF-8') + b'\n')
+                for (_section, data) in sections:
+                    cache_file.write(data)
+            os.replace(tmp_path, cache_path)
+        except OSError as error:
+            LOGGER.warning('Cannot write dictionary cache %s: %s: %s',
+                           cache_path, error.__class__.__name__, error)
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            return False
+        if DEBUG_LEVEL > 0:
+            LOGGER.debug('Wrote dictionary cache %s', cache_path)
+        return True
+
+    def prefix_completions(self, input_phrase: str) -> List[str]:
+        '''Return the words in this dictionary which start with input_phrase
+
+        :param input_phrase: The prefix to complete, in internal
+                             normalization form (NFD)
+        :return: List of matching words in the order of the index.
+
+        The match is case insensitive and, for languages in
+        itb_util.ACCENT_LANGUAGES, accent insensitive. The sorted
+        prefix index only narrows down the candidates, each candidate
+        is then checked with the same regular expression match which
+        was used before the index existed, so the result set does not
+        depend on the subtle differences between str.casefold() and
+        the case insensitive matching of “regex” or “re”.
+
+        Examples:
+
+        >>> d = Dictionary('en_US')
+        >>> 'Camelot' in d.prefix_completions('camel')
+        True
+
+        >>> 'camel' in d.prefix_completions('CAMEL')
+        True
+
+        >>> d.prefix_completions('camelx')
+        []
+
+        >>> d = Dictionary('None')
+        >>> d.prefix_completions('camel')
+        []
+        '''
+        if not self.prefix_keys or len(input_phrase) > self.max_word_len:
+            return []
+        if self.word_pairs:
+            input_phrase = itb_util.remove_accents(
+                input_phrase, keep=itb_util.ACCENT_LANGUAGES[self.language])
+        if IMPORT_REGEX_SUCCESFUL:
+            pattern = regex.compile(
+                regex.escape(input_phrase), regex.IGNORECASE)
+        else:
+            pattern = re.compile( # pylint: disable=used-before-assignment
+                re.escape(input_phrase), re.IGNORECASE)
+        folded_input = input_phrase.casefold()
+        completions = []
+        position = bisect.bisect_left(self.prefix_keys, folded_input)
+        while (position < len(self.prefix_keys)
+               and self.prefix_keys[position].startswith(folded_input)):
+            index = self.prefix_indexes[position]
+            position += 1
+            if self.word_pairs:
+                (word, match_key) = self.word_pairs[index]
+            else:
+                word = match_key = self.words[index]
+            if pattern.match(match_key):
+                completions.append(word)
+        return completions
+
+    def build_correction_index(self) -> None:
+        '''Build the index used by correction_suggest()
+
+        This is a SymSpell style deletion index: For every distinct
+        prefix of up to CORRECTION_PREFIX_LENGTH characters of the
+        casefolded match keys in self.prefix_keys, all strings which
+        can be made by deleting up to CORRECTION_MAX_DISTANCE
+        characters are stored. Two words within that edit distance
+        have at least one such deletion in common, so the candidates
+        for a correction are found by looking up the deletions of the
+        input instead of comparing the input to every word.
+
+        As the match keys are sorted, all words with the same prefix
+        are a contiguous group in self.prefix_keys. The index is a
+        sorted array of 64 bit integers, the upper 32 bits are a hash
+        of a deletion and the lower 32 bits the number of the group of
+        words it belongs to. Hash collisions only add candidates which
+        are then rejected when verifying the edit distance. This needs
+        about 8 bytes per deletion, much less than a Python dict.
+
+        Building takes a few seconds for big dictionaries, the
+        Hunspell class does it in a background thread. Calling this
+        again when the index exists already does nothing.
+        '''
+        with self._correction_index_lock:
+            if self.correction_index or not self.prefix_keys:
+                return
+            if DEBUG_LEVEL > 0:
+                LOGGER.debug('Building correction index for %s', self.name)
+            group_starts = array.array('I')
+            entries = []
+            previous_prefix = None
+            for position, key in enumerate(self.prefix_keys):
+                prefix = key[:CORRECTION_PREFIX_LENGTH]
+                if prefix == previous_prefix:
+                    continue
+                previous_prefix = prefix
+                group = len(group_starts)
+                group_starts.append(position)
+                for deleted in _deletes(prefix, CORRECTION_MAX_DISTANCE):
+                    entries.append((hash(deleted) & 0xffffffff) << 32 | group)
+            group_starts.append(len(self.prefix_keys))
+            entries.sort()
+            # Assign the group starts first, another thread may use
+            # the index as soon as it is not empty anymore:
+            self.correction_group_starts = group_starts
+            self.correction_index = array.array('Q', entries)
+            LOGGER.info('Built correction index for %s: %s groups, '
+                        '%s deletions', self.name, len(group_starts) - 1,
+                        len(self.correction_index))
+
+    def correction_suggest(self, word: str) -> List[str]:
+        '''Return spellchecking suggestions for word using the
+        correction index
+
+        :param word: The word to return spellchecking suggestions for,
+                     in internal normalization form (NFD)
+        :return: List of up to CORRECTION_MAX_RESULTS words within an
+                 edit distance of CORRECTION_MAX_DISTANCE of word
+                 (case insensitive and, for languages in
+                 itb_util.ACCENT_LANGUAGES, accent insensitive), the
+                 closest first. Empty if nothing was found or if the
+                 index has not been built (yet).
+
+        The dictionaries have no word frequencies which could help
+        ranking, words with the same distance are ordered to prefer
+        those with the same case of the first letter as the input,
+        then those with a longer prefix in common with the input
+        (typos at the beginning of words are rare), then
+        alphabetically.
+
+        Examples:
+
+        >>> d = Dictionary('fi_FI')
+        >>> d.build_correction_index()
+        >>> d.correction_suggest('kisssa')[0]
+        'kissa'
+
+        >>> d.correction_suggest('xyzxyzxyzxyz')
+        []
+        '''
+        index = self.correction_index
+        if not word or not index:
+            return []
+        group_starts = self.correction_group_starts
+        key = word
+        if self.word_pairs:
+            key = itb_util.remove_accents(
+                key, keep=itb_util.ACCENT_LANGUAGES[self.language])
+        key = key.casefold()
+        # Look up the groups in the order of the number of
+        # characters deleted from the input, the closest groups are
+        # verified first if there are too many candidates:
+        groups: Dict[int, None] = {}
+        for deleted in _deletes(key[:CORRECTION_PREFIX_LENGTH],
+                                CORRECTION_MAX_DISTANCE):
+            deletion_hash = hash(deleted) & 0xffffffff
+            position = bisect.bisect_left(index, deletion_hash << 32)
+            while (position < len(index)
+                   and index[position] >> 32 == deletion_hash):
+                groups[index[position] & 0xffffffff] = None
+                position += 1
+        ranked: List[Tuple[int, bool, int, str]] = []
+        candidates = 0
+        for group in groups:
+            for position in range(group_starts[group],
+                                  group_starts[group + 1]):
+                # Check within a group as well, a single group can
+                # be big, for example for short inputs:
+                if candidates >= CORRECTION_MAX_CANDIDATES:
+                    break
+                match_key = self.prefix_keys[position]
+                if (abs(len(match_key) - len(key))
+                        > CORRECTION_MAX_DISTANCE):
+                    continue
+                candidates += 1
+                distance = edit_distance(
+                    key, match_key, CORRECTION_MAX_DISTANCE)
+                if distance <= CORRECTION_MAX_DISTANCE:
+                    suggestion = self.words[self.prefix_indexes[position]]
+                    ranked.append((
+                        distance,
+                        suggestion[:1].isupper() != word[:1].isupper(),
+                        - len(os.path.commonprefix([key, match_key])),
+                        suggestion))
+            if candidates >= CORRECTION_MAX_CANDIDATES:
+                break
+        return [x[3] for x in sorted(ranked)[:CORRECTION_MAX_RESULTS]]
+
     def spellcheck_enchant(self, word: str) -> bool:
         '''
         Spellcheck a word using enchant
@@ -244,14 +777,30 @@ class Dictionary():
         >>> d.spellcheck('winxer')
         False
         '''
-        if self.enchant_dict:
-            return self.spellcheck_enchant(word)
-        if self.pyhunspell_object:
-            return self.spellcheck_pyhunspell(word)
-        if self.voikko:
-            return bool(self.voikko.spell(word))
+        with self._spellcheck_lock:
+            if self.enchant_dict:
+                return self.spellcheck_enchant(word)
+            if self.pyhunspell_object:
+                return self.spellcheck_pyhunspell(word)
+            if self.voikko:
+                return bool(self.voikko.spell(word))
         return False
 
+    def spellcheck_words(self, words: Iterable[str]) -> List[bool]:
+        '''
+        Spellcheck several words, taking the lock only once
+
+        :param words: The words to spellcheck
+        :return: For each word, True if spelling is correct,
+                 False if not or unknown
+
+        >>> d = Dictionary('en_US')
+        >>> d.spellcheck_words(['winter', 'winxer'])
+        [True, False]
+        '''
+        with self._spellcheck_lock:
+            return [self.spellcheck(word) for word in words]
+
     def has_spellchecking(self) -> bool:
         '''
         Returns wether this dictionary supports spellchecking or not
@@ -357,12 +906,13 @@ class Dictionary():
         []
 
         '''
-        if self.enchant_dict:
-            return self.spellcheck_suggest_enchant(word)
-        if self.pyhunspell_object:
-            return self.spellcheck_suggest_pyhunspell(word)
-        if self.voikko:
-            return self.spellcheck_suggest_voikko(word)
+        with self._spellcheck_lock:
+            if self.enchant_dict:
+                return self.spellcheck_suggest_enchant(word)
+            if self.pyhunspell_object:
+                return self.spellcheck_suggest_pyhunspell(word)
+            if self.voikko:
+                return self.spellcheck_suggest_voikko(word)
         return []
 # pylint: enable=attribute-defined-outside-init
 
@@ -384,9 +934,16 @@ class Hunspell:
                     dictionary_names)
             else:
                 LOGGER.debug('Hunspell.__init__(dictionary_names=())\n')
-        self._suggest_cache: Dict[str, List[Tuple[str, int]]] = {}
+        # Cleared when the dictionaries of this object change, see
+        # init_dictionaries() and set_dictionary_names():
+        self._suggest_cache = itb_util.LruCache('Hunspell.suggest()')
+        self._match_list_cache = itb_util.LruCache(
+            'Hunspell.spellcheck_match_list()')
         self._dictionary_names: List[str] = list(dictionary_names)
         self._dictionaries: List[Dictionary] = []
+        # Patterns of the names of the dictionaries which use the
+        # correction index instead of enchant, pyhunspell or voikko:
+        self._fast_correction_patterns: List[str] = []
         self.init_dictionaries()
 
     def init_dictionaries(self) -> None:
@@ -400,10 +957,17 @@ class Hunspell:
             else:
                 LOGGER.debug(
                     'Hunspell.init_dictionaries() dictionary_names=()\n')
-        self._suggest_cache = {}
-        self._dictionaries = []
-        for dictionary_name in self._dictionary_names:
-            self._dictionaries.append(Dictionary(name=dictionary_name))
+        # The candidates are computed in a worker thread which may
+        # iterate over self._dictionaries right now. Build the new
+        # list completely and replace the old one in one assignment,
+        # never change a list which may be in use:
+        self._dictionaries = [Dictionary(name=dictionary_name)
+                              for dictionary_name in self._dictionary_names]
+        # Clear after replacing the dictionaries, results computed
+        # with the old ones must not stay in the caches:
+        self._suggest_cache.clear()
+        self._match_list_cache.clear()
+        self._build_correction_indexes()
 
     def get_dictionary_names(self) -> List[str]:
         '''Returns a copy of the list of dictionary names.
@@ -428,17 +992,148 @@ class Hunspell:
                 # Reinitializing wastes time, just reorder the
                 # dictionaries:
                 self._dictionary_names = dictionary_names
+                # Replace the list in one assignment, see
+                # init_dictionaries():
                 dictionaries_new = []
                 for name in dictionary_names:
                     for dictionary in self._dictionaries:
                         if dictionary.name == name:
                             dictionaries_new.append(dictionary)
                 self._dictionaries = dictionaries_new
+                # The order of the dictionaries influences the
+                # scores of the spellchecking suggestions and the
+                # order of the spellcheck matches:
+                self._suggest_cache.clear()
+                self._match_list_cache.clear()
         if DEBUG_LEVEL > 1:
             LOGGER.debug('set_dictionary_names(%s):\n', dictionary_names)
             for dictionary in self._dictionaries:
                 LOGGER.debug('%s\n', dictionary.name)
 
+    def get_fast_correction_dictionaries(self) -> List[str]:
+        '''Returns a copy of the list of patterns of the names of the
+        dictionaries using the correction index'''
+        return list(self._fast_correction_patterns)
+
+    def set_fast_correction_dictionaries(self, patterns: List[str]) -> None:
+        '''Sets which dictionaries use the correction index
+
+        :param patterns: List of names of dictionaries, shell style
+                         wildcards like “*” or “en_*” are allowed.
+
+        The dictionaries matching one of the patterns get spellchecking
+        suggestions from their correction index (see
+        Dictionary.correction_suggest()) and use enchant, pyhunspell or
+        voikko only when the index finds nothing. The other
+        dictionaries use only enchant, pyhunspell or voikko.
+        '''
+        if patterns == self._fast_correction_patterns:
+            return
+        self._fast_correction_patterns = list(patterns)
+        self._suggest_cache.clear()
+        self._build_correction_indexes()
+
+    def _uses_correction_index(self, dictionary: Dictionary) -> bool:
+        '''Checks whether a dictionary should use its correction index'''
+        return any(fnmatch.fnmatchcase(dictionary.name, pattern)
+                   for pattern in self._fast_correction_patterns)
+
+    def _build_correction_indexes(self) -> None:
+        '''Builds the missing correction indexes in background threads
+
+        Until the index of a dictionary is ready, its suggestions come
+        from enchant, pyhunspell or voikko.
+        '''
+        for dictionary in self._dictionaries:
+            if (self._uses_correction_index(dictionary)
+                    and dictionary.words
+                    and not dictionary.correction_index):
+                threading.Thread(
+                    target=dictionary.build_correction_index,
+                    daemon=True).start()
+
+    @staticmethod
+    def _native_suggestions(
+            dictionary: Dictionary, input_phrase: str) -> List[str]:
+        '''Returns the suggestions of enchant, pyhunspell or voikko
+        in the internal normalization form'''
+        return [unicodedata.normalize(itb_util.NORMALIZATION_FORM_INTERNAL, x)
+                for x in dictionary.spellcheck_suggest(input_phrase)]
+
+    @staticmethod
+    def _score_suggestions(
+            dictionary: Dictionary,
+            input_phrase: str,
+            suggestions: List[str]) -> List[Tuple[str, int]]:
+        '''Scores spellchecking suggestions like suggest() does
+
+        A suggestion which differs from the input phrase only in
+        accents scores 0 like a completion, the others score the
+        negative of their rank.
+        '''
+        if not dictionary.word_pairs:
+            return [(suggestion, -(index + 1))
+                    for index, suggestion in enumerate(suggestions)]
+        keep = itb_util.ACCENT_LANGUAGES[dictionary.language]
+        input_phrase_no_accents = itb_util.remove_accents(
+            input_phrase, keep=keep)
+        return [(suggestion,
+                 0 if itb_util.remove_accents(suggestion, keep=keep)
+                 == input_phrase_no_accents else -(index + 1))
+                for index, suggestion in enumerate(suggestions)]
+
+    def native_suggest(self, input_phrase: str) -> List[Tuple[str, int]]:
+        '''Returns only the suggestions which suggest(input_phrase)
+        gets from enchant, pyhunspell or voikko
+
+        Added to suggest(input_phrase, native_suggestions=False), this
+        gives what suggest(input_phrase) returns. That makes it
+        possible to compute candidates quickly without the possibly
+        slow native suggestions first and add them later without
+        computing everything again.
+
+        :param input_phrase: A string to find corrections for
+        :return: A list of (<word>, <score>) tuples scored like in
+                 suggest(), in the internal normalization form
+        '''
+        if not self.has_native_suggestions(input_phrase):
+            return []
+        input_phrase = unicodedata.normalize(
+            itb_util.NORMALIZATION_FORM_INTERNAL, input_phrase)
+        cached_suggestions = self._suggest_cache.get(
+            (input_phrase, 'native'))
+        if cached_suggestions is not None:
+            return cached_suggestions
+        suggested_words: Dict[str, int] = {}
+        for dictionary in self._dictionaries:
+            if not dictionary.words or not dictionary.has_spellchecking():
+                continue
+            if (self._uses_correction_index(dictionary)
+                    and dictionary.correction_suggest(input_phrase)):
+                # suggest() uses the corrections from the index then
+                continue
+            for (suggestion, score) in self._score_suggestions(
+                    dictionary, input_phrase,
+                    self._native_suggestions(dictionary, input_phrase)):
+                if suggestion not in suggested_words:
+                    suggested_words[suggestion] = score
+        suggestions = list(suggested_words.items())
+        self._suggest_cache.put((input_phrase, 'native'), suggestions)
+        return suggestions
+
+    def has_native_suggestions(self, input_phrase: str) -> bool:
+        '''Checks whether suggest() would ask enchant, pyhunspell or
+        voikko for spellchecking suggestions for the input phrase
+
+        These suggestions can be slow, if there are none,
+        suggest(input_phrase, native_suggestions=False) returns the
+        same as suggest(input_phrase).
+        '''
+        if len(input_phrase) < SPELLCHECK_MIN_LENGTH or '/' in input_phrase:
+            return False
+        return any(dictionary.words and dictionary.has_spellchecking()
+                   for dictionary in self._dictionaries)
+
     def spellcheck(self, input_phrase: str) -> bool:
         '''
         Checks if a string is likely to be spelled correctly checking
@@ -515,13 +1210,54 @@ class Hunspell:
         >>> h.spellcheck_match_list(' \t')
         []
         '''
-        match_list = []
-        if not input_phrase.strip():
-            return []
+        return self.spellcheck_match_lists([input_phrase])[input_phrase]
+
+    def spellcheck_match_lists(
+            self, input_phrases: Iterable[str]) -> Dict[str, List[str]]:
+        '''
+        Returns the dictionaries where each of several phrases can be found
+
+        Like spellcheck_match_list() but for a whole list of
+        candidates at once. The results are remembered until the
+        dictionaries change, only phrases not seen before are
+        spellchecked, each dictionary checks all of them in one go.
+
+        :param input_phrases: The words to be spellchecked
+        :return: A dictionary mapping each input phrase to the list
+                 of dictionary names which accept it as a valid word.
+
+        Examples:
+
+        >>> h = Hunspell(['en_US', 'None', 'it_IT', 'fr_FR'])
+        >>> h.spellcheck_match_lists(['arrive', 'arrivé', 'ragazzo', ' '])
+        {'arrive': ['en_US', 'fr_FR'], 'arrivé': ['fr_FR'], 'ragazzo': ['it_IT'], ' ': []}
+        '''
+        match_lists: Dict[str, List[str]] = {}
+        unknown_phrases: List[str] = []
+        for input_phrase in input_phrases:
+            if input_phrase in match_lists:
+                continue
+            if not input_phrase.strip():
+                match_lists[input_phrase] = []
+                continue
+            cached_match_list = self._match_list_cache.get(input_phrase)
+            if cached_match_list is None:
+                unknown_phrases.append(input_phrase)
+                match_lists[input_phrase] = []
+            else:
+                match_lists[input_phrase] = list(cached_match_list)
+        if not unknown_phrases:
+            return match_lists
         for dictionary in self._dictionaries:
-            if dictionary.spellcheck(input_phrase):
-                match_list.append(dictionary.name)
-        return match_list
+            for input_phrase, correct in zip(
+                    unknown_phrases,
+                    dictionary.spellcheck_words(unknown_phrases)):
+                if correct:
+                    match_lists[input_phrase].append(dictionary.name)
+        for input_phrase in unknown_phrases:
+            self._match_list_cache.put(
+                input_phrase, tuple(match_lists[input_phrase]))
+        return match_lists
 
     def spellcheck_single_dictionary(self, words: Iterable[str] = ()) -> List[str]:
         '''
@@ -590,11 +1326,20 @@ class Hunspell:
                 dictionary_names.append(dictionary.name)
         return sorted(dictionary_names)
 
-    def suggest(self, input_phrase: str) -> List[Tuple[str, int]]:
+    @itb_util.trace_stage('hunspell_suggest')
+    def suggest(
+            self,
+            input_phrase: str,
+            native_suggestions: bool = True) -> List[Tuple[str, int]]:
         # pylint: disable=line-too-long
         '''Return completions or corrections for the input phrase
 
         :param input_phrase: A string to find completions or corrections for
+        :param native_suggestions: Whether to get spellchecking
+                                   suggestions from enchant, pyhunspell
+                                   or voikko, which may be slow. If
+                                   False, only the corrections from
+                                   the correction indexes are used.
 
         Returns a list of tuples of the form (<word>, <score>)
                 <score> can have these values:
@@ -657,8 +1402,10 @@ class Hunspell:
         True
         '''
         # pylint: enable=line-too-long
-        if input_phrase in self._suggest_cache:
-            return self._suggest_cache[input_phrase]
+        cached_suggestions = self._suggest_cache.get(
+            (input_phrase, native_suggestions))
+        if cached_suggestions is not None:
+            return cached_suggestions
         if DEBUG_LEVEL > 1:
             LOGGER.debug(
                 "Hunspell.suggest() input_phrase=%(ip)s\n",
@@ -675,7 +1422,7 @@ class Hunspell:
         # match a word in the dictionary and we return an empty list
         # immediately:
         if '/' in input_phrase:
-            self._suggest_cache[input_phrase] = []
+            self._suggest_cache.put((input_phrase, native_suggestions), [])
             return []
         # make sure input_phrase is in the internal normalization form (NFD):
         input_phrase = unicodedata.normalize(
@@ -684,49 +1431,14 @@ class Hunspell:
         suggested_words: Dict[str, int] = {}
         for dictionary in self._dictionaries:
             if dictionary.words:
-                if dictionary.word_pairs:
-                    input_phrase_no_accents = itb_util.remove_accents(
-                        input_phrase,
-                        keep=itb_util.ACCENT_LANGUAGES[dictionary.language])
                 # If the input phrase is longer than than the maximum
-                # word length in a dictionary, don’t try
-                # complete it, it just wastes time then.
-                if len(input_phrase) <= dictionary.max_word_len:
-                    if dictionary.word_pairs:
-                        if IMPORT_REGEX_SUCCESFUL:
-                            regex_pattern = regex.compile(
-                                regex.escape(input_phrase_no_accents),
-                                regex.IGNORECASE)
-                            suggested_words.update([
-                                (x[0], 0)
-                                for x in dictionary.word_pairs
-                                if regex_pattern.match(x[1])])
-                        else:
-                            re_pattern = re.compile( # pylint: disable=used-before-assignment
-                                re.escape(input_phrase_no_accents),
-                                re.IGNORECASE)
-                            suggested_words.update([
-                                (x[0], 0)
-                                for x in dictionary.word_pairs
-                                if re_pattern.match(x[1])])
-                    else:
-                        if IMPORT_REGEX_SUCCESFUL:
-                            regex_pattern = regex.compile(
-                                regex.escape(input_phrase),
-                                regex.IGNORECASE)
-                            suggested_words.update([
-                                (x, 0)
-                                for x in dictionary.words
-                                if regex_pattern.match(x)])
-                        else:
-                            re_pattern = re.compile(
-                                re.escape(input_phrase),
-                                re.IGNORECASE)
-                            suggested_words.update([
-                                (x, 0)
-                                for x in dictionary.words
-                                if re_pattern.match(x)])
-                if len(input_phrase) >= 4:
+                # word length in a dictionary, prefix_completions()
+                # does not try to complete it, it just wastes time
+                # then.
+                suggested_words.update([
+                    (x, 0)
+                    for x in dictionary.prefix_completions(input_phrase)])
+                if len(input_phrase) >= SPELLCHECK_MIN_LENGTH:
                     if dictionary.spellcheck(input_phrase):
                         # This is a valid word in this dictionary.
                         # It might have been missed by the
@@ -738,24 +1450,17 @@ class Hunspell:
                         # thinks it is a correct word, it must be
                         # counted as a match of course:
                         suggested_words[input_phrase] = 0
-                    extra_suggestions = [
-                        unicodedata.normalize(
-                            itb_util.NORMALIZATION_FORM_INTERNAL, x)
-                        for x in
-                        dictionary.spellcheck_suggest(input_phrase)
-                    ]
-                    for index, suggestion in enumerate(extra_suggestions):
+                    extra_suggestions: List[str] = []
+                    if self._uses_correction_index(dictionary):
+                        extra_suggestions = dictionary.correction_suggest(
+                            input_phrase)
+                    if not extra_suggestions and native_suggestions:
+                        extra_suggestions = self._native_suggestions(
+                            dictionary, input_phrase)
+                    for (suggestion, score) in self._score_suggestions(
+                            dictionary, input_phrase, extra_suggestions):
                         if suggestion not in suggested_words:
-                            if (dictionary.word_pairs
-                                and
-                                itb_util.remove_accents(
-                                    suggestion,
-                                    keep=itb_util.ACCENT_LANGUAGES[
-                                        dictionary.language])
-                                == input_phrase_no_accents):
-                                suggested_words[suggestion] = 0
-                            else:
-                                suggested_words[suggestion] = -(index + 1)
+                            suggested_words[suggestion] = score
         sorted_suggestions = sorted(
             suggested_words.items(),
             key=lambda x: (
@@ -763,7 +1468,8 @@ class Hunspell:
                 len(x[0]), # length of word ascending
                 x[0],      # alphabetical
             ))[0:MAX_WORDS]
-        self._suggest_cache[input_phrase] = sorted_suggestions
+        self._suggest_cache.put(
+            (input_phrase, native_suggestions), sorted_suggestions)
         return sorted_suggestions
 
 BENCHMARK = True
@@ -804,6 +1510,7 @@ def main() -> None:
 
     LOGGER.info('itb_util.remove_accents() cache info: %s',
                 itb_util.remove_accents.cache_info())
+    itb_util.log_cache_info(logging.INFO)
 
     sys.exit(failed)
 
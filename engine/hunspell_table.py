@@ -46,6 +46,7 @@ import time
 import copy
 import logging
 import threading
+import concurrent.futures
 import subprocess
 import textwrap
 from gettext import dgettext
@@ -134,6 +135,16 @@ OFF_THE_RECORD_MODE_SYMBOL = '🕵'
 
 IBUS_VERSION = (IBus.MAJOR_VERSION, IBus.MINOR_VERSION, IBus.MICRO_VERSION)
 
+# Delay before the frequency updates collected in memory by the
+# user database are written to disk, see _schedule_database_flush():
+DATABASE_FLUSH_DELAY_MILLISECONDS = 5000
+
+# How many transliterators and emoji matchers which are not used at
+# the moment are kept, so that switching back to them, for example
+# when autosettings change the input methods or dictionaries on focus
+# in, does not need to create them again:
+MAX_WARM_RESOURCES = 3
+
 def log_glib_callback_exception(
         func: Callable[..., Any],
         args: Tuple[Any, ...],
@@ -222,6 +233,69 @@ class SurroundingText:
             anchor_pos=self.anchor_pos,
             event=new_event)
 
+@dataclass
+class CandidatesRequest:
+    '''
+    A snapshot of the input to compute candidates for, possibly in
+    a worker thread while the main thread continues to process keys.
+
+    typed_string: List[str]     The typed msymbols
+    transliterated_strings: Dict[str, str]
+                                The typed string transliterated with
+                                each of the current input methods
+    current_imes: List[str]     The current input methods
+    p_phrase: str = ''          The previous word of the context
+    pp_phrase: str = ''         The word before the previous word
+    lookup_table_enabled_by_tab: bool = False
+                                Whether the lookup table has been
+                                enabled by the Tab key
+    page_size: int = 9          The page size of the lookup table
+    cancel_event: threading.Event = field(default_factory=threading.Event)
+                                Set when the request has become stale
+                                because newer input arrived
+    trace_record: Optional[Dict[str, Any]] = None
+                                The record of the keystroke tracer to
+                                add the stages of the computation to
+    timings: Dict[str, float] = field(default_factory=dict)
+                                Milliseconds spent in each source of
+                                candidates, for the debug output
+    partial_result: Optional[
+        Tuple[List[itb_util.PredictionCandidate], bool]] = None
+                                The candidates from the cheap sources
+                                only, shown if computing all candidates
+                                takes longer than the time budget
+    budget_expired: bool = False
+                                Whether the time budget is over
+    word_inputs: List[Tuple[str, str]] = field(default_factory=list)
+                                (prefix, stripped input) of each input
+                                method the words have been selected for
+    word_frequencies: Optional[Dict[str, float]] = None
+                                The frequencies of the words and
+                                shortcuts found without the slow
+                                sources, kept to add the slow sources
+                                to them later
+    enabled_by_min_char_complete: bool = False
+                                Whether the lookup table is enabled by
+                                the minimum number of characters for
+                                completion, valid with word_frequencies
+    '''
+    typed_string: List[str]
+    transliterated_strings: Dict[str, str]
+    current_imes: List[str]
+    p_phrase: str = ''
+    pp_phrase: str = ''
+    lookup_table_enabled_by_tab: bool = False
+    page_size: int = 9
+    cancel_event: threading.Event = field(default_factory=threading.Event)
+    trace_record: Optional[Dict[str, Any]] = None
+    timings: Dict[str, float] = field(default_factory=dict)
+    partial_result: Optional[
+        Tuple[List[itb_util.PredictionCandidate], bool]] = None
+    budget_expired: bool = False
+    word_inputs: List[Tuple[str, str]] = field(default_factory=list)
+    word_frequencies: Optional[Dict[str, float]] = None
+    enabled_by_min_char_complete: bool = False
+
 class TypingBoosterEngine(IBus.Engine): # type: ignore
     '''The IBus Engine for ibus-typing-booster'''
 
@@ -273,8 +347,10 @@ class TypingBoosterEngine(IBus.Engine): # type: ignore
             schema='org.freedesktop.ibus.engine.typing-booster',
             path=schema_path)
 
-        self._keyvals_to_keycodes = itb_util.KeyvalsToKeycodes()
-        self._compose_sequences = itb_util.ComposeSequences()
+        self._keyvals_to_keycodes = itb_util.get_keyvals_to_keycodes()
+        self._compose_sequences: itb_util.ComposeSequences = (
+            itb_util.acquire_shared(('ComposeSequences',),
+                                    itb_util.ComposeSequences))
         self._unit_test = unit_test
         self._input_purpose: int = 0
         self._input_hints: int = 0
@@ -289,6 +365,26 @@ class TypingBoosterEngine(IBus.Engine): # type: ignore
         self._bus = bus
         self.database = database
         self.emoji_matcher: Optional[itb_emoji.EmojiMatcher] = None
+        # (dictionary names, unicode_data_all, emoji style) the
+        # current self.emoji_matcher was created for:
+        self._emoji_matcher_key: Optional[
+            Tuple[Tuple[str, ...], bool, str]] = None
+        self._emoji_matcher_lock = threading.Lock()
+        self._emoji_matcher_executor: Optional[
+            concurrent.futures.ThreadPoolExecutor] = None
+        # The emoji matcher loading in the background for the current
+        # settings, if any:
+        self._emoji_matcher_future: Optional[concurrent.futures.Future[
+            itb_emoji.EmojiMatcher]] = None
+        # All emoji matchers loading in the background which have
+        # not been handled by _emoji_matcher_loaded() yet:
+        self._emoji_matcher_pending: Dict[
+            concurrent.futures.Future[itb_emoji.EmojiMatcher],
+            Tuple[Tuple[str, ...], bool, str]] = {}
+        # Recently used emoji matchers which are not used at the
+        # moment, by their keys, the most recently used last:
+        self._warm_emoji_matchers: Dict[
+            Tuple[Tuple[str, ...], bool, str], itb_emoji.EmojiMatcher] = {}
         self._setup_process: Optional[subprocess.Popen[Any]] = None
         self._settings_dict = self._init_settings_dict()
 
@@ -337,6 +433,15 @@ class TypingBoosterEngine(IBus.Engine): # type: ignore
             break_on_hyphens=True)
 
         self._timeout_source_id: int = 0
+        # Candidates are computed in a worker thread, the request
+        # currently computed is remembered to be able to cancel it
+        # and to drop its result if newer input arrived:
+        self._candidates_executor: Optional[
+            concurrent.futures.ThreadPoolExecutor] = None
+        self._candidates_request: Optional[CandidatesRequest] = None
+        # Timer to write the pending frequency updates of the user
+        # database in the background, see _schedule_database_flush():
+        self._database_flush_source_id: int = 0
         self._candidates_delay_milliseconds: int = self._settings_dict[
             'candidatesdelaymilliseconds']['user']
         self._candidates_delay_milliseconds = max(
@@ -345,6 +450,45 @@ class TypingBoosterEngine(IBus.Engine): # type: ignore
             self._candidates_delay_milliseconds, itb_util.UINT32_MAX)
         LOGGER.info('self._candidates_delay_milliseconds=%s',
                     self._candidates_delay_milliseconds)
+        # How long to wait for the slow sources of candidates before
+        # showing the candidates of the fast sources, 0 means to wait
+        # until all candidates are computed:
+        self._candidates_budget_source_id: int = 0
+        self._candidates_budget_milliseconds: int = self._settings_dict[
+            'candidatesbudgetmilliseconds']['user']
+        self._candidates_budget_milliseconds = max(
+            self._candidates_budget_milliseconds, 0)
+        self._candidates_budget_milliseconds = min(
+            self._candidates_budget_milliseconds, itb_util.UINT32_MAX)
+        LOGGER.info('self._candidates_budget_milliseconds=%s',
+                    self._candidates_budget_milliseconds)
+
+        self._cache_max_entries: int = self._settings_dict[
+            'cachemaxentries']['user']
+        self._cache_max_megabytes: int = self._settings_dict[
+            'cachemaxmegabytes']['user']
+        itb_util.set_cache_limits(
+            max_entries=self._cache_max_entries,
+            max_bytes=self._cache_max_megabytes * 1024 * 1024)
+
+        # Tracing the latency of the stages of processing keystrokes.
+        # IBUS_TYPING_BOOSTER_TRACE=1 enables it as well, any other
+        # value except 0 is the path of the file to write the trace to:
+        self._keystroke_tracing: bool = self._settings_dict[
+            'keystroketracing']['user']
+        self._keystroke_trace_file: str = self._settings_dict[
+            'keystroketracefile']['user']
+        trace_environment = os.environ.get('IBUS_TYPING_BOOSTER_TRACE', '')
+        if trace_environment not in ('', '0'):
+            self._keystroke_tracing = True
+            if trace_environment != '1':
+                self._keystroke_trace_file = trace_environment
+        if self._keystroke_tracing:
+            itb_util.KEYSTROKE_TRACER.enable(
+                trace_file=self._keystroke_trace_file)
+        LOGGER.info('self._keystroke_tracing=%s '
+                    'self._keystroke_trace_file=%r',
+                    self._keystroke_tracing, self._keystroke_trace_file)
 
         # Between some events sent to ibus like forward_key_event(),
         # delete_surrounding_text(), commit_text(), a sleep is necessary.
@@ -547,6 +691,11 @@ class TypingBoosterEngine(IBus.Engine): # type: ignore
             self._settings_dict['keybindings']['user'], update_gsettings=False)
 
         self._autosettings: List[Tuple[str, str, str]] = []
+        # self._autosettings with the regular expressions compiled,
+        # only rules for settings which can be changed automatically:
+        self._autosettings_rules: List[Tuple[str, str, re.Pattern[str]]] = []
+        self._autosettings_profiles = itb_util.LruCache(
+            'TypingBoosterEngine._autosettings_profile()', max_entries=100)
         self.set_autosettings(
             self._settings_dict['autosettings']['user'],
             update_gsettings=False)
@@ -579,6 +728,12 @@ class TypingBoosterEngine(IBus.Engine): # type: ignore
                 GLib.Variant.new_string(','.join(self._dictionary_names)))
         self.database.hunspell_obj.set_dictionary_names(
             self._dictionary_names[:])
+        self._fast_correction_dictionaries: List[str] = [
+            x.strip() for x in self._settings_dict[
+                'fastcorrectiondictionaries']['user'].split(',')
+            if x.strip()]
+        self.database.hunspell_obj.set_fast_correction_dictionaries(
+            self._fast_correction_dictionaries[:])
         self._dictionary_flags: Dict[str, str] = itb_util.get_flags(
             self._dictionary_names)
 
@@ -586,14 +741,7 @@ class TypingBoosterEngine(IBus.Engine): # type: ignore
             if self._debug_level > 1:
                 LOGGER.debug('Instantiate EmojiMatcher(languages = %s',
                              self._dictionary_names)
-            self.emoji_matcher = itb_emoji.EmojiMatcher(
-                languages=self._dictionary_names,
-                unicode_data_all=self._unicode_data_all,
-                variation_selector=self._emoji_style)
-            if self._debug_level > 1:
-                LOGGER.debug('EmojiMatcher() instantiated.')
-        else:
-            self.emoji_matcher = None
+            self._update_emoji_matcher()
 
         # Try to get the selected input methods from Gsettings:
         inputmethod = self._settings_dict['inputmethod']['user']
@@ -622,6 +770,10 @@ class TypingBoosterEngine(IBus.Engine): # type: ignore
         self._transliterated_strings_before_compose: Dict[str, str] = {}
         self._transliterated_strings_compose_part = ''
         self._transliterators: Dict[str, m17n_translit.Transliterator] = {}
+        # Recently used transliterators which are not used at the
+        # moment, by input method, the most recently used last:
+        self._warm_transliterators: Dict[
+            str, m17n_translit.Transliterator] = {}
         self._init_transliterators()
         self._candidates: List[itb_util.PredictionCandidate] = []
         # a copy of self._candidates in case mode 'orig':
@@ -826,6 +978,9 @@ class TypingBoosterEngine(IBus.Engine): # type: ignore
             'dictionary': {
                 'set': self.set_dictionary_names,
                 'get': self.get_dictionary_names},
+            'fastcorrectiondictionaries': {
+                'set': self.set_fast_correction_dictionaries,
+                'get': self.get_fast_correction_dictionaries},
             'dictionaryinstalltimestamp': {
                 'set': self._reload_dictionaries},
             'inputmethodchangetimestamp': {
@@ -911,6 +1066,21 @@ class TypingBoosterEngine(IBus.Engine): # type: ignore
             'candidatesdelaymilliseconds': {
                 'set': self.set_candidates_delay_milliseconds,
                 'get': self.get_candidates_delay_milliseconds},
+            'candidatesbudgetmilliseconds': {
+                'set': self.set_candidates_budget_milliseconds,
+                'get': self.get_candidates_budget_milliseconds},
+            'cachemaxentries': {
+                'set': self.set_cache_max_entries,
+                'get': self.get_cache_max_entries},
+            'cachemaxmegabytes': {
+                'set': self.set_cache_max_megabytes,
+                'get': self.get_cache_max_megabytes},
+            'keystroketracing': {
+                'set': self.set_keystroke_tracing,
+                'get': self.get_keystroke_tracing},
+            'keystroketracefile': {
+                'set': self.set_keystroke_trace_file,
+                'get': self.get_keystroke_trace_file},
             'ibuseventsleepseconds': {
                 'set': self.set_ibus_event_sleep_seconds,
                 'get': self.get_ibus_event_sleep_seconds},
@@ -1117,9 +1287,26 @@ class TypingBoosterEngine(IBus.Engine): # type: ignore
         return lookup_table
 
     def _init_transliterators(self) -> None:
-        '''Initialize the dictionary of m17n-db transliterator objects'''
+        '''Initialize the dictionary of m17n-db transliterator objects
+
+        Transliterators for input methods which are still used are
+        kept. The ones not used anymore are kept warm for a while, if
+        an input method is used again soon, its old transliterator is
+        reused instead of creating a new one.
+        '''
+        old_transliterators = self._transliterators
         self._transliterators = {}
         for ime in self._current_imes:
+            if ime in old_transliterators:
+                self._transliterators[ime] = old_transliterators.pop(ime)
+                continue
+            if ime in self._warm_transliterators:
+                if self._debug_level > 1:
+                    LOGGER.debug('Reusing Transliterator(%s)', ime)
+                self._transliterators[ime] = (
+                    self._warm_transliterators.pop(ime))
+                self._transliterators[ime].reset_ic()
+                continue
             # using m17n transliteration
             try:
                 if self._debug_level > 1:
@@ -1135,6 +1322,10 @@ class TypingBoosterEngine(IBus.Engine): # type: ignore
                 # Use dummy transliterator “NoIME” as a fallback:
                 self._transliterators[ime] = m17n_translit.Transliterator(
                     'NoIME')
+        self._warm_transliterators.update(old_transliterators)
+        while len(self._warm_transliterators) > MAX_WARM_RESOURCES:
+            del self._warm_transliterators[next(iter(
+                self._warm_transliterators))]
         self._update_transliterated_strings()
 
     def _show_prediction_candidates(self) -> bool:
@@ -1332,7 +1523,10 @@ class TypingBoosterEngine(IBus.Engine): # type: ignore
         elif (len(phrase) >= 3
             and not comment
             and not self._m17n_trans_parts.candidates
-            and not self._typed_compose_sequence):
+            and not self._typed_compose_sequence
+            and (self._label_dictionary
+                 or self._flag_dictionary
+                 or self._color_dictionary)):
             dictionary_matches = (
                 self.database.hunspell_obj.spellcheck_match_list(phrase))
         # Embed “phrase” and “comment” separately with “Explicit
@@ -1468,33 +1662,143 @@ class TypingBoosterEngine(IBus.Engine): # type: ignore
         self._lookup_table.append_candidate(text)
         self._lookup_table.set_cursor_visible(False)
 
-    def _update_candidates(self) -> None:
-        '''Update the list of candidates and fill the lookup table with the
-        candidates
+    def _new_candidates_request(self) -> CandidatesRequest:
+        '''Returns a snapshot of the current input to compute candidates for'''
+        return CandidatesRequest(
+            typed_string=self._typed_string[:],
+            transliterated_strings=dict(self._transliterated_strings),
+            current_imes=self._current_imes[:],
+            p_phrase=self._p_phrase,
+            pp_phrase=self._pp_phrase,
+            lookup_table_enabled_by_tab=self.is_lookup_table_enabled_by_tab,
+            page_size=self._lookup_table.get_page_size(),
+            trace_record=itb_util.KEYSTROKE_TRACER.current())
+
+    @staticmethod
+    def _add_source_timing(
+            request: CandidatesRequest, source: str, time_start: float) -> None:
+        '''Adds the time since time_start to the timing of a source
+        of candidates'''
+        request.timings[source] = (
+            request.timings.get(source, 0.0)
+            + (time.perf_counter() - time_start) * 1000)
+
+    def _emoji_candidates_wanted(self, request: CandidatesRequest) -> bool:
+        '''Checks whether emoji candidates should be computed for a request'''
+        return bool(
+            (self._emoji_predictions
+             and not self.client_capabilities & itb_util.Capabilite.OSK)
+            or self._temporary_emoji_predictions
+            or request.typed_string[0] in self._emoji_trigger_characters
+            or request.typed_string[-1] in self._emoji_trigger_characters)
+
+    def _has_slow_candidates_sources(self, request: CandidatesRequest) -> bool:
+        '''Checks whether computing the candidates for a request
+        needs slow sources
+
+        The slow sources are the spellchecking suggestions of
+        enchant, pyhunspell or voikko and the fuzzy matching of emoji.
         '''
-        if self._debug_level > 1:
-            LOGGER.debug('self._typed_string=%s', self._typed_string)
-        self._lookup_table.clear()
-        self._lookup_table.set_cursor_visible(False)
-        if self.is_empty():
-            # Nothing to do when there is no input available.
-            # One can accidentally end up here even though the
-            # input is empty because this is called by GLib.idle_add().
-            # Better make sure that calling this function with
-            # empty input does not pointlessly try to find candidates.
-            return
-        self._candidates = []
+        if self._emoji_candidates_wanted(request):
+            return True
+        if not (self._word_predictions or self._temporary_word_predictions):
+            return False
+        return any(
+            self.database.hunspell_obj.has_native_suggestions(
+                itb_util.lstrip_token(request.transliterated_strings[ime]))
+            for ime in request.current_imes)
+
+    def _add_native_suggestions(
+            self,
+            request: CandidatesRequest,
+            phrase_frequencies: Dict[str, float]) -> bool:
+        '''Adds the spellchecking suggestions of enchant, pyhunspell or
+        voikko to the words found for a request without them
+
+        Gives the same as selecting the words with these suggestions
+        in the first place, see Hunspell.native_suggest().
+
+        :param request: The request the words have been selected for
+        :param phrase_frequencies: The frequencies of the words found,
+                                   the suggestions are added here
+        :return: False if the request was cancelled, True if not
+        '''
+        for (prefix, input_phrase) in request.word_inputs:
+            if request.cancel_event.is_set():
+                return False
+            if ' ' in input_phrase:
+                # select_words() does not use hunspell then either
+                continue
+            suggestions: List[Tuple[str, int]] = []
+            time_start = time.perf_counter()
+            try:
+                suggestions = self.database.hunspell_obj.native_suggest(
+                    input_phrase)
+            except Exception as error: # pylint: disable=broad-except
+                LOGGER.exception(
+                    'Exception when calling native_suggest: %s: %s',
+                    error.__class__.__name__, error)
+            self._add_source_timing(request, 'native_suggestions', time_start)
+            for cand in itb_util.best_candidates(
+                    dict(suggestions), title=input_phrase.istitle()):
+                phrase = prefix + cand.phrase
+                if phrase in phrase_frequencies:
+                    phrase_frequencies[phrase] = max(
+                        phrase_frequencies[phrase], cand.user_freq)
+                else:
+                    phrase_frequencies[phrase] = cand.user_freq
+        return True
+
+    def _compute_candidates(
+            self,
+            request: CandidatesRequest,
+            slow_sources: bool = True
+    ) -> Optional[Tuple[List[itb_util.PredictionCandidate], bool]]:
+        '''Computes the candidates for a snapshot of the input
+
+        Uses only the snapshot and the settings and does not touch
+        the lookup table, therefore it can run in a worker thread.
+
+        :param request: The snapshot of the input
+        :param slow_sources: Whether to use the slow sources of
+                             candidates as well. If False, only the
+                             user database, the completions from the
+                             dictionaries and the shortcuts are used,
+                             no spellchecking suggestions from
+                             enchant, pyhunspell or voikko and no emoji.
+                             The words found are kept in the request,
+                             computing the candidates for the same
+                             request with the slow sources later
+                             only adds the slow sources to them.
+        :return: A tuple of the list of candidates and whether the
+                 lookup table is enabled by the minimum number of
+                 characters for completion, or None if the request
+                 was cancelled while computing.
+        '''
+        if request.cancel_event.is_set():
+            return None
+        new_candidates: List[itb_util.PredictionCandidate] = []
         phrase_frequencies: Dict[str, float] = {}
         phrase_candidates: List[itb_util.PredictionCandidate] = []
-        self.is_lookup_table_enabled_by_min_char_complete = False
-        if self._word_predictions or self._temporary_word_predictions:
-            for ime in self._current_imes:
-                if self._transliterated_strings[ime]:
+        enabled_by_min_char_complete = False
+        if request.word_frequencies is not None:
+            phrase_frequencies = dict(request.word_frequencies)
+            enabled_by_min_char_complete = request.enabled_by_min_char_complete
+            if slow_sources:
+                if not self._add_native_suggestions(
+                        request, phrase_frequencies):
+                    return None
+            phrase_candidates = itb_util.best_candidates(phrase_frequencies)
+        elif self._word_predictions or self._temporary_word_predictions:
+            for ime in request.current_imes:
+                if request.cancel_event.is_set():
+                    return None
+                if request.transliterated_strings[ime]:
                     candidates = []
                     prefix_length = 0
                     prefix = ''
                     stripped_transliterated_string = (
-                        itb_util.lstrip_token(self._transliterated_strings[ime]))
+                        itb_util.lstrip_token(request.transliterated_strings[ime]))
                     if ime in ['ko-romaja', 'ko-han2']:
                         # The two Korean input methods we have in m17n produce
                         # Jamo from the Hangul compatibility block and not
@@ -1524,24 +1828,33 @@ class TypingBoosterEngine(IBus.Engine): # type: ignore
                     if (stripped_transliterated_string
                             and (len(stripped_transliterated_string)
                                   >= self._min_char_complete)):
-                        self.is_lookup_table_enabled_by_min_char_complete = True
-                    if (self.is_lookup_table_enabled_by_min_char_complete
-                            or self.is_lookup_table_enabled_by_tab):
+                        enabled_by_min_char_complete = True
+                    if (enabled_by_min_char_complete
+                            or request.lookup_table_enabled_by_tab):
                         prefix_length = (
-                            len(self._transliterated_strings[ime])
+                            len(request.transliterated_strings[ime])
                             - len(stripped_transliterated_string))
                         if prefix_length:
-                            prefix = (
-                                self._transliterated_strings[ime][0:prefix_length])
+                            prefix = request.transliterated_strings[ime][
+                                0:prefix_length]
+                        request.word_inputs.append(
+                            (prefix, stripped_transliterated_string))
+                        time_start = time.perf_counter()
                         try:
                             candidates = self.database.select_words(
                                 stripped_transliterated_string,
-                                p_phrase=self._p_phrase,
-                                pp_phrase=self._pp_phrase)
+                                p_phrase=request.p_phrase,
+                                pp_phrase=request.pp_phrase,
+                                native_suggestions=slow_sources)
                         except Exception as error: # pylint: disable=broad-except
                             LOGGER.exception(
                                 'Exception when calling select_words: %s: %s',
                                 error.__class__.__name__, error)
+                        self._add_source_timing(
+                            request,
+                            'select_words' if slow_sources
+                            else 'select_words_without_native_suggestions',
+                            time_start)
                     if candidates and prefix:
                         candidates = [
                             itb_util.PredictionCandidate(
@@ -1549,13 +1862,15 @@ class TypingBoosterEngine(IBus.Engine): # type: ignore
                                 user_freq=x.user_freq)
                             for x in candidates]
                     shortcut_candidates: List[Tuple[str, float]] = []
+                    time_start = time.perf_counter()
                     try:
                         shortcut_candidates = self.database.select_shortcuts(
-                            self._transliterated_strings[ime])
+                            request.transliterated_strings[ime])
                     except Exception as error: # pylint: disable=broad-except
                         LOGGER.exception(
                             'Exception when calling select_shortcuts: %s: %s',
                             error.__class__.__name__, error)
+                    self._add_source_timing(request, 'shortcuts', time_start)
                     for cand in candidates + shortcut_candidates:
                         if cand.phrase in phrase_frequencies:
                             phrase_frequencies[cand.phrase] = max(
@@ -1563,6 +1878,10 @@ class TypingBoosterEngine(IBus.Engine): # type: ignore
                                 cand.user_freq)
                         else:
                             phrase_frequencies[cand.phrase] = cand.user_freq
+            if not slow_sources:
+                request.word_frequencies = dict(phrase_frequencies)
+                request.enabled_by_min_char_complete = (
+                    enabled_by_min_char_complete)
             phrase_candidates = itb_util.best_candidates(phrase_frequencies)
         # If the first candidate is exactly the same as the typed string
         # prefer longer candidates which start exactly with the typed
@@ -1572,8 +1891,7 @@ class TypingBoosterEngine(IBus.Engine): # type: ignore
         # the opportunity to save some key strokes.
         if phrase_candidates:
             typed_string = itb_util.normalize_nfc_and_composition_exclusions(
-                self._transliterated_strings[
-                    self.get_current_imes()[0]])
+                request.transliterated_strings[request.current_imes[0]])
             first_candidate = itb_util.normalize_nfc_and_composition_exclusions(
                 phrase_candidates[0].phrase)
             if typed_string == first_candidate:
@@ -1592,34 +1910,32 @@ class TypingBoosterEngine(IBus.Engine): # type: ignore
                         phrase_frequencies[cand.phrase] = cand.user_freq
                 phrase_candidates = itb_util.best_candidates(
                     phrase_frequencies)
-        if ((self._emoji_predictions
-             and not self.client_capabilities & itb_util.Capabilite.OSK)
-            or self._temporary_emoji_predictions
-            or self._typed_string[0] in self._emoji_trigger_characters
-            or self._typed_string[-1] in self._emoji_trigger_characters):
+        emoji_matcher: Optional[itb_emoji.EmojiMatcher] = None
+        if slow_sources and self._emoji_candidates_wanted(request):
             # If emoji mode is off and the emoji predictions are
             # triggered here because the typed string starts with an
             # emoji trigger character, the emoji matcher might not have been
-            # initialized yet.  Make sure it is initialized now:
-            if (not self.emoji_matcher
-                or
-                self.emoji_matcher.get_languages()
-                != self._dictionary_names):
-                self.emoji_matcher = itb_emoji.EmojiMatcher(
-                    languages=self._dictionary_names,
-                    unicode_data_all=self._unicode_data_all,
-                    variation_selector=self._emoji_style)
+            # initialized yet.  Make sure it is loading now. Until it
+            # is ready, only text candidates are shown:
+            emoji_matcher = self._update_emoji_matcher()
+        if emoji_matcher is not None:
+            if request.cancel_event.is_set():
+                return None
             emoji_scores: Dict[str, Tuple[float, str]] = {}
             emoji_max_score: float = 0.0
-            for ime in self._current_imes:
-                if (self._transliterated_strings[ime]
-                        and ((len(self._transliterated_strings[ime])
+            for ime in request.current_imes:
+                if request.cancel_event.is_set():
+                    return None
+                if (request.transliterated_strings[ime]
+                        and ((len(request.transliterated_strings[ime])
                               >= self._min_char_complete)
                              or self._tab_enable)):
-                    emoji_matcher_candidates = self.emoji_matcher.candidates(
-                        self._transliterated_strings[ime],
+                    time_start = time.perf_counter()
+                    emoji_matcher_candidates = emoji_matcher.candidates(
+                        request.transliterated_strings[ime],
                         match_limit=self._emoji_match_limit,
                         trigger_characters=self._emoji_trigger_characters)
+                    self._add_source_timing(request, 'emoji', time_start)
                     for ecand in emoji_matcher_candidates:
                         emoji_max_score = max(emoji_max_score, ecand.user_freq)
                         if (ecand.phrase not in emoji_scores
@@ -1644,7 +1960,7 @@ class TypingBoosterEngine(IBus.Engine): # type: ignore
                         itb_util.PredictionCandidate(
                             phrase=cand.phrase,
                             user_freq=cand.user_freq,
-                            comment=self.emoji_matcher.name(cand.phrase),
+                            comment=emoji_matcher.name(cand.phrase),
                             from_user_db=cand.user_freq > 0,
                             spell_checking=cand.user_freq < 0))
             emoji_candidates: List[itb_util.PredictionCandidate] = []
@@ -1658,13 +1974,13 @@ class TypingBoosterEngine(IBus.Engine): # type: ignore
                 emoji_candidates.append(
                     itb_util.PredictionCandidate(
                         phrase=key, user_freq=value[0], comment=value[1]))
-            page_size = self._lookup_table.get_page_size()
+            page_size = request.page_size
             phrase_candidates_top = phrase_candidates_emoji_name[:page_size-1]
             phrase_candidates_rest = phrase_candidates_emoji_name[page_size-1:]
             emoji_candidates_top = emoji_candidates[:page_size]
             emoji_candidates_rest = emoji_candidates[page_size:]
             for cand in phrase_candidates_top:
-                self._candidates.append(
+                new_candidates.append(
                     itb_util.PredictionCandidate(
                         phrase=cand.phrase,
                         user_freq=cand.user_freq,
@@ -1672,7 +1988,7 @@ class TypingBoosterEngine(IBus.Engine): # type: ignore
                         from_user_db=cand.from_user_db,
                         spell_checking=cand.spell_checking))
             for cand in emoji_candidates_top:
-                self._candidates.append(
+                new_candidates.append(
                     itb_util.PredictionCandidate(
                         phrase=cand.phrase,
                         user_freq=cand.user_freq,
@@ -1680,7 +1996,7 @@ class TypingBoosterEngine(IBus.Engine): # type: ignore
                         from_user_db=False,
                         spell_checking=False))
             for cand in phrase_candidates_rest:
-                self._candidates.append(
+                new_candidates.append(
                     itb_util.PredictionCandidate(
                         phrase=cand.phrase,
                         user_freq=cand.user_freq,
@@ -1688,7 +2004,7 @@ class TypingBoosterEngine(IBus.Engine): # type: ignore
                         from_user_db=cand.from_user_db,
                         spell_checking=cand.spell_checking))
             for cand in emoji_candidates_rest:
-                self._candidates.append(
+                new_candidates.append(
                     itb_util.PredictionCandidate(
                         phrase=cand.phrase,
                         user_freq=cand.user_freq,
@@ -1697,13 +2013,41 @@ class TypingBoosterEngine(IBus.Engine): # type: ignore
                         spell_checking=False))
         else:
             for cand in phrase_candidates:
-                self._candidates.append(
+                new_candidates.append(
                     itb_util.PredictionCandidate(
                         phrase=cand.phrase,
                         user_freq=cand.user_freq,
                         comment='',
                         from_user_db=cand.user_freq > 0,
                         spell_checking=cand.user_freq < 0))
+        if (self._label_dictionary
+            or self._flag_dictionary
+            or self._color_dictionary):
+            # Spellcheck all candidates which may get dictionary
+            # labels in one batch, possibly in the worker thread.
+            # _append_candidate_to_lookup_table() then finds the
+            # results in the memo of the Hunspell object:
+            time_start = time.perf_counter()
+            self.database.hunspell_obj.spellcheck_match_lists(
+                phrase for phrase in (
+                    itb_util.normalize_nfc_and_composition_exclusions(
+                        cand.phrase)
+                    for cand in new_candidates if not cand.comment)
+                if len(phrase) >= 3)
+            self._add_source_timing(request, 'dictionary_labels', time_start)
+        return (new_candidates, enabled_by_min_char_complete)
+
+    @itb_util.trace_stage('lookup_table')
+    def _apply_candidates(
+            self,
+            candidates: List[itb_util.PredictionCandidate],
+            enabled_by_min_char_complete: bool) -> None:
+        '''Fills the lookup table with the computed candidates'''
+        self._lookup_table.clear()
+        self._lookup_table.set_cursor_visible(False)
+        self._candidates = candidates
+        self.is_lookup_table_enabled_by_min_char_complete = (
+            enabled_by_min_char_complete)
         for cand in self._candidates:
             self._append_candidate_to_lookup_table(
                 phrase=cand.phrase,
@@ -1714,7 +2058,177 @@ class TypingBoosterEngine(IBus.Engine): # type: ignore
         self._candidates_case_mode_orig = self._candidates.copy()
         if self._current_case_mode != 'orig':
             self._case_mode_change(mode=self._current_case_mode)
-        return
+
+    def _update_candidates(self) -> None:
+        '''Update the list of candidates and fill the lookup table with the
+        candidates
+        '''
+        if self._debug_level > 1:
+            LOGGER.debug('self._typed_string=%s', self._typed_string)
+        self._lookup_table.clear()
+        self._lookup_table.set_cursor_visible(False)
+        if self.is_empty():
+            # Nothing to do when there is no input available.
+            # One can accidentally end up here even though the
+            # input is empty because this is called by GLib.idle_add().
+            # Better make sure that calling this function with
+            # empty input does not pointlessly try to find candidates.
+            return
+        result = self._compute_candidates(self._new_candidates_request())
+        if result is not None:
+            self._apply_candidates(*result)
+
+    def _cancel_candidates_computation(self) -> None:
+        '''Cancels the computation of candidates in the worker thread
+
+        A computation which has already started stops at its next
+        check of the cancel event, its result is never used.
+        '''
+        if self._candidates_budget_source_id:
+            GLib.source_remove(self._candidates_budget_source_id)
+            self._candidates_budget_source_id = 0
+        if self._candidates_request is None:
+            return
+        self._candidates_request.cancel_event.set()
+        self._candidates_request = None
+
+    def _start_candidates_computation(self) -> None:
+        '''Computes the candidates in the worker thread
+
+        The result is delivered to the main loop by
+        _candidates_computed() which uses it only if it still
+        matches the current input.
+
+        If a time budget is set and slow sources of candidates are
+        needed, the candidates of the fast sources are computed
+        first. They are shown when the budget is over before all
+        candidates are computed (see _candidates_budget_expired()),
+        the complete candidates replace them when they are ready,
+        unless the input has changed meanwhile.
+        '''
+        self._cancel_candidates_computation()
+        if self.is_empty():
+            return
+        request = self._new_candidates_request()
+        self._candidates_request = request
+        if self._candidates_executor is None:
+            self._candidates_executor = (
+                concurrent.futures.ThreadPoolExecutor(
+                    max_workers=1, thread_name_prefix='itb-candidates'))
+        self._candidates_executor.submit(
+            self._candidates_worker_function, request)
+        if self._candidates_budget_milliseconds:
+            self._candidates_budget_source_id = GLib.timeout_add(
+                self._candidates_budget_milliseconds,
+                self._candidates_budget_expired, request)
+
+    def _candidates_worker_function(self, request: CandidatesRequest) -> None:
+        '''Runs in the worker thread to compute candidates for a request'''
+        if request.cancel_event.is_set():
+            return
+        itb_util.KEYSTROKE_TRACER.attach(request.trace_record)
+        time_start = time.perf_counter()
+        try:
+            if (self._candidates_budget_milliseconds
+                    and self._has_slow_candidates_sources(request)):
+                partial_result = self._compute_candidates(
+                    request, slow_sources=False)
+                if partial_result is None:
+                    return
+                GLib.idle_add(
+                    self._candidates_partially_computed,
+                    request, partial_result)
+            result = self._compute_candidates(request)
+        except Exception as error: # pylint: disable=broad-except
+            LOGGER.exception(
+                'Exception when computing candidates: %s: %s',
+                error.__class__.__name__, error)
+            return
+        if result is None or request.cancel_event.is_set():
+            if self._debug_level > 1:
+                LOGGER.debug('Cancelled candidates for %r',
+                             request.typed_string)
+            return
+        if self._debug_level > 1:
+            LOGGER.debug('Computed candidates for %r in %s seconds, '
+                         'milliseconds per source: %s',
+                         request.typed_string,
+                         time.perf_counter() - time_start,
+                         {source: round(milliseconds, 2)
+                          for (source, milliseconds)
+                          in request.timings.items()})
+        GLib.idle_add(self._candidates_computed, request, result)
+
+    def _candidates_request_is_current(
+            self, request: CandidatesRequest) -> bool:
+        '''Checks whether a request still matches the current input'''
+        return (request is self._candidates_request
+                and not request.cancel_event.is_set()
+                and request.typed_string == self._typed_string)
+
+    def _candidates_partially_computed(
+            self,
+            request: CandidatesRequest,
+            partial_result: Tuple[List[itb_util.PredictionCandidate], bool]
+    ) -> bool:
+        '''Receives the candidates of the fast sources from the worker
+        thread and shows them if the time budget is over already
+
+        :return: *Must* always return False to avoid that this callback
+                 called by GLib.idle_add() runs again.
+        '''
+        if not self._candidates_request_is_current(request):
+            return False
+        request.partial_result = partial_result
+        if request.budget_expired:
+            self._apply_candidates(*partial_result)
+            self._refresh_lookup_table_and_aux()
+        return False
+
+    def _candidates_budget_expired(self, request: CandidatesRequest) -> bool:
+        '''Called when the time budget for computing the candidates is
+        over, shows the candidates of the fast sources if they are
+        ready, else _candidates_partially_computed() shows them as soon
+        as they are
+
+        :return: *Must* always return False to avoid that this callback
+                 called by GLib.timeout_add() runs again.
+        '''
+        self._candidates_budget_source_id = 0
+        if not self._candidates_request_is_current(request):
+            return False
+        request.budget_expired = True
+        if request.partial_result is not None:
+            self._apply_candidates(*request.partial_result)
+            self._refresh_lookup_table_and_aux()
+        return False
+
+    def _candidates_computed(
+            self,
+            request: CandidatesRequest,
+            result: Tuple[List[itb_util.PredictionCandidate], bool]) -> bool:
+        '''Shows the candidates computed in the worker thread
+
+        :return: *Must* always return False to avoid that this callback
+                 called by GLib.idle_add() runs again.
+        '''
+        if not self._candidates_request_is_current(request):
+            # Stale, the input has changed since the request was made:
+            return False
+        if self._candidates_budget_source_id:
+            GLib.source_remove(self._candidates_budget_source_id)
+            self._candidates_budget_source_id = 0
+        self._candidates_request = None
+        if (request.budget_expired
+                and request.partial_result is not None
+                and self._lookup_table.cursor_visible):
+            # The candidates of the fast sources are shown and the
+            # user has started to select one of them, replacing them
+            # now would move the candidate under the cursor:
+            return False
+        self._apply_candidates(*result)
+        self._refresh_lookup_table_and_aux()
+        return False
 
     def _arrow_down(self) -> bool:
         '''Process Arrow Down Key Event
@@ -1932,6 +2446,7 @@ class TypingBoosterEngine(IBus.Engine): # type: ignore
         self._p_phrase = ''
         self._new_sentence = False
 
+    @itb_util.trace_stage('transliteration')
     def _update_transliterated_strings(self) -> None:
         '''Transliterates the current input (list of msymbols) for all current
         input methods and stores the results in a dictionary.
@@ -1941,10 +2456,13 @@ class TypingBoosterEngine(IBus.Engine): # type: ignore
             self._transliterated_strings_compose_part = (
                 self._compose_sequences.preedit_representation(
                     self._typed_compose_sequence))
+        # Typing mostly appends at the end of self._typed_string,
+        # the incremental transliteration then feeds only the new
+        # msymbols into the input methods instead of all of them:
         for ime in self._current_imes:
             if self._typed_compose_sequence:
                 self._transliterated_strings_before_compose[ime] = (
-                    self._transliterators[ime].transliterate(
+                    self._transliterators[ime].transliterate_incremental(
                         self._typed_string[:self._typed_string_cursor],
                         ascii_digits=self._ascii_digits))
                 self._transliterated_strings[ime] = (
@@ -1955,7 +2473,7 @@ class TypingBoosterEngine(IBus.Engine): # type: ignore
                         ascii_digits=self._ascii_digits))
             else:
                 self._transliterated_strings[ime] = (
-                    self._transliterators[ime].transliterate(
+                    self._transliterators[ime].transliterate_incremental(
                         self._typed_string,
                         ascii_digits=self._ascii_digits))
         if self._debug_level > 1:
@@ -2041,6 +2559,8 @@ class TypingBoosterEngine(IBus.Engine): # type: ignore
         if dictionary_names == self._dictionary_names: # nothing to do
             return
         self._dictionary_names = dictionary_names
+        # Clears the caches of this Hunspell object if necessary,
+        # other engines have their own:
         self.database.hunspell_obj.set_dictionary_names(dictionary_names)
         self._dictionary_flags = itb_util.get_flags(self._dictionary_names)
         self._update_dictionary_menu_dicts()
@@ -2051,10 +2571,7 @@ class TypingBoosterEngine(IBus.Engine): # type: ignore
                     or
                     self.emoji_matcher.get_languages()
                     != dictionary_names):
-                self.emoji_matcher = itb_emoji.EmojiMatcher(
-                    languages=dictionary_names,
-                    unicode_data_all=self._unicode_data_all,
-                    variation_selector=self._emoji_style)
+                self._update_emoji_matcher()
         if not self.is_empty():
             self._update_ui()
         if update_gsettings:
@@ -2068,6 +2585,41 @@ class TypingBoosterEngine(IBus.Engine): # type: ignore
         # the private member variable directly.
         return self._dictionary_names[:]
 
+    def set_fast_correction_dictionaries(
+            self,
+            dictionary_names: Union[str, List[str], Any],
+            update_gsettings: bool = True) -> None:
+        '''Set the dictionaries which use the fast correction index
+
+        :param dictionary_names: List of names of dictionaries, shell
+                                 style wildcards are allowed. If a
+                                 single string is used, it should
+                                 contain the names separated by commas.
+        :param update_gsettings: Whether to write the change to Gsettings.
+                                 Set this to False if this method is
+                                 called because the Gsettings key changed
+                                 to avoid endless loops when the Gsettings
+                                 key is changed twice in a short time.
+        '''
+        LOGGER.debug(
+            '(%s, update_gsettings = %s)', dictionary_names, update_gsettings)
+        if isinstance(dictionary_names, str):
+            dictionary_names = [
+                x.strip() for x in dictionary_names.split(',') if x.strip()]
+        if dictionary_names == self._fast_correction_dictionaries:
+            return
+        self._fast_correction_dictionaries = dictionary_names
+        self.database.hunspell_obj.set_fast_correction_dictionaries(
+            dictionary_names)
+        if update_gsettings:
+            self._gsettings.set_value(
+                'fastcorrectiondictionaries',
+                GLib.Variant.new_string(','.join(dictionary_names)))
+
+    def get_fast_correction_dictionaries(self) -> List[str]:
+        '''Get the dictionaries which use the fast correction index'''
+        return self._fast_correction_dictionaries[:]
+
     def set_autosettings(
             self,
             autosettings: Union[List[Tuple[str, str, str]], Any],
@@ -2088,6 +2640,7 @@ class TypingBoosterEngine(IBus.Engine): # type: ignore
         if autosettings == self._autosettings:
             return
         self._autosettings = autosettings
+        self._compile_autosettings()
         if update_gsettings:
             variant_array = GLib.Variant.new_array(GLib.VariantType('as'), [
                     GLib.Variant.new_array(GLib.VariantType('s'), [
@@ -2098,6 +2651,51 @@ class TypingBoosterEngine(IBus.Engine): # type: ignore
                 'autosettings',
                 variant_array)
 
+    def _compile_autosettings(self) -> None:
+        '''Compiles the regular expressions of the autosettings
+
+        Done only when the autosettings change, not on each focus
+        in. Rules for settings which cannot be changed automatically
+        and rules with invalid regular expressions are skipped.
+        '''
+        self._autosettings_rules = []
+        self._autosettings_profiles.clear()
+        for (setting, value, regexp) in self._autosettings:
+            if (not regexp
+                or setting not in self._settings_dict
+                or 'set_function' not in self._settings_dict[setting]
+                or 'get_function' not in self._settings_dict[setting]):
+                continue
+            try:
+                pattern = re.compile(regexp)
+            except re.error as error:
+                LOGGER.exception(
+                    'Invalid regular expression “%s” in autosettings: %s: %s',
+                    regexp, error.__class__.__name__, error)
+                continue
+            self._autosettings_rules.append((setting, value, pattern))
+
+    def _autosettings_profile(
+            self, im_client: str) -> Tuple[Tuple[str, str, str], ...]:
+        '''Returns the autosettings rules matching a window
+
+        The result for each window is remembered until the
+        autosettings change.
+
+        :param im_client: The self._im_client of the window
+        :return: (setting, value, regexp) tuples of the matching rules
+                 in the order of the autosettings
+        '''
+        profile: Optional[Tuple[Tuple[str, str, str], ...]] = (
+            self._autosettings_profiles.get(im_client))
+        if profile is None:
+            profile = tuple(
+                (setting, value, pattern.pattern)
+                for (setting, value, pattern) in self._autosettings_rules
+                if pattern.search(im_client))
+            self._autosettings_profiles.put(im_client, profile)
+        return profile
+
     def get_autosettings(self) -> List[Tuple[str, str, str]]:
         '''Get current autosettings
 
@@ -2710,6 +3308,156 @@ class TypingBoosterEngine(IBus.Engine): # type: ignore
         self._clear_input()
         self._update_ui_empty_input()
 
+    def _current_emoji_matcher_key(
+            self) -> Tuple[Tuple[str, ...], bool, str]:
+        '''Returns the settings the emoji matcher has to be created for'''
+        return (tuple(self._dictionary_names),
+                self._unicode_data_all,
+                self._emoji_style)
+
+    def _set_emoji_matcher(
+            self,
+            emoji_matcher: itb_emoji.EmojiMatcher,
+            key: Tuple[Tuple[str, ...], bool, str]) -> None:
+        '''Swaps in a new shared emoji matcher
+
+        The old one is kept warm, the least recently used warm emoji
+        matcher beyond MAX_WARM_RESOURCES is released.
+        '''
+        released: List[itb_emoji.EmojiMatcher] = []
+        with self._emoji_matcher_lock:
+            old_emoji_matcher = self.emoji_matcher
+            old_key = self._emoji_matcher_key
+            self.emoji_matcher = emoji_matcher
+            self._emoji_matcher_key = key
+            if old_emoji_matcher is not None:
+                if old_key is not None and old_key != key:
+                    self._warm_emoji_matchers[old_key] = old_emoji_matcher
+                else:
+                    released.append(old_emoji_matcher)
+            while len(self._warm_emoji_matchers) > MAX_WARM_RESOURCES:
+                released.append(self._warm_emoji_matchers.pop(
+                    next(iter(self._warm_emoji_matchers))))
+        for released_emoji_matcher in released:
+            itb_util.release_shared(released_emoji_matcher)
+
+    def _update_emoji_matcher(
+            self, wait: bool = False) -> Optional[itb_emoji.EmojiMatcher]:
+        '''Makes sure the emoji matcher for the current settings is available
+
+        If the current emoji matcher was created for different
+        settings, the shared emoji matcher for the current settings
+        is loaded in a background thread and swapped in by
+        _emoji_matcher_loaded() when it is ready. Loading the Unicode
+        and CLDR data takes long and should not block typing. Until
+        the new one is ready, the old emoji matcher, if any, continues
+        to be used.
+
+        Can be called from the candidates worker thread as well.
+
+        :param wait: Whether to wait until the emoji matcher for the
+                     current settings is ready. When running the unit
+                     tests, this always waits.
+        :return: The emoji matcher to use now, None if there is none yet.
+        '''
+        key = self._current_emoji_matcher_key()
+        wait = wait or self._unit_test
+        with self._emoji_matcher_lock:
+            if (self.emoji_matcher is not None
+                and self._emoji_matcher_key == key):
+                return self.emoji_matcher
+            warm_emoji_matcher = self._warm_emoji_matchers.pop(key, None)
+        if warm_emoji_matcher is not None:
+            if self._debug_level > 1:
+                LOGGER.debug('Reusing EmojiMatcher for %r', key)
+            self._set_emoji_matcher(warm_emoji_matcher, key)
+            return warm_emoji_matcher
+        with self._emoji_matcher_lock:
+            future = self._emoji_matcher_future
+            if (future is not None
+                and self._emoji_matcher_pending.get(future) != key):
+                # Still loading for settings which have changed since,
+                # _emoji_matcher_loaded() will release the result:
+                future = None
+            if future is None and not wait:
+                if self._debug_level > 1:
+                    LOGGER.debug('Loading EmojiMatcher for %r', key)
+                if self._emoji_matcher_executor is None:
+                    self._emoji_matcher_executor = (
+                        concurrent.futures.ThreadPoolExecutor(
+                            max_workers=1,
+                            thread_name_prefix='itb-emoji-matcher'))
+                future = self._emoji_matcher_executor.submit(
+                    itb_emoji.acquire_emoji_matcher,
+                    languages=key[0],
+                    unicode_data_all=key[1],
+                    variation_selector=key[2])
+                self._emoji_matcher_pending[future] = key
+                future.add_done_callback(
+                    lambda done: GLib.idle_add(
+                        self._emoji_matcher_loaded, done))
+            self._emoji_matcher_future = future
+            if not wait:
+                return self.emoji_matcher
+        if future is None:
+            self._set_emoji_matcher(
+                itb_emoji.acquire_emoji_matcher(
+                    languages=key[0],
+                    unicode_data_all=key[1],
+                    variation_selector=key[2]),
+                key)
+        else:
+            concurrent.futures.wait([future])
+            self._emoji_matcher_loaded(future, update_ui=False)
+        return self.emoji_matcher
+
+    def _emoji_matcher_loaded(
+            self,
+            future: 'concurrent.futures.Future[itb_emoji.EmojiMatcher]',
+            update_ui: bool = True) -> bool:
+        '''Swaps in an emoji matcher which has been loaded in the background
+
+        If the settings have changed while it was loading, it is
+        released instead. If it is swapped in, the lookup table is
+        updated to show emoji candidates as well.
+
+        :param future: The future the emoji matcher was loaded by
+        :param update_ui: Whether to update the lookup table
+        :return: *Must* always return False to avoid that this callback
+                 called by GLib.idle_add() runs again.
+        '''
+        with self._emoji_matcher_lock:
+            key = self._emoji_matcher_pending.pop(future, None)
+            if key is None:
+                # Already handled
+                return False
+            current = future is self._emoji_matcher_future
+            if current:
+                self._emoji_matcher_future = None
+        try:
+            emoji_matcher = future.result()
+        except Exception as error: # pylint: disable=broad-except
+            LOGGER.exception(
+                'Exception when loading EmojiMatcher: %s: %s',
+                error.__class__.__name__, error)
+            return False
+        if not current or key != self._current_emoji_matcher_key():
+            itb_util.release_shared(emoji_matcher)
+            return False
+        if self._debug_level > 1:
+            LOGGER.debug('EmojiMatcher for %r loaded', key)
+        self._set_emoji_matcher(emoji_matcher, key)
+        if not update_ui:
+            return False
+        if self._lookup_table_shows_related_candidates:
+            self._lookup_related_candidates(
+                self._lookup_table_related_candidates_phrase)
+        elif not (self.is_empty()
+                  or self._lookup_table_shows_m17n_candidates
+                  or self._lookup_table_shows_compose_completions):
+            self._update_ui()
+        return False
+
     def do_destroy(self) -> None: # pylint: disable=arguments-differ
         '''Called when this input engine is destroyed
         '''
@@ -2717,6 +3465,28 @@ class TypingBoosterEngine(IBus.Engine): # type: ignore
             LOGGER.debug('entering function')
         self._clear_input_and_update_ui()
         self.do_focus_out()
+        if self._database_flush_source_id:
+            GLib.source_remove(self._database_flush_source_id)
+            self._database_flush_source_id = 0
+        self.database.flush_pending_updates(checkpoint=True)
+        self._cancel_candidates_computation()
+        if self._candidates_executor is not None:
+            self._candidates_executor.shutdown(wait=False)
+            self._candidates_executor = None
+        with self._emoji_matcher_lock:
+            itb_util.release_shared(self.emoji_matcher)
+            self.emoji_matcher = None
+            self._emoji_matcher_key = None
+            for emoji_matcher in self._warm_emoji_matchers.values():
+                itb_util.release_shared(emoji_matcher)
+            self._warm_emoji_matchers = {}
+            # Loaded emoji matchers are released by
+            # _emoji_matcher_loaded() because they are not current anymore:
+            self._emoji_matcher_future = None
+        if self._emoji_matcher_executor is not None:
+            self._emoji_matcher_executor.shutdown(wait=False)
+            self._emoji_matcher_executor = None
+        itb_util.release_shared(self._compose_sequences)
         super().destroy()
 
     def _add_color_to_attrs_for_spellcheck(
@@ -2819,6 +3589,7 @@ class TypingBoosterEngine(IBus.Engine): # type: ignore
         after = str(cm_func(after))
         return before + inner_preedit + after
 
+    @itb_util.trace_stage('preedit')
     def _update_preedit(self) -> None:
         '''Update Preedit String in UI'''
         if self._debug_level > 1:
@@ -3051,6 +3822,21 @@ class TypingBoosterEngine(IBus.Engine): # type: ignore
                  the same as `return False` to remove the source
                  added by Glib.timeout_add() (GLib.SOURCE_REMOVE is False)
         '''
+        # Whatever is shown now, for example related candidates,
+        # must not be replaced by candidates still being computed:
+        self._cancel_candidates_computation()
+        self._refresh_lookup_table_and_aux()
+
+    @itb_util.trace_stage('lookup_table')
+    def _refresh_lookup_table_and_aux(self) -> None:
+        '''Update the lookup table and the auxiliary text without
+        cancelling the computation of candidates in the worker thread
+
+        Used to show the candidates delivered by the worker thread,
+        the candidates of the fast sources shown when the time budget
+        is over must not cancel the computation of the complete
+        candidates.
+        '''
         self._update_aux()
         # auto select best candidate if the option
         # self._auto_select_candidate is on:
@@ -3102,6 +3888,14 @@ class TypingBoosterEngine(IBus.Engine): # type: ignore
         else:
             super().update_auxiliary_text(
                 IBus.Text.new_from_string(''), False)
+        if not self._unit_test:
+            # Compute the candidates in the worker thread, key events
+            # are processed meanwhile and the busy label stays until
+            # _candidates_computed() updates the lookup table and the
+            # auxiliary text:
+            self._timeout_source_id = 0
+            self._start_candidates_computation()
+            return
         self._update_candidates()
         self._update_lookup_table_and_aux()
         if self._debug_level < 2:
@@ -3121,6 +3915,7 @@ class TypingBoosterEngine(IBus.Engine): # type: ignore
         '''
         if self._debug_level > 1:
             LOGGER.debug('entering function')
+        self._cancel_candidates_computation()
         self._update_preedit()
         self.get_lookup_table().clear()
         self.get_lookup_table().set_cursor_visible(False)
@@ -3217,6 +4012,9 @@ class TypingBoosterEngine(IBus.Engine): # type: ignore
         '''Update User Interface'''
         if self._debug_level > 1:
             LOGGER.debug('entering function')
+        # The input has changed, candidates still being computed
+        # for older input are useless now:
+        self._cancel_candidates_computation()
         if self.is_empty():
             # Hide lookup table again if preëdit became empty and
             # suggestions are only enabled by Tab key:
@@ -3327,20 +4125,10 @@ class TypingBoosterEngine(IBus.Engine): # type: ignore
         # So make sure that the emoji matcher is available for the
         # correct list of languages before searching for similar
         # emoji:
-        if (not self.emoji_matcher
-            or
-            self.emoji_matcher.get_languages()
-            != self._dictionary_names):
-            self.emoji_matcher = itb_emoji.EmojiMatcher(
-                languages=self._dictionary_names,
-                unicode_data_all=self._unicode_data_all,
-                variation_selector=self._emoji_style)
-        if self._debug_level > 0:
-            related_candidates = self.emoji_matcher.similar(
-                phrase)
-        else:
-            related_candidates = self.emoji_matcher.similar(
-                phrase, show_keywords=False)
+        emoji_matcher = self._update_emoji_matcher(wait=True)
+        if emoji_matcher is not None:
+            related_candidates = emoji_matcher.similar(
+                phrase, show_keywords=self._debug_level > 0)
         if not IMPORT_ITB_NLTK_SUCCESSFUL:
             LOGGER.info('nltk is not available')
         else:
@@ -3923,6 +4711,7 @@ class TypingBoosterEngine(IBus.Engine): # type: ignore
                 phrase=self.get_p_phrase() + ' ' + stripped_commit_phrase,
                 p_phrase=self.get_pp_phrase(),
                 pp_phrase=self.get_ppp_phrase())
+        self._schedule_database_flush()
         # push context after recording in the database is finished:
         if push_context:
             self.push_context(stripped_commit_phrase)
@@ -4817,15 +5606,8 @@ class TypingBoosterEngine(IBus.Engine): # type: ignore
         self._emoji_predictions = mode
         self._init_or_update_property_menu(
             self.emoji_prediction_mode_menu, mode)
-        if (self._emoji_predictions
-            and (not self.emoji_matcher
-                 or
-                 self.emoji_matcher.get_languages()
-                 != self._dictionary_names)):
-            self.emoji_matcher = itb_emoji.EmojiMatcher(
-                languages=self._dictionary_names,
-                unicode_data_all=self._unicode_data_all,
-                variation_selector=self._emoji_style)
+        if self._emoji_predictions:
+            self._update_emoji_matcher()
         self._update_ui()
         if update_gsettings:
             self._gsettings.set_value(
@@ -4868,13 +5650,11 @@ class TypingBoosterEngine(IBus.Engine): # type: ignore
         if mode == self._unicode_data_all:
             return
         self._unicode_data_all = mode
-        if self.emoji_matcher:
+        if (self.emoji_matcher is not None
+            or self._emoji_matcher_future is not None):
             if self._debug_level > 1:
                 LOGGER.debug('Updating EmojiMatcher')
-            self.emoji_matcher = itb_emoji.EmojiMatcher(
-                languages=self._dictionary_names,
-                unicode_data_all=self._unicode_data_all,
-                variation_selector=self._emoji_style)
+            self._update_emoji_matcher()
         self._update_ui()
         if update_gsettings:
             self._gsettings.set_value(
@@ -4999,11 +5779,11 @@ class TypingBoosterEngine(IBus.Engine): # type: ignore
         if style == self._emoji_style:
             return
         self._emoji_style = style
-        if self.emoji_matcher:
+        if (self.emoji_matcher is not None
+            or self._emoji_matcher_future is not None):
             if self._debug_level > 1:
                 LOGGER.debug('Updating EmojiMatcher')
-            self.emoji_matcher.set_variation_selector(
-                self._emoji_style)
+            self._update_emoji_matcher()
         if self._lookup_table_shows_related_candidates:
             # If there is a lookup table showing related candidates
             # it might show Emoji and needs to be regenerated to
@@ -6284,6 +7064,158 @@ class TypingBoosterEngine(IBus.Engine): # type: ignore
         '''Returns the current value of the candidates delay in milliseconds'''
         return self._candidates_delay_milliseconds
 
+    def set_candidates_budget_milliseconds(
+            self,
+            milliseconds: Union[int, Any],
+            update_gsettings: bool = True) -> None:
+        '''Sets the time budget for computing the candidates in milliseconds
+
+        :param milliseconds:     How long to wait for the slow sources
+                                 of candidates before showing the
+                                 candidates of the fast sources,
+                                 0 means to wait for all sources.
+        :param update_gsettings: Whether to write the change to Gsettings.
+                                 Set this to False if this method is
+                                 called because the Gsettings key changed
+                                 to avoid endless loops when the Gsettings
+                                 key is changed twice in a short time.
+        '''
+        LOGGER.debug(
+            '(%s, update_gsettings = %s)', milliseconds, update_gsettings)
+        if milliseconds == self._candidates_budget_milliseconds:
+            return
+        self._candidates_budget_milliseconds = milliseconds
+        if update_gsettings:
+            self._gsettings.set_value(
+                'candidatesbudgetmilliseconds',
+                GLib.Variant.new_uint32(self._candidates_budget_milliseconds))
+
+    def get_candidates_budget_milliseconds(self) -> int:
+        '''Returns the current time budget for the candidates in milliseconds'''
+        return self._candidates_budget_milliseconds
+
+    def set_cache_max_entries(
+            self,
+            max_entries: Union[int, Any],
+            update_gsettings: bool = True) -> None:
+        '''Sets the maximum number of entries of each cache
+
+        :param max_entries:      maximum number of entries per cache
+        :param update_gsettings: Whether to write the change to Gsettings.
+                                 Set this to False if this method is
+                                 called because the Gsettings key changed
+                                 to avoid endless loops when the Gsettings
+                                 key is changed twice in a short time.
+        '''
+        LOGGER.debug(
+            '(%s, update_gsettings = %s)', max_entries, update_gsettings)
+        if max_entries == self._cache_max_entries:
+            return
+        self._cache_max_entries = max_entries
+        itb_util.set_cache_limits(max_entries=self._cache_max_entries)
+        if self._debug_level > 0:
+            itb_util.log_cache_info()
+        if update_gsettings:
+            self._gsettings.set_value(
+                'cachemaxentries',
+                GLib.Variant.new_uint32(self._cache_max_entries))
+
+    def get_cache_max_entries(self) -> int:
+        '''Returns the maximum number of entries of each cache'''
+        return self._cache_max_entries
+
+    def set_cache_max_megabytes(
+            self,
+            megabytes: Union[int, Any],
+            update_gsettings: bool = True) -> None:
+        '''Sets the approximate maximum size of each cache in megabytes
+
+        :param megabytes:        approximate maximum size per cache
+        :param update_gsettings: Whether to write the change to Gsettings.
+                                 Set this to False if this method is
+                                 called because the Gsettings key changed
+                                 to avoid endless loops when the Gsettings
+                                 key is changed twice in a short time.
+        '''
+        LOGGER.debug(
+            '(%s, update_gsettings = %s)', megabytes, update_gsettings)
+        if megabytes == self._cache_max_megabytes:
+            return
+        self._cache_max_megabytes = megabytes
+        itb_util.set_cache_limits(
+            max_bytes=self._cache_max_megabytes * 1024 * 1024)
+        if self._debug_level > 0:
+            itb_util.log_cache_info()
+        if update_gsettings:
+            self._gsettings.set_value(
+                'cachemaxmegabytes',
+                GLib.Variant.new_uint32(self._cache_max_megabytes))
+
+    def get_cache_max_megabytes(self) -> int:
+        '''Returns the approximate maximum size of each cache in megabytes'''
+        return self._cache_max_megabytes
+
+    def set_keystroke_tracing(
+            self,
+            mode: Union[bool, Any],
+            update_gsettings: bool = True) -> None:
+        '''Sets whether the latency of processing keystrokes is traced
+
+        :param mode:             Whether to trace keystrokes
+        :param update_gsettings: Whether to write the change to Gsettings.
+                                 Set this to False if this method is
+                                 called because the Gsettings key changed
+                                 to avoid endless loops when the Gsettings
+                                 key is changed twice in a short time.
+        '''
+        LOGGER.debug(
+            '(%s, update_gsettings = %s)', mode, update_gsettings)
+        if mode == self._keystroke_tracing:
+            return
+        self._keystroke_tracing = mode
+        itb_util.KEYSTROKE_TRACER.enable(
+            enabled=self._keystroke_tracing,
+            trace_file=self._keystroke_trace_file)
+        if update_gsettings:
+            self._gsettings.set_value(
+                'keystroketracing',
+                GLib.Variant.new_boolean(self._keystroke_tracing))
+
+    def get_keystroke_tracing(self) -> bool:
+        '''Returns whether the latency of processing keystrokes is traced'''
+        return self._keystroke_tracing
+
+    def set_keystroke_trace_file(
+            self,
+            path: Union[str, Any],
+            update_gsettings: bool = True) -> None:
+        '''Sets the file to append the keystroke trace to
+
+        :param path:             The path of the file, if empty the
+                                 trace is only kept in memory
+        :param update_gsettings: Whether to write the change to Gsettings.
+                                 Set this to False if this method is
+                                 called because the Gsettings key changed
+                                 to avoid endless loops when the Gsettings
+                                 key is changed twice in a short time.
+        '''
+        LOGGER.debug(
+            '(%s, update_gsettings = %s)', path, update_gsettings)
+        if path == self._keystroke_trace_file:
+            return
+        self._keystroke_trace_file = path
+        if self._keystroke_tracing:
+            itb_util.KEYSTROKE_TRACER.enable(
+                trace_file=self._keystroke_trace_file)
+        if update_gsettings:
+            self._gsettings.set_value(
+                'keystroketracefile',
+                GLib.Variant.new_string(self._keystroke_trace_file))
+
+    def get_keystroke_trace_file(self) -> str:
+        '''Returns the file the keystroke trace is appended to'''
+        return self._keystroke_trace_file
+
     def set_ibus_event_sleep_seconds(
             self,
             seconds: Union[float, Any],
@@ -7327,17 +8259,14 @@ class TypingBoosterEngine(IBus.Engine): # type: ignore
             grapheme_clusters = grapheme_clusters[-1:]
         # Make sure we have an EmojiMatcher to be able to get
         # names for emoji:
-        if (not self.emoji_matcher
-            or self.emoji_matcher.get_languages() != self._dictionary_names):
-            self.emoji_matcher = itb_emoji.EmojiMatcher(
-                languages=self._dictionary_names,
-                unicode_data_all=self._unicode_data_all,
-                variation_selector=self._emoji_style)
+        emoji_matcher = self._update_emoji_matcher(wait=True)
+        if emoji_matcher is None:
+            return False
         candidates = []
         code_point_list_phrase = ''
         full_breakdown_phrase = ''
         for cluster in grapheme_clusters:
-            name = self.emoji_matcher.name(cluster)
+            name = emoji_matcher.name(cluster)
             if len(cluster) == 1:
                 phrase = f'\u00A0{cluster} U+{ord(cluster):04X} {name}'
                 comment = phrase
@@ -7353,7 +8282,7 @@ class TypingBoosterEngine(IBus.Engine): # type: ignore
             candidates.append(itb_util.PredictionCandidate(
                 phrase=selection_text + phrase, comment=comment))
             for index, char in enumerate(cluster):
-                name = self.emoji_matcher.name(char)
+                name = emoji_matcher.name(char)
                 phrase = f'\u00A0{char} U+{ord(char):04X}'
                 if name:
                     phrase += f' {name}'
@@ -8398,6 +9327,7 @@ class TypingBoosterEngine(IBus.Engine): # type: ignore
         '''
         return self._remove_candidate(8)
 
+    @itb_util.trace_stage('hotkeys')
     def _handle_hotkeys(
             self,
             key: itb_util.KeyEvent,
@@ -9257,6 +10187,7 @@ class TypingBoosterEngine(IBus.Engine): # type: ignore
         self._update_ui()
         return True
 
+    @itb_util.trace_stage('compose')
     def _handle_compose(self, key: itb_util.KeyEvent, add_to_preedit: bool = True) -> bool:
         '''Internal method to handle possible compose keys
 
@@ -9614,6 +10545,18 @@ class TypingBoosterEngine(IBus.Engine): # type: ignore
         Key Events include Key Press and Key Release,
         modifier means Key Pressed
         '''
+        if not itb_util.KEYSTROKE_TRACER.enabled():
+            return self._do_process_key_event(keyval, keycode, state)
+        if not state & IBus.ModifierType.RELEASE_MASK:
+            # Everything done until the next key press, including
+            # computing the candidates, belongs to this keystroke:
+            itb_util.KEYSTROKE_TRACER.begin_keystroke()
+        with itb_util.KEYSTROKE_TRACER.stage('process_key_event'):
+            return self._do_process_key_event(keyval, keycode, state)
+
+    def _do_process_key_event(
+            self, keyval: int, keycode: int, state: int) -> bool:
+        '''Process a key event, see do_process_key_event()'''
         key = itb_util.KeyEvent(keyval, keycode, state)
         if self._debug_level > 1:
             LOGGER.debug('KeyEvent object: %s', key)
@@ -10369,7 +11312,7 @@ class TypingBoosterEngine(IBus.Engine): # type: ignore
             self._im_client += ':' + window_title
         if self._debug_level > 1:
             LOGGER.debug('self._im_client=%s\n', self._im_client)
-        self._keyvals_to_keycodes = itb_util.KeyvalsToKeycodes()
+        self._keyvals_to_keycodes = itb_util.get_keyvals_to_keycodes()
         if self._debug_level > 2:
             for keyval in self._keyvals_to_keycodes.keyvals():
                 name = IBus.keyval_name(keyval)
@@ -10393,15 +11336,8 @@ class TypingBoosterEngine(IBus.Engine): # type: ignore
         if not self._im_client:
             return
         autosettings_apply: Dict[str, Any] = {}
-        for (setting, value, regexp) in self._autosettings:
-            if (not regexp
-                or setting not in self._settings_dict
-                or 'set_function' not in self._settings_dict[setting]
-                or 'get_function' not in self._settings_dict[setting]):
-                continue
-            pattern = re.compile(regexp)
-            if not pattern.search(self._im_client):
-                continue
+        for (setting, value, regexp) in self._autosettings_profile(
+                self._im_client):
             current_value = self._settings_dict[setting]['get_function']()
             if setting in ('inputmethod', 'dictionary'):
                 current_value = ','.join(current_value)
@@ -10525,8 +11461,34 @@ class TypingBoosterEngine(IBus.Engine): # type: ignore
             phrase=stripped_commit_phrase,
             p_phrase=self.get_p_phrase(),
             pp_phrase=self.get_pp_phrase())
+        self._schedule_database_flush()
         self.push_context(stripped_commit_phrase)
 
+    def _schedule_database_flush(self) -> None:
+        '''Write pending frequency updates to the user database soon
+
+        Recording a committed phrase only collects the frequency
+        update in memory, writing it to disk while typing would
+        add latency to the next key press. Write all updates
+        collected within DATABASE_FLUSH_DELAY_MILLISECONDS in one
+        transaction instead. The timer is not restarted by later
+        commits, otherwise it might never fire while typing fast.
+        '''
+        if self._unit_test:
+            # Keep the unit tests synchronous:
+            self.database.flush_pending_updates()
+            return
+        if self._database_flush_source_id:
+            return
+        self._database_flush_source_id = GLib.timeout_add(
+            DATABASE_FLUSH_DELAY_MILLISECONDS, self._flush_database)
+
+    def _flush_database(self) -> bool:
+        '''Timer callback writing the pending frequency updates'''
+        self._database_flush_source_id = 0
+        self.database.flush_pending_updates()
+        return False
+
     def do_focus_out(self) -> None: # pylint: disable=arguments-differ
         '''
         Called for ibus < 1.5.27 when a window loses focus while
@@ -10561,6 +11523,27 @@ class TypingBoosterEngine(IBus.Engine): # type: ignore
         # been recorded in the user database yet. Do it now:
         if not self.is_empty():
             self._record_in_database_and_push_context()
+        if self._database_flush_source_id:
+            GLib.source_remove(self._database_flush_source_id)
+            self._database_flush_source_id = 0
+        self.database.flush_pending_updates()
+        # Write the rest of the keystroke trace in the background:
+        itb_util.KEYSTROKE_TRACER.flush(wait=False)
+        if self._debug_level > 0:
+            itb_util.log_cache_info()
+            # Measuring the shared instances is slow, only do it
+            # for more verbose debugging, it runs in the background:
+            itb_util.log_shared_instances_info(
+                measure=self._debug_level > 1)
+            itb_util.log_keystroke_trace_info()
+            if self.emoji_matcher is not None:
+                (number_of_queries,
+                 number_of_queries_short_circuited) = (
+                     self.emoji_matcher.query_statistics())
+                LOGGER.debug(
+                    'Emoji queries: %s, short-circuited because no label '
+                    'could match: %s',
+                    number_of_queries, number_of_queries_short_circuited)
         self.clear_context()
         self._clear_input_and_update_ui()
         self._revert_autosettings()
@@ -10812,6 +11795,8 @@ class TypingBoosterEngine(IBus.Engine): # type: ignore
         LOGGER.info('Reloading input methods ...')
         m17n_translit.fini()
         m17n_translit.init()
+        self._transliterators = {}
+        self._warm_transliterators = {}
         self._init_transliterators()
         self._clear_input_and_update_ui()
     # pylint: enable=unused-argument
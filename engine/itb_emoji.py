@@ -33,14 +33,21 @@ from typing import Callable
 import os
 import sys
 import re
+import array
+import bisect
 import functools
 import itertools
 import gzip
 import json
+import marshal
+import hashlib
+import time
 import unicodedata
 import html
 import logging
+import threading
 import gettext
+import zlib
 import itb_util
 
 DOMAINNAME = 'ibus-typing-booster'
@@ -91,6 +98,15 @@ except (ImportError,):
 
 LOGGER = logging.getLogger('ibus-typing-booster')
 
+# Increase this when the format of the EmojiMatcher snapshots or
+# the data stored in them changes:
+EMOJI_SNAPSHOT_VERSION = 2
+EMOJI_SNAPSHOT_MAGIC = b'ibus-typing-booster emoji snapshot\n'
+# Keep at most that many snapshots for different languages and options:
+EMOJI_SNAPSHOT_MAX_FILES = 8
+# Size in bits of the Bloom filter of the trigrams of the label words:
+LABEL_TRIGRAM_FILTER_BITS = 1 << 21
+
 DATADIR = os.path.join(os.path.dirname(__file__), '../data')
 # USER_DATADIR will be “~/.local/share/ibus-typing-booster/data” by default
 USER_DATADIR = itb_util.xdg_save_data_path('ibus-typing-booster/data')
@@ -403,19 +419,21 @@ def find_cldr_annotation_path(language: str) -> str:
             return path
     return ''
 
-# @functools.cache is available only in Python >= 3.9.
-#
-# Python >= 3.9 is not available on RHEL8, not yet on openSUSE
-# Tumbleweed (2021-22-29), ...
-#
-# But @functools.lru_cache(maxsize=None) is the same and it is
-# available for Python >= 3.2, that means it should be available
-# everywhere.
-#
 # Many keywords are of course shared by many emoji, therefore the
 # query string is often matched against labels already matched
 # previously. Caching previous matches speeds it up quite a bit.
-@functools.lru_cache(maxsize=None)
+#
+# The number of (label, query string) pairs grows with every query
+# typed, so the cache must be bounded, an unbounded
+# @functools.lru_cache(maxsize=None) grew for the whole lifetime of
+# the engine process.
+#
+# These functions are called for every label of every candidate
+# emoji, use itb_util.functools_lru_cache() here which is nearly as
+# fast as functools.lru_cache(), not itb_util.lru_cache() which
+# locks and measures the size of every entry. An entry holds the
+# label, the query string, and the score, about 400 bytes.
+@itb_util.functools_lru_cache('itb_emoji._match_classic()', 400)
 def _match_classic(label: str, match_string: str) -> float:
     '''Matches a label from the emoji data against the query string.'''
     label = itb_util.remove_accents(label.lower())
@@ -464,7 +482,7 @@ def _match_classic(label: str, match_string: str) -> float:
             tmp_no_spaces = tmp_no_spaces[:match_start] + tmp_no_spaces[match_start + len(word):]
     return total_score
 
-@functools.lru_cache(maxsize=None)
+@itb_util.functools_lru_cache('itb_emoji._match_rapidfuzz()', 400)
 def _match_rapidfuzz(label: str, match_string: str) -> float:
     '''Matches a label from the emoji data against the query string using rapidfuzz.'''
     label = itb_util.remove_accents(label.lower())
@@ -483,7 +501,9 @@ class EmojiMatcher():
                  cldr_data: bool = True,
                  variation_selector: str = 'emoji',
                  romaji: bool = True,
-                 match_algorithm: str = 'rapidfuzz') -> None:
+                 match_algorithm: str = 'rapidfuzz',
+                 label_index: bool = True,
+                 snapshot: bool = True) -> None:
         '''
         Initialize the emoji matcher
 
@@ -498,15 +518,27 @@ class EmojiMatcher():
         :param romaji: Whether to add Latin transliteration for Japanese.
                        Works only when pykakasi is available, if this is not
                        the case, this option is ignored.
+        :param label_index: Whether to build an index of the words in
+                            the labels of the emoji to find the emoji
+                            to score for a query faster. Turning it off
+                            is only useful for benchmarking, the results
+                            are the same.
+        :param snapshot: Whether to restore the loaded data from a
+                         snapshot on disk if an up to date one exists
+                         and to write one after loading the data if not.
         '''
         self._languages = languages
         self._gettext_translations: Dict[str, Any] = {}
+        # The .mo files used for the translations, for the snapshot key:
+        self._gettext_mo_files: Dict[str, str] = {}
         for language in itb_util.expand_languages(self._languages):
             mo_file = gettext.find(DOMAINNAME, languages=[language])
+            self._gettext_mo_files[language] = ''
             if (mo_file
                     and
                     '/' + language  + '/LC_MESSAGES/' + DOMAINNAME + '.mo'
                     in mo_file):
+                self._gettext_mo_files[language] = mo_file
                 # Get the gettext translation instance only if a
                 # translation file for this *exact* language was
                 # found.  Ignore it if only a fallback was found. For
@@ -531,11 +563,50 @@ class EmojiMatcher():
                 if enchant.dict_exists(language):
                     self._enchant_dicts.append(enchant.Dict(language))
         self._emoji_dict: Dict[Tuple[str, str], Dict[str, Any]] = {}
-        self._candidate_cache: Dict[
-            Tuple[str, int, str, bool], List[itb_util.PredictionCandidate]] = {}
+        # Index of the words in the labels, see _build_label_index():
+        self._label_index = label_index
+        self._emoji_keys: List[Tuple[str, str]] = []
+        self._label_words_text = ''
+        self._label_words_offsets = array.array('I')
+        # The positions of the emoji having the label word at index i
+        # are self._label_words_positions[start:end] with
+        # start, end = self._label_words_position_offsets[i:i + 2]
+        self._label_words_positions = array.array('I')
+        self._label_words_position_offsets = array.array('I')
+        # Bloom filter of all trigrams of the label words, see
+        # _query_cannot_match():
+        self._label_trigram_filter = bytearray()
+        # Number of queries to candidates() and how many of them
+        # were answered by _query_cannot_match() alone. Counted for
+        # all users of a shared EmojiMatcher (see
+        # acquire_emoji_matcher()), their worker threads may query
+        # at the same time:
+        self._number_of_queries = 0
+        self._number_of_queries_short_circuited = 0
+        self._statistics_lock = threading.Lock()
+        # (dirnames, basenames, subdir, path found) of all data files
+        # searched while loading, see _find_data_file():
+        self._data_file_lookups: List[
+            Tuple[List[str], List[str], str, str]] = []
+        self._load_options: Dict[str, Any] = {
+            'unicode_data': unicode_data,
+            'unicode_data_all': unicode_data_all,
+            'unikemet': unikemet,
+            'nameslist': nameslist,
+            'emoji_unicode_min': emoji_unicode_min,
+            'emoji_unicode_max': emoji_unicode_max,
+            'cldr_data': cldr_data,
+            'romaji': romaji,
+        }
+        # The languages of an EmojiMatcher never change, a different
+        # list of languages uses a different EmojiMatcher:
+        self._candidate_cache = itb_util.LruCache('EmojiMatcher.candidates()')
         self._match_function: Callable[[Any, Any], Any] = _match_classic
         self._good_match_score: float = 60.0
         self.set_match_algorithm(match_algorithm)
+        if snapshot and self.load_snapshot():
+            return
+        time_start = time.time()
         # The three data sources are loaded in this order on purpose.
         # The data from Unicode is loaded first to put the official
         # names first into the list of names to display the official
@@ -559,6 +630,367 @@ class EmojiMatcher():
                 self._load_cldr_annotation_data(language, 'annotations')
                 self._load_cldr_annotation_data(language, 'annotationsDerived')
         self._load_unicode_blocks()
+        if self._label_index:
+            self._build_label_index()
+        LOGGER.info('Loaded emoji data for %s in %s seconds',
+                    self._languages, time.time() - time_start)
+        if snapshot:
+            self.save_snapshot()
+
+    def _find_data_file(
+            self,
+            dirnames: Iterable[str],
+            basenames: Iterable[str],
+            subdir: str = '') -> Tuple[str, Optional[Callable[[Any], Any]]]:
+        '''Like _find_path_and_open_function() but remembers the lookup
+
+        The lookups are stored in the snapshot, a snapshot is only
+        used if the same lookups still find the same unchanged files.
+        '''
+        (path, open_function) = _find_path_and_open_function(
+            dirnames, basenames, subdir=subdir)
+        self._data_file_lookups.append(
+            (list(dirnames), list(basenames), subdir, path))
+        return (path, open_function)
+
+    @staticmethod
+    def _data_file_stat(path: str) -> List[int]:
+        '''Returns [mtime in ns, size] of a data file, [0, 0] if missing'''
+        if not path:
+            return [0, 0]
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return [0, 0]
+        return [stat.st_mtime_ns, stat.st_size]
+
+    def _snapshot_key(self) -> Dict[str, Any]:
+        '''Returns what a snapshot must match to be usable
+
+        Everything except the data files, these are checked
+        separately because which files are read is only known after
+        loading.
+        '''
+        return {
+            'version': EMOJI_SNAPSHOT_VERSION,
+            # The marshal format may change between Python versions:
+            'python': list(sys.version_info[:2]),
+            'code': [self._data_file_stat(module.__file__ or '')
+                     for module in (sys.modules[__name__], itb_util)],
+            'languages': list(self._languages),
+            'options': self._load_options,
+            'label_index': self._label_index,
+            'domainname': DOMAINNAME,
+            'mo_files': {
+                language: [mo_file] + self._data_file_stat(mo_file)
+                for language, mo_file in self._gettext_mo_files.items()},
+            'pykakasi': IMPORT_PYKAKASI_SUCCESSFUL,
+            'pinyin': IMPORT_PINYIN_SUCCESSFUL,
+        }
+
+    def _snapshot_path(self) -> str:
+        '''Returns the path of the snapshot file for this EmojiMatcher'''
+        key_hash = hashlib.sha256(
+            json.dumps(self._snapshot_key(), sort_keys=True).encode('UTF-8')
+        ).hexdigest()[:16]
+        return os.path.join(
+            itb_util.xdg_save_cache_path('ibus-typing-booster', 'emoji'),
+            f'emoji-{key_hash}.snapshot')
+
+    def load_snapshot(self) -> bool:
+        '''Try to restore the loaded data from a snapshot file
+
+        :return: True if the emoji data, the unicode blocks and the
+                 label index could be restored from an up to date
+                 snapshot, False if the data needs to be loaded.
+
+        The snapshot file starts with a magic line and a JSON header
+        line with the key and the data files used, followed by the
+        data serialized with marshal. marshal is much faster than
+        parsing all the data files again and, contrary to pickle,
+        it cannot run code while loading.
+        '''
+        snapshot_path = self._snapshot_path()
+        if not os.path.isfile(snapshot_path):
+            return False
+        time_start = time.time()
+        try:
+            with open(snapshot_path, 'rb') as snapshot_file:
+                if (snapshot_file.readline()
+                        != EMOJI_SNAPSHOT_MAGIC):
+                    return False
+                header = json.loads(snapshot_file.readline())
+                if header.get('key') != json.loads(
+                        json.dumps(self._snapshot_key())):
+                    LOGGER.info('Emoji snapshot %s is outdated.',
+                                snapshot_path)
+                    return False
+                for (dirnames, basenames, subdir, path,
+                     stat) in header['data_files']:
+                    (found_path, _open_function) = (
+                        _find_path_and_open_function(
+                            dirnames, basenames, subdir=subdir))
+                    if (found_path != path
+                            or self._data_file_stat(found_path) != stat):
+                        LOGGER.info(
+                            'Emoji snapshot %s is outdated, %s changed.',
+                            snapshot_path, found_path or path)
+                        return False
+                data = marshal.loads(snapshot_file.read())
+            emoji_dict = data['emoji_dict']
+            unicode_blocks = {
+                range(start, stop): block
+                for (start, stop, block) in data['unicode_blocks']}
+            label_words_offsets = array.array('I')
+            label_words_positions = array.array('I')
+            label_words_position_offsets = array.array('I')
+            if self._label_index:
+                label_words_offsets.frombytes(data['label_words_offsets'])
+                label_words_positions.frombytes(data['label_words_positions'])
+                label_words_position_offsets.frombytes(
+                    data['label_words_position_offsets'])
+                label_trigram_filter = bytearray(data['label_trigram_filter'])
+        except (OSError, ValueError, KeyError, TypeError, EOFError) as error:
+            LOGGER.warning('Cannot read emoji snapshot %s: %s: %s',
+                           snapshot_path, error.__class__.__name__, error)
+            return False
+        self._emoji_dict = emoji_dict
+        self._unicode_blocks = unicode_blocks
+        self._data_file_lookups = [
+            (dirnames, basenames, subdir, path)
+            for (dirnames, basenames, subdir, path, _stat)
+            in header['data_files']]
+        if self._label_index:
+            self._emoji_keys = list(self._emoji_dict)
+            self._label_words_text = data['label_words_text']
+            self._label_words_offsets = label_words_offsets
+            self._label_words_positions = label_words_positions
+            self._label_words_position_offsets = label_words_position_offsets
+            self._label_trigram_filter = label_trigram_filter
+        LOGGER.info('Restored emoji data for %s from %s in %s seconds',
+                    self._languages, snapshot_path, time.time() - time_start)
+        return True
+
+    def save_snapshot(self) -> bool:
+        '''Write the loaded data to a snapshot file
+
+        :return: True if the snapshot file could be written, False if not.
+
+        The file is written to a temporary file first and then
+        renamed, other processes reading the snapshot at the same
+        time never see a partially written file. Only the
+        EMOJI_SNAPSHOT_MAX_FILES most recently written snapshots
+        are kept.
+        '''
+        if not self._emoji_dict:
+            return False
+        header = {
+            'key': self._snapshot_key(),
+            'data_files': [
+                [dirnames, basenames, subdir, path,
+                 self._data_file_stat(path)]
+                for (dirnames, basenames, subdir, path)
+                in self._data_file_lookups],
+        }
+        data = {
+            'emoji_dict': self._emoji_dict,
+            'unicode_blocks': [
+                (block_range.start, block_range.stop, block)
+                for block_range, block in self._unicode_blocks.items()],
+        }
+        if self._label_index:
+            data['label_words_text'] = self._label_words_text
+            data['label_words_offsets'] = self._label_words_offsets.tobytes()
+            data['label_words_positions'] = (
+                self._label_words_positions.tobytes())
+            data['label_words_position_offsets'] = (
+                self._label_words_position_offsets.tobytes())
+            data['label_trigram_filter'] = bytes(self._label_trigram_filter)
+        snapshot_path = self._snapshot_path()
+        tmp_path = f'{snapshot_path}.{os.getpid()}.tmp'
+        try:
+            with open(tmp_path, 'wb') as snapshot_file:
+                snapshot_file.write(EMOJI_SNAPSHOT_MAGIC)
+                snapshot_file.write(json.dumps(header).encode('UTF-8') + b'\n')
+                snapshot_file.write(marshal.dumps(data))
+            os.replace(tmp_path, snapshot_path)
+        except (OSError, ValueError) as error:
+            LOGGER.warning('Cannot write emoji snapshot %s: %s: %s',
+                           snapshot_path, error.__class__.__name__, error)
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            return False
+        snapshot_dir = os.path.dirname(snapshot_path)
+        try:
+            snapshots = sorted(
+                (os.path.join(snapshot_dir, name)
+                 for name in os.listdir(snapshot_dir)
+                 if name.endswith('.snapshot')),
+                key=os.path.getmtime, reverse=True)
+            for old_snapshot in snapshots[EMOJI_SNAPSHOT_MAX_FILES:]:
+                os.remove(old_snapshot)
+        except OSError as error:
+            LOGGER.warning('Cannot remove old emoji snapshots: %s: %s',
+                           error.__class__.__name__, error)
+        return True
+
+    def _build_label_index(self) -> None:
+        '''Build an inverted index from the words in the labels to the emoji
+
+        _candidates() skips all emoji unless each word of the query
+        is a substring of at least one word of their labels. Finding
+        these by checking all emoji for each query is slow. Instead,
+        all distinct label words are joined into one string
+        separated by newlines, so the words containing a query word
+        are found by searching that string. For each label word the
+        positions of the emoji in self._emoji_dict which have
+        it in their labels are stored.
+        '''
+        self._emoji_keys = list(self._emoji_dict)
+        word_positions: Dict[str, List[int]] = {}
+        for position, emoji_key in enumerate(self._emoji_keys):
+            for word in self.get_all_label_words(emoji_key):
+                try:
+                    word_positions[word].append(position)
+                except KeyError:
+                    word_positions[word] = [position]
+        words = sorted(word_positions)
+        self._label_words_text = '\n'.join(words)
+        self._label_words_offsets = array.array('I')
+        self._label_words_positions = array.array('I')
+        self._label_words_position_offsets = array.array('I', [0])
+        offset = 0
+        for word in words:
+            self._label_words_offsets.append(offset)
+            offset += len(word) + 1
+            self._label_words_positions.extend(word_positions[word])
+            self._label_words_position_offsets.append(
+                len(self._label_words_positions))
+        self._label_trigram_filter = bytearray(LABEL_TRIGRAM_FILTER_BITS // 8)
+        for trigram in {word[index:index + 3]
+                        for word in words
+                        for index in range(len(word) - 2)}:
+            for bit in self._trigram_filter_bits(trigram):
+                self._label_trigram_filter[bit >> 3] |= 1 << (bit & 7)
+
+    @staticmethod
+    def _trigram_filter_bits(trigram: str) -> Tuple[int, int]:
+        '''Returns the bits of a trigram in the Bloom filter
+
+        zlib.crc32() is used instead of hash() because the hash of
+        a string changes with each Python process and the filter
+        is stored in the snapshot.
+        '''
+        data = trigram.encode('UTF-8')
+        return (zlib.crc32(data) % LABEL_TRIGRAM_FILTER_BITS,
+                zlib.crc32(data, 0x9E3779B9) % LABEL_TRIGRAM_FILTER_BITS)
+
+    def _may_be_in_label_word(self, token: str) -> bool:
+        '''Checks whether a token may be a substring of a label word
+
+        :return: False if the token is certainly not a substring
+                 of any label word, True if it may be.
+
+        Tokens with at least 3 characters are checked with the Bloom
+        filter of the trigrams of the label words, which never gives
+        false negatives. Shorter tokens are searched in the text of all
+        label words.
+        '''
+        if len(token) < 3:
+            return token in self._label_words_text
+        label_trigram_filter = self._label_trigram_filter
+        for index in range(len(token) - 2):
+            for bit in self._trigram_filter_bits(token[index:index + 3]):
+                if not label_trigram_filter[bit >> 3] & (1 << (bit & 7)):
+                    return False
+        return True
+
+    def _normalize_query(self, query_string: str,
+                         trigger_characters: str = '') -> str:
+        '''Normalizes a query string for _candidates()'''
+        # Remove the trigger characters from the beginning and end of
+        # the query string:
+        if query_string[:1] and query_string[:1] in trigger_characters:
+            query_string = query_string[1:]
+        if query_string[-1:] and query_string[-1:] in trigger_characters:
+            query_string = query_string[:-1]
+        if not query_string:
+            return ''
+        # self._emoji_dict contains only emoji or sequences without
+        # variation selectors:
+        query_string = self.variation_selector_normalize(
+            query_string, variation_selector='')
+        # Replace any sequence of white space characters and '_'
+        # and '＿' in the query string with a single ' '.  '＿'
+        # (U+FF3F FULLWIDTH LOW LINE) is included here because when
+        # Japanese transliteration is used, something like “neko_”
+        # transliterates to “ねこ＿” and that should of course match
+        # the emoji for “ねこ”　(= “cat”):
+        return re.sub(r'[＿_\s]+', ' ', query_string)
+
+    def _query_cannot_match(self, query_string: str) -> bool:
+        '''Checks cheaply whether _candidates() would find nothing
+
+        :param query_string: A query string normalized with
+                             _normalize_query()
+        :return: True if it is certain that the query matches nothing
+                 without spellchecking, False if it may match.
+
+        Without spellchecking, _candidates() only finds emoji
+        having a label word containing each word of the query, the
+        query itself if it is an emoji, and a code point if the query
+        is a hexadecimal number. When a word of the query is found in
+        no label word at all, searching is pointless. This is the
+        case for most normal words typed while emoji predictions are
+        on.
+        '''
+        if not query_string:
+            return True
+        if (not self._label_trigram_filter
+            or (query_string, 'en') in self._emoji_dict):
+            return False
+        try:
+            int(query_string, 16)
+            # May be a code point:
+            return False
+        except ValueError:
+            pass
+        tokens = itb_util.remove_accents(query_string.lower()).split()
+        if not tokens:
+            return False
+        return not all(self._may_be_in_label_word(token) for token in tokens)
+
+    def query_statistics(self) -> Tuple[int, int]:
+        '''Returns the number of queries to candidates() and how many of
+        them were answered without searching because nothing could match
+        '''
+        with self._statistics_lock:
+            return (self._number_of_queries,
+                    self._number_of_queries_short_circuited)
+
+    def _emoji_keys_with_label_word_containing(
+            self, token: str) -> Set[int]:
+        '''Find the emoji which have a label word containing token
+
+        :param token: A word from the query string
+        :return: The positions in self._emoji_keys of the emoji found
+        '''
+        positions: Set[int] = set()
+        text = self._label_words_text
+        offsets = self._label_words_offsets
+        start = text.find(token)
+        while start >= 0:
+            index = bisect.bisect_right(offsets, start) - 1
+            positions.update(self._label_words_positions[
+                self._label_words_position_offsets[index]:
+                self._label_words_position_offsets[index + 1]])
+            if index + 1 >= len(offsets):
+                break
+            # Continue searching in the next word:
+            start = text.find(token, offsets[index + 1])
+        return positions
 
     def set_match_algorithm(self, name: str = 'rapidfuzz') -> None:
         '''Sets the match algorithm
@@ -570,7 +1002,7 @@ class EmojiMatcher():
 
         Changing the match algorithm clears the candidate cache.
         '''
-        self._candidate_cache = {}
+        self._candidate_cache.clear()
         if name == 'rapidfuzz' and  IMPORT_RAPIDFUZZ_SUCCESSFUL:
             self._match_function = _match_rapidfuzz
             self._good_match_score = 60.0
@@ -599,7 +1031,7 @@ class EmojiMatcher():
 
         Changing the variation selector clears the candidate cache.
         '''
-        self._candidate_cache = {}
+        self._candidate_cache.clear()
         self._variation_selector = variation_selector
 
     def get_languages(self) -> List[str]:
@@ -786,7 +1218,7 @@ class EmojiMatcher():
         '''
         dirnames = UNICODE_DATA_DIRNAMES
         basenames = ('NamesList.txt',)
-        (path, open_function) = _find_path_and_open_function(
+        (path, open_function) = self._find_data_file(
             dirnames, basenames)
         if not path or open_function is None:
             return
@@ -821,7 +1253,7 @@ class EmojiMatcher():
         '''Loads Unikemet.txt for Egyptian Hieroglyphs'''
         dirnames = UNICODE_DATA_DIRNAMES
         basenames = ('Unikemet.txt',)
-        (path, open_function) = _find_path_and_open_function(
+        (path, open_function) = self._find_data_file(
             dirnames, basenames)
         if not path or open_function is None:
             return
@@ -866,7 +1298,7 @@ class EmojiMatcher():
         '''Loads the names of Unicode blocks'''
         dirnames = UNICODE_DATA_DIRNAMES
         basenames = ('Blocks.txt',)
-        (path, open_function) = _find_path_and_open_function(
+        (path, open_function) = self._find_data_file(
             dirnames, basenames)
         if not path or open_function is None:
             return
@@ -912,7 +1344,7 @@ class EmojiMatcher():
         '''
         dirnames = UNICODE_DATA_DIRNAMES
         basenames = ('DerivedAge.txt',)
-        (path, open_function) = _find_path_and_open_function(
+        (path, open_function) = self._find_data_file(
             dirnames, basenames)
         if not path or open_function is None:
             return
@@ -948,7 +1380,7 @@ class EmojiMatcher():
         '''Loads alternative names from NameAliases.txt'''
         dirnames = UNICODE_DATA_DIRNAMES
         basenames = ('NameAliases.txt',)
-        (path, open_function) = _find_path_and_open_function(
+        (path, open_function) = self._find_data_file(
             dirnames, basenames)
         if not path or open_function is None:
             return
@@ -978,7 +1410,7 @@ class EmojiMatcher():
         '''Loads character names from UnicodeData.txt'''
         dirnames = UNICODE_DATA_DIRNAMES
         basenames = ('UnicodeData.txt',)
-        (path, open_function) = _find_path_and_open_function(
+        (path, open_function) = self._find_data_file(
             dirnames, basenames)
         if not path or open_function is None:
             return
@@ -1032,7 +1464,7 @@ class EmojiMatcher():
         '''
         dirnames = UNICODE_EMOJI_DATA_DIRNAMES
         basenames = ('emoji-data.txt',)
-        (path, open_function) = _find_path_and_open_function(
+        (path, open_function) = self._find_data_file(
             dirnames, basenames)
         if not path or open_function is None:
             return
@@ -1087,7 +1519,7 @@ class EmojiMatcher():
         '''
         dirnames = UNICODE_EMOJI_DATA_DIRNAMES
         basenames = ('emoji-sequences.txt',)
-        (path, open_function) = _find_path_and_open_function(
+        (path, open_function) = self._find_data_file(
             dirnames, basenames)
         if not path or open_function is None:
             return
@@ -1150,7 +1582,7 @@ class EmojiMatcher():
         '''
         dirnames = UNICODE_EMOJI_DATA_DIRNAMES
         basenames = ('emoji-zwj-sequences.txt',)
-        (path, open_function) = _find_path_and_open_function(
+        (path, open_function) = self._find_data_file(
             dirnames, basenames)
         if not path or open_function is None:
             return
@@ -1210,7 +1642,7 @@ class EmojiMatcher():
         '''
         dirnames = UNICODE_EMOJI_DATA_DIRNAMES
         basenames = ('emoji-test.txt',)
-        (path, open_function) = _find_path_and_open_function(
+        (path, open_function) = self._find_data_file(
             dirnames, basenames)
         if not path or open_function is None:
             return
@@ -1311,7 +1743,7 @@ class EmojiMatcher():
                     # has the name “emoji.json”, an old
                     # version was named “emojione.json”
         basenames = ('emoji.json', 'emojione.json')
-        (path, open_function) = _find_path_and_open_function(
+        (path, open_function) = self._find_data_file(
             dirnames, basenames)
         if not path or open_function is None:
             return
@@ -1464,7 +1896,7 @@ class EmojiMatcher():
         '''
         dirnames = CLDR_ANNOTATION_DIRNAMES
         basenames = (language + '.xml',)
-        (path, open_function) = _find_path_and_open_function(
+        (path, open_function) = self._find_data_file(
             dirnames, basenames, subdir=subdir)
         if not path or open_function is None:
             return
@@ -1530,6 +1962,7 @@ class EmojiMatcher():
                 'Error while loading cldr annotation data: %s: %s',
                 error.__class__.__name__, error)
 
+    @itb_util.trace_stage('emoji')
     def candidates(
             self,
             query_string: str,
@@ -1895,20 +2328,26 @@ class EmojiMatcher():
         'U+1B'
         '''
         # pylint: enable=line-too-long
-        if ((query_string, match_limit, trigger_characters, spellcheck)
-            in self._candidate_cache):
-            return self._candidate_cache[(
-                query_string, match_limit, trigger_characters, spellcheck)]
+        cannot_match = (
+            not spellcheck
+            and self._query_cannot_match(
+                self._normalize_query(query_string, trigger_characters)))
+        with self._statistics_lock:
+            self._number_of_queries += 1
+            if cannot_match:
+                self._number_of_queries_short_circuited += 1
+        if cannot_match:
+            return []
+        cache_key = (query_string, match_limit, trigger_characters, spellcheck)
+        cached_candidates = self._candidate_cache.get(cache_key)
+        if cached_candidates is not None:
+            return cached_candidates
         candidates = self._candidates(
             query_string=query_string,
             match_limit=match_limit,
             trigger_characters=trigger_characters,
             spellcheck=spellcheck)
-        self._candidate_cache[(
-            query_string,
-            match_limit,
-            trigger_characters,
-            spellcheck)] = candidates
+        self._candidate_cache.put(cache_key, candidates)
         return candidates
 
     def _candidates(
@@ -1917,25 +2356,9 @@ class EmojiMatcher():
             match_limit: int = 20,
             trigger_characters: str  = '',
             spellcheck: bool = False) -> List[itb_util.PredictionCandidate]:
-        # Remove the trigger characters from the beginning and end of
-        # the query string:
-        if query_string[:1] and query_string[:1] in trigger_characters:
-            query_string = query_string[1:]
-        if query_string[-1:] and query_string[-1:] in trigger_characters:
-            query_string = query_string[:-1]
+        query_string = self._normalize_query(query_string, trigger_characters)
         if not query_string:
             return []
-        # self._emoji_dict contains only emoji or sequences without
-        # variation selectors:
-        query_string = self.variation_selector_normalize(
-            query_string, variation_selector='')
-        # Replace any sequence of white space characters and '_'
-        # and '＿' in the query string with a single ' '.  '＿'
-        # (U+FF3F FULLWIDTH LOW LINE) is included here because when
-        # Japanese transliteration is used, something like “neko_”
-        # transliterates to “ねこ＿” and that should of course match
-        # the emoji for “ねこ”　(= “cat”):
-        query_string = re.sub(r'[＿_\s]+', ' ', query_string)
         if (query_string, 'en') in self._emoji_dict:
             # the query_string is itself an emoji, match similar ones:
             candidates = self.similar(query_string, match_limit=match_limit)
@@ -1962,7 +2385,22 @@ class EmojiMatcher():
                         match_string += f' {" ".join(suggestions)}'
         match_string = itb_util.remove_accents(match_string.lower())
         candidates = []
-        for emoji_key, emoji_value in self._emoji_dict.items():
+        emoji_items: Iterable[Tuple[Tuple[str, str], Dict[str, Any]]] = (
+            self._emoji_dict.items())
+        if not spellcheck and self._emoji_keys and match_string.split():
+            # Only the emoji having a label word which contains the
+            # longest token of the match string can pass the filter
+            # below, get them from the index. Keep the order of
+            # self._emoji_dict to get exactly the same result as
+            # without the index:
+            longest_token = max(match_string.split(), key=len)
+            emoji_items = (
+                (self._emoji_keys[position],
+                 self._emoji_dict[self._emoji_keys[position]])
+                for position in sorted(
+                        self._emoji_keys_with_label_word_containing(
+                            longest_token)))
+        for emoji_key, emoji_value in emoji_items:
             if (not spellcheck
                 and any(all(token not in label
                             for label in self.get_all_label_words(emoji_key))
@@ -2987,6 +3425,30 @@ class EmojiMatcher():
                         print(f'ZWJ sequence “{emoji_key[0]}” '
                               'in emojione but not in unicode.org')
 
+def acquire_emoji_matcher(languages: Iterable[str] = ('en_US',),
+                          unicode_data_all: bool = False,
+                          variation_selector: str = 'emoji') -> EmojiMatcher:
+    '''Returns an EmojiMatcher shared by all engines in this process
+
+    The matcher is created only if there is none yet for the same
+    parameters. Do not change its configuration, for example with
+    set_match_algorithm() or set_variation_selector(), all engines
+    using it would be affected. Its candidate cache and its query
+    statistics are shared by all of them. Release it with
+    itb_util.release_shared() when it is not needed anymore.
+
+    :param languages: See EmojiMatcher()
+    :param unicode_data_all: See EmojiMatcher()
+    :param variation_selector: See EmojiMatcher()
+    '''
+    languages = list(languages)
+    return itb_util.acquire_shared(
+        ('EmojiMatcher', tuple(languages), unicode_data_all,
+         variation_selector),
+        lambda: EmojiMatcher(languages=languages,
+                             unicode_data_all=unicode_data_all,
+                             variation_selector=variation_selector))
+
 BENCHMARK = True
 
 def main() -> None:
@@ -3053,6 +3515,7 @@ def main() -> None:
     LOGGER.info(
         '_match_rapidfuzz() cache info: %s',
         _match_rapidfuzz.cache_info()) # pylint: disable=no-value-for-parameter
+    itb_util.log_cache_info(logging.INFO)
 
     sys.exit(failed)
 
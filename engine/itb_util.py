@@ -25,10 +25,14 @@ from typing import Tuple
 from typing import List
 from typing import Dict
 from typing import Set
+from typing import FrozenSet
 from typing import Optional
 from typing import Union
 from typing import Iterable
 from typing import Callable
+from typing import NamedTuple
+from typing import Deque
+from typing import Iterator
 # pylint: disable=wrong-import-position
 import sys
 if sys.version_info >= (3, 8):
@@ -37,9 +41,13 @@ else:
     from typing_extensions import Literal
 from enum import Enum, Flag
 import os
+import array
+import bisect
 import re
 import functools
 import collections
+import concurrent.futures
+import contextlib
 import unicodedata
 import locale
 import logging
@@ -47,6 +55,13 @@ import shutil
 import subprocess
 import glob
 import gettext
+import hashlib
+import json
+import mmap
+import threading
+import time
+import types
+import weakref
 import xml.etree.ElementTree
 from dataclasses import dataclass
 from gi import require_version # type: ignore
@@ -4142,6 +4157,938 @@ def best_candidates(
             seen_phrases.add(phrase_title)
     return candidates_title
 
+# Default limits for the caches created with LruCache().  They can be
+# changed at runtime for all caches with set_cache_limits(), the engine
+# does that from the “cachemaxentries” and “cachemaxmegabytes” settings.
+CACHE_MAX_ENTRIES_DEFAULT = 200_000
+CACHE_MAX_BYTES_DEFAULT = 64 * 1024 * 1024
+
+_CACHE_LIMITS: Dict[str, int] = {
+    'max_entries': CACHE_MAX_ENTRIES_DEFAULT,
+    'max_bytes': CACHE_MAX_BYTES_DEFAULT,
+}
+_CACHES: 'weakref.WeakSet[Union[LruCache, FunctoolsLruCache]]' = (
+    weakref.WeakSet())
+
+class CacheInfo(NamedTuple):
+    '''Statistics of an LruCache, similar to functools._CacheInfo'''
+    hits: int
+    misses: int
+    evictions: int
+    max_entries: int
+    entries: int
+    max_bytes: int
+    approximate_bytes: int
+
+def approximate_size(obj: Any, depth: int = 3) -> int:
+    '''Returns the approximate memory used by an object in bytes
+
+    Follows the contents of lists, tuples, sets, dictionaries, and
+    objects with a __dict__ (like dataclasses) up to “depth” levels
+    deep. Shared objects like interned strings are counted each time
+    they are seen, therefore this overestimates a little bit, which
+    is fine for limiting the size of a cache.
+
+    Examples:
+
+    >>> approximate_size('') == sys.getsizeof('')
+    True
+
+    >>> approximate_size(('a', 1)) > sys.getsizeof(('a', 1))
+    True
+    '''
+    size = sys.getsizeof(obj)
+    if depth <= 0 or isinstance(obj, (str, bytes, int, float, bool)):
+        return size
+    if isinstance(obj, (list, tuple, set, frozenset)):
+        return size + sum(approximate_size(x, depth - 1) for x in obj)
+    if isinstance(obj, dict):
+        return size + sum(
+            approximate_size(key, depth - 1)
+            + approximate_size(value, depth - 1)
+            for key, value in obj.items())
+    if hasattr(obj, '__dict__'):
+        return size + approximate_size(vars(obj), depth - 1)
+    return size
+
+class LruCache:
+    '''A bounded cache evicting the least recently used entries
+
+    The cache is limited both by the number of entries and by the
+    approximate number of bytes used by keys and values. It counts
+    hits, misses, and evictions, see cache_info(), and it can be
+    subscribed to invalidation events, see invalidate_caches().
+
+    All LruCache instances are registered in a module wide weak set
+    so that their limits can be changed with set_cache_limits() and
+    their statistics logged with log_cache_info().
+
+    Examples:
+
+    >>> cache = LruCache('doctest', max_entries=2)
+    >>> cache.put('a', 1)
+    >>> cache.put('b', 2)
+    >>> cache.get('a')
+    1
+    >>> cache.put('c', 3)
+    >>> 'b' in cache
+    False
+    >>> cache.get('b') is None
+    True
+    >>> cache.cache_info()[:5]
+    (1, 1, 1, 2, 2)
+    '''
+    def __init__(self,
+                 name: str,
+                 max_entries: Optional[int] = None,
+                 max_bytes: Optional[int] = None,
+                 invalidate_on: Iterable[str] = ()) -> None:
+        '''
+        :param name: Name of the cache, used when logging statistics
+        :param max_entries: Maximum number of entries. If None, the
+                            current global default is used and the
+                            cache follows set_cache_limits().
+        :param max_bytes: Maximum approximate size of keys and values
+                          in bytes. If None, the current global default
+                          is used and the cache follows set_cache_limits().
+        :param invalidate_on: Names of events which clear this cache,
+                              for example ('dictionaries', 'languages').
+        '''
+        self.name = name
+        self._follow_global_max_entries = max_entries is None
+        self._follow_global_max_bytes = max_bytes is None
+        self._max_entries: int = (
+            _CACHE_LIMITS['max_entries'] if max_entries is None
+            else max_entries)
+        self._max_bytes: int = (
+            _CACHE_LIMITS['max_bytes'] if max_bytes is None
+            else max_bytes)
+        self._invalidate_on: Set[str] = set(invalidate_on)
+        self._data: 'collections.OrderedDict[Any, Tuple[Any, int]]' = (
+            collections.OrderedDict())
+        self._bytes = 0
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._lock = threading.Lock()
+        _CACHES.add(self)
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key: Any) -> bool:
+        return key in self._data
+
+    def get(self, key: Any, default: Any = None) -> Any:
+        '''Returns the value for key and marks it as recently used
+
+        Counts a hit if the key is in the cache, a miss otherwise.
+        '''
+        with self._lock:
+            try:
+                value = self._data[key][0]
+            except KeyError:
+                self._misses += 1
+                return default
+            self._data.move_to_end(key)
+            self._hits += 1
+            return value
+
+    def put(self, key: Any, value: Any) -> None:
+        '''Stores a value and evicts old entries if over the limits'''
+        size = approximate_size(key) + approximate_size(value)
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+            if size > self._max_bytes or self._max_entries <= 0:
+                return
+            self._data[key] = (value, size)
+            self._bytes += size
+            self._evict()
+
+    def _evict(self) -> None:
+        '''Drops least recently used entries until within the limits
+
+        Must be called with the lock held.
+        '''
+        while self._data and (len(self._data) > self._max_entries
+                              or self._bytes > self._max_bytes):
+            _key, (_value, size) = self._data.popitem(last=False)
+            self._bytes -= size
+            self._evictions += 1
+
+    def clear(self) -> None:
+        '''Removes all entries, the statistics are kept'''
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+
+    def set_limits(self,
+                   max_entries: Optional[int] = None,
+                   max_bytes: Optional[int] = None) -> None:
+        '''Changes the limits and evicts entries if necessary
+
+        Limits passed as None are not changed.
+        '''
+        with self._lock:
+            if max_entries is not None:
+                self._max_entries = max_entries
+            if max_bytes is not None:
+                self._max_bytes = max_bytes
+            self._evict()
+
+    def follows_global_limits(self) -> Tuple[bool, bool]:
+        '''Whether the entry and byte limits follow set_cache_limits()'''
+        return (self._follow_global_max_entries,
+                self._follow_global_max_bytes)
+
+    def invalidated_by(self, event: str) -> bool:
+        '''Whether this cache is cleared by invalidate_caches(event)'''
+        return event in self._invalidate_on
+
+    def cache_info(self) -> CacheInfo:
+        '''Returns the statistics of this cache'''
+        return CacheInfo(
+            hits=self._hits,
+            misses=self._misses,
+            evictions=self._evictions,
+            max_entries=self._max_entries,
+            entries=len(self._data),
+            max_bytes=self._max_bytes,
+            approximate_bytes=self._bytes)
+
+def lru_cache(name: str,
+              max_entries: Optional[int] = None,
+              max_bytes: Optional[int] = None,
+              invalidate_on: Iterable[str] = ()) -> Callable[[Any], Any]:
+    '''Decorator memoizing a function with positional arguments in an LruCache
+
+    Like functools.lru_cache() but bounded by entries and approximate
+    bytes and registered for set_cache_limits(), log_cache_info(), and
+    invalidate_caches(). The decorated function gets the attributes
+    “cache”, “cache_info()”, and “cache_clear()”.
+
+    Looking up and storing entries is much slower than with
+    functools.lru_cache(), use this only for functions which are
+    expensive compared to that, not for functions called in tight
+    loops.
+
+    Examples:
+
+    >>> @lru_cache('doctest_square', max_entries=10)
+    ... def square(x: int) -> int:
+    ...     return x * x
+    >>> square(3), square(3)
+    (9, 9)
+    >>> square.cache_info().hits
+    1
+    '''
+    def decorator(function: Callable[..., Any]) -> Callable[..., Any]:
+        cache = LruCache(name,
+                         max_entries=max_entries,
+                         max_bytes=max_bytes,
+                         invalidate_on=invalidate_on)
+        missing = object()
+
+        @functools.wraps(function)
+        def wrapper(*args: Any) -> Any:
+            result = cache.get(args, missing)
+            if result is missing:
+                result = function(*args)
+                cache.put(args, result)
+            return result
+
+        wrapper.cache = cache # type: ignore
+        wrapper.cache_info = cache.cache_info # type: ignore
+        wrapper.cache_clear = cache.clear # type: ignore
+        return wrapper
+    return decorator
+
+class FunctoolsLruCache:
+    '''A functools.lru_cache() registered like an LruCache
+
+    For small functions called in tight loops, where the locking and
+    the size measuring of LruCache would cost more than the function
+    itself. The limits follow set_cache_limits() and the cache can
+    be subscribed to invalidate_caches() and is logged by
+    log_cache_info() like an LruCache.
+
+    functools.lru_cache() can only limit the number of entries, the
+    byte limit is turned into a limit of entries by assuming that
+    every entry uses “entry_bytes”. Changing the limits empties the
+    cache because a functools.lru_cache() cannot be resized.
+
+    Examples:
+
+    >>> cache = FunctoolsLruCache(
+    ...     'doctest_functools', lambda x: x * x, 100, max_entries=2)
+    >>> [cache.cached(x) for x in (1, 2, 1, 3)]
+    [1, 4, 1, 9]
+    >>> cache.cache_info()[:5]
+    (1, 3, 1, 2, 2)
+    '''
+    def __init__(self,
+                 name: str,
+                 function: Callable[..., Any],
+                 entry_bytes: int,
+                 max_entries: Optional[int] = None,
+                 max_bytes: Optional[int] = None,
+                 invalidate_on: Iterable[str] = ()) -> None:
+        '''
+        :param name: Name of the cache, used when logging statistics
+        :param function: The function to memoize
+        :param entry_bytes: Approximate size of an entry in bytes
+        :param max_entries: See LruCache
+        :param max_bytes: See LruCache
+        :param invalidate_on: See LruCache
+        '''
+        self.name = name
+        self._function = function
+        self._entry_bytes = max(1, entry_bytes)
+        self._follow_global_max_entries = max_entries is None
+        self._follow_global_max_bytes = max_bytes is None
+        self._max_entries: int = (
+            _CACHE_LIMITS['max_entries'] if max_entries is None
+            else max_entries)
+        self._max_bytes: int = (
+            _CACHE_LIMITS['max_bytes'] if max_bytes is None
+            else max_bytes)
+        self._invalidate_on: Set[str] = set(invalidate_on)
+        # Statistics of the functools.lru_cache() instances replaced
+        # or cleared already, they start counting from 0 again:
+        self._hits = 0
+        self._misses = 0
+        # Entries dropped by clearing or replacing, not by eviction:
+        self._dropped = 0
+        self.cached = functools.lru_cache(
+            maxsize=self._maxsize())(function)
+        _CACHES.add(self)
+
+    def _maxsize(self) -> int:
+        return max(0, min(self._max_entries,
+                          self._max_bytes // self._entry_bytes))
+
+    def _add_statistics(self) -> None:
+        '''Adds the statistics of the current functools.lru_cache()
+        before it is cleared or replaced'''
+        info = self.cached.cache_info()
+        self._hits += info.hits
+        self._misses += info.misses
+        self._dropped += info.currsize
+
+    def clear(self) -> None:
+        '''Removes all entries, the statistics are kept'''
+        self._add_statistics()
+        self.cached.cache_clear()
+
+    def set_limits(self,
+                   max_entries: Optional[int] = None,
+                   max_bytes: Optional[int] = None) -> None:
+        '''Changes the limits, empties the cache if they change
+
+        Limits passed as None are not changed.
+        '''
+        old_maxsize = self._maxsize()
+        if max_entries is not None:
+            self._max_entries = max_entries
+        if max_bytes is not None:
+            self._max_bytes = max_bytes
+        if self._maxsize() == old_maxsize:
+            return
+        self._add_statistics()
+        self.cached = functools.lru_cache(
+            maxsize=self._maxsize())(self._function)
+
+    def follows_global_limits(self) -> Tuple[bool, bool]:
+        '''Whether the entry and byte limits follow set_cache_limits()'''
+        return (self._follow_global_max_entries,
+                self._follow_global_max_bytes)
+
+    def invalidated_by(self, event: str) -> bool:
+        '''Whether this cache is cleared by invalidate_caches(event)'''
+        return event in self._invalidate_on
+
+    def cache_info(self) -> CacheInfo:
+        '''Returns the statistics of this cache
+
+        Every miss adds an entry, so the evictions are the misses
+        minus the entries still there and the entries dropped by
+        clearing.
+        '''
+        info = self.cached.cache_info()
+        misses = self._misses + info.misses
+        return CacheInfo(
+            hits=self._hits + info.hits,
+            misses=misses,
+            evictions=max(0, misses - info.currsize - self._dropped),
+            max_entries=self._maxsize(),
+            entries=info.currsize,
+            max_bytes=self._max_bytes,
+            approximate_bytes=info.currsize * self._entry_bytes)
+
+def functools_lru_cache(
+        name: str,
+        entry_bytes: int,
+        max_entries: Optional[int] = None,
+        max_bytes: Optional[int] = None,
+        invalidate_on: Iterable[str] = ()) -> Callable[[Any], Any]:
+    '''Decorator memoizing a function in a FunctoolsLruCache
+
+    Nearly as fast as functools.lru_cache(), use it instead of
+    lru_cache() for cheap functions called in tight loops. The
+    decorated function gets the attributes “cache”,
+    “cache_info()”, and “cache_clear()”.
+
+    Examples:
+
+    >>> @functools_lru_cache('doctest_cube', 100, max_entries=10)
+    ... def cube(x: int) -> int:
+    ...     return x * x * x
+    >>> cube(2), cube(2)
+    (8, 8)
+    >>> cube.cache_info().hits
+    1
+    '''
+    def decorator(function: Callable[..., Any]) -> Callable[..., Any]:
+        cache = FunctoolsLruCache(name, function, entry_bytes,
+                                  max_entries=max_entries,
+                                  max_bytes=max_bytes,
+                                  invalidate_on=invalidate_on)
+
+        @functools.wraps(function)
+        def wrapper(*args: Any) -> Any:
+            return cache.cached(*args)
+
+        wrapper.cache = cache # type: ignore
+        wrapper.cache_info = cache.cache_info # type: ignore
+        wrapper.cache_clear = cache.clear # type: ignore
+        return wrapper
+    return decorator
+
+def set_cache_limits(max_entries: Optional[int] = None,
+                     max_bytes: Optional[int] = None) -> None:
+    '''Sets the default limits and applies them to the existing caches
+
+    Only caches created without explicit limits follow the defaults.
+    Limits passed as None are not changed.
+    '''
+    if max_entries is not None:
+        _CACHE_LIMITS['max_entries'] = max_entries
+    if max_bytes is not None:
+        _CACHE_LIMITS['max_bytes'] = max_bytes
+    for cache in list(_CACHES):
+        follow_entries, follow_bytes = cache.follows_global_limits()
+        cache.set_limits(
+            max_entries=max_entries if follow_entries else None,
+            max_bytes=max_bytes if follow_bytes else None)
+
+def invalidate_caches(event: str) -> None:
+    '''Clears all caches subscribed to an event
+
+    :param event: Name of the event, for example 'dictionaries' when
+                  the list of dictionaries has changed or 'languages'
+                  when the emoji languages have changed.
+    '''
+    for cache in list(_CACHES):
+        if cache.invalidated_by(event):
+            LOGGER.debug('Invalidating cache %s because of %s',
+                         cache.name, event)
+            cache.clear()
+
+def log_cache_info(level: int = logging.DEBUG) -> None:
+    '''Logs the statistics of all caches'''
+    for cache in sorted(_CACHES, key=lambda x: x.name):
+        LOGGER.log(level, '%s cache info: %s', cache.name, cache.cache_info())
+
+def deep_size(obj: Any) -> int:
+    '''Returns the memory used by an object and everything it references
+
+    Unlike approximate_size() this follows references to any depth and
+    counts every object only once. Modules, classes, and functions are
+    not followed. This can be slow for big objects, use it only for
+    debugging.
+
+    Examples:
+
+    >>> deep_size('abc') == sys.getsizeof('abc')
+    True
+
+    >>> text = 'abc'
+    >>> deep_size([text, text]) == sys.getsizeof([text, text]) + sys.getsizeof(text)
+    True
+    '''
+    seen: Set[int] = set()
+    stack = [obj]
+    size = 0
+    while stack:
+        item = stack.pop()
+        if id(item) in seen:
+            continue
+        seen.add(id(item))
+        if isinstance(item, (type, types.ModuleType, types.FunctionType,
+                             types.MethodType, types.BuiltinFunctionType)):
+            continue
+        size += sys.getsizeof(item)
+        if isinstance(item, (str, bytes, int, float, bool)):
+            continue
+        if isinstance(item, dict):
+            stack.extend(item.keys())
+            stack.extend(item.values())
+        elif isinstance(item, (list, tuple, set, frozenset)):
+            stack.extend(item)
+        if hasattr(item, '__dict__'):
+            stack.append(vars(item))
+        for slot in getattr(type(item), '__slots__', ()):
+            if hasattr(item, slot):
+                stack.append(getattr(item, slot))
+    return size
+
+class SharedInstanceInfo(NamedTuple):
+    '''Statistics of a shared instance in a SharedInstanceRegistry'''
+    key: Tuple[Any, ...]
+    refcount: int
+    size: int
+    saved_bytes: int
+
+class SharedInstanceRegistry:
+    '''Hands out reference counted instances shared by all engines
+
+    Every engine created by the factory in the same process may need
+    the same big read-only objects, for example an EmojiMatcher for
+    the same languages. Instead of creating one per engine, engines
+    acquire them here by a key describing their configuration. When
+    the last engine releases an instance, the registry drops it and it
+    can be freed.
+
+    Users must not change the configuration of a shared instance,
+    the results of its methods must only depend on the key. To use a
+    different configuration, release the instance and acquire the one
+    for the new key. Internal state which does not change the results,
+    like caches and statistics, may still change when it is used.
+    Several engines may use it at the same time from their worker
+    threads, so such state must be thread safe.
+
+    Examples:
+
+    >>> registry = SharedInstanceRegistry()
+    >>> a = registry.acquire(('list', 1), lambda: [1])
+    >>> b = registry.acquire(('list', 1), lambda: [1])
+    >>> a is b
+    True
+    >>> registry.refcount(('list', 1))
+    2
+    >>> registry.release(a)
+    >>> registry.release(b)
+    >>> registry.refcount(('list', 1))
+    0
+    '''
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        # key -> [instance, refcount, size in bytes or -1 if not measured]
+        self._entries: Dict[Tuple[Any, ...], List[Any]] = {}
+        # id(instance) -> key
+        self._keys: Dict[int, Tuple[Any, ...]] = {}
+
+    def acquire(self, key: Tuple[Any, ...], factory: Callable[[], Any]) -> Any:
+        '''Returns the shared instance for a key, creating it if needed
+
+        :param key: A hashable tuple describing the configuration
+                    of the instance.
+        :param factory: Called without arguments to create the
+                        instance if there is none for the key yet.
+        '''
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry[1] += 1
+                return entry[0]
+        # Create outside of the lock, creating an instance can
+        # take long and should not block acquiring other keys:
+        instance = factory()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                # Created concurrently by another thread, use that one:
+                entry[1] += 1
+                return entry[0]
+            self._entries[key] = [instance, 1, -1]
+            self._keys[id(instance)] = key
+            LOGGER.debug('Created shared instance %r', key)
+            return instance
+
+    def release(self, instance: Any) -> None:
+        '''Releases a shared instance acquired before
+
+        Releasing None or an instance which is not shared does nothing.
+        '''
+        if instance is None:
+            return
+        with self._lock:
+            key = self._keys.get(id(instance))
+            if key is None:
+                return
+            entry = self._entries[key]
+            entry[1] -= 1
+            if entry[1] <= 0:
+                del self._entries[key]
+                del self._keys[id(instance)]
+                LOGGER.debug('Dropped shared instance %r', key)
+
+    def refcount(self, key: Tuple[Any, ...]) -> int:
+        '''Returns how many users currently hold the instance for a key'''
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry[1] if entry is not None else 0
+
+    def info(self, measure: bool = True) -> List[SharedInstanceInfo]:
+        '''Returns statistics about the shared instances
+
+        The saved bytes are the memory the other users would have
+        needed for their own copies.
+
+        :param measure: Whether to measure the size of the instances
+                        not measured yet, which may take a while for
+                        big instances. The size of instances not
+                        measured is -1 and their saved bytes are 0.
+        '''
+        with self._lock:
+            entries = list(self._entries.items())
+        result = []
+        for key, entry in entries:
+            if entry[2] < 0 and measure:
+                try:
+                    entry[2] = deep_size(entry[0])
+                except RuntimeError as error:
+                    # A cache of the instance changed while measuring
+                    # it, try again next time:
+                    LOGGER.debug('Cannot measure %r: %s: %s',
+                                 key, error.__class__.__name__, error)
+            result.append(SharedInstanceInfo(
+                key=key,
+                refcount=entry[1],
+                size=entry[2],
+                saved_bytes=max(entry[2], 0) * (entry[1] - 1)))
+        return result
+
+_SHARED_INSTANCES = SharedInstanceRegistry()
+
+def acquire_shared(key: Tuple[Any, ...], factory: Callable[[], Any]) -> Any:
+    '''Returns the process wide shared instance for a key
+
+    See SharedInstanceRegistry.acquire()
+    '''
+    return _SHARED_INSTANCES.acquire(key, factory)
+
+def release_shared(instance: Any) -> None:
+    '''Releases a process wide shared instance
+
+    See SharedInstanceRegistry.release()
+    '''
+    _SHARED_INSTANCES.release(instance)
+
+def log_shared_instances_info(level: int = logging.DEBUG,
+                              measure: bool = False) -> None:
+    '''Logs the shared instances and the memory saved by sharing them
+
+    :param level:   The log level to use
+    :param measure: Whether to measure the sizes of the instances not
+                    measured yet. Measuring big instances is slow,
+                    it is done in a background thread which logs when
+                    it is done. Without measuring, only the sizes
+                    measured before are logged.
+    '''
+    if measure:
+        threading.Thread(
+            target=_log_shared_instances_info,
+            args=(level, True),
+            name='itb-shared-instances-info',
+            daemon=True).start()
+        return
+    _log_shared_instances_info(level, False)
+
+def _log_shared_instances_info(level: int, measure: bool) -> None:
+    '''Logs the shared instances, see log_shared_instances_info()'''
+    total_saved = 0
+    for info in _SHARED_INSTANCES.info(measure=measure):
+        total_saved += info.saved_bytes
+        LOGGER.log(level,
+                   'Shared instance %r: refcount=%s size=%s saved=%.1f MiB',
+                   info.key, info.refcount,
+                   f'{info.size / (1024 * 1024):.1f} MiB'
+                   if info.size >= 0 else 'not measured',
+                   info.saved_bytes / (1024 * 1024))
+    LOGGER.log(level, 'Memory saved by shared instances: %.1f MiB',
+               total_saved / (1024 * 1024))
+
+
+# The stages of processing a keystroke which are timed by the
+# KeystrokeTracer. The time of a stage includes the time of the
+# stages called by it, for example “select_words” includes
+# “hunspell_suggest”:
+KEYSTROKE_TRACE_STAGES = (
+    'process_key_event',
+    'compose',
+    'hotkeys',
+    'transliteration',
+    'select_words',
+    'hunspell_suggest',
+    'emoji',
+    'lookup_table',
+    'preedit',
+)
+
+class KeystrokeTracer:
+    '''Records how long the stages of processing each keystroke take
+
+    A record is started for each key press by begin_keystroke(). All
+    stages timed until the next key press are added to that record,
+    this includes the candidates which are computed after a delay or
+    in a worker thread (which has to attach() the record first).
+
+    Records contain only timestamps and durations in milliseconds,
+    never the keys typed. The last “max_records” records are kept in
+    a ring buffer. If a trace file is set, each record is appended
+    to it as one line of JSON. A record is complete when the next
+    keystroke begins, the complete records are written in batches of
+    “write_batch” records by a background thread, so that typing
+    does not wait for the file. flush() writes the records not yet
+    written.
+
+    Examples:
+
+    >>> tracer = KeystrokeTracer(max_records=2)
+    >>> with tracer.stage('preedit'):
+    ...     pass
+    >>> tracer.records()
+    []
+    >>> tracer.enable()
+    >>> for _ in range(3):
+    ...     _record = tracer.begin_keystroke()
+    ...     with tracer.stage('preedit'):
+    ...         with tracer.stage('preedit'):
+    ...             pass
+    >>> len(tracer.records())
+    2
+    >>> list(tracer.records()[-1]['stages'])
+    ['preedit']
+    >>> sorted(tracer.percentiles())
+    ['preedit']
+    >>> tracer.percentiles()['preedit']['count']
+    2
+    '''
+    def __init__(self,
+                 max_records: int = 2000,
+                 write_batch: int = 100) -> None:
+        self._enabled = False
+        self._trace_file = ''
+        self._records: Deque[Dict[str, Any]] = collections.deque(
+            maxlen=max_records)
+        self._write_batch = write_batch
+        # The complete records not yet written and the record of the
+        # current keystroke which is not yet complete:
+        self._unwritten_records: List[Dict[str, Any]] = []
+        self._current_record: Optional[Dict[str, Any]] = None
+        # A single thread so that the batches are written in order:
+        self._writer: Optional[
+            concurrent.futures.ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+        # Per thread: the record to add the stages to and the
+        # names of the stages being timed at the moment:
+        self._local = threading.local()
+
+    def enable(self, enabled: bool = True, trace_file: str = '') -> None:
+        '''Enables or disables tracing
+
+        :param enabled:    Whether to record keystrokes
+        :param trace_file: If not empty, the path of a file to append
+                           the records to as JSON lines
+        '''
+        self.flush()
+        with self._lock:
+            self._enabled = enabled
+            self._trace_file = os.path.expanduser(trace_file)
+            if not enabled:
+                self._records.clear()
+        if not enabled:
+            self._local.record = None
+
+    def enabled(self) -> bool:
+        '''Returns whether tracing is enabled'''
+        return self._enabled
+
+    def begin_keystroke(self) -> Optional[Dict[str, Any]]:
+        '''Starts the record of a new keystroke
+
+        :return: The new record or None if tracing is disabled
+        '''
+        if not self._enabled:
+            return None
+        record: Dict[str, Any] = {'time': time.time(), 'stages': {}}
+        with self._lock:
+            self._records.append(record)
+            if self._current_record is not None and self._trace_file:
+                self._unwritten_records.append(self._current_record)
+            self._current_record = record
+            write = len(self._unwritten_records) >= self._write_batch
+        self._local.record = record
+        if write:
+            self.flush(wait=False, current=False)
+        return record
+
+    def current(self) -> Optional[Dict[str, Any]]:
+        '''Returns the record the stages of the current thread are added to'''
+        return getattr(self._local, 'record', None)
+
+    def attach(self, record: Optional[Dict[str, Any]]) -> None:
+        '''Adds the stages timed in the current thread to this record'''
+        self._local.record = record
+
+    @contextlib.contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        '''Context manager adding the time spent in it to a stage
+
+        Nested use of the same stage, for example by recursion, is
+        counted only once.
+        '''
+        record = self.current() if self._enabled else None
+        active = getattr(self._local, 'active', None)
+        if active is None:
+            active = self._local.active = set()
+        if record is None or name in active:
+            yield
+            return
+        active.add(name)
+        time_start = time.perf_counter()
+        try:
+            yield
+        finally:
+            milliseconds = (time.perf_counter() - time_start) * 1000
+            active.discard(name)
+            with self._lock:
+                record['stages'][name] = (
+                    record['stages'].get(name, 0.0) + milliseconds)
+
+    def records(self) -> List[Dict[str, Any]]:
+        '''Returns copies of the records in the ring buffer, oldest first'''
+        with self._lock:
+            return [{'time': record['time'], 'stages': dict(record['stages'])}
+                    for record in self._records]
+
+    def flush(self, wait: bool = True, current: bool = True) -> None:
+        '''Appends the records not yet written to the trace file
+
+        :param wait:    Whether to wait until they are written
+        :param current: Whether to write the record of the current
+                        keystroke as well. Stages timed for it later
+                        are not written then.
+        '''
+        with self._lock:
+            records = self._unwritten_records
+            self._unwritten_records = []
+            if current and self._current_record is not None:
+                records.append(self._current_record)
+                self._current_record = None
+            trace_file = self._trace_file
+            if not records or not trace_file:
+                return
+            # Serialize now, the stages of the records must not change
+            # while the writer thread converts them:
+            lines = ''.join(json.dumps(record, sort_keys=True) + '\n'
+                            for record in records)
+            if self._writer is None:
+                self._writer = concurrent.futures.ThreadPoolExecutor(
+                    max_workers=1, thread_name_prefix='itb-trace')
+            future = self._writer.submit(self._write, trace_file, lines)
+        if wait:
+            concurrent.futures.wait([future])
+
+    def _write(self, trace_file: str, lines: str) -> None:
+        '''Appends lines to the trace file, runs in the writer thread'''
+        try:
+            with open(trace_file, 'a', encoding='UTF-8') as trace:
+                trace.write(lines)
+        except OSError as error:
+            LOGGER.exception(
+                'Cannot write keystroke trace, stop writing to %r: %s: %s',
+                trace_file, error.__class__.__name__, error)
+            with self._lock:
+                if self._trace_file == trace_file:
+                    self._trace_file = ''
+
+    def percentiles(self) -> Dict[str, Dict[str, float]]:
+        '''Returns the count and the 50th, 95th, 99th percentile and maximum
+        latency in milliseconds of each stage in the ring buffer
+        '''
+        return keystroke_trace_percentiles(self.records())
+
+def keystroke_trace_percentiles(
+        records: Iterable[Dict[str, Any]]) -> Dict[str, Dict[str, float]]:
+    '''Computes latency percentiles per stage from keystroke trace records
+
+    Keystrokes during which a stage did not run are not counted for
+    that stage. The nearest rank method is used.
+
+    :param records: Records as written by KeystrokeTracer
+    :return: A dictionary mapping the stage names to dictionaries
+             with the keys 'count', 'p50', 'p95', 'p99', and 'max'
+
+    Examples:
+
+    >>> result = keystroke_trace_percentiles(
+    ...     [{'stages': {'preedit': float(milliseconds)}}
+    ...      for milliseconds in range(1, 101)])
+    >>> [result['preedit'][key]
+    ...  for key in ('count', 'p50', 'p95', 'p99', 'max')]
+    [100, 50.0, 95.0, 99.0, 100.0]
+    '''
+    durations: Dict[str, List[float]] = {}
+    for record in records:
+        for name, milliseconds in record.get('stages', {}).items():
+            durations.setdefault(name, []).append(milliseconds)
+    result: Dict[str, Dict[str, float]] = {}
+    for name, values in durations.items():
+        values.sort()
+        result[name] = {'count': len(values), 'max': values[-1]}
+        for percentile in (50, 95, 99):
+            rank = max(-(-percentile * len(values) // 100), 1)
+            result[name][f'p{percentile}'] = values[rank - 1]
+    return result
+
+def trace_stage(name: str) -> Callable[[Any], Any]:
+    '''Decorator timing each call of a function as a stage of keystrokes
+
+    Costs only a check whether tracing is enabled when it is not.
+    '''
+    def decorator(function: Callable[..., Any]) -> Callable[..., Any]:
+        @functools.wraps(function)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            if not KEYSTROKE_TRACER.enabled():
+                return function(*args, **kwargs)
+            with KEYSTROKE_TRACER.stage(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def log_keystroke_trace_info(level: int = logging.DEBUG) -> None:
+    '''Logs the latency percentiles of the keystrokes in the ring buffer'''
+    percentiles = KEYSTROKE_TRACER.percentiles()
+    for name in sorted(percentiles,
+                       key=lambda x: (
+                           KEYSTROKE_TRACE_STAGES.index(x)
+                           if x in KEYSTROKE_TRACE_STAGES
+                           else len(KEYSTROKE_TRACE_STAGES), x)):
+        stage = percentiles[name]
+        LOGGER.log(level,
+                   'Keystroke stage %s: count=%d p50=%.2f ms p95=%.2f ms '
+                   'p99=%.2f ms max=%.2f ms',
+                   name, stage['count'], stage['p50'], stage['p95'],
+                   stage['p99'], stage['max'])
+
+# Process wide, the stages of all engines are traced together:
+KEYSTROKE_TRACER = KeystrokeTracer()
+
+
 class Capabilite(Flag):
     '''Compatibility class to handle IBus.Capabilite the same way no matter
     what version of ibus is used.
@@ -4454,6 +5401,159 @@ class InputHints(Flag):
     NO_EMOJI = 'NO_EMOJI'
     PRIVATE = 'PRIVATE'
 
+# Increase this when the format of the compiled compose cache changes:
+COMPOSE_CACHE_VERSION = 1
+COMPOSE_CACHE_MAGIC = b'ibus-typing-booster compose cache\n'
+# Keep at most that many compose caches for different compose files:
+COMPOSE_CACHE_MAX_FILES = 8
+
+class ComposeTrie:
+    '''Compose sequences compiled into a trie stored in flat arrays
+
+    Node 0 is the root node. The edges leaving node n are
+    edge_keyvals[node_edges[n]:node_edges[n + 1]], sorted by key
+    value so that they can be searched with bisect. An edge target
+    with RESULT_FLAG set is the index of a result, otherwise the
+    index of the next node. The results are stored UTF-8 encoded
+    in one block, result i is results[result_offsets[i]:result_offsets[i + 1]].
+
+    The arrays are memoryviews into a single buffer, either
+    compiled in memory or a memory mapped cache file. No Python
+    objects are created for the nodes, loading a cache file does
+    not parse anything and its pages are shared by all processes
+    using the same cache file.
+
+    Examples:
+
+    >>> trie = ComposeTrie(ComposeTrie.compile({1: {2: 'a', 3: {4: 'b'}}}))
+    >>> trie.lookup(0, 1)
+    1
+    >>> trie.lookup(1, 2)
+    'a'
+    >>> repr(trie.lookup(1, 4))
+    'None'
+    >>> trie.to_dict()
+    {1: {2: 'a', 3: {4: 'b'}}}
+    '''
+    RESULT_FLAG = 0x80000000
+    # 4 unsigned 32 bit integers with the sizes of the arrays:
+    _HEADER = 16
+
+    def __init__(self, buffer: Any, offset: int = 0) -> None:
+        '''
+        :param buffer: bytes or an mmap.mmap with the compiled trie
+                       as returned by ComposeTrie.compile()
+        :param offset: Where the compiled trie starts in the buffer,
+                       must be a multiple of 4
+        '''
+        view = memoryview(buffer)[offset:]
+        (number_of_nodes, number_of_edges, number_of_results,
+         results_size) = view[:self._HEADER].cast('I')
+        position = self._HEADER
+        def next_array(length: int) -> memoryview:
+            nonlocal position
+            start = position
+            position += 4 * length
+            return view[start:position].cast('I')
+        self._node_edges = next_array(number_of_nodes + 1)
+        self._edge_keyvals = next_array(number_of_edges)
+        self._edge_targets = next_array(number_of_edges)
+        self._result_offsets = next_array(number_of_results + 1)
+        self._results = view[position:position + results_size]
+        if len(self._results) != results_size:
+            raise ValueError('Compiled compose trie is truncated')
+        self._view = view[:position + results_size]
+        self._buffer = buffer # keep an mmap alive
+
+    def tobytes(self) -> bytes:
+        '''Returns the compiled trie, as returned by ComposeTrie.compile()'''
+        return self._view.tobytes()
+
+    @classmethod
+    def compile(cls, compose_sequences: Dict[int, Any]) -> bytes:
+        '''Compiles nested dictionaries of compose sequences
+
+        :param compose_sequences: Nested dictionaries mapping key values
+                                  to either the next dictionary or
+                                  to the result string.
+        :return: The compiled trie to pass to ComposeTrie()
+        '''
+        node_edges = array.array('I', [0])
+        edge_keyvals = array.array('I')
+        edge_targets = array.array('I')
+        result_offsets = array.array('I', [0])
+        results = bytearray()
+        result_indexes: Dict[str, int] = {}
+        nodes = [compose_sequences]
+        for node in nodes: # nodes grows while iterating, breadth first
+            for keyval in sorted(node):
+                value = node[keyval]
+                edge_keyvals.append(keyval)
+                if isinstance(value, str):
+                    if value not in result_indexes:
+                        result_indexes[value] = len(result_offsets) - 1
+                        results += value.encode('UTF-8')
+                        result_offsets.append(len(results))
+                    edge_targets.append(
+                        result_indexes[value] | cls.RESULT_FLAG)
+                else:
+                    edge_targets.append(len(nodes))
+                    nodes.append(value)
+            node_edges.append(len(edge_keyvals))
+        header = array.array(
+            'I', [len(nodes), len(edge_keyvals),
+                  len(result_offsets) - 1, len(results)])
+        return b''.join((header.tobytes(), node_edges.tobytes(),
+                         edge_keyvals.tobytes(), edge_targets.tobytes(),
+                         result_offsets.tobytes(), bytes(results)))
+
+    def _target(self, index: int) -> Union[int, str]:
+        '''Returns the next node or the result an edge points to'''
+        target = self._edge_targets[index]
+        if target & self.RESULT_FLAG:
+            target &= ~self.RESULT_FLAG
+            return str(self._results[self._result_offsets[target]:
+                                     self._result_offsets[target + 1]],
+                       encoding='UTF-8')
+        return int(target)
+
+    def lookup(self, node: int, keyval: int) -> Union[None, int, str]:
+        '''Follows the edge for a key value from a node
+
+        :param node: The index of the node, 0 is the root node
+        :param keyval: The key value of the edge to follow
+        :return: None if there is no such edge, the result string if
+                 the edge completes a sequence, else the index of the
+                 next node.
+        '''
+        start = self._node_edges[node]
+        end = self._node_edges[node + 1]
+        index = bisect.bisect_left(self._edge_keyvals, keyval, start, end)
+        if index == end or self._edge_keyvals[index] != keyval:
+            return None
+        return self._target(index)
+
+    def edges(self, node: int) -> List[Tuple[int, Union[int, str]]]:
+        '''Returns the edges leaving a node, sorted by key value
+
+        :param node: The index of the node, 0 is the root node
+        :return: A list of (key value, next node or result) tuples
+        '''
+        return [(int(self._edge_keyvals[index]), self._target(index))
+                for index in range(self._node_edges[node],
+                                   self._node_edges[node + 1])]
+
+    def to_dict(self, node: int = 0) -> Dict[int, Any]:
+        '''Converts a node back into nested dictionaries'''
+        return {keyval: value if isinstance(value, str) else self.to_dict(value)
+                for keyval, value in self.edges(node)}
+
+class ComposeCompletion(NamedTuple):
+    '''A completion in the index of ComposeSequences.find_compose_completions()'''
+    keyvals: Tuple[int, ...]
+    result: str
+    involves_keypad: bool
+
 class ComposeSequences:
     '''Class to handle compose sequences.
 
@@ -4461,8 +5561,19 @@ class ComposeSequences:
     for the current locale and the compose files from the users
     home directory and stores the compose sequences found there
     in an internal variable.
+
+    The compose sequences are compiled into a ComposeTrie which is
+    written to a cache file in $XDG_CACHE_HOME/ibus-typing-booster/compose/.
+    As long as none of the compose files read changes, later
+    instances memory map that cache file instead of parsing the
+    compose files again.
     '''
-    def __init__(self) -> None:
+    def __init__(self, cache: bool = True) -> None:
+        '''
+        :param cache: Whether to use a compiled cache file of the
+                      compose sequences if an up to date one exists
+                      and to write one if not.
+        '''
         self._keypad_keyvals = {
             IBus.KEY_KP_0: IBus.KEY_0,
             IBus.KEY_KP_1: IBus.KEY_1,
@@ -4708,7 +5819,26 @@ class ComposeSequences:
         if hasattr(IBus, 'KEY_dead_longsolidusoverlay'):
             self._dead_keys[
                 getattr(IBus, 'KEY_dead_longsolidusoverlay')] = '\u0338'
-        self._compose_sequences: Dict[int, Any] = {}
+        # Nested dictionaries of compose sequences, only while the
+        # compose files are read or sequences have been added since
+        # the last compilation:
+        self._compose_sequences: Optional[Dict[int, Any]] = None
+        self._compose_trie = ComposeTrie(ComposeTrie.compile({}))
+        # For each trie node for which completions have been
+        # requested, all completions starting there, sorted by length
+        # and key values:
+        self._completions_index: Dict[int, List[ComposeCompletion]] = {}
+        # For the same nodes, which of these completions use a key
+        # value, to find quickly the completions which cannot be typed
+        # on a keyboard layout:
+        self._completions_keyvals_index: Dict[int, Dict[int, List[int]]] = {}
+        # Completions filtered by the available key values of a
+        # keyboard layout:
+        self._completions_cache = LruCache(
+            'ComposeSequences.find_compose_completions()')
+        # [mtime in ns, size] of all compose files read, including
+        # missing ones which would be read if they existed:
+        self._compose_file_stats: Dict[str, List[int]] = {}
         compose_file_paths = []
         # Gtk reads compose files like this:
         #
@@ -4790,8 +5920,196 @@ class ComposeSequences:
         # or, shorter:
         #
         #     include "%L"
+        self._compose_file_paths = compose_file_paths
+        if cache and self.load_cache():
+            return
+        self._compose_sequences = {}
         for path in compose_file_paths:
             self._read_compose_file(path)
+        self._trie()
+        if cache:
+            self.save_cache()
+
+    def _trie(self) -> ComposeTrie:
+        '''Returns the compiled compose sequences
+
+        Compiles them first if sequences have been added since the
+        last compilation.
+        '''
+        if self._compose_sequences is not None:
+            self._compose_trie = ComposeTrie(
+                ComposeTrie.compile(self._compose_sequences))
+            self._compose_sequences = None
+            self._completions_index = {}
+            self._completions_keyvals_index = {}
+            self._completions_cache.clear()
+        return self._compose_trie
+
+    def _node_completions(self, node: int) -> List[ComposeCompletion]:
+        '''Returns all completions starting at a node of the trie
+
+        Computed once per node, sorted by length and key values.
+        '''
+        completions = self._completions_index.get(node)
+        if completions is not None:
+            return completions
+        compose_trie = self._trie()
+        completions = []
+        stack: List[Tuple[int, Tuple[int, ...]]] = [(node, ())]
+        while stack:
+            (next_node, prefix) = stack.pop()
+            for keyval, value in compose_trie.edges(next_node):
+                keyvals = prefix + (keyval,)
+                if isinstance(value, str):
+                    completions.append(ComposeCompletion(
+                        keyvals=keyvals,
+                        result=value,
+                        involves_keypad=any(
+                            IBus.keyval_name(x).startswith('KP_')
+                            for x in keyvals)))
+                else:
+                    stack.append((value, keyvals))
+        completions.sort(key=lambda x: (len(x.keyvals), x.keyvals))
+        keyvals_index: Dict[int, List[int]] = {}
+        for index, completion in enumerate(completions):
+            for keyval in set(completion.keyvals):
+                keyvals_index.setdefault(keyval, []).append(index)
+        self._completions_index[node] = completions
+        self._completions_keyvals_index[node] = keyvals_index
+        return completions
+
+    @staticmethod
+    def _compose_file_stat(path: str) -> List[int]:
+        '''Returns [mtime in ns, size] of a compose file, [0, 0] if missing'''
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return [0, 0]
+        return [stat.st_mtime_ns, stat.st_size]
+
+    def _cache_key(self) -> Dict[str, Any]:
+        '''Returns what a cache file must match to be usable
+
+        The compose files read are checked separately because the
+        files included are only known after reading.
+        '''
+        return {
+            'version': COMPOSE_CACHE_VERSION,
+            'byteorder': sys.byteorder,
+            'code': self._compose_file_stat(__file__),
+            'ibus': [IBus.MAJOR_VERSION, IBus.MINOR_VERSION,
+                     IBus.MICRO_VERSION],
+            'compose_files': self._compose_file_paths,
+            # Substitutions in include statements:
+            'xorg_locale_path': self._xorg_locale_path(),
+            'locale_compose_file': self._locale_compose_file(),
+            'home': os.path.expanduser('~'),
+        }
+
+    def _cache_path(self) -> str:
+        '''Returns the path of the cache file for the compose files'''
+        key_hash = hashlib.sha256(
+            json.dumps(self._cache_key(), sort_keys=True).encode('UTF-8')
+        ).hexdigest()[:16]
+        return os.path.join(
+            xdg_save_cache_path('ibus-typing-booster', 'compose'),
+            f'compose-{key_hash}.cache')
+
+    def load_cache(self) -> bool:
+        '''Try to memory map the compiled compose sequences from a cache file
+
+        :return: True if an up to date cache file could be used,
+                 False if the compose files need to be read.
+
+        The cache file starts with a magic line and a JSON header
+        line with the key and the compose files read, followed by
+        padding to a multiple of 4 bytes and the compiled ComposeTrie.
+        '''
+        cache_path = self._cache_path()
+        if not os.path.isfile(cache_path):
+            return False
+        time_start = time.time()
+        try:
+            with open(cache_path, 'rb') as cache_file:
+                if cache_file.readline() != COMPOSE_CACHE_MAGIC:
+                    return False
+                header = json.loads(cache_file.readline())
+                if header.get('key') != json.loads(
+                        json.dumps(self._cache_key())):
+                    LOGGER.info('Compose cache %s is outdated.', cache_path)
+                    return False
+                for path, stat in header['compose_files'].items():
+                    if self._compose_file_stat(path) != stat:
+                        LOGGER.info(
+                            'Compose cache %s is outdated, %s changed.',
+                            cache_path, path)
+                        return False
+                offset = cache_file.tell()
+                offset += -offset % 4
+                compose_trie = ComposeTrie(
+                    mmap.mmap(cache_file.fileno(), 0, access=mmap.ACCESS_READ),
+                    offset)
+        except (OSError, ValueError, KeyError, TypeError,
+                AttributeError) as error:
+            LOGGER.warning('Cannot read compose cache %s: %s: %s',
+                           cache_path, error.__class__.__name__, error)
+            return False
+        self._compose_trie = compose_trie
+        self._compose_sequences = None
+        self._compose_file_stats = header['compose_files']
+        LOGGER.info('Loaded compose sequences from %s in %s seconds',
+                    cache_path, time.time() - time_start)
+        return True
+
+    def save_cache(self) -> bool:
+        '''Write the compiled compose sequences to a cache file
+
+        :return: True if the cache file could be written, False if not.
+
+        The file is written to a temporary file first and then
+        renamed, other processes reading the cache at the same time
+        never see a partially written file. Only the
+        COMPOSE_CACHE_MAX_FILES most recently written caches are kept.
+        '''
+        if self._compose_sequences is not None:
+            # Contains sequences added after reading the compose files
+            return False
+        header = json.dumps({
+            'key': self._cache_key(),
+            'compose_files': self._compose_file_stats,
+        }).encode('UTF-8') + b'\n'
+        compiled = self._compose_trie.tobytes()
+        cache_path = self._cache_path()
+        tmp_path = f'{cache_path}.{os.getpid()}.tmp'
+        try:
+            with open(tmp_path, 'wb') as cache_file:
+                cache_file.write(COMPOSE_CACHE_MAGIC)
+                cache_file.write(header)
+                cache_file.write(
+                    b'\0' * (-(len(COMPOSE_CACHE_MAGIC) + len(header)) % 4))
+                cache_file.write(compiled)
+            os.replace(tmp_path, cache_path)
+        except OSError as error:
+            LOGGER.warning('Cannot write compose cache %s: %s: %s',
+                           cache_path, error.__class__.__name__, error)
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            return False
+        cache_dir = os.path.dirname(cache_path)
+        try:
+            caches = sorted(
+                (os.path.join(cache_dir, name)
+                 for name in os.listdir(cache_dir)
+                 if name.endswith('.cache')),
+                key=os.path.getmtime, reverse=True)
+            for old_cache in caches[COMPOSE_CACHE_MAX_FILES:]:
+                os.remove(old_cache)
+        except OSError as error:
+            LOGGER.warning('Cannot remove old compose caches: %s: %s',
+                           error.__class__.__name__, error)
+        return True
 
     def _add_compose_sequence(self, sequence: str, result: str) -> None:
         # pylint: disable=line-too-long
@@ -4865,6 +6183,10 @@ class ComposeSequences:
                     return
         if not keyvals:
             return
+        if self._compose_sequences is None:
+            # Already compiled, add to the nested dictionaries again,
+            # they are compiled again when needed:
+            self._compose_sequences = self._compose_trie.to_dict()
         compose_sequences = self._compose_sequences
         if result == '':
             for keyval in keyvals:
@@ -4928,6 +6250,9 @@ class ComposeSequences:
 
         :param compose_path: Path to a compose file to read
         '''
+        if compose_path:
+            self._compose_file_stats[compose_path] = self._compose_file_stat(
+                compose_path)
         if not compose_path or not os.path.isfile(compose_path):
             LOGGER.info('Skipping reading of compose file "%s"', compose_path)
             return
@@ -5161,7 +6486,7 @@ class ComposeSequences:
 
         :return: True if the key can start a Compose sequence, False if not
         '''
-        return bool(keyval in self._compose_sequences)
+        return self._trie().lookup(0, keyval) is not None
 
     def compose(
             self,
@@ -5239,27 +6564,22 @@ class ComposeSequences:
         # pylint: enable=line-too-long
         if not keyvals:
             return ''
-        compose_sequences = self._compose_sequences
+        compose_trie = self._trie()
+        node = 0
         for keyval in keyvals:
-            if keyval in compose_sequences:
-                if isinstance(compose_sequences[keyval], str):
-                    return str(compose_sequences[keyval])
-                compose_sequences = compose_sequences[keyval]
+            value = compose_trie.lookup(node, keyval)
+            if value is None and keypad_fallback:
+                if keyval in self._keypad_keyvals:
+                    value = compose_trie.lookup(
+                        node, self._keypad_keyvals[keyval])
+                if value is None and keyval in self._non_keypad_keyvals:
+                    value = compose_trie.lookup(
+                        node, self._non_keypad_keyvals[keyval])
+            if isinstance(value, str):
+                return value
+            if value is not None:
+                node = value
                 continue
-            if keypad_fallback and keyval in self._keypad_keyvals:
-                fallback_keyval = self._keypad_keyvals[keyval]
-                if fallback_keyval in compose_sequences:
-                    if isinstance(compose_sequences[fallback_keyval], str):
-                        return str(compose_sequences[fallback_keyval])
-                    compose_sequences = compose_sequences[fallback_keyval]
-                    continue
-            if keypad_fallback and keyval in self._non_keypad_keyvals:
-                fallback_keyval = self._non_keypad_keyvals[keyval]
-                if fallback_keyval in compose_sequences:
-                    if isinstance(compose_sequences[fallback_keyval], str):
-                        return str(compose_sequences[fallback_keyval])
-                    compose_sequences = compose_sequences[fallback_keyval]
-                    continue
             # This sequence is not defined in any of the Compose
             # files read. In that sense it is an invalid sequence
             # and “return ''” would be appropriate here.  But
@@ -5424,25 +6744,25 @@ class ComposeSequences:
 
     def list_compose_sequences(
             self,
-            compose_sequences: Dict[int, Union[Dict[Any, Any], str]],
+            node: int = 0,
             partial_sequence: Optional[List[int]] = None,
             available_keyvals: Optional[Set[int]] = None,
             omit_sequences_involving_keypad: bool = True) -> List[List[int]]:
-        '''Lists all possible compose sequences in a dictionary
+        '''Lists all possible compose sequences starting at a node
 
         Returns a list of possible sequences, each sequence is a list
         of key values
 
-        :param compose_sequences: The compose_sequences dictionary
-                                  to check for possible sequences
+        :param node: The node of the compiled compose sequences
+                     to check for possible sequences, 0 lists
+                     all compose sequences.
         :param available_keyvals: The key values available to type
-                                  compose sequences. Sequences from
-                                  the compose_sequences dictionary
+                                  compose sequences. Sequences
                                   which require key values not in this
                                   Set are not listed.
                                   If this parameter is None, *All*
-                                  sequences in the compose_sequences
-                                  dictionary are listed.
+                                  sequences starting at the node
+                                  are listed.
         :param omit_sequences_involving_keypad: Omit all sequences
                                                 containing any
                                                 keys on the keypad.
@@ -5450,28 +6770,28 @@ class ComposeSequences:
         if partial_sequence is None:
             partial_sequence = []
         possible_sequences: List[List[int]] = []
-        for keyval in compose_sequences:
+        for keyval, value in self._trie().edges(node):
             if available_keyvals and keyval not in available_keyvals:
                 continue
             if (omit_sequences_involving_keypad
                 and IBus.keyval_name(keyval).startswith('KP_')):
                 continue
             new_partial_sequence = partial_sequence + [keyval]
-            value = compose_sequences[keyval]
             if isinstance(value, str):
                 possible_sequences.append(new_partial_sequence)
             else:
-                new_compose_sequence = value
                 possible_sequences += self.list_compose_sequences(
-                    new_compose_sequence,
+                    value,
                     partial_sequence = new_partial_sequence,
-                    available_keyvals = available_keyvals)
+                    available_keyvals = available_keyvals,
+                    omit_sequences_involving_keypad = (
+                        omit_sequences_involving_keypad))
         return possible_sequences
 
     def find_compose_completions(
             self,
             keyvals: List[int],
-            available_keyvals: Optional[Set[int]] = None,
+            available_keyvals: Optional[Iterable[int]] = None,
             omit_sequences_involving_keypad: bool = True) -> List[List[int]]:
         # pylint: disable=line-too-long
         '''Lists all possible compose sequences in the dictionary starting
@@ -5482,9 +6802,22 @@ class ComposeSequences:
         considered, “automatic dead key sequences” are *not* included
         in the possible completions.
 
+        The completions starting at a node of the compose sequences
+        are enumerated only once and the results filtered by the key
+        values available in a keyboard layout are cached, repeated
+        calls while composing do not enumerate thousands of sequences
+        again. For each node, an index of which completions use which
+        key value is kept, filtering then only needs to look at the
+        key values missing on the keyboard layout. Passing the
+        frozenset of KeyvalsToKeycodes.keyvals() avoids copying the
+        available key values for each call.
+
         :param kevals: The key values which started the compose sequence
         :param available_keyvals: The key values available to complete the
                                   compose sequence
+        :param omit_sequences_involving_keypad: Omit all completions
+                                                containing any keys
+                                                on the keypad.
 
         Examples:
 
@@ -5532,25 +6865,38 @@ class ComposeSequences:
         # pylint: enable=line-too-long
         if not keyvals:
             return []
-        compose_sequences = self._compose_sequences
+        compose_trie = self._trie()
+        node = 0
         for keyval in keyvals:
-            if keyval not in compose_sequences:
+            value = compose_trie.lookup(node, keyval)
+            if value is None:
                 # No completion possible, it’s invalid:
                 return []
-            compose_sequences = compose_sequences[keyval]
-            if isinstance(compose_sequences, str):
+            if isinstance(value, str):
                 # It is already complete:
                 return []
-        sequences = self.list_compose_sequences(
-            compose_sequences,
-            partial_sequence = [],
-            available_keyvals = available_keyvals,
-            omit_sequences_involving_keypad = omit_sequences_involving_keypad)
-        return sorted(sequences,
-                      key=lambda x: (
-                          len(x),
-                          x
-                      ))
+            node = value
+        available = (
+            frozenset(available_keyvals) if available_keyvals else None)
+        cache_key = (node, available, omit_sequences_involving_keypad)
+        sequences: Optional[List[List[int]]] = (
+            self._completions_cache.get(cache_key))
+        if sequences is None:
+            completions = self._node_completions(node)
+            unavailable: Set[int] = set()
+            if available is not None:
+                for keyval, indexes in (
+                        self._completions_keyvals_index[node].items()):
+                    if keyval not in available:
+                        unavailable.update(indexes)
+            sequences = [
+                list(completion.keyvals)
+                for index, completion in enumerate(completions)
+                if index not in unavailable
+                and not (omit_sequences_involving_keypad
+                         and completion.involves_keypad)]
+            self._completions_cache.put(cache_key, sequences)
+        return sequences[:]
 
 class M17nDbInfo:
     '''Class to find and store information about the available input
@@ -5877,6 +7223,22 @@ def xdg_save_data_path(*resource: str) -> str:
         os.makedirs(path, exist_ok=True)
     return path
 
+def xdg_save_cache_path(*resource: str) -> str:
+    '''
+    Like xdg_save_data_path() but for files in $XDG_CACHE_HOME
+
+    Files in this directory must be safe to delete at any time,
+    they are only used to speed things up.
+    '''
+    xdg_cache_home = os.environ.get('XDG_CACHE_HOME') or os.path.join(
+        os.path.expanduser('~'), '.cache')
+    resource_joined = os.path.join(*resource)
+    assert not resource_joined.startswith('/')
+    path = os.path.join(xdg_cache_home, resource_joined)
+    if not os.path.isdir(path):
+        os.makedirs(path, exist_ok=True)
+    return path
+
 def is_desktop(name: str) -> bool:
     '''Checks whether a desktop named “name” is used
 
@@ -5945,19 +7307,21 @@ class KeyvalsToKeycodes:
     is mapped to different hardware keys in the keyboard layout)
     and a certain hardware key with a certain key code can generate different
     key values depending on which modifier was pressed.
+
+    Computing the mapping asks Gdk about every key code, use
+    get_keyvals_to_keycodes() to get an instance shared by all engines
+    which is only computed again when the keyboard layout changes.
     '''
     def __init__(self) -> None:
         self.keyvals_to_keycodes: Dict[int, List[int]] = {}
-        display = Gdk.Display.get_default()
-        if not display:
-            LOGGER.warning('Gdk.Display.get_default() returned %s', display)
-            self._fallback_to_std_us_layout()
-            return
-        keymap = Gdk.Keymap.get_for_display(display)
+        self._keyvals: FrozenSet[int] = frozenset()
+        self.fingerprint: Tuple[Any, ...] = ()
+        keymap = self.keymap()
         if not keymap:
-            LOGGER.warning('Could not get keymap')
+            LOGGER.warning('No keymap, falling back to standard US layout')
             self._fallback_to_std_us_layout()
             return
+        self.fingerprint = self.layout_fingerprint(keymap)
         # Checking AltGr state should not just check for Mod5,
         # that works only on Legacy X11 systems. Modern X11 and
         # Wayland systems use Mod1 + Level3 (1 << 16) instead:
@@ -5998,6 +7362,37 @@ class KeyvalsToKeycodes:
         if not self.keyvals_to_keycodes:
             LOGGER.warning('No keycodes found, falling back to standard US layout')
             self._fallback_to_std_us_layout()
+            return
+        self._keyvals = frozenset(self.keyvals_to_keycodes)
+
+    @staticmethod
+    def keymap() -> Optional[Gdk.Keymap]:
+        '''Returns the keymap of the default display or None'''
+        display = Gdk.Display.get_default()
+        if not display:
+            return None
+        keymap = Gdk.Keymap.get_for_display(display)
+        if not keymap:
+            return None
+        return keymap
+
+    @staticmethod
+    def layout_fingerprint(keymap: Gdk.Keymap) -> Tuple[Any, ...]:
+        '''Returns something cheap to compute which changes when the
+        keyboard layout changes
+
+        Looks only at the key values of a few keys of the main block
+        whose meaning differs between common layouts: the digit 1, a
+        letter key of each row (Q, A, Z on the us layout), the key
+        left of 1 and the extra key next to the left Shift.
+
+        :param keymap: The keymap of the default display
+        '''
+        fingerprint: List[Tuple[int, ...]] = []
+        for keycode in (10, 24, 38, 52, 49, 94):
+            success, _keys, keyvals = keymap.get_entries_for_keycode(keycode)
+            fingerprint.append(tuple(keyvals) if success else ())
+        return tuple(fingerprint)
 
     def _fallback_to_std_us_layout(self) -> None:
         """Fallback mapping for when keycode detection fails"""
@@ -6013,10 +7408,16 @@ class KeyvalsToKeycodes:
         # Add more fallbacks as needed
         }
         self.keyvals_to_keycodes.update(self._std_us_keyvals_to_keycodes)
+        self._keyvals = frozenset(self.keyvals_to_keycodes)
+
+    def keyvals(self) -> FrozenSet[int]:
+        '''Returns the Set of keyvals available on the keyboard layout
 
-    def keyvals(self) -> Set[int]:
-        '''Returns the Set of keyvals available on the keyboard layout'''
-        return set(self.keyvals_to_keycodes.keys())
+        Always the same object for the same instance, so it is cheap
+        to use as a cache key, see
+        ComposeSequences.find_compose_completions().
+        '''
+        return self._keyvals
 
     def keycodes(self, keyval: int) -> List[int]:
         '''Returns a list of key codes of the hardware keys which can generate
@@ -6085,6 +7486,43 @@ class KeyvalsToKeycodes:
                 f'keycodes: {self.keyvals_to_keycodes[keyval]}\n')
         return return_string
 
+# The KeyvalsToKeycodes shared by all engines of the process, see
+# get_keyvals_to_keycodes():
+_KEYVALS_TO_KEYCODES: Optional[KeyvalsToKeycodes] = None
+# The keymap whose “keys-changed” signal is connected:
+_KEYS_CHANGED_KEYMAP: Optional[Gdk.Keymap] = None
+
+def _on_keys_changed(_keymap: Gdk.Keymap) -> None:
+    '''Called when the “keys-changed” signal of the keymap is emitted'''
+    global _KEYVALS_TO_KEYCODES # pylint: disable=global-statement
+    LOGGER.debug('Keymap changed')
+    _KEYVALS_TO_KEYCODES = None
+
+def get_keyvals_to_keycodes() -> KeyvalsToKeycodes:
+    '''Returns the KeyvalsToKeycodes for the current keyboard layout
+
+    The instance is shared by all engines of the process and only
+    computed again when the “keys-changed” signal of the keymap was
+    emitted or when KeyvalsToKeycodes.layout_fingerprint() changed.
+    The signal alone is not enough, it is not emitted in all desktop
+    sessions when the layout is switched.
+    '''
+    # pylint: disable=global-statement
+    global _KEYVALS_TO_KEYCODES
+    global _KEYS_CHANGED_KEYMAP
+    # pylint: enable=global-statement
+    keymap = KeyvalsToKeycodes.keymap()
+    if keymap is not None and keymap is not _KEYS_CHANGED_KEYMAP:
+        keymap.connect('keys-changed', _on_keys_changed)
+        _KEYS_CHANGED_KEYMAP = keymap
+        _KEYVALS_TO_KEYCODES = None
+    fingerprint = (
+        KeyvalsToKeycodes.layout_fingerprint(keymap) if keymap else ())
+    if (_KEYVALS_TO_KEYCODES is None
+        or _KEYVALS_TO_KEYCODES.fingerprint != fingerprint):
+        _KEYVALS_TO_KEYCODES = KeyvalsToKeycodes()
+    return _KEYVALS_TO_KEYCODES
+
 class KeyEvent:
     '''Key event class used to make the checking of details of the key
     event easy
@@ -987,6 +987,12 @@ class Transliterator:
                     a string.
         '''
         self._dummy = False
+        # Checkpoint of transliterate_parts_incremental(): the msymbols
+        # already fed into self._incremental_ic and what they committed:
+        self._incremental_ic: Any = None
+        self._incremental_msymbols: List[str] = []
+        self._incremental_committed = ''
+        self._incremental_committed_index = 0
         if ime == 'NoIME':
             self._dummy = True
             return
@@ -1050,6 +1056,25 @@ class Transliterator:
         _symbol = libm17n__msymbol(b'nil') # type: ignore
         _retval = libm17n__minput_filter( # type: ignore
             self._ic, _symbol, ctypes.c_void_p(None))
+        if self._incremental_ic is not None:
+            self._reset_incremental()
+            libm17n__minput_reset_ic(self._incremental_ic) # type: ignore
+
+    def _reset_incremental(self) -> None:
+        '''Forgets the checkpoint of transliterate_parts_incremental()
+
+        The next incremental transliteration replays all its input.
+        '''
+        if self._incremental_ic is not None and self._incremental_msymbols:
+            # Commit the remaining preedit like transliterate_parts()
+            # does after each transliteration to start the replay
+            # with an empty preedit:
+            _symbol = libm17n__msymbol(b'nil') # type: ignore
+            _retval = libm17n__minput_filter( # type: ignore
+                self._incremental_ic, _symbol, ctypes.c_void_p(None))
+        self._incremental_msymbols = []
+        self._incremental_committed = ''
+        self._incremental_committed_index = 0
 
     def transliterate_parts(
             self,
@@ -1478,35 +1503,118 @@ class Transliterator:
                                        committed_index=len(msymbol_list))
         if reset:
             libm17n__minput_reset_ic(self._ic) # type: ignore
-        committed = ''
-        committed_index = 0
-        preedit = ''
-        candidates: List[str] = []
-        for index, symbol in enumerate(msymbol_list):
-            symbol = self._convert_non_ascii_msymbol(symbol)
+        committed, committed_index = self._filter(
+            self._ic, msymbol_list, 0, '', 0)
+        transliteration_parts = self._read_ic(
+            self._ic, len(msymbol_list), committed, committed_index,
+            ascii_digits)
+        # From the m17n-lib documentation:
+        #
+        # The minput_reset_ic () function resets input context $IC by
+        # calling a callback function corresponding to @b
+        # Minput_reset.  It resets the status of $IC to its initial
+        # one.  As the current preedit text is deleted without
+        # commitment, if necessary, call minput_filter () with the arg
+        # @b key #Mnil to force the input method to commit the preedit
+        # in advance.
+        #
+        # Looks like we need to do this here, i.e. call minput_filter
+        # with a final 'nil' msymbol to commit the preedit in the
+        # input context to make the next call to minput_reset_ic()
+        # work reliably.  Without that minput_reset_ic() sometimes
+        # segfaults.  The old code, before fixing
+        # https://github.com/mike-fabian/ibus-typing-booster/issues/460
+        # always appended a final 'nil' symbol to the msymbol_list
+        # argument which had to be removed to get the correct preedit
+        # contents.  But apparently that final 'nil' is necessary to
+        # make it work reliably. We can do this here because above we
+        # read the preedit already and don’t need it anymore.
+        #
+        # It is not only necessary to make the next call to
+        # minput_reset_ic() work reliably, it is also necessary to
+        # commit any remaining preedit to avoid that the next
+        # transliteration starts with a non-empty preedit remaining
+        # from the previous transliteration.
+        #
+        # Unfortunately that makes state changing switches which
+        # affect only the next character not survive until the next
+        # transliteration.  For example when switching to
+        # single-fullwidth-mode by typing `Z` (see cjk-util.mim) with
+        # early commits (i.e. with the `tb:zh:py`), `aZ` will commit
+        # `啊`. The `Z` causes the commit but the state change done by
+        # the `Z` does not survive, typing `aZaZ` commits `啊啊`.
+        # With empty input one can type `Za` to get a single `ａ`
+        # FULLWIDTH LATIN SMALL LETTER A though.
+        _symbol = libm17n__msymbol(b'nil') # type: ignore
+        _retval = libm17n__minput_filter( # type: ignore
+            self._ic, _symbol, ctypes.c_void_p(None))
+        return transliteration_parts
+
+    def _filter(
+            self,
+            ic: Any,
+            msymbol_list: List[str],
+            start: int,
+            committed: str,
+            committed_index: int) -> Tuple[str, int]:
+        '''Feeds msymbol_list[start:] into an input context
+
+        :param ic: The input context
+        :param msymbol_list: The complete list of msymbols
+        :param start: Index of the first msymbol to feed, the
+                      msymbols before were fed already
+        :param committed: Text committed by the msymbols before start
+        :param committed_index: Index up to which the msymbols before
+                                start were used up to create “committed”
+        :return: The committed text and committed index after feeding
+        '''
+        for index in range(start, len(msymbol_list)):
+            symbol = self._convert_non_ascii_msymbol(msymbol_list[index])
             _symbol = libm17n__msymbol(symbol.encode('utf-8')) # type: ignore
             retval = libm17n__minput_filter( # type: ignore
-                self._ic, _symbol, ctypes.c_void_p(None))
+                ic, _symbol, ctypes.c_void_p(None))
             if retval == 0:
                 _mt = libm17n__mtext() # type: ignore
                 retval = libm17n__minput_lookup( # type: ignore
-                    self._ic, _symbol, ctypes.c_void_p(None), _mt)
+                    ic, _symbol, ctypes.c_void_p(None), _mt)
                 if libm17n__mtext_len(_mt) > 0: # type: ignore
                     committed += mtext_to_string(_mt)
                     committed_index = index
                 if retval:
                     committed += msymbol_list[index]
                     committed_index = index + 1
+        return (committed, committed_index)
+
+    def _read_ic(
+            self,
+            ic: Any,
+            number_of_msymbols: int,
+            committed: str,
+            committed_index: int,
+            ascii_digits: bool) -> TransliterationParts:
+        '''Reads the preedit, candidates, and status of an input context
+
+        :param ic: The input context
+        :param number_of_msymbols: How many msymbols were fed into
+                                   the input context
+        :param committed: The text committed while feeding them
+        :param committed_index: Index up to which the msymbols were used
+                                up to create “committed”
+        :param ascii_digits: If true, convert language specific digits
+                             to ASCII digits
+        '''
+        preedit = ''
+        candidates: List[str] = []
         try:
-            if (self._ic.contents.preedit_changed
+            if (ic.contents.preedit_changed
                 and
                 libm17n__mtext_len(
-                    self._ic.contents.preedit) > 0): # type: ignore
-                preedit = mtext_to_string(self._ic.contents.preedit)
+                    ic.contents.preedit) > 0): # type: ignore
+                preedit = mtext_to_string(ic.contents.preedit)
         except Exception as error: # pylint: disable=broad-except
             # This should never happen:
             raise ValueError('Problem accessing preedit') from error
-        plist = self._ic.contents.candidate_list
+        plist = ic.contents.candidate_list
         while bool(plist):  # NULL pointers have a False boolean value
             key = libm17n__mplist_key(plist) # type: ignore
             if not bool(key):
@@ -1540,54 +1648,14 @@ class Transliterator:
             else:
                 break
             plist = libm17n__mplist_next(plist) # type: ignore
-        cursor_pos = self._ic.contents.cursor_pos
-        status = mtext_to_string(self._ic.contents.status)
-        candidate_index = self._ic.contents.candidate_index
-        candidate_from = self._ic.contents.candidate_from
-        candidate_to = self._ic.contents.candidate_to
-        candidate_show = self._ic.contents.candidate_show
-        # From the m17n-lib documentation:
-        #
-        # The minput_reset_ic () function resets input context $IC by
-        # calling a callback function corresponding to @b
-        # Minput_reset.  It resets the status of $IC to its initial
-        # one.  As the current preedit text is deleted without
-        # commitment, if necessary, call minput_filter () with the arg
-        # @b key #Mnil to force the input method to commit the preedit
-        # in advance.
-        #
-        # Looks like we need to do this here, i.e. call minput_filter
-        # with a final 'nil' msymbol to commit the preedit in the
-        # input context to make the next call to minput_reset_ic()
-        # work reliably.  Without that minput_reset_ic() sometimes
-        # segfaults.  The old code, before fixing
-        # https://github.com/mike-fabian/ibus-typing-booster/issues/460
-        # always appended a final 'nil' symbol to the msymbol_list
-        # argument which had to be removed to get the correct preedit
-        # contents.  But apparently that final 'nil' is necessary to
-        # make it work reliably. We can do this here because above we
-        # read the preedit already and don’t need it anymore.
-        #
-        # It is not only necessary to make the next call to
-        # minput_reset_ic() work reliably, it is also necessary to
-        # commit any remaining preedit to avoid that the next
-        # transliteration starts with a non-empty preedit remaining
-        # from the previous transliteration.
-        #
-        # Unfortunately that makes state changing switches which
-        # affect only the next character not survive until the next
-        # transliteration.  For example when switching to
-        # single-fullwidth-mode by typing `Z` (see cjk-util.mim) with
-        # early commits (i.e. with the `tb:zh:py`), `aZ` will commit
-        # `啊`. The `Z` causes the commit but the state change done by
-        # the `Z` does not survive, typing `aZaZ` commits `啊啊`.
-        # With empty input one can type `Za` to get a single `ａ`
-        # FULLWIDTH LATIN SMALL LETTER A though.
-        _symbol = libm17n__msymbol(b'nil') # type: ignore
-        _retval = libm17n__minput_filter( # type: ignore
-            self._ic, _symbol, ctypes.c_void_p(None))
+        cursor_pos = ic.contents.cursor_pos
+        status = mtext_to_string(ic.contents.status)
+        candidate_index = ic.contents.candidate_index
+        candidate_from = ic.contents.candidate_from
+        candidate_to = ic.contents.candidate_to
+        candidate_show = ic.contents.candidate_show
         if committed and not preedit:
-            committed_index = len(msymbol_list)
+            committed_index = number_of_msymbols
         # Some Chinese input methods and some Vietnamese input methods
         # for Chinese characters sometimes have “candidates == []” but
         # at the same time “candidate_show == 1”:
@@ -1692,6 +1760,100 @@ class Transliterator:
             candidate_to=candidate_to,
             candidate_show=candidate_show)
 
+    def transliterate_parts_incremental(
+            self,
+            msymbol_list: List[str],
+            ascii_digits: bool = False) -> TransliterationParts:
+        '''Transliterate a list of Msymbol names reusing the previous input
+
+        Gives the same results as transliterate_parts() but keeps the
+        state of a separate input context after the input of the
+        previous call. If msymbol_list starts with that previous
+        input, only the msymbols added at the end are fed into the
+        input context. When typing a word key by key, this needs one
+        call of minput_filter() per key instead of replaying the whole
+        word on each key. If msymbol_list does not start with the
+        previous input, for example because something was deleted or
+        inserted in the middle, all of it is replayed.
+
+        :param msymbol_list: A list of strings which are interpreted
+                             as the names of Msymbols to transliterate.
+        :param ascii_digits: If true, convert language specific digits
+                             to ASCII digits
+        :return: The transliteration in several parts
+
+        Examples:
+
+        >>> trans = Transliterator('hi-itrans')
+        >>> trans.transliterate_parts_incremental(list('nam')).preedit
+        'म्'
+        >>> parts = trans.transliterate_parts_incremental(list('namaste'))
+        >>> parts.committed
+        'नम'
+        >>> parts.preedit
+        'स्ते'
+        >>> parts.committed_index
+        4
+        >>> parts == trans.transliterate_parts(list('namaste'))
+        True
+
+        Editing in the middle replays everything:
+
+        >>> parts = trans.transliterate_parts_incremental(list('nmaste'))
+        >>> parts == trans.transliterate_parts(list('nmaste'))
+        True
+        '''
+        if not isinstance(msymbol_list, list):
+            raise ValueError('Argument of transliterate() must be a list.')
+        if self._dummy:
+            return TransliterationParts(committed=''.join(msymbol_list),
+                                       committed_index=len(msymbol_list))
+        if self._incremental_ic is None:
+            self._incremental_ic = libm17n__minput_create_ic( # type: ignore
+                self._im, ctypes.c_void_p(None))
+            try:
+                _ic_contents = self._incremental_ic.contents
+            except ValueError as error: # NULL pointer access
+                self._incremental_ic = None
+                raise ValueError('minput_create_ic() failed') from error
+        start = len(self._incremental_msymbols)
+        if (len(msymbol_list) < start
+            or msymbol_list[:start] != self._incremental_msymbols):
+            self._reset_incremental()
+            start = 0
+        committed, committed_index = self._filter(
+            self._incremental_ic, msymbol_list, start,
+            self._incremental_committed, self._incremental_committed_index)
+        self._incremental_msymbols = msymbol_list[:]
+        self._incremental_committed = committed
+        self._incremental_committed_index = committed_index
+        return self._read_ic(
+            self._incremental_ic, len(msymbol_list), committed,
+            committed_index, ascii_digits)
+
+    def transliterate_incremental(
+            self,
+            msymbol_list: List[str],
+            ascii_digits: bool = False) -> str:
+        '''Transliterate a list of Msymbol names reusing the previous input
+
+        Like transliterate() but uses transliterate_parts_incremental().
+
+        Examples:
+
+        >>> trans = Transliterator('ko-romaja')
+        >>> word = list('annyeonghaseyo')
+        >>> all(trans.transliterate_incremental(word[:i])
+        ...     == trans.transliterate(word[:i])
+        ...     for i in range(len(word) + 1))
+        True
+        >>> trans.transliterate_incremental(word)
+        '안녕하세요'
+        '''
+        transliteration_parts = self.transliterate_parts_incremental(
+            msymbol_list, ascii_digits)
+        return transliteration_parts.committed + transliteration_parts.preedit
+
     def transliterate(
             self,
             msymbol_list: Iterable[str],
@@ -1979,6 +2141,9 @@ class Transliterator:
             raise ValueError(
                 f'minput_save_config() failed with retval = {retval} '
                 '(unknown error, should never happen)')
+        # Replay the input with the new values of the variables
+        # on the next incremental transliteration:
+        self._reset_incremental()
         return
 
 if __name__ == "__main__":
@@ -26,7 +26,16 @@ from typing import Optional
 from typing import Any
 from typing import Callable
 from typing import Iterator
+from typing import Deque
 import os
+import signal
+import array
+import bisect
+import collections
+import concurrent.futures
+import multiprocessing
+import functools
+import threading
 import unicodedata
 from contextlib import contextmanager
 import sqlite3
@@ -41,7 +50,423 @@ LOGGER = logging.getLogger('ibus-typing-booster')
 
 DEBUG_LEVEL = int(0)
 
-USER_DATABASE_VERSION = '0.65'
+USER_DATABASE_VERSION = '0.66'
+
+# Older versions of the user database which can be upgraded in place
+# by TabSqliteDb._upgrade_database_schema() instead of being renamed
+# and replaced by a new database:
+UPGRADABLE_USER_DATABASE_VERSIONS = ('0.65',)
+
+# With write behind enabled, do a wal_checkpoint when flushing the
+# pending frequency updates only if the last one was at least that
+# many seconds ago:
+CHECKPOINT_INTERVAL_SECONDS = 60
+
+# cleanup_database() keeps at most that many rows, user defined
+# shortcuts are kept even beyond that limit:
+CLEANUP_MAX_ROWS = 50000
+
+# cleanup_database() rebuilds the database with VACUUM only if it
+# deleted at least that fraction of the rows. Otherwise it just
+# gives the free pages back to the file system with an incremental
+# vacuum, if there are at least that many:
+VACUUM_MIN_DELETED_FRACTION = 0.1
+VACUUM_MIN_FREE_PAGES = 256
+
+# read_training_data_from_file() gives the training data in chunks of
+# about that many bytes to the worker processes which tokenize them:
+TRAINING_CHUNK_BYTES = 1024 * 1024
+
+# read_training_data_from_file() adds the n-gram counts to the
+# database whenever it has counted that many distinct n-grams:
+TRAINING_MAX_NGRAMS = 500_000
+
+def _training_key(
+        token: str, p_token: str, pp_token: str) -> Tuple[str, str, str, str]:
+    '''Returns the (input_phrase, phrase, p_phrase, pp_phrase) key of a token
+
+    The token and the context tokens are already in
+    NORMALIZATION_FORM_INTERNAL.
+    '''
+    return (itb_util.remove_accents(token.lower()),
+            token,
+            itb_util.remove_accents(p_token.lower()),
+            itb_util.remove_accents(pp_token.lower()))
+
+def _count_training_ngrams(
+        chunk: bytes
+) -> Tuple[Dict[Tuple[str, str, str, str], int], List[str], List[str]]:
+    '''Tokenizes a chunk of training data and counts the trigrams
+
+    Runs in the worker processes of read_training_data_from_file().
+    The context of the first two tokens is unknown here, they are
+    counted as if the chunk were the beginning of the text and
+    corrected by _fix_chunk_context() when the chunk is merged.
+
+    :param chunk: Complete lines of UTF-8 encoded text
+    :return: The counts of the (input_phrase, phrase, p_phrase,
+             pp_phrase) keys, the first two tokens and the last two
+             tokens of the chunk
+    '''
+    counts: Dict[Tuple[str, str, str, str], int] = {}
+    tokens: List[str] = []
+    p_token = ''
+    pp_token = ''
+    for line in chunk.decode('UTF-8', errors='replace').splitlines():
+        line = unicodedata.normalize(
+            itb_util.NORMALIZATION_FORM_INTERNAL, line)
+        for token in itb_util.tokenize(line):
+            key = _training_key(token, p_token, pp_token)
+            counts[key] = counts.get(key, 0) + 1
+            if len(tokens) < 2:
+                tokens.append(token)
+            pp_token = p_token
+            p_token = token
+    return (counts, tokens, [token for token in (pp_token, p_token) if token])
+
+def _fix_chunk_context(
+        counts: Dict[Tuple[str, str, str, str], int],
+        first_tokens: List[str],
+        context: List[str]) -> None:
+    '''Recounts the first tokens of a chunk with the tokens before it
+
+    :param counts: The counts of the chunk, changed in place
+    :param first_tokens: The first two tokens of the chunk
+    :param context: The last two tokens before the chunk
+    '''
+    for index, token in enumerate(first_tokens):
+        (wrong_pp, wrong_p) = ([''] * 2 + first_tokens[:index])[-2:]
+        (right_pp, right_p) = ([''] * 2 + context + first_tokens[:index])[-2:]
+        if (wrong_p, wrong_pp) == (right_p, right_pp):
+            continue
+        wrong_key = _training_key(token, wrong_p, wrong_pp)
+        counts[wrong_key] -= 1
+        if not counts[wrong_key]:
+            del counts[wrong_key]
+        right_key = _training_key(token, right_p, right_pp)
+        counts[right_key] = counts.get(right_key, 0) + 1
+
+class _PrefixCounts:
+    '''Phrase counts of one n-gram order in sorted parallel arrays
+
+    Each row has a key, a phrase id and a count. The key is the
+    input phrase prefixed by the context, for example
+    'p_phrase\\0input_phrase' for bigrams. The rows are sorted by
+    key, so all rows of a context with input phrases starting with
+    a prefix are a contiguous slice which is found with bisect.
+    The rows of a key are sorted by phrase id. The phrase ids and
+    counts are kept in arrays, the keys of consecutive rows share
+    the same string object.
+
+    Very short prefixes match a big part of the rows, the sums for
+    these are remembered and updated when counts are added.
+    '''
+    __slots__ = ('keys', 'phrase_ids', 'counts', 'prefix_sums')
+
+    # Remember the sums for prefixes up to that length:
+    PREFIX_SUMS_MAX_LENGTH = 2
+
+    def __init__(self) -> None:
+        self.keys: List[str] = []
+        self.phrase_ids = array.array('l')
+        self.counts = array.array('q')
+        # Maps context + input phrase prefix to phrase id -> count:
+        self.prefix_sums: Dict[str, Dict[int, int]] = {}
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def load(self, counts: Dict[Tuple[str, int], int]) -> None:
+        '''Replace all rows
+
+        :param counts: Maps (key, phrase id) to the count
+        '''
+        rows = sorted(counts.items())
+        key_objects: Dict[str, str] = {}
+        self.keys = [key_objects.setdefault(key, key)
+                     for ((key, _phrase_id), _count) in rows]
+        self.phrase_ids = array.array(
+            'l', [phrase_id for ((_key, phrase_id), _count) in rows])
+        self.counts = array.array('q', [count for (_key, count) in rows])
+        self.prefix_sums = {}
+
+    def _search(self, key: str, phrase_id: int) -> Tuple[int, bool]:
+        '''Returns the index where the row is or would be inserted
+        and whether the row is there
+        '''
+        keys = self.keys
+        low = bisect.bisect_left(keys, key)
+        high = bisect.bisect_right(keys, key, low)
+        index = bisect.bisect_left(self.phrase_ids, phrase_id, low, high)
+        return (index, index < high and self.phrase_ids[index] == phrase_id)
+
+    def find(self, key: str, phrase_id: int) -> int:
+        '''Returns the index of the row, -1 if there is none'''
+        (index, found) = self._search(key, phrase_id)
+        return index if found else -1
+
+    def add(self, key: str, phrase_id: int, count: int) -> None:
+        '''Add count to a row, insert the row if it does not exist'''
+        (index, found) = self._search(key, phrase_id)
+        if found:
+            self.counts[index] += count
+        else:
+            if index < len(self.keys) and self.keys[index] == key:
+                key = self.keys[index]
+            elif index and self.keys[index - 1] == key:
+                key = self.keys[index - 1]
+            self.keys.insert(index, key)
+            self.phrase_ids.insert(index, phrase_id)
+            self.counts.insert(index, count)
+        if not self.prefix_sums:
+            return
+        context_length = key.rfind('\0') + 1
+        for length in range(
+                context_length,
+                context_length + min(len(key) - context_length,
+                                     self.PREFIX_SUMS_MAX_LENGTH) + 1):
+            sums = self.prefix_sums.get(key[:length])
+            if sums is not None:
+                sums[phrase_id] = sums.get(phrase_id, 0) + count
+
+    def remove(self, phrase_id: int, input_phrase: str = '') -> None:
+        '''Remove the rows of a phrase
+
+        :param input_phrase: If not empty, remove only the rows
+                             of the phrase for this input phrase
+        '''
+        keep = [index
+                for (index, (key, row_phrase_id))
+                in enumerate(zip(self.keys, self.phrase_ids))
+                if row_phrase_id != phrase_id
+                or (input_phrase
+                    and key[key.rfind('\0') + 1:] != input_phrase)]
+        if len(keep) == len(self.keys):
+            return
+        self.keys = [self.keys[index] for index in keep]
+        self.phrase_ids = array.array(
+            'l', [self.phrase_ids[index] for index in keep])
+        self.counts = array.array(
+            'q', [self.counts[index] for index in keep])
+        self.prefix_sums = {}
+
+    def sums(self, context: str, prefix: str) -> Dict[int, int]:
+        '''Sum the counts of the phrases over all rows of the context
+        with input phrases starting with prefix
+
+        :return: Maps phrase ids to the sums. The returned dictionary
+                 must not be changed by the caller.
+        '''
+        search = context + prefix
+        sums = self.prefix_sums.get(search)
+        if sums is not None:
+            return sums
+        sums = {}
+        keys = self.keys
+        phrase_ids = self.phrase_ids
+        counts = self.counts
+        for index in range(bisect.bisect_left(keys, search), len(keys)):
+            if not keys[index].startswith(search):
+                break
+            phrase_id = phrase_ids[index]
+            sums[phrase_id] = sums.get(phrase_id, 0) + counts[index]
+        if len(prefix) <= self.PREFIX_SUMS_MAX_LENGTH:
+            self.prefix_sums[search] = sums
+        return sums
+
+class NgramModel:
+    '''In-memory mirror of the n-gram counts in the user database
+
+    Answers the same questions as the queries in
+    TabSqliteDb.select_words() and
+    TabSqliteDb.select_words_empty_input() without going through
+    sqlite. The database stays the durable store, TabSqliteDb
+    applies every change it makes to the phrases table to this
+    model as well, or reloads it after bulk changes.
+
+    The phrases are stored only once and referred to by their ids
+    in the rows of the unigram, bigram and trigram counts. The
+    trigram rows have the same key as the rows in the database, a
+    row with user_freq 0 still counts as present, exactly like in
+    the database.
+    '''
+    def __init__(self) -> None:
+        self._phrases: List[str] = []
+        self._phrase_ids: Dict[str, int] = {}
+        self._unigrams = _PrefixCounts()
+        self._bigrams = _PrefixCounts()
+        self._trigrams = _PrefixCounts()
+
+    def __len__(self) -> int:
+        return len(self._trigrams)
+
+    @staticmethod
+    def _bigram_context(p_phrase: str) -> str:
+        return p_phrase + '\0'
+
+    @staticmethod
+    def _trigram_context(p_phrase: str, pp_phrase: str) -> str:
+        return p_phrase + '\0' + pp_phrase + '\0'
+
+    def _phrase_id(self, phrase: str) -> int:
+        phrase_id = self._phrase_ids.get(phrase)
+        if phrase_id is None:
+            phrase_id = self._phrase_ids[phrase] = len(self._phrases)
+            self._phrases.append(phrase)
+        return phrase_id
+
+    def load(self,
+             rows: List[Tuple[str, str, str, str, int]]) -> None:
+        '''Replace the contents of the model
+
+        :param rows: Rows of (input_phrase, phrase, p_phrase,
+                     pp_phrase, user_freq) from the phrases table
+        '''
+        self._phrases = []
+        self._phrase_ids = {}
+        unigrams: Dict[Tuple[str, int], int] = {}
+        bigrams: Dict[Tuple[str, int], int] = {}
+        trigrams: Dict[Tuple[str, int], int] = {}
+        # Same keys as _bigram_context() and _trigram_context() make
+        # them, written out because this loop runs for every row:
+        for (input_phrase, phrase, p_phrase, pp_phrase, user_freq) in rows:
+            phrase_id = self._phrase_id(phrase)
+            key = (input_phrase, phrase_id)
+            unigrams[key] = unigrams.get(key, 0) + user_freq
+            key = (p_phrase + '\0' + input_phrase, phrase_id)
+            bigrams[key] = bigrams.get(key, 0) + user_freq
+            key = (p_phrase + '\0' + pp_phrase + '\0' + input_phrase,
+                   phrase_id)
+            trigrams[key] = trigrams.get(key, 0) + user_freq
+        self._unigrams.load(unigrams)
+        self._bigrams.load(bigrams)
+        self._trigrams.load(trigrams)
+
+    def _add(self,
+             input_phrase: str,
+             phrase: str,
+             p_phrase: str,
+             pp_phrase: str,
+             user_freq: int) -> None:
+        phrase_id = self._phrase_id(phrase)
+        self._unigrams.add(input_phrase, phrase_id, user_freq)
+        self._bigrams.add(
+            self._bigram_context(p_phrase) + input_phrase,
+            phrase_id, user_freq)
+        self._trigrams.add(
+            self._trigram_context(p_phrase, pp_phrase) + input_phrase,
+            phrase_id, user_freq)
+
+    def _find(self,
+              input_phrase: str,
+              phrase: str,
+              p_phrase: str,
+              pp_phrase: str) -> int:
+        '''Returns the index of the trigram row, -1 if there is none'''
+        phrase_id = self._phrase_ids.get(phrase)
+        if phrase_id is None:
+            return -1
+        return self._trigrams.find(
+            self._trigram_context(p_phrase, pp_phrase) + input_phrase,
+            phrase_id)
+
+    def update_frequency(
+            self,
+            input_phrase: str,
+            phrase: str,
+            p_phrase: str,
+            pp_phrase: str,
+            user_freq_increment: int) -> None:
+        '''Increase the user frequency of a row, add it if it is new'''
+        self._add(input_phrase, phrase, p_phrase, pp_phrase,
+                  user_freq_increment)
+
+    def set_frequency(
+            self,
+            input_phrase: str,
+            phrase: str,
+            p_phrase: str,
+            pp_phrase: str,
+            user_freq: int) -> None:
+        '''Set the user frequency of a row, add it if it is new'''
+        index = self._find(input_phrase, phrase, p_phrase, pp_phrase)
+        old_user_freq = self._trigrams.counts[index] if index >= 0 else 0
+        self._add(input_phrase, phrase, p_phrase, pp_phrase,
+                  user_freq - old_user_freq)
+
+    def contains(
+            self,
+            input_phrase: str,
+            phrase: str,
+            p_phrase: str,
+            pp_phrase: str) -> bool:
+        '''Whether a row with this key exists'''
+        return self._find(input_phrase, phrase, p_phrase, pp_phrase) >= 0
+
+    def remove_phrase(self, input_phrase: str, phrase: str) -> None:
+        '''Remove all rows of phrase for input_phrase
+
+        If input_phrase is '', remove all rows of phrase no matter
+        for what input phrase, like TabSqliteDb.remove_phrase().
+        '''
+        phrase_id = self._phrase_ids.get(phrase)
+        if phrase_id is None:
+            return
+        for prefix_counts in (self._unigrams, self._bigrams, self._trigrams):
+            prefix_counts.remove(phrase_id, input_phrase)
+
+    def ngram_counts(
+            self,
+            input_phrase: str,
+            p_phrase: str,
+            pp_phrase: str,
+    ) -> List[Tuple[str, int, Optional[int], Optional[int]]]:
+        '''Get the unigram, bigram and trigram counts of all phrases
+        completing input_phrase
+
+        :return: Rows of (phrase, unigram count, bigram count,
+                 trigram count) like the query in
+                 TabSqliteDb.select_words() returns them. The bigram
+                 and trigram counts are None if no row of the
+                 phrase matches the context.
+        '''
+        unigrams = self._unigrams.sums('', input_phrase)
+        if not unigrams:
+            return []
+        bigrams = self._bigrams.sums(
+            self._bigram_context(p_phrase), input_phrase)
+        trigrams = self._trigrams.sums(
+            self._trigram_context(p_phrase, pp_phrase), input_phrase)
+        phrases = self._phrases
+        return [(phrases[phrase_id], user_freq,
+                 bigrams.get(phrase_id), trigrams.get(phrase_id))
+                for phrase_id, user_freq in unigrams.items()]
+
+    def context_counts(
+            self, p_phrase: str, pp_phrase: str) -> List[Tuple[str, int]]:
+        '''Get the counts of all phrases which occurred after the context
+
+        :return: Rows of (phrase, count) like the query in
+                 TabSqliteDb.select_words_empty_input() returns them.
+        '''
+        phrases = self._phrases
+        return [(phrases[phrase_id], count)
+                for phrase_id, count in self._trigrams.sums(
+                        self._trigram_context(p_phrase, pp_phrase),
+                        '').items()]
+
+def _synchronized(method: Callable[..., Any]) -> Callable[..., Any]:
+    '''Decorator holding the lock of the TabSqliteDb while a method runs
+
+    The engine computes candidates in a worker thread while the main
+    thread records the committed phrases, both use the same sqlite
+    connection, the pending updates, and the n-gram model.
+    '''
+    @functools.wraps(method)
+    def wrapper(self: 'TabSqliteDb', *args: Any, **kwargs: Any) -> Any:
+        with self._lock:
+            return method(self, *args, **kwargs)
+    return wrapper
 
 class DatabaseConnectionError(Exception):
     '''Custom exception for database connection failures'''
@@ -56,9 +481,28 @@ class TabSqliteDb:
 
     It is a database where the phrases learned from the user are stored.
     user_freq >= 1: The number of times the user has used this phrase
+
+    If write_behind is True, check_phrase_and_update_frequency()
+    does not write to the database but only collects the frequency
+    increments in memory. select_words(), select_words_empty_input()
+    and phrase_exists() take these pending updates into account
+    as if they had been written already. flush_pending_updates()
+    writes them all in a single transaction, the engine calls it
+    from a timer, on focus out and when it is destroyed.
+
+    If ngram_model is True, the n-gram counts of the phrases table
+    are loaded into an NgramModel once and select_words() and
+    select_words_empty_input() use that instead of querying sqlite.
+    When another connection changed the database, for example the
+    setup tool deleting the learned data or learning from a file,
+    the model is loaded again before it is used.
     '''
     # pylint: enable=line-too-long
-    def __init__(self, user_db_file: str = 'user.db') -> None:
+    def __init__(
+            self,
+            user_db_file: str = 'user.db',
+            write_behind: bool = False,
+            ngram_model: bool = False) -> None:
         global DEBUG_LEVEL # pylint: disable=global-statement
         try:
             DEBUG_LEVEL = int(str(os.getenv('IBUS_TYPING_BOOSTER_DEBUG_LEVEL')))
@@ -88,6 +532,20 @@ class TabSqliteDb:
             'timestamp']
 
         self._old_phrases: List[Tuple[str, str, int]] = []
+        self._upgrade_database = False
+        # Serializes the use of the connection, the pending updates,
+        # and the n-gram model between threads, see _synchronized():
+        self._lock = threading.RLock()
+        self._write_behind = write_behind
+        # Maps (input_phrase, phrase, p_phrase, pp_phrase) to
+        # (user_freq_increment, timestamp) of updates not yet written:
+        self._pending_updates: Dict[
+            Tuple[str, str, str, str], Tuple[int, float]] = {}
+        self._last_checkpoint_time = time.time()
+        self._ngram_model: Optional[NgramModel] = None
+        # “PRAGMA data_version” when the model was loaded, it changes
+        # when another connection commits a change to the database:
+        self._ngram_model_data_version = 0
 
         self.hunspell_obj = hunspell_suggest.Hunspell(())
 
@@ -95,11 +553,73 @@ class TabSqliteDb:
         self._check_database_readability()
 
         self.database = self.sqlite3_connect_database_legacy(self.user_db_file)
+        if self._upgrade_database and not self._upgrade_database_schema():
+            self._old_phrases = self._extract_user_phrases()
+            self.database.close()
+            self._rename_incompatible_or_broken_database()
         self.create_tables()
         self._restore_old_phrases()
 
         self.create_indexes()
         self.generate_userdb_desc()
+        if ngram_model:
+            self._ngram_model = NgramModel()
+            self._reload_ngram_model()
+
+    @_synchronized
+    def _reload_ngram_model(self) -> None:
+        '''Load the n-gram model again from the database
+
+        The pending updates are not in the database yet, they are
+        applied to the model after loading.
+        '''
+        if self._ngram_model is None:
+            return
+        time_start = time.time()
+        rows: List[Tuple[str, str, str, str, int]] = []
+        try:
+            self._ngram_model_data_version = self._data_version()
+            rows = self.database.execute(
+                'SELECT input_phrase, phrase, p_phrase, pp_phrase, user_freq '
+                'FROM user_db.phrases;').fetchall()
+        except Exception as error: # pylint: disable=broad-except
+            LOGGER.exception(
+                'Unexpected error loading the n-gram model: %s: %s',
+                error.__class__.__name__, error)
+        self._ngram_model.load(rows)
+        for ((input_phrase, phrase, p_phrase, pp_phrase),
+             (user_freq_increment, _timestamp)) in self._pending_updates.items():
+            self._ngram_model.update_frequency(
+                input_phrase, phrase, p_phrase, pp_phrase, user_freq_increment)
+        LOGGER.info('Loaded n-gram model with %s rows in %s seconds.',
+                    len(self._ngram_model), time.time() - time_start)
+
+    def _data_version(self) -> int:
+        '''Returns the data version of the user database
+
+        It changes when a different connection, in this or in another
+        process, commits a change to the database.
+        '''
+        return int(self.database.execute(
+            'PRAGMA user_db.data_version;').fetchone()[0])
+
+    def _current_ngram_model(self) -> Optional[NgramModel]:
+        '''Returns the n-gram model, reloaded first if the database
+        was changed by a different connection
+        '''
+        if self._ngram_model is None:
+            return None
+        try:
+            data_version = self._data_version()
+        except sqlite3.Error as error:
+            LOGGER.exception(
+                'Database error getting the data version: %s: %s',
+                error.__class__.__name__, error)
+            return self._ngram_model
+        if data_version != self._ngram_model_data_version:
+            LOGGER.info('User database changed by a different connection.')
+            self._reload_ngram_model()
+        return self._ngram_model
 
     @contextmanager
     def transaction(
@@ -118,8 +638,11 @@ class TabSqliteDb:
             self.database.commit()
             if checkpoint:
                 # self.database.execute('PRAGMA wal_checkpoint;')
-                # more aggressive with TRUNCATE:
-                self.database.execute('PRAGMA wal_checkpoint(TRUNCATE);')
+                # more aggressive with TRUNCATE. Only for user_db,
+                # checkpointing “main”, which is the same file, would
+                # change the data version of user_db as if a different
+                # connection changed it, see _current_ngram_model():
+                self.database.execute('PRAGMA user_db.wal_checkpoint(TRUNCATE);')
         except sqlite3.Error as error:
             LOGGER.exception('Transaction failed, rolling back: %s: %s',
                              error.__class__.__name__, error)
@@ -143,16 +666,20 @@ class TabSqliteDb:
         # dictionary has less then 6000 pages. 20000 pages
         # should be enough to cache the complete database
         # in most cases.
+        #
+        # “auto_vacuum” has to be set before “journal_mode = WAL”
+        # writes the header of a new database file, afterwards it
+        # only takes effect after the next VACUUM.
         database_connection.executescript('''
         PRAGMA encoding = "UTF-8";
         PRAGMA case_sensitive_like = true;
         PRAGMA page_size = 4096;
+        PRAGMA auto_vacuum = INCREMENTAL;
         PRAGMA cache_size = 20000;
         PRAGMA temp_store = MEMORY;
         PRAGMA journal_mode = WAL;
         PRAGMA journal_size_limit = 1000000;
         PRAGMA synchronous = NORMAL;
-        PRAGMA auto_vacuum = FULL;
         PRAGMA busy_timeout = 5000;
         ''')
         # Pragmas autocommit, so a database_connection.commit()
@@ -196,7 +723,10 @@ class TabSqliteDb:
         '''For long-lived connections (manual close)'''
         LOGGER.info('Connect to the database %s.', db_file)
         try:
-            database_connection = sqlite3.connect(db_file)
+            # The connection is shared with the thread computing
+            # candidates, TabSqliteDb serializes its use with a lock:
+            database_connection = sqlite3.connect(
+                db_file, check_same_thread=False)
             cls._setup_database_connection(database_connection, db_file)
             return database_connection
         except sqlite3.Error as error:
@@ -257,10 +787,19 @@ class TabSqliteDb:
             desc = self.get_database_desc(self.user_db_file)
             if (desc
                 and
-                desc['version'] == USER_DATABASE_VERSION
+                desc['version'] in ((USER_DATABASE_VERSION,)
+                                    + UPGRADABLE_USER_DATABASE_VERSIONS)
                 and
                 self.get_number_of_columns_of_phrase_table(self.user_db_file)
                 == len(self._phrase_table_column_names)):
+                if desc['version'] != USER_DATABASE_VERSION:
+                    LOGGER.info(
+                        'Database %s has version %s and will be upgraded '
+                        'to version %s.',
+                        self.user_db_file, desc['version'],
+                        USER_DATABASE_VERSION)
+                    self._upgrade_database = True
+                    return
                 LOGGER.info(
                     'Compatible database %s found.', self.user_db_file)
                 return
@@ -292,6 +831,65 @@ class TabSqliteDb:
                 'Unexpected error checking database compatibility: %s: %s',
                 error.__class__.__name__, error)
 
+    def _upgrade_database_schema(self) -> bool:
+        '''Upgrade a database with an older, compatible schema in place
+
+        Version 0.66 added a UNIQUE index on (input_phrase, p_phrase,
+        pp_phrase, phrase). Older versions could contain duplicate
+        rows for the same key which would make creating that index
+        fail. Merge them into the row with the smallest id, summing
+        up user_freq and keeping the newest timestamp. The new indexes
+        are created by create_indexes() and the new version is stored
+        by generate_userdb_desc() afterwards.
+
+        :return: True if successful, False on failure
+        '''
+        LOGGER.info('Upgrading database schema ...')
+        time_start = time.time()
+        sqlstr = '''
+        UPDATE user_db.phrases SET
+        user_freq = (
+            SELECT sum(duplicates.user_freq) FROM user_db.phrases AS duplicates
+            WHERE duplicates.input_phrase IS phrases.input_phrase
+            AND duplicates.p_phrase IS phrases.p_phrase
+            AND duplicates.pp_phrase IS phrases.pp_phrase
+            AND duplicates.phrase IS phrases.phrase),
+        timestamp = (
+            SELECT max(duplicates.timestamp) FROM user_db.phrases AS duplicates
+            WHERE duplicates.input_phrase IS phrases.input_phrase
+            AND duplicates.p_phrase IS phrases.p_phrase
+            AND duplicates.pp_phrase IS phrases.pp_phrase
+            AND duplicates.phrase IS phrases.phrase)
+        WHERE id IN (
+            SELECT min(id) FROM user_db.phrases
+            GROUP BY input_phrase, p_phrase, pp_phrase, phrase
+            HAVING count(*) > 1);
+        '''
+        delete_sqlstr = '''
+        DELETE FROM user_db.phrases WHERE id NOT IN (
+            SELECT min(id) FROM user_db.phrases
+            GROUP BY input_phrase, p_phrase, pp_phrase, phrase);
+        '''
+        try:
+            with self.transaction():
+                self.database.execute(sqlstr)
+                number_of_duplicates = self.database.execute(
+                    delete_sqlstr).rowcount
+            LOGGER.info(
+                'Database schema upgraded, %s duplicate rows merged, '
+                'took %s seconds.',
+                number_of_duplicates, time.time() - time_start)
+            return True
+        except sqlite3.Error as error:
+            LOGGER.exception(
+                'Database error upgrading database schema: %s: %s',
+                error.__class__.__name__, error)
+        except Exception as error: # pylint: disable=broad-except
+            LOGGER.exception(
+                'Unexpected error upgrading database schema: %s: %s',
+                error.__class__.__name__, error)
+        return False
+
     def _check_database_readability(self) -> bool:
         '''Check whether all rows from the phrases table of the
         database are readable
@@ -345,6 +943,7 @@ class TabSqliteDb:
         self.database = self.__class__.sqlite3_connect_database_legacy(
             self.user_db_file)
 
+    @_synchronized
     def update_phrase(
             self,
             input_phrase: str = '',
@@ -381,6 +980,11 @@ class TabSqliteDb:
         try:
             with self.transaction():
                 self.database.execute(sqlstr, sqlargs)
+            if (self._ngram_model is not None
+                and self._ngram_model.contains(
+                    input_phrase, phrase, p_phrase, pp_phrase)):
+                self._ngram_model.set_frequency(
+                    input_phrase, phrase, p_phrase, pp_phrase, user_freq)
             return True
         except sqlite3.Error as error:
             LOGGER.exception(
@@ -392,14 +996,17 @@ class TabSqliteDb:
                 error.__class__.__name__, error)
         return False
 
+    @_synchronized
     def sync_usrdb(self) -> None:
         '''Trigger a checkpoint operation.'''
+        self.flush_pending_updates()
         LOGGER.info('commit and execute checkpoint ...')
         try:
             self.database.commit()
             # self.database.execute('PRAGMA wal_checkpoint;')
             # more aggressive with TRUNCATE:
-            self.database.execute('PRAGMA wal_checkpoint(TRUNCATE);')
+            self.database.execute('PRAGMA user_db.wal_checkpoint(TRUNCATE);')
+            self._last_checkpoint_time = time.time()
             LOGGER.info('commit and execute checkpoint done.')
         except sqlite3.OperationalError as error:
             LOGGER.exception(
@@ -436,6 +1043,7 @@ class TabSqliteDb:
                 error.__class__.__name__, error)
         return False
 
+    @_synchronized
     def add_phrase(
             self,
             input_phrase: str = '',
@@ -457,25 +1065,13 @@ class TabSqliteDb:
             itb_util.NORMALIZATION_FORM_INTERNAL, phrase)
         p_phrase = itb_util.remove_accents(p_phrase.lower())
         pp_phrase = itb_util.remove_accents(pp_phrase.lower())
-        select_sqlstr = '''
-        SELECT * FROM user_db.phrases
-        WHERE input_phrase = :input_phrase
-        AND phrase = :phrase AND p_phrase = :p_phrase AND pp_phrase = :pp_phrase
-        '''
-        select_sqlargs = {
-            'input_phrase': input_phrase,
-            'phrase': phrase,
-            'p_phrase': p_phrase,
-            'pp_phrase': pp_phrase}
-        if self.database.execute(select_sqlstr, select_sqlargs).fetchall():
-            # there is already such a phrase, i.e. add_phrase was called
-            # in error, do nothing to avoid duplicate entries.
-            return True
-
+        # If there is already such a phrase, i.e. add_phrase was
+        # called in error, do nothing to avoid duplicate entries:
         insert_sqlstr = '''
         INSERT INTO user_db.phrases
         (input_phrase, phrase, p_phrase, pp_phrase, user_freq, timestamp)
         VALUES (:input_phrase, :phrase, :p_phrase, :pp_phrase, :user_freq, :timestamp)
+        ON CONFLICT (input_phrase, p_phrase, pp_phrase, phrase) DO NOTHING
         '''
         insert_sqlargs = {'input_phrase': input_phrase,
                           'phrase': phrase,
@@ -488,7 +1084,10 @@ class TabSqliteDb:
             LOGGER.debug('insert_sqlargs=%s', insert_sqlargs)
         try:
             with self.transaction():
-                self.database.execute(insert_sqlstr, insert_sqlargs)
+                cursor = self.database.execute(insert_sqlstr, insert_sqlargs)
+            if self._ngram_model is not None and cursor.rowcount > 0:
+                self._ngram_model.update_frequency(
+                    input_phrase, phrase, p_phrase, pp_phrase, user_freq)
             return True
         except sqlite3.Error as error:
             LOGGER.exception(
@@ -505,9 +1104,29 @@ class TabSqliteDb:
 
         :return: True if indexes were created, False on error
         '''
-        sqlstr = '''
-        CREATE INDEX IF NOT EXISTS user_db.phrases_index_p ON phrases
-        (input_phrase, id ASC);
+        # The UNIQUE index is the conflict target of the UPSERTs and
+        # also serves the input_phrase range scans of select_words().
+        # A separate covering index which appends user_freq to the
+        # same columns (sqlite has no INCLUDE clause) would save
+        # looking up user_freq in the table for each row found, but
+        # it would double the size of the biggest index and the
+        # work of every write. select_words() only uses that query
+        # when there is no n-gram model in memory. An older
+        # version created such an index, drop it.
+        #
+        # The partial index for the shortcuts is only used by queries
+        # which contain the same literal “user_freq >= ...”
+        # condition, a bound parameter does not work there.
+        sqlstr = f'''
+        DROP INDEX IF EXISTS user_db.phrases_index_p;
+        DROP INDEX IF EXISTS user_db.phrases_index_covering;
+        CREATE UNIQUE INDEX IF NOT EXISTS user_db.phrases_index_unique
+        ON phrases (input_phrase, p_phrase, pp_phrase, phrase);
+        CREATE INDEX IF NOT EXISTS user_db.phrases_index_context
+        ON phrases (p_phrase, pp_phrase, phrase, user_freq);
+        CREATE INDEX IF NOT EXISTS user_db.phrases_index_shortcuts
+        ON phrases (input_phrase, phrase)
+        WHERE user_freq >= {itb_util.SHORTCUT_USER_FREQ:d};
         CREATE INDEX IF NOT EXISTS user_db.phrases_index_i ON phrases
         (phrase)
         '''
@@ -527,6 +1146,7 @@ class TabSqliteDb:
                 error.__class__.__name__, error)
         return False
 
+    @_synchronized
     def select_shortcuts(
             self,
             input_phrase: str) -> List[itb_util.PredictionCandidate]:
@@ -536,11 +1156,13 @@ class TabSqliteDb:
         if DEBUG_LEVEL > 1:
             LOGGER.debug('input_phrase=%s', input_phrase)
         phrase_frequencies: Dict[str, float] = {}
-        sqlargs = {'input_phrase': input_phrase + '%',
-                   'user_freq': itb_util.SHORTCUT_USER_FREQ}
+        sqlargs = {
+            'input_phrase_lower': input_phrase,
+            'input_phrase_upper': self._prefix_upper_bound(input_phrase)}
         sqlstr = ('SELECT phrase, sum(user_freq) FROM user_db.phrases '
-                  'WHERE input_phrase LIKE :input_phrase '
-                  'AND user_freq >= :user_freq '
+                  'WHERE input_phrase >= :input_phrase_lower '
+                  'AND input_phrase < :input_phrase_upper '
+                  f'AND user_freq >= {itb_util.SHORTCUT_USER_FREQ:d} '
                   'GROUP BY phrase;')
         results_shortcuts: List[Tuple[str, int]] = []
         try:
@@ -559,6 +1181,7 @@ class TabSqliteDb:
                 'best_shortcut_candidates=%s', best_shortcut_candidates)
         return best_shortcut_candidates
 
+    @_synchronized
     def select_words_empty_input(
             self,
             p_phrase: str,
@@ -584,6 +1207,11 @@ class TabSqliteDb:
                   'WHERE p_phrase = :p_phrase '
                   'AND pp_phrase = :pp_phrase GROUP BY phrase;')
         results = None
+        ngram_model = self._current_ngram_model()
+        if ngram_model is not None:
+            # The model already contains the pending updates:
+            return self._empty_input_candidates(
+                ngram_model.context_counts(p_phrase, pp_phrase))
         try:
             results = self.database.execute(sqlstr, sqlargs).fetchall()
         except Exception as error: # pylint: disable=broad-except
@@ -592,21 +1220,31 @@ class TabSqliteDb:
                 'with given context from user_db: %s: %s',
                 error.__class__.__name__, error)
             results = None
+        if self._pending_updates:
+            frequencies = dict(results or [])
+            for ((_input_phrase, phrase, pending_p_phrase, pending_pp_phrase),
+                 (user_freq_increment, _timestamp)) in (
+                     self._pending_updates.items()):
+                if (pending_p_phrase == p_phrase
+                        and pending_pp_phrase == pp_phrase):
+                    frequencies[phrase] = (
+                        frequencies.get(phrase, 0) + user_freq_increment)
+            results = list(frequencies.items())
+        return self._empty_input_candidates(results or [])
+
+    @staticmethod
+    def _empty_input_candidates(
+            results: List[Tuple[str, int]]
+    ) -> List[itb_util.PredictionCandidate]:
+        '''Normalize the counts of the phrases found after a context
+
+        :param results: Rows of (phrase, count)
+        '''
+        phrase_frequencies: Dict[str, float] = {}
         if not results:
             return itb_util.best_candidates(phrase_frequencies)
-        sqlstr = (
-            'SELECT sum(user_freq) FROM user_db.phrases '
-            'WHERE p_phrase = :p_phrase AND pp_phrase = :pp_phrase;')
-        count_pp_phrase_p_phrase = 0
-        try:
-            count_pp_phrase_p_phrase = self.database.execute(
-                sqlstr, sqlargs).fetchall()[0][0]
-        except Exception as error: # pylint: disable=broad-except
-            LOGGER.exception(
-                'Unexpected error getting total count for empty input '
-                'with given context from user_db: %s: %s',
-                 error.__class__.__name__, error)
-            count_pp_phrase_p_phrase = 0
+        # The sum over all phrases is the total count of the context:
+        count_pp_phrase_p_phrase = sum(result[1] for result in results)
         if not count_pp_phrase_p_phrase:
             return itb_util.best_candidates(phrase_frequencies)
         for result in results:
@@ -618,17 +1256,24 @@ class TabSqliteDb:
                 itb_util.best_candidates(phrase_frequencies))
         return itb_util.best_candidates(phrase_frequencies)
 
+    @itb_util.trace_stage('select_words')
     def select_words(
             self,
             input_phrase: str,
             p_phrase: str = '',
-            pp_phrase: str = '') -> List[itb_util.PredictionCandidate]:
+            pp_phrase: str = '',
+            native_suggestions: bool = True
+    ) -> List[itb_util.PredictionCandidate]:
         '''
         Get phrases from database completing input_phrase.
 
         Returns a list of matches where each match is a tuple in the
         form of (phrase, user_freq), i.e. returns something like
         [(phrase, user_freq), ...]
+
+        If native_suggestions is False, the possibly slow spellchecking
+        suggestions of enchant, pyhunspell or voikko are left out
+        (see Hunspell.suggest()).
         '''
         if DEBUG_LEVEL > 1:
             LOGGER.debug(
@@ -649,7 +1294,8 @@ class TabSqliteDb:
             # Trying to complete an input_phrase which contains spaces
             # will never work and spell checking suggestions by hunspell
             # for input which contains spaces is almost always nonsense.
-            phrase_frequencies.update(self.hunspell_obj.suggest(input_phrase))
+            phrase_frequencies.update(self.hunspell_obj.suggest(
+                input_phrase, native_suggestions=native_suggestions))
         if DEBUG_LEVEL > 1:
             LOGGER.debug(
                 'hunspell: best_candidates=%s',
@@ -667,59 +1313,71 @@ class TabSqliteDb:
         #
         # {'code': 0, 'communicability': 0, 'cold': 0, 'colour': 0}
 
-        # To quote a string to be used as a parameter when assembling
-        # an sqlite statement with Python string operations, remove
-        # all NUL characters, replace ' with '' and wrap the whole
-        # string in single quotes. Assembling sqlite statements using
-        # parameters containing user input with python string operations
-        # is not recommended because of the risk of SQL injection attacks
-        # if the quoting is not done the right way. So it is better to use
-        # the parameter substitution of the sqlite3 python interface.
-        # But unfortunately that does not work when creating views,
-        # (“OperationalError: parameters are not allowed in views”).
-        sql_escaped_input_phrase = input_phrase.replace(
-            '\x00', '').replace("'", "''")
-        self.database.execute('DROP VIEW IF EXISTS like_input_phrase_view;')
-        sqlstr = f'''
-        CREATE TEMPORARY VIEW IF NOT EXISTS like_input_phrase_view AS
-        SELECT * FROM user_db.phrases
-        WHERE input_phrase LIKE '{sql_escaped_input_phrase}%'
+        # Get the “unigram”, “bigram” and “trigram” counts of all
+        # phrases completing the input with a single query.
+        #
+        # Example: Let’s assume the user typed “co”, the context is
+        # p_phrase = “green”, pp_phrase = “nice” and user_db contains
+        #
+        #     1|colou|colour|green|nice|1
+        #     2|col|colour|yellow|ugly|2
+        #     3|co|colour|green|awesome|1
+        #     4|co|cold|||1
+        #     5|conspirac|conspiracy|||5
+        #     6|conspi|conspiracy|||1
+        #     7|c|conspiracy|||1
+        #
+        # Then the result returned by .fetchall() is:
+        #
+        # [('colour', 4, 2, 1), ('cold', 1, None, None),
+        #  ('conspiracy', 6, None, None)]
+        #
+        # (“c|conspiracy|1” is not selected because it doesn’t
+        # match the user input “co”, the range predicate on
+        # input_phrase filters it out. The range predicate is
+        # equivalent to “input_phrase LIKE 'co%'” with
+        # case_sensitive_like but, unlike LIKE, it can use the index
+        # on input_phrase and it needs no escaping of “%” and “_”
+        # in the input. The sums of the bigram and trigram columns
+        # are NULL if no row of a phrase matches the context.)
+        sqlstr = '''
+        SELECT phrase,
+        sum(user_freq),
+        sum(CASE WHEN p_phrase = :p_phrase THEN user_freq END),
+        sum(CASE WHEN p_phrase = :p_phrase AND pp_phrase = :pp_phrase
+            THEN user_freq END)
+        FROM user_db.phrases
+        WHERE input_phrase >= :input_phrase_lower
+        AND input_phrase < :input_phrase_upper
+        GROUP BY phrase
         ;'''
-        try:
-            self.database.execute(sqlstr)
-        except Exception as error: # pylint: disable=broad-except
-            LOGGER.exception(
-                'Unexpected error in creating database view: %s: %s',
-                error.__class__.__name__, error)
-        sqlargs = {'p_phrase': p_phrase, 'pp_phrase': pp_phrase}
-        sqlstr = (
-            'SELECT phrase, sum(user_freq) FROM like_input_phrase_view '
-            'GROUP BY phrase;')
-        try:
-            # Get “unigram” data from user_db.
-            #
-            # Example: Let’s assume the user typed “co” and user_db contains
-            #
-            #     1|colou|colour|green|nice|1
-            #     2|col|colour|yellow|ugly|2
-            #     3|co|colour|green|awesome|1
-            #     4|co|cold|||1
-            #     5|conspirac|conspiracy|||5
-            #     6|conspi|conspiracy|||1
-            #     7|c|conspiracy|||1
-            results_uni = self.database.execute(sqlstr, sqlargs).fetchall()
-            # Then the result returned by .fetchall() is:
-            #
-            # [('colour', 4), ('cold', 1), ('conspiracy', 6)]
-            #
-            # (“c|conspiracy|1” is not selected because it doesn’t
-            # match the user input “LIKE co%”! I.e. this is filtered
-            # out by the VIEW created above already)
-        except Exception as error: # pylint: disable=broad-except
-            LOGGER.exception(
-                'Unexpected error getting “unigram” data from user_db: %s: %s',
-                error.__class__.__name__, error)
-        if not results_uni:
+        sqlargs = {
+            'input_phrase_lower': input_phrase,
+            'input_phrase_upper': self._prefix_upper_bound(input_phrase),
+            'p_phrase': p_phrase,
+            'pp_phrase': pp_phrase}
+        results: List[Tuple[str, int, Optional[int], Optional[int]]] = []
+        # Hold the lock only here and not while getting the hunspell
+        # suggestions above which may be slow:
+        with self._lock:
+            ngram_model = self._current_ngram_model()
+            if ngram_model is not None:
+                # The model already contains the pending updates:
+                results = ngram_model.ngram_counts(
+                    input_phrase, p_phrase, pp_phrase)
+            else:
+                try:
+                    results = self.database.execute(
+                        sqlstr, sqlargs).fetchall()
+                except Exception as error: # pylint: disable=broad-except
+                    LOGGER.exception(
+                        'Unexpected error getting n-gram data '
+                        'from user_db: %s: %s',
+                        error.__class__.__name__, error)
+            if self._pending_updates and ngram_model is None:
+                results = self._merge_pending_updates(
+                    results, input_phrase, p_phrase, pp_phrase)
+        if not results:
             # If no unigrams matched, bigrams and trigrams cannot
             # match either. We can stop here and return what we got
             # from hunspell.
@@ -728,20 +1386,13 @@ class TabSqliteDb:
         # (which is 11 in the above example), which gives us the
         # normalized result:
         # [('colour', 4/11), ('cold', 1/11), ('conspiracy', 6/11)]
-        sqlstr = 'SELECT sum(user_freq) FROM like_input_phrase_view;'
-        try:
-            count = self.database.execute(sqlstr, sqlargs).fetchall()[0][0]
-        except Exception as error: # pylint: disable=broad-except
-            LOGGER.exception(
-                'Unexpected error getting total unigram count '
-                'from user_db: %s: %s',
-                 error.__class__.__name__, error)
+        count = sum(result[1] for result in results)
         # Updating the phrase_frequency dictionary with the normalized
         # results gives: {'conspiracy': 6/11, 'code': 0,
         # 'communicability': 0, 'cold': 1/11, 'colour': 4/11}
-        for result_uni in results_uni:
+        for result in results:
             phrase_frequencies.update(
-                [(result_uni[0], result_uni[1]/float(count))])
+                [(result[0], result[1]/float(count))])
         if DEBUG_LEVEL > 1:
             LOGGER.debug(
                 'Unigram best_candidates=%s',
@@ -750,31 +1401,14 @@ class TabSqliteDb:
             # If no context for bigram matching is available, return
             # what we have so far:
             return itb_util.best_candidates(phrase_frequencies, title=title_case)
-        sqlstr = (
-            'SELECT phrase, sum(user_freq) FROM like_input_phrase_view '
-            'WHERE p_phrase = :p_phrase GROUP BY phrase;')
-        try:
-            results_bi = self.database.execute(sqlstr, sqlargs).fetchall()
-        except Exception as error: # pylint: disable=broad-except
-            LOGGER.exception(
-                'Unexpected error getting “bigram” data '
-                'from user_db: %s: %s',
-                error.__class__.__name__, error)
+        results_bi = [
+            (result[0], result[2]) for result in results
+            if result[2] is not None]
         if not results_bi:
             # If no bigram could be matched, return what we have so far:
             return itb_util.best_candidates(phrase_frequencies, title=title_case)
         # get the total count of p_phrase to normalize the bigram frequencies:
-        sqlstr = (
-            'SELECT sum(user_freq) FROM like_input_phrase_view '
-            'WHERE p_phrase = :p_phrase;')
-        try:
-            count_p_phrase = self.database.execute(
-                sqlstr, sqlargs).fetchall()[0][0]
-        except Exception as error: # pylint: disable=broad-except
-            LOGGER.exception(
-                'Unexpected error getting total bigram count '
-                'from user_db: %s: %s',
-                 error.__class__.__name__, error)
+        count_p_phrase = sum(result_bi[1] for result_bi in results_bi)
         # Update the phrase frequency dictionary by using a linear
         # combination of the unigram and the bigram results, giving
         # both the weight of 0.5:
@@ -791,32 +1425,16 @@ class TabSqliteDb:
             # If no context for trigram matching is available, return
             # what we have so far:
             return itb_util.best_candidates(phrase_frequencies, title=title_case)
-        sqlstr = ('SELECT phrase, sum(user_freq) FROM like_input_phrase_view '
-                  'WHERE p_phrase = :p_phrase '
-                  'AND pp_phrase = :pp_phrase GROUP BY phrase;')
-        try:
-            results_tri = self.database.execute(sqlstr, sqlargs).fetchall()
-        except Exception as error: # pylint: disable=broad-except
-            LOGGER.exception(
-                'Unexpected error getting “trigram” data '
-                'from user_db: %s: %s',
-                 error.__class__.__name__, error)
+        results_tri = [
+            (result[0], result[3]) for result in results
+            if result[3] is not None]
         if not results_tri:
             # if no trigram could be matched, return what we have so far:
             return itb_util.best_candidates(phrase_frequencies, title=title_case)
         # get the total count of (p_phrase, pp_phrase) pairs to
         # normalize the bigram frequencies:
-        sqlstr = (
-            'SELECT sum(user_freq) FROM like_input_phrase_view '
-            'WHERE p_phrase = :p_phrase AND pp_phrase = :pp_phrase;')
-        try:
-            count_pp_phrase_p_phrase = self.database.execute(
-                sqlstr, sqlargs).fetchall()[0][0]
-        except Exception as error: # pylint: disable=broad-except
-            LOGGER.exception(
-                'Unexpected error getting total trigram count '
-                'from user_db: %s: %s',
-                 error.__class__.__name__, error)
+        count_pp_phrase_p_phrase = sum(
+            result_tri[1] for result_tri in results_tri)
         # Update the phrase frequency dictionary by using a linear
         # combination of the bigram and the trigram results, giving
         # both the weight of 0.5 (that makes the total weights: 0.25 *
@@ -833,6 +1451,72 @@ class TabSqliteDb:
                 itb_util.best_candidates(phrase_frequencies, title=title_case))
         return itb_util.best_candidates(phrase_frequencies, title=title_case)
 
+    def _merge_pending_updates(
+            self,
+            results: List[Tuple[str, int, Optional[int], Optional[int]]],
+            input_phrase: str,
+            p_phrase: str,
+            pp_phrase: str,
+    ) -> List[Tuple[str, int, Optional[int], Optional[int]]]:
+        '''Add the pending frequency updates to the n-gram query results
+
+        :param results: Rows of (phrase, unigram sum, bigram sum,
+                        trigram sum) as returned by the query in
+                        select_words()
+        :param input_phrase: The input phrase the phrases complete
+        :param p_phrase: The previous phrase of the context
+        :param pp_phrase: The phrase before the previous phrase
+        :return: The rows the query would have returned if the
+                 pending updates had been written to the database
+        '''
+        sums: Dict[str, List[Optional[int]]] = {
+            result[0]: list(result[1:]) for result in results}
+        for ((pending_input_phrase, phrase, pending_p_phrase,
+              pending_pp_phrase),
+             (user_freq_increment, _timestamp)) in self._pending_updates.items():
+            if not pending_input_phrase.startswith(input_phrase):
+                continue
+            if phrase not in sums:
+                sums[phrase] = [0, None, None]
+            phrase_sums = sums[phrase]
+            phrase_sums[0] = (phrase_sums[0] or 0) + user_freq_increment
+            if pending_p_phrase == p_phrase:
+                phrase_sums[1] = (phrase_sums[1] or 0) + user_freq_increment
+                if pending_pp_phrase == pp_phrase:
+                    phrase_sums[2] = (
+                        (phrase_sums[2] or 0) + user_freq_increment)
+        return [(phrase, int(phrase_sums[0] or 0), phrase_sums[1], phrase_sums[2])
+                for phrase, phrase_sums in sums.items()]
+
+    @staticmethod
+    def _prefix_upper_bound(prefix: str) -> str:
+        '''Returns the smallest string greater than all strings
+        starting with prefix
+
+        Then “column >= prefix AND column < upper_bound” selects
+        exactly the values of column starting with prefix, just like
+        “column LIKE 'prefix%'” with case_sensitive_like, but it
+        can use an index on column and the prefix needs no escaping.
+
+        The default BINARY collation of sqlite compares the UTF-8
+        encoded strings with memcmp() which orders them by code
+        point. Therefore incrementing the last character which is
+        not the maximum code point gives the upper bound.
+        '''
+        chars = list(prefix)
+        while chars:
+            code_point = ord(chars.pop()) + 1
+            if 0xD800 <= code_point <= 0xDFFF:
+                # Surrogates cannot be encoded in UTF-8, skip them:
+                code_point = 0xE000
+            if code_point <= 0x10FFFF:
+                return ''.join(chars) + chr(code_point)
+        # Only possible if prefix is empty or consists only of
+        # U+10FFFF characters: there is no upper bound then, return
+        # something greater than any string without a U+10FFFF
+        # character (NUL characters are never in an input phrase):
+        return prefix + '\U0010FFFF'
+
     def generate_userdb_desc(self) -> bool:
         '''
         Add a description table to the user database
@@ -848,8 +1532,10 @@ class TabSqliteDb:
                     CREATE TABLE IF NOT EXISTS user_db.desc
                     (name PRIMARY KEY, value)
                 ''')
+                # Replace the version, a database upgraded by
+                # _upgrade_database_schema() has an older one:
                 self.database.execute(
-                    'INSERT OR IGNORE INTO user_db.desc  VALUES (?, ?);',
+                    'INSERT OR REPLACE INTO user_db.desc  VALUES (?, ?);',
                     ('version', USER_DATABASE_VERSION))
                 self.database.execute('''
                     INSERT OR IGNORE INTO user_db.desc
@@ -940,13 +1626,15 @@ CREATE TABLE phrases (id INTEGER PRIMARY KEY, input_phrase TEXT, phrase TEXT, p_
                  error.__class__.__name__, error)
         return 0
 
+    @_synchronized
     def list_user_shortcuts(self) -> List[Tuple[str, str]]:
         '''Returns a list of user defined shortcuts from the user database.
         '''
-        sqlstr = '''
-        SELECT input_phrase, phrase FROM user_db.phrases WHERE user_freq >= :freq
+        sqlstr = f'''
+        SELECT input_phrase, phrase FROM user_db.phrases
+        WHERE user_freq >= {itb_util.SHORTCUT_USER_FREQ:d}
         ;'''
-        sqlargs = {'freq': itb_util.SHORTCUT_USER_FREQ}
+        sqlargs: Dict[str, Any] = {}
         if DEBUG_LEVEL > 1:
             LOGGER.debug('sqlstr=%s', sqlstr)
             LOGGER.debug('sqlargs=%s', sqlargs)
@@ -955,6 +1643,7 @@ CREATE TABLE phrases (id INTEGER PRIMARY KEY, input_phrase TEXT, phrase TEXT, p_
             LOGGER.debug('result=%s', result)
         return result
 
+    @_synchronized
     def define_user_shortcut(
             self,
             input_phrase: str = '',
@@ -987,10 +1676,16 @@ CREATE TABLE phrases (id INTEGER PRIMARY KEY, input_phrase TEXT, phrase TEXT, p_
         sqlstr = (
             'INSERT INTO user_db.phrases '
             '(input_phrase, phrase, p_phrase, pp_phrase, user_freq, timestamp)'
-            'VALUES (:input_phrase, :phrase, "", "", :user_freq, :timestamp);')
+            'VALUES (:input_phrase, :phrase, "", "", :user_freq, :timestamp) '
+            'ON CONFLICT (input_phrase, p_phrase, pp_phrase, phrase) '
+            'DO UPDATE SET user_freq = excluded.user_freq, '
+            'timestamp = excluded.timestamp;')
         try:
             with self.transaction():
                 self.database.execute(sqlstr, sqlargs)
+            if self._ngram_model is not None:
+                self._ngram_model.set_frequency(
+                    input_phrase, phrase, '', '', user_freq)
             return True
         except sqlite3.Error as error:
             LOGGER.exception(
@@ -1002,6 +1697,7 @@ CREATE TABLE phrases (id INTEGER PRIMARY KEY, input_phrase TEXT, phrase TEXT, p_
                 error.__class__.__name__, error)
         return False
 
+    @_synchronized
     def check_shortcut_and_update_frequency(
             self,
             input_phrase: str = '',
@@ -1063,6 +1759,9 @@ CREATE TABLE phrases (id INTEGER PRIMARY KEY, input_phrase TEXT, phrase TEXT, p_
             try:
                 with self.transaction():
                     self.database.execute(sqlstr, sqlargs)
+                if self._ngram_model is not None:
+                    self._ngram_model.set_frequency(
+                        db_input_phrase, phrase, '', '', new_user_freq)
                 continue
             except sqlite3.Error as error:
                 LOGGER.exception(
@@ -1075,6 +1774,7 @@ CREATE TABLE phrases (id INTEGER PRIMARY KEY, input_phrase TEXT, phrase TEXT, p_
             return False
         return True
 
+    @_synchronized
     def check_phrase_and_update_frequency(
             self,
             input_phrase: str = '',
@@ -1112,25 +1812,40 @@ CREATE TABLE phrases (id INTEGER PRIMARY KEY, input_phrase TEXT, phrase TEXT, p_
         p_phrase = itb_util.remove_accents(p_phrase.lower())
         pp_phrase = itb_util.remove_accents(pp_phrase.lower())
         input_phrase = itb_util.remove_accents(input_phrase.lower())
+        if not input_phrase or not phrase:
+            return True # “Nothing” successfully updated
+        if self._write_behind:
+            key = (input_phrase, phrase, p_phrase, pp_phrase)
+            (pending_increment, _timestamp) = self._pending_updates.get(
+                key, (0, 0.0))
+            self._pending_updates[key] = (
+                pending_increment + user_freq_increment, time.time())
+            if self._ngram_model is not None:
+                self._ngram_model.update_frequency(
+                    input_phrase, phrase, p_phrase, pp_phrase,
+                    user_freq_increment)
+            return True
 
-        # There should never be more than 1 database row for the same
-        # input_phrase *and* phrase. So the following query on
-        # the database should match at most one database
-        # row and the length of the result array should be 0 or
-        # 1. So the “GROUP BY phrase” is actually redundant. It is
-        # only a safeguard for the case when duplicate rows have been
-        # added to the database accidentally (But in that case there
-        # is a bug somewhere else which should be fixed).
+        # The UNIQUE index on (input_phrase, p_phrase, pp_phrase,
+        # phrase) guarantees that there is at most one database row
+        # for this key. If there is one, increase its user frequency
+        # by user_freq_increment (1 by default), if not, add it as a
+        # new phrase with user_freq = user_freq_increment:
         sqlstr = '''
-        SELECT max(user_freq) FROM user_db.phrases
-        WHERE input_phrase = :input_phrase
-        AND phrase = :phrase AND p_phrase = :p_phrase AND pp_phrase = :pp_phrase
-        GROUP BY phrase
+        INSERT INTO user_db.phrases
+        (input_phrase, phrase, p_phrase, pp_phrase, user_freq, timestamp)
+        VALUES (:input_phrase, :phrase, :p_phrase, :pp_phrase,
+                :user_freq_increment, :timestamp)
+        ON CONFLICT (input_phrase, p_phrase, pp_phrase, phrase)
+        DO UPDATE SET user_freq = user_freq + excluded.user_freq,
+        timestamp = excluded.timestamp
         ;'''
         sqlargs = {'input_phrase': input_phrase,
                    'phrase': phrase,
                    'p_phrase': p_phrase,
-                   'pp_phrase': pp_phrase}
+                   'pp_phrase': pp_phrase,
+                   'user_freq_increment': user_freq_increment,
+                   'timestamp': time.time()}
         if DEBUG_LEVEL > 1:
             LOGGER.debug(
                 'TabSqliteDb.check_phrase_and_update_frequency() sqlstr=%s',
@@ -1138,29 +1853,83 @@ CREATE TABLE phrases (id INTEGER PRIMARY KEY, input_phrase TEXT, phrase TEXT, p_
             LOGGER.debug(
                 'TabSqliteDb.check_phrase_and_update_frequency() sqlargs=%s',
                 sqlargs)
-        result = self.database.execute(sqlstr, sqlargs).fetchall()
-        if DEBUG_LEVEL > 1:
-            LOGGER.debug(
-                'check_phrase_and_update_frequency() result=%s', result)
-        if result:
-            # A match was found in user_db, increase user frequency by
-            # user_freq_increment (1 by default)
-            return self.update_phrase(
-                input_phrase=input_phrase,
-                phrase=phrase,
-                p_phrase=p_phrase,
-                pp_phrase=pp_phrase,
-                user_freq=result[0][0]+user_freq_increment)
-        # The phrase was not found in user_db.
-        # Add it as a new phrase, i.e. with user_freq = user_freq_increment
-        # (1 by default):
-        return self.add_phrase(
-            input_phrase=input_phrase,
-            phrase=phrase,
-            p_phrase=p_phrase,
-            pp_phrase=pp_phrase,
-            user_freq=user_freq_increment)
+        try:
+            with self.transaction():
+                self.database.execute(sqlstr, sqlargs)
+            if self._ngram_model is not None:
+                self._ngram_model.update_frequency(
+                    input_phrase, phrase, p_phrase, pp_phrase,
+                    user_freq_increment)
+            return True
+        except sqlite3.Error as error:
+            LOGGER.exception(
+                'Database error updating phrase frequency: %s: %s',
+                error.__class__.__name__, error)
+        except Exception as error: # pylint: disable=broad-except
+            LOGGER.exception(
+                'Unexpected error updating phrase frequency: %s: %s',
+                error.__class__.__name__, error)
+        return False
 
+    @_synchronized
+    def flush_pending_updates(self, checkpoint: bool = False) -> bool:
+        '''Write the pending frequency updates to the database
+
+        :param checkpoint: If True, always do a wal_checkpoint after
+                           writing, if False only if the last one was
+                           at least CHECKPOINT_INTERVAL_SECONDS ago.
+        :return: True if successful, False on failure. On failure
+                 the updates stay pending and are tried again on
+                 the next flush.
+        '''
+        if not self._pending_updates:
+            return True
+        time_start = time.time()
+        checkpoint = checkpoint or (
+            time_start - self._last_checkpoint_time
+            >= CHECKPOINT_INTERVAL_SECONDS)
+        sqlstr = '''
+        INSERT INTO user_db.phrases
+        (input_phrase, phrase, p_phrase, pp_phrase, user_freq, timestamp)
+        VALUES (:input_phrase, :phrase, :p_phrase, :pp_phrase,
+                :user_freq_increment, :timestamp)
+        ON CONFLICT (input_phrase, p_phrase, pp_phrase, phrase)
+        DO UPDATE SET user_freq = user_freq + excluded.user_freq,
+        timestamp = excluded.timestamp
+        ;'''
+        sqlargs = [
+            {'input_phrase': input_phrase,
+             'phrase': phrase,
+             'p_phrase': p_phrase,
+             'pp_phrase': pp_phrase,
+             'user_freq_increment': user_freq_increment,
+             'timestamp': timestamp}
+            for ((input_phrase, phrase, p_phrase, pp_phrase),
+                 (user_freq_increment, timestamp))
+            in self._pending_updates.items()]
+        try:
+            with self.transaction(checkpoint=checkpoint):
+                self.database.executemany(sqlstr, sqlargs)
+            self._pending_updates = {}
+            if checkpoint:
+                self._last_checkpoint_time = time.time()
+            if DEBUG_LEVEL > 0:
+                LOGGER.debug(
+                    'Flushed %s pending updates, checkpoint=%s, '
+                    'took %s seconds.',
+                    len(sqlargs), checkpoint, time.time() - time_start)
+            return True
+        except sqlite3.Error as error:
+            LOGGER.exception(
+                'Database error flushing pending updates: %s: %s',
+                error.__class__.__name__, error)
+        except Exception as error: # pylint: disable=broad-except
+            LOGGER.exception(
+                'Unexpected error flushing pending updates: %s: %s',
+                error.__class__.__name__, error)
+        return False
+
+    @_synchronized
     def phrase_exists(self, phrase: str) -> int:
         '''
         Checks if an entry for phrase already exists in the user database
@@ -1176,12 +1945,19 @@ CREATE TABLE phrases (id INTEGER PRIMARY KEY, input_phrase TEXT, phrase TEXT, p_
             return 0
         phrase = unicodedata.normalize(
             itb_util.NORMALIZATION_FORM_INTERNAL, phrase)
+        pending_user_freq = sum(
+            user_freq_increment
+            for ((_input_phrase, pending_phrase, _p_phrase, _pp_phrase),
+                 (user_freq_increment, _timestamp))
+            in self._pending_updates.items()
+            if pending_phrase == phrase)
         try:
             row = self.database.execute(
                 'SELECT sum(user_freq) FROM user_db.phrases WHERE phrase = ?',
                 (phrase,)
             ).fetchone()
-            return int(row[0]) if row and row[0] is not None else 0
+            return pending_user_freq + (
+                int(row[0]) if row and row[0] is not None else 0)
         except sqlite3.Error as error:
             LOGGER.exception(
                 'Error checking whether phrase exists: %s: %s',
@@ -1192,6 +1968,7 @@ CREATE TABLE phrases (id INTEGER PRIMARY KEY, input_phrase TEXT, phrase TEXT, p_
                  error.__class__.__name__, error)
         return 0
 
+    @_synchronized
     def remove_phrase(
             self,
             input_phrase: str = '',
@@ -1207,6 +1984,7 @@ CREATE TABLE phrases (id INTEGER PRIMARY KEY, input_phrase TEXT, phrase TEXT, p_
             return False
         if DEBUG_LEVEL > 1:
             LOGGER.debug('phrase=%r', phrase)
+        self.flush_pending_updates()
         phrase = unicodedata.normalize(
             itb_util.NORMALIZATION_FORM_INTERNAL, phrase)
         if input_phrase:
@@ -1221,6 +1999,8 @@ CREATE TABLE phrases (id INTEGER PRIMARY KEY, input_phrase TEXT, phrase TEXT, p_
         try:
             with self.transaction():
                 self.database.execute(delete_sqlstr, delete_sqlargs)
+            if self._ngram_model is not None:
+                self._ngram_model.remove_phrase(input_phrase, phrase)
             return True
         except sqlite3.Error as error:
             LOGGER.exception(
@@ -1265,110 +2045,253 @@ CREATE TABLE phrases (id INTEGER PRIMARY KEY, input_phrase TEXT, phrase TEXT, p_
                  error.__class__.__name__, error)
         return []
 
-    def read_training_data_from_file(self, filename: str) -> bool:
+    @_synchronized
+    def read_training_data_from_file(
+            self,
+            filename: str,
+            progress_callback: Optional[Callable[[float], None]] = None,
+            cancel_event: Optional[threading.Event] = None,
+            processes: int = 0) -> bool:
         '''
         Read data to train the prediction from a text file.
 
-        :param filename: Full path of the text file to read.
+        The file is read in chunks which are tokenized in worker
+        processes. The n-gram counts are added to the existing rows of
+        the database in batched transactions whenever
+        TRAINING_MAX_NGRAMS distinct n-grams have been counted. The
+        position in the file is stored with each batch, if training is
+        cancelled or interrupted, training from the same, unchanged
+        file again continues from there.
+
+        :param filename: Full path of the text file to read,
+                         may be compressed with gzip.
+        :param progress_callback: Called with the fraction of the file
+                                  done (0.0 to 1.0) after each chunk
+        :param cancel_event: When set, stop after the current chunk
+        :param processes: Number of worker processes, 0 means as many
+                          as there are CPUs. Small files are always
+                          read without worker processes.
+        :return: True if the whole file has been read successfully,
+                 False on error or if cancelled.
         '''
         if not os.path.isfile(filename):
             filename += '.gz'
             if not os.path.isfile(filename):
                 return False
-        open_function: Callable[[Any], Any] = open
-        if filename.endswith('.gz'):
-            open_function = gzip.open
-        rows = self.database.execute(
-            'SELECT input_phrase, phrase, p_phrase, pp_phrase, '
-            + 'user_freq, timestamp FROM phrases;').fetchall()
-        rows = sorted(rows, key = lambda x: (float(x[5]))) # sort by timestamp
-        time_min = time.time()
-        time_max = time.time()
-        if rows:
-            time_min = rows[0][5]
-            time_max = rows[-1][5]
-        # timestamp for added entries (timestamp of existing entries is kept):
-        time_new = time_min + 0.20 * (time_max - time_min)
-        LOGGER.info('Minimum timestamp in the database=%s',
-                    time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(time_min)))
-        LOGGER.info('Maximum timestamp in the database=%s',
-                    time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(time_max)))
-        LOGGER.info('New timestamp in the database=%s',
-                    time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(time_new)))
-        p_token = ''
-        pp_token = ''
-        database_dict: Dict[Tuple[str, str, str, str], Dict[str, Any]] = {}
-        for row in rows:
-            # itb_util.remove_accents() returns in NORMALIZATION_FORM_INTERNAL.
-            # row[1] (“phrase”) should already be in NORMALIZATION_FORM_INTERNAL
-            # but better convert it again here just to make sure.
-            input_phrase = itb_util.remove_accents(row[0].lower())
-            phrase = unicodedata.normalize(
-                itb_util.NORMALIZATION_FORM_INTERNAL, row[1])
-            p_phrase = itb_util.remove_accents(row[2].lower())
-            pp_phrase = itb_util.remove_accents(row[3].lower())
-            database_dict.update([((row[0], row[1], row[2], row[3]),
-                                   {'input_phrase': input_phrase,
-                                    'phrase': phrase,
-                                    'p_phrase': p_phrase,
-                                    'pp_phrase': pp_phrase,
-                                    'user_freq': row[4],
-                                    'timestamp': row[5]}
-                                  )])
-        lines = []
+        filename = os.path.abspath(filename)
+        self.flush_pending_updates()
         try:
-            with open_function( # type: ignore
-                    filename, mode='rt', encoding='UTF-8') as file_handle:
-                lines = [
-                    unicodedata.normalize(
-                        itb_util.NORMALIZATION_FORM_INTERNAL, line)
-                    for line in file_handle.readlines()]
+            file_stat = os.stat(filename)
+            progress = self._training_progress(filename, file_stat)
+            (offset, p_token, pp_token, time_new) = progress
+            LOGGER.info('Training from %r, starting at offset %s',
+                        filename, offset)
+            LOGGER.info(
+                'New timestamp in the database=%s',
+                time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(time_new)))
+            with open(filename, mode='rb') as raw_file:
+                file_handle: Any = raw_file
+                if filename.endswith('.gz'):
+                    file_handle = gzip.GzipFile(fileobj=raw_file, mode='rb')
+                file_handle.seek(offset)
+                processes = processes or os.cpu_count() or 1
+                executor: Optional[concurrent.futures.ProcessPoolExecutor] = (
+                    concurrent.futures.ProcessPoolExecutor(
+                        max_workers=processes,
+                        # Forking a process with other threads, like
+                        # the setup tool training in a thread while
+                        # GLib runs, may deadlock the children on
+                        # locks copied while held:
+                        mp_context=multiprocessing.get_context('spawn'),
+                        # Control+C is for the main process, which
+                        # cancels and stores the progress:
+                        initializer=signal.signal,
+                        initargs=(signal.SIGINT, signal.SIG_IGN))
+                    if (processes > 1
+                        and file_stat.st_size > 2 * TRAINING_CHUNK_BYTES)
+                    else None)
+                try:
+                    return self._train_from_chunks(
+                        filename, file_stat, (file_handle, raw_file),
+                        (offset, p_token, pp_token, time_new),
+                        (executor, 2 * processes),
+                        progress_callback, cancel_event)
+                finally:
+                    if executor is not None:
+                        # The chunks read ahead but not needed anymore
+                        # have been cancelled by _train_from_chunks():
+                        executor.shutdown(wait=True)
         except Exception as error: # pylint: disable=broad-except
             LOGGER.exception(
-                'Unexpected error reading training data from file: %s: %s',
+                'Unexpected error training from file: %s: %s',
                  error.__class__.__name__, error)
             return False
-        for line in lines:
-            for token in itb_util.tokenize(line):
-                key = (itb_util.remove_accents(token.lower()),
-                       token,
-                       itb_util.remove_accents(p_token.lower()),
-                       itb_util.remove_accents(pp_token.lower()))
-                if key in database_dict:
-                    database_dict[key]['user_freq'] += 1
-                else:
-                    database_dict[key] = {
-                        'input_phrase': itb_util.remove_accents(token.lower()),
-                        'phrase': token,
-                        'p_phrase': itb_util.remove_accents(p_token.lower()),
-                        'pp_phrase': itb_util.remove_accents(pp_token.lower()),
-                        'user_freq': 1,
-                        'timestamp': time_new}
-                pp_token = p_token
-                p_token = token
-        sqlargs = []
-        for key, value in database_dict.items():
-            sqlargs.append(value)
-        sqlstr = '''
-        INSERT INTO user_db.phrases (input_phrase, phrase, p_phrase, pp_phrase, user_freq, timestamp)
-        VALUES (:input_phrase, :phrase, :p_phrase, :pp_phrase, :user_freq, :timestamp)
-        ;'''
+        finally:
+            self._reload_ngram_model()
+
+    def _training_progress(
+            self,
+            filename: str,
+            file_stat: os.stat_result) -> Tuple[int, str, str, float]:
+        '''Returns where training from a file continues
+
+        :return: (offset, p_token, pp_token, time_new), the offset in
+                 the uncompressed file, the last two tokens before it
+                 and the timestamp for the rows added from this file.
+                 (0, '', '', timestamp) if training has to start
+                 from the beginning.
+        '''
+        with self.transaction(checkpoint=False):
+            self.database.execute(
+                'CREATE TABLE IF NOT EXISTS user_db.training_progress '
+                '(filename TEXT PRIMARY KEY, size INTEGER, mtime REAL, '
+                'offset INTEGER, p_token TEXT, pp_token TEXT, '
+                'time_new REAL);')
+        row = self.database.execute(
+            'SELECT size, mtime, offset, p_token, pp_token, time_new '
+            'FROM user_db.training_progress WHERE filename = ?;',
+            (filename,)).fetchone()
+        if (row
+            and row[0] == file_stat.st_size
+            and row[1] == file_stat.st_mtime):
+            return (row[2], row[3], row[4], row[5])
+        (time_min, time_max) = self.database.execute(
+            'SELECT min(timestamp), max(timestamp) '
+            'FROM user_db.phrases;').fetchone()
+        if time_min is None:
+            time_min = time_max = time.time()
+        # timestamp for added entries (timestamp of existing entries is kept):
+        time_new = time_min + 0.20 * (time_max - time_min)
+        return (0, '', '', time_new)
+
+    def _train_from_chunks(
+            self,
+            filename: str,
+            file_stat: os.stat_result,
+            file_handles: Tuple[Any, Any],
+            progress: Tuple[int, str, str, float],
+            workers: Tuple[
+                Optional[concurrent.futures.ProcessPoolExecutor], int],
+            progress_callback: Optional[Callable[[float], None]],
+            cancel_event: Optional[threading.Event]) -> bool:
+        '''Counts the n-grams of the chunks of a file and adds them
+
+        See read_training_data_from_file().
+
+        :param file_handles: The file handle to read the (uncompressed)
+                             text from and the underlying raw file
+                             to measure the progress
+        :param workers: The executor of the worker processes or None
+                        to tokenize in this process and how many
+                        chunks may be read ahead
+        '''
+        (file_handle, raw_file) = file_handles
+        (executor, max_pending) = workers
+        (offset, p_token, pp_token, time_new) = progress
+        context = [token for token in (pp_token, p_token) if token]
+        counts: Dict[Tuple[str, str, str, str], int] = {}
+        # (future or result, offset after the chunk), in file order.
+        # Only max_pending chunks are read ahead to keep the
+        # memory bounded:
+        pending: Deque[Tuple[Any, int]] = collections.deque()
+        end_of_file = False
         try:
-            self.database.execute('DELETE FROM phrases;')
-            # Without the following commit, the
-            # self.database.executemany() fails with
-            # “OperationalError: database is locked”.
-            self.database.commit()
-            self.database.executemany(sqlstr, sqlargs)
-            self.database.commit()
-            self.database.execute('PRAGMA wal_checkpoint;')
-        except Exception as error: # pylint: disable=broad-except
-            LOGGER.exception(
-                'Unexpected error writing training data to database: %s: %s',
-                 error.__class__.__name__, error)
-            return False
+            while pending or not end_of_file:
+                while not end_of_file and len(pending) < max_pending:
+                    chunk = b''.join(
+                        file_handle.readlines(TRAINING_CHUNK_BYTES))
+                    if not chunk:
+                        end_of_file = True
+                        break
+                    chunk_end = file_handle.tell()
+                    if executor is not None:
+                        pending.append(
+                            (executor.submit(_count_training_ngrams, chunk),
+                             chunk_end))
+                    else:
+                        pending.append(
+                            (_count_training_ngrams(chunk), chunk_end))
+                if not pending:
+                    break
+                (result, offset) = pending.popleft()
+                if executor is not None:
+                    result = result.result()
+                (chunk_counts, first_tokens, last_tokens) = result
+                _fix_chunk_context(chunk_counts, first_tokens, context)
+                context = (context + last_tokens)[-2:]
+                for key, count in chunk_counts.items():
+                    counts[key] = counts.get(key, 0) + count
+                cancelled = cancel_event is not None and cancel_event.is_set()
+                if len(counts) >= TRAINING_MAX_NGRAMS or cancelled:
+                    self._add_training_counts(
+                        counts, time_new,
+                        (filename, file_stat, offset, context))
+                    counts = {}
+                if progress_callback is not None:
+                    progress_callback(
+                        min(raw_file.tell() / max(file_stat.st_size, 1), 1.0))
+                if cancelled:
+                    LOGGER.info('Training from %r cancelled at offset %s',
+                                filename, offset)
+                    return False
+        finally:
+            if executor is not None:
+                # Do not wait for chunks read ahead which are not
+                # needed anymore when cancelled or on errors:
+                for (future, _offset) in pending:
+                    future.cancel()
+        self._add_training_counts(counts, time_new, (filename, None, 0, []))
+        self.database.execute('PRAGMA user_db.wal_checkpoint;')
+        LOGGER.info('Training from %r finished', filename)
         return True
 
+    def _add_training_counts(
+            self,
+            counts: Dict[Tuple[str, str, str, str], int],
+            time_new: float,
+            progress: Tuple[str, Optional[os.stat_result], int, List[str]]
+    ) -> None:
+        '''Adds n-gram counts and the training progress in one transaction
+
+        :param counts: The counts of the (input_phrase, phrase,
+                       p_phrase, pp_phrase) keys
+        :param time_new: The timestamp for new rows, existing rows
+                         keep theirs
+        :param progress: (filename, file_stat, offset, context), if
+                         file_stat is None, training from the file
+                         is complete and its progress is removed.
+        '''
+        (filename, file_stat, offset, context) = progress
+        sqlstr = '''
+        INSERT INTO user_db.phrases
+        (input_phrase, phrase, p_phrase, pp_phrase, user_freq, timestamp)
+        VALUES (?, ?, ?, ?, ?, ?)
+        ON CONFLICT (input_phrase, p_phrase, pp_phrase, phrase)
+        DO UPDATE SET user_freq = user_freq + excluded.user_freq
+        ;'''
+        with self.transaction(checkpoint=False):
+            self.database.executemany(
+                sqlstr,
+                ((input_phrase, phrase, p_phrase, pp_phrase, count, time_new)
+                 for ((input_phrase, phrase, p_phrase, pp_phrase), count)
+                 in counts.items()))
+            if file_stat is None:
+                self.database.execute(
+                    'DELETE FROM user_db.training_progress '
+                    'WHERE filename = ?;', (filename,))
+            else:
+                (pp_token, p_token) = ([''] * 2 + context)[-2:]
+                self.database.execute(
+                    'INSERT OR REPLACE INTO user_db.training_progress '
+                    '(filename, size, mtime, offset, p_token, pp_token, '
+                    'time_new) VALUES (?, ?, ?, ?, ?, ?, ?);',
+                    (filename, file_stat.st_size, file_stat.st_mtime,
+                     offset, p_token, pp_token, time_new))
+        if DEBUG_LEVEL > 0:
+            LOGGER.debug('Added %s n-gram counts, offset %s',
+                         len(counts), offset)
+
+    @_synchronized
     def remove_all_phrases(self) -> bool:
         '''
         Remove all phrases from the database, i.e. delete all the
@@ -1376,9 +2299,11 @@ CREATE TABLE phrases (id INTEGER PRIMARY KEY, input_phrase TEXT, phrase TEXT, p_
 
         :return: True if successful, False on failure
         '''
+        self._pending_updates = {}
         try:
             with self.transaction():
                 self.database.execute('DELETE FROM phrases;')
+            self._reload_ngram_model()
             return True
         except sqlite3.Error as error:
             LOGGER.exception(
@@ -1390,12 +2315,14 @@ CREATE TABLE phrases (id INTEGER PRIMARY KEY, input_phrase TEXT, phrase TEXT, p_
                  error.__class__.__name__, error)
         return False
 
+    @_synchronized
     def dump_database(self) -> None:
         '''
         Dump the contents of the database to the log
 
         (For debugging)
         '''
+        self.flush_pending_updates()
         try:
             LOGGER.debug('SELECT * FROM desc;\n')
             for row in self.database.execute("SELECT * FROM desc;").fetchall():
@@ -1408,12 +2335,14 @@ CREATE TABLE phrases (id INTEGER PRIMARY KEY, input_phrase TEXT, phrase TEXT, p_
             LOGGER.exception('Unexpected error dumping database: %s: %s',
                               error.__class__.__name__, error)
 
+    @_synchronized
     def number_of_rows_in_database(self) -> int:
         '''
         Return the current number of rows in the database
 
         (For debugging)
         '''
+        self.flush_pending_updates()
         try:
             return len(self.database.execute(
                 "SELECT * FROM phrases;").fetchall())
@@ -1442,8 +2371,6 @@ CREATE TABLE phrases (id INTEGER PRIMARY KEY, input_phrase TEXT, phrase TEXT, p_
             return
         LOGGER.info('Database cleanup starting ...')
         time_now = time.time()
-        # id, input_phrase, phrase, p_phrase, pp_phrase, user_freq, timestamp
-        rows: List[Tuple[int, str, str, str, str, int, float]] = []
         database = None
         try:
             if thread:
@@ -1454,43 +2381,32 @@ CREATE TABLE phrases (id INTEGER PRIMARY KEY, input_phrase TEXT, phrase TEXT, p_
                     self.user_db_file)
             else:
                 database = self.database
-            rows = database.execute("SELECT * FROM phrases;").fetchall()
-            if not rows:
+            number_of_rows_before = database.execute(
+                'SELECT count(*) FROM phrases;').fetchone()[0]
+            if not number_of_rows_before:
                 return
-            rows = sorted(rows,
-                          key = lambda x: (
-                              x[5], # user_freq
-                              x[6], # timestamp
-                              x[0], # id
-                          ))
-            LOGGER.info('Total number of database rows to check=%s', len(rows))
-            index = len(rows)
-            max_rows = 50000
-            number_delete_above_max = 0
-            rows_kept: List[Tuple[int, str, str, str, str, int, float]] = []
-            for row in rows:
-                user_freq = row[5]
-                if (index > max_rows
-                    and user_freq < itb_util.SHORTCUT_USER_FREQ):
-                    LOGGER.info('1st pass: deleting %s %s',
-                                repr(row),
-                                time.strftime("%Y-%m-%d %H:%M:%S",
-                                              time.gmtime(row[6])))
-                    number_delete_above_max += 1
-                    sqlstr_delete = 'DELETE from phrases WHERE id = :id;'
-                    sqlargs_delete = {'id': row[0]}
-                    try:
-                        database.execute(sqlstr_delete, sqlargs_delete)
-                    except Exception as error: # pylint: disable=broad-except
-                        LOGGER.exception(
-                            '1st pass: exception deleting row '
-                            'from database: %s: %s',
-                             error.__class__.__name__, error)
-                else:
-                    rows_kept.append(row)
-                index -= 1
-            LOGGER.info('1st pass: Number of rows deleted above maximum size=%s',
-                        number_delete_above_max)
+            sqlargs = {'max_rows': CLEANUP_MAX_ROWS,
+                       'shortcut_user_freq': itb_util.SHORTCUT_USER_FREQ,
+                       # 0.1% of the maximum number of rows, rounded
+                       # up, are checked in the 2nd pass, see below:
+                       'index_decay': (
+                           CLEANUP_MAX_ROWS - -(-CLEANUP_MAX_ROWS // 1000)),
+                       'timestamp': time.time()}
+            # 1st pass: Delete the rows beyond the maximum number of
+            # rows, sorted by user_freq and then by timestamp. User
+            # defined shortcuts are never deleted.
+            time_start = time.time()
+            number_delete_above_max = database.execute('''
+            DELETE FROM phrases WHERE id IN (
+                SELECT id FROM (
+                    SELECT id, user_freq, row_number() OVER (
+                        ORDER BY user_freq DESC, timestamp DESC, id DESC
+                    ) AS row_rank
+                    FROM phrases)
+                WHERE row_rank > :max_rows
+                AND user_freq < :shortcut_user_freq)
+            ;''', sqlargs).rowcount
+            time_first_pass = time.time() - time_start
             # As the first pass above removes rows sorted by count and
             # then by timestamp, it will never remove rows with a higher
             # count even if they are extremely old. Therefore, a second
@@ -1498,6 +2414,7 @@ CREATE TABLE phrases (id INTEGER PRIMARY KEY, input_phrase TEXT, phrase TEXT, p_
             # eventually remove some rows which have not been used for a
             # long time as well, even if they have a higher count.
             # In this second pass, the 0.1% oldest rows are checked
+            # (0.1% of CLEANUP_MAX_ROWS rounded up, at least one row)
             # and:
             #
             # - if user_freq == 1 remove the row
@@ -1506,78 +2423,78 @@ CREATE TABLE phrases (id INTEGER PRIMARY KEY, input_phrase TEXT, phrase TEXT, p_
             # 0.1% is really not much but I want to be careful not to remove
             # too much when trying this out.
             #
-            # sort kept rows by timestamp only instead of user_freq and timestamp:
-            rows_kept = sorted(rows_kept,
-                               key = lambda x: (
-                                   x[6], # timestamp
-                                   x[0], # id
-                               ))
-            index = len(rows_kept)
-            LOGGER.info('1st pass: Number of rows kept=%s', index)
-            index_decay = int(max_rows * 0.999)
-            LOGGER.info('2nd pass: Index for decay=%s', index_decay)
-            number_of_rows_to_decay = 0
+            # The rows to check are those at or before the row at
+            # position index_decay + 1 when sorted by timestamp from
+            # newest to oldest. That boundary row is determined first,
+            # because the deletions and the timestamp updates of the
+            # decayed rows would change the positions of the rows:
+            time_start = time.time()
             number_of_rows_to_delete = 0
-            for row in rows_kept:
-                user_freq = row[5]
-                if (index > index_decay
-                    and user_freq < itb_util.SHORTCUT_USER_FREQ):
-                    if user_freq == 1:
-                        LOGGER.info('2nd pass: deleting %s %s',
-                                    repr(row),
-                                    time.strftime("%Y-%m-%d %H:%M:%S",
-                                                  time.gmtime(row[6])))
-                        number_of_rows_to_delete += 1
-                        sqlstr_delete = 'DELETE from phrases WHERE id = :id;'
-                        sqlargs_delete = {'id': row[0]}
-                        try:
-                            database.execute(sqlstr_delete, sqlargs_delete)
-                        except Exception as error: # pylint: disable=broad-except
-                            LOGGER.exception(
-                                '2nd pass: exception deleting row '
-                                'from database: %s: %s',
-                                 error.__class__.__name__, error)
-                    else:
-                        LOGGER.info('2nd pass: decaying %s %s',
-                                    repr(row),
-                                    time.strftime("%Y-%m-%d %H:%M:%S",
-                                                  time.gmtime(row[6])))
-                        number_of_rows_to_decay += 1
-                        sqlstr_update = '''
-                        UPDATE phrases
-                        SET user_freq = :user_freq, timestamp = :timestamp
-                        WHERE id = :id
-                        ;'''
-                        sqlargs_update = {'id': row[0],
-                                          'user_freq': int(user_freq/2),
-                                          'timestamp': time.time()}
-
-                        try:
-                            database.execute(sqlstr_update, sqlargs_update)
-                        except Exception as error: # pylint: disable=broad-except
-                            LOGGER.exception(
-                                '2nd pass: exception decaying row '
-                                'from database: %s: %s',
-                                 error.__class__.__name__, error)
-                index -= 1
-            LOGGER.info('Commit database and execute checkpoint ...')
+            number_of_rows_to_decay = 0
+            boundary = database.execute('''
+            SELECT timestamp, id FROM (
+                SELECT timestamp, id, row_number() OVER (
+                    ORDER BY timestamp DESC, id DESC
+                ) AS row_rank
+                FROM phrases)
+            WHERE row_rank = :index_decay + 1
+            ;''', sqlargs).fetchone()
+            if boundary:
+                sqlargs['boundary_timestamp'] = boundary[0]
+                sqlargs['boundary_id'] = boundary[1]
+                old_rows_condition = '''
+                (timestamp < :boundary_timestamp
+                 OR (timestamp = :boundary_timestamp AND id <= :boundary_id))
+                AND user_freq < :shortcut_user_freq'''
+                number_of_rows_to_delete = database.execute(
+                    'DELETE FROM phrases WHERE user_freq = 1 AND '
+                    + old_rows_condition + ';', sqlargs).rowcount
+                number_of_rows_to_decay = database.execute(
+                    'UPDATE phrases '
+                    'SET user_freq = user_freq / 2, timestamp = :timestamp '
+                    'WHERE user_freq != 1 AND '
+                    + old_rows_condition + ';', sqlargs).rowcount
+            time_second_pass = time.time() - time_start
+            time_start = time.time()
             database.commit()
             database.execute('PRAGMA wal_checkpoint;')
-            LOGGER.info('Rebuild database using VACUUM command ...')
-            database.execute('VACUUM;')
-            LOGGER.info('Number of database rows deleted=%s',
-                         number_delete_above_max + number_of_rows_to_delete)
-            LOGGER.info('Number of database rows decayed=%s',
-                        number_of_rows_to_decay)
-            LOGGER.info('Number of rows before cleanup=%s', len(rows))
-            LOGGER.info('Number of rows remaining=%s',
-                        len(rows_kept) - number_of_rows_to_delete)
-            LOGGER.info('Time for database cleanup=%s seconds',
-                        time.time() - time_now)
-            LOGGER.info('Database cleanup finished.')
+            time_commit = time.time() - time_start
+            time_start = time.time()
+            vacuumed_pages = self._vacuum(
+                database,
+                number_of_rows_before,
+                number_delete_above_max + number_of_rows_to_delete)
+            time_vacuum = time.time() - time_start
+            if not thread:
+                self._reload_ngram_model()
+            # Else the change by the connection of this thread is
+            # noticed by _current_ngram_model() which reloads the
+            # n-gram model when it is used next.
+            LOGGER.info(
+                'Database cleanup finished: rows before=%s, '
+                'deleted above maximum=%s, deleted old=%s, decayed=%s, '
+                'remaining=%s, pages freed=%s, '
+                'seconds: 1st pass=%.3f 2nd pass=%.3f commit=%.3f '
+                'vacuum=%.3f total=%.3f',
+                number_of_rows_before,
+                number_delete_above_max,
+                number_of_rows_to_delete,
+                number_of_rows_to_decay,
+                number_of_rows_before
+                - number_delete_above_max - number_of_rows_to_delete,
+                vacuumed_pages,
+                time_first_pass, time_second_pass, time_commit,
+                time_vacuum, time.time() - time_now)
         except Exception as error: # pylint: disable=broad-except
             LOGGER.exception('Exception when accessing database: %s: %s',
                               error.__class__.__name__, error)
+            if database:
+                try:
+                    database.rollback()
+                except sqlite3.Error as rollback_error:
+                    LOGGER.warning(
+                        'Failed to roll back database cleanup: %s',
+                        rollback_error)
             return
         finally:
             if thread and database:
@@ -1589,3 +2506,44 @@ CREATE TABLE phrases (id INTEGER PRIMARY KEY, input_phrase TEXT, phrase TEXT, p_
             elif not thread:
                 LOGGER.debug(
                     'Reused main thread database connection (not closing)')
+
+    @staticmethod
+    def _vacuum(
+            database: sqlite3.Connection,
+            number_of_rows_before: int,
+            number_of_rows_deleted: int) -> int:
+        '''Give unused space of the database back to the file system
+
+        A full VACUUM rebuilds the whole database file. That is only
+        worth it if a big part of the rows was deleted, or to switch
+        a database with “auto_vacuum = NONE” which has accumulated
+        free pages to incremental mode. Otherwise
+        “PRAGMA incremental_vacuum” just cuts the free pages from
+        the end of the file, which is cheap.
+
+        :param database: The database connection to use
+        :param number_of_rows_before: Number of rows before the cleanup
+        :param number_of_rows_deleted: Number of rows the cleanup deleted
+        :return: The number of pages the database file shrunk
+        '''
+        page_count = database.execute('PRAGMA page_count;').fetchone()[0]
+        freelist_count = database.execute(
+            'PRAGMA freelist_count;').fetchone()[0]
+        auto_vacuum = database.execute('PRAGMA auto_vacuum;').fetchone()[0]
+        LOGGER.info('Database pages=%s free pages=%s auto_vacuum=%s',
+                    page_count, freelist_count, auto_vacuum)
+        if (number_of_rows_deleted
+            >= VACUUM_MIN_DELETED_FRACTION * number_of_rows_before
+            or (auto_vacuum == 0 # NONE
+                and freelist_count >= VACUUM_MIN_FREE_PAGES)):
+            LOGGER.info('Rebuild database using VACUUM command ...')
+            database.execute('PRAGMA auto_vacuum = INCREMENTAL;')
+            database.execute('VACUUM;')
+        elif freelist_count >= VACUUM_MIN_FREE_PAGES:
+            database.execute('PRAGMA incremental_vacuum;').fetchall()
+        else:
+            return 0
+        # The file shrinks when the write ahead log is checkpointed:
+        database.execute('PRAGMA wal_checkpoint(TRUNCATE);')
+        return int(page_count
+                   - database.execute('PRAGMA page_count;').fetchone()[0])
@@ -0,0 +1,105 @@
+# vim:et sts=4 sw=4
+#
+# ibus-typing-booster - A completion input method for IBus
+#
+# Copyright (c) 2026 Mike FABIAN <mfabian@redhat.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>
+'''
+Utility to train the user database of Typing Booster from text files
+
+Does the same as the “Learn from text file” button of the setup tool
+but works for huge files as well. Interrupting it with Control+C
+keeps what has been learned so far, running it again with the same
+file continues where it stopped.
+'''
+
+from typing import Any
+import sys
+import time
+import signal
+import threading
+import argparse
+
+import tabsqlitedb
+
+def parse_args() -> Any:
+    '''
+    Parse the command line arguments.
+    '''
+    parser = argparse.ArgumentParser(
+        description='Tool for training the user database of Typing Booster '
+        'from text files')
+    parser.add_argument(
+        '-f', '--file',
+        dest='file',
+        type=str,
+        action='store',
+        default='~/.local/share/ibus-typing-booster/user.db',
+        help=('Full path of the database file to train, '
+              'default: "%(default)s"'))
+    parser.add_argument(
+        '-p', '--processes',
+        dest='processes',
+        type=int,
+        action='store',
+        default=0,
+        help=('Number of worker processes to tokenize the text, '
+              '0 means as many as there are CPUs. default: %(default)s'))
+    parser.add_argument(
+        '-q', '--quiet',
+        dest='quiet',
+        action='store_true',
+        default=False,
+        help=('Do not print the progress. default: %(default)s'))
+    parser.add_argument(
+        'training_files',
+        metavar='TEXT_FILE',
+        nargs='+',
+        help='Text files to learn from, may be compressed with gzip')
+    return parser.parse_args()
+
+_ARGS = parse_args()
+
+def print_progress(fraction: float) -> None:
+    '''Print the progress of the current file'''
+    print(f'\r{100 * fraction:5.1f}%', end='', file=sys.stderr, flush=True)
+
+def main() -> int:
+    '''Train from all files given on the command line'''
+    database = tabsqlitedb.TabSqliteDb(user_db_file=_ARGS.file)
+    cancel_event = threading.Event()
+    # Control+C stops after the current chunk, after writing what
+    # has been learned so far and where to continue:
+    signal.signal(signal.SIGINT, lambda _signum, _frame: cancel_event.set())
+    for training_file in _ARGS.training_files:
+        if not _ARGS.quiet:
+            print(f'{training_file}:', file=sys.stderr)
+        time_start = time.time()
+        success = database.read_training_data_from_file(
+            training_file,
+            progress_callback=None if _ARGS.quiet else print_progress,
+            cancel_event=cancel_event,
+            processes=_ARGS.processes)
+        if not _ARGS.quiet:
+            print(f' {time.time() - time_start:.1f} seconds', file=sys.stderr)
+        if not success:
+            print(f'Training from {training_file} failed or was interrupted, '
+                  'run again to continue.', file=sys.stderr)
+            return 1
+    database.database.close()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
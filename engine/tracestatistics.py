@@ -0,0 +1,116 @@
+# vim:et sts=4 sw=4
+#
+# ibus-typing-booster - A completion input method for IBus
+#
+# Copyright (c) 2026 Mike FABIAN <mfabian@redhat.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>
+'''
+Utility to print the latency percentiles per stage from a keystroke
+trace written by Typing Booster (see the “keystroketracing” and
+“keystroketracefile” settings)
+'''
+
+from typing import List
+from typing import Dict
+from typing import Any
+import os
+import sys
+import json
+import time
+import argparse
+
+import itb_util
+
+def parse_args() -> Any:
+    '''
+    Parse the command line arguments.
+    '''
+    parser = argparse.ArgumentParser(
+        description=('Tool for printing the latency percentiles '
+                     'of a keystroke trace of Typing Booster'))
+    parser.add_argument(
+        '-f', '--file',
+        dest='file',
+        type=str,
+        action='store',
+        # Same as the default of the “keystroketracefile” setting:
+        default='~/.local/share/ibus-typing-booster/keystroke-trace.jsonl',
+        help=('Full path of the trace file to inspect, '
+              'default: "%(default)s"'))
+    parser.add_argument(
+        '-l', '--last',
+        dest='last',
+        type=int,
+        action='store',
+        default=0,
+        help=('Use only the last N keystrokes of the trace, '
+              '0 means all. default: %(default)s'))
+    parser.add_argument(
+        '-j', '--json',
+        dest='json',
+        action='store_true',
+        default=False,
+        help=('Print the result as JSON instead of a table. '
+              'default: %(default)s'))
+    return parser.parse_args()
+
+_ARGS = parse_args()
+
+def read_records(trace_file: str, last: int = 0) -> List[Dict[str, Any]]:
+    '''Reads the records of a trace file, skipping damaged lines'''
+    records: List[Dict[str, Any]] = []
+    with open(os.path.expanduser(trace_file), encoding='UTF-8') as trace:
+        for line in trace:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # The last line may be incomplete if the engine
+                # was killed while writing it:
+                continue
+            if isinstance(record, dict):
+                records.append(record)
+    if last > 0:
+        records = records[-last:]
+    return records
+
+def print_percentiles(records: List[Dict[str, Any]]) -> None:
+    '''Print a table of the latency percentiles per stage'''
+    percentiles = itb_util.keystroke_trace_percentiles(records)
+    if records:
+        print(f'Keystrokes={len(records)} '
+              f'from {time.ctime(records[0].get("time", 0))} '
+              f'to {time.ctime(records[-1].get("time", 0))}')
+    print(f'{"stage":20} {"count":>7} {"p50 ms":>9} {"p95 ms":>9} '
+          f'{"p99 ms":>9} {"max ms":>9}')
+    stages = [name for name in itb_util.KEYSTROKE_TRACE_STAGES
+              if name in percentiles]
+    stages += sorted(set(percentiles) - set(stages))
+    for name in stages:
+        stage = percentiles[name]
+        print(f'{name:20} {stage["count"]:7} '
+              f'{stage["p50"]:9.2f} {stage["p95"]:9.2f} '
+              f'{stage["p99"]:9.2f} {stage["max"]:9.2f}')
+
+if __name__ == '__main__':
+    try:
+        RECORDS = read_records(_ARGS.file, last=_ARGS.last)
+    except OSError as error:
+        print(f'Cannot read {_ARGS.file}: {error}', file=sys.stderr)
+        sys.exit(1)
+    if _ARGS.json:
+        print(json.dumps(itb_util.keystroke_trace_percentiles(RECORDS),
+                         indent=4, sort_keys=True))
+    else:
+        print_percentiles(RECORDS)
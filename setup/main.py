@@ -37,6 +37,7 @@ import signal
 import argparse
 import locale
 import copy
+import threading
 import logging
 import logging.handlers
 from time import strftime
@@ -1064,6 +1065,94 @@ class SetupUI(Gtk.Window): # type: ignore
         self._options_grid.attach(
             self._debug_level_adjustment, 1, _options_grid_row, 1, 1)
 
+        self._cache_max_entries_label = Gtk.Label()
+        self._cache_max_entries_label.set_text(
+            # Translators: The maximum number of entries in each of
+            # the caches used to speed up finding suggestions and emoji.
+            _('Maximum number of entries per cache:'))
+        self._cache_max_entries_label.set_tooltip_text(
+            # Translators: A tooltip explaining the meaning of the
+            # “Maximum number of entries per cache:” option.
+            _('Suggestions and emoji found are cached to find them '
+              'faster next time. When a cache is full, the least '
+              'recently used entries are removed.'))
+        self._cache_max_entries_label.set_xalign(0)
+        self._cache_max_entries_adjustment = Gtk.SpinButton()
+        self._cache_max_entries_adjustment.set_visible(True)
+        self._cache_max_entries_adjustment.set_can_focus(True)
+        self._cache_max_entries_adjustment.set_increments(1000.0, 10000.0)
+        self._cache_max_entries_adjustment.set_range(
+            0.0, float(itb_util.UINT32_MAX))
+        self._cache_max_entries_adjustment.set_value(
+            int(self._settings_dict['cachemaxentries']['user']))
+        self._cache_max_entries_adjustment.connect(
+            'value-changed',
+            self._on_cache_max_entries_adjustment_value_changed)
+        _options_grid_row += 1
+        self._options_grid.attach(
+            self._cache_max_entries_label, 0, _options_grid_row, 1, 1)
+        self._options_grid.attach(
+            self._cache_max_entries_adjustment, 1, _options_grid_row, 1, 1)
+
+        self._cache_max_megabytes_label = Gtk.Label()
+        self._cache_max_megabytes_label.set_text(
+            # Translators: The approximate maximum memory used by each
+            # of the caches used to speed up finding suggestions and emoji.
+            _('Maximum size per cache in megabytes:'))
+        self._cache_max_megabytes_label.set_tooltip_text(
+            # Translators: A tooltip explaining the meaning of the
+            # “Maximum size per cache in megabytes:” option.
+            _('Approximate maximum memory used by each of the caches '
+              'of suggestions and emoji.'))
+        self._cache_max_megabytes_label.set_xalign(0)
+        self._cache_max_megabytes_adjustment = Gtk.SpinButton()
+        self._cache_max_megabytes_adjustment.set_visible(True)
+        self._cache_max_megabytes_adjustment.set_can_focus(True)
+        self._cache_max_megabytes_adjustment.set_increments(1.0, 16.0)
+        self._cache_max_megabytes_adjustment.set_range(
+            0.0, float(itb_util.UINT32_MAX))
+        self._cache_max_megabytes_adjustment.set_value(
+            int(self._settings_dict['cachemaxmegabytes']['user']))
+        self._cache_max_megabytes_adjustment.connect(
+            'value-changed',
+            self._on_cache_max_megabytes_adjustment_value_changed)
+        _options_grid_row += 1
+        self._options_grid.attach(
+            self._cache_max_megabytes_label, 0, _options_grid_row, 1, 1)
+        self._options_grid.attach(
+            self._cache_max_megabytes_adjustment, 1, _options_grid_row, 1, 1)
+
+        self._fast_correction_dictionaries_label = Gtk.Label()
+        self._fast_correction_dictionaries_label.set_text(
+            # Translators: A comma separated list of dictionaries
+            # which get spellchecking suggestions from a fast index
+            # instead of from hunspell, aspell or voikko.
+            _('Dictionaries using fast corrections:'))
+        self._fast_correction_dictionaries_label.set_tooltip_text(
+            _('Comma separated list of dictionaries which get '
+              'spellchecking suggestions from an index built from '
+              'the words of the dictionary instead of from hunspell, '
+              'aspell or voikko. This is much faster for long words '
+              'but may suggest different corrections. When the index '
+              'finds nothing, hunspell, aspell or voikko is still used. '
+              'Shell style wildcards are allowed, for example “*” for '
+              'all dictionaries or “en_*”. Building the index takes a '
+              'few seconds in the background and needs about 10 MB of '
+              'memory for a big dictionary. Empty by default.'))
+        self._fast_correction_dictionaries_label.set_xalign(0)
+        self._fast_correction_dictionaries_entry = Gtk.Entry()
+        self._fast_correction_dictionaries_entry.set_text(
+            self._settings_dict['fastcorrectiondictionaries']['user'])
+        self._fast_correction_dictionaries_entry.connect(
+            'notify::text', self._on_fast_correction_dictionaries_entry)
+        _options_grid_row += 1
+        self._options_grid.attach(
+            self._fast_correction_dictionaries_label,
+            0, _options_grid_row, 1, 1)
+        self._options_grid.attach(
+            self._fast_correction_dictionaries_entry,
+            1, _options_grid_row, 1, 1)
+
         self._learn_from_file_button = Gtk.Button(
             # Translators: A button used to popup a file selector to
             # choose a text file and learn your writing style by
@@ -1731,6 +1820,40 @@ class SetupUI(Gtk.Window): # type: ignore
             self._candidates_delay_milliseconds_adjustment,
             1, _appearance_grid_row, 1, 1)
 
+        self._candidates_budget_milliseconds_label = Gtk.Label()
+        self._candidates_budget_milliseconds_label.set_text(
+            # Translators: Here one can choose how many milliseconds
+            # to wait for slow sources of candidates like spellchecking
+            # before showing the candidates found already
+            _('Candidates time budget in milliseconds:'))
+        self._candidates_budget_milliseconds_label.set_tooltip_text(
+            # Translators: A tooltip explaining the meaning of the
+            # “Candidates time budget in milliseconds:” option.
+            _('How long to wait for spellchecking suggestions and emoji '
+              'before the candidates found already are displayed. '
+              'The other candidates are added when they are ready. '
+              '0 means to always wait for all candidates.'))
+        self._candidates_budget_milliseconds_label.set_xalign(0)
+        self._candidates_budget_milliseconds_adjustment = Gtk.SpinButton()
+        self._candidates_budget_milliseconds_adjustment.set_visible(True)
+        self._candidates_budget_milliseconds_adjustment.set_can_focus(True)
+        self._candidates_budget_milliseconds_adjustment.set_increments(
+            10.0, 100.0)
+        self._candidates_budget_milliseconds_adjustment.set_range(
+            0.0, float(itb_util.UINT32_MAX))
+        self._candidates_budget_milliseconds_adjustment.set_value(
+            int(self._settings_dict['candidatesbudgetmilliseconds']['user']))
+        self._candidates_budget_milliseconds_adjustment.connect(
+            'value-changed',
+            self._on_candidates_budget_milliseconds_adjustment_value_changed)
+        _appearance_grid_row += 1
+        self._appearance_grid.attach(
+            self._candidates_budget_milliseconds_label,
+            0, _appearance_grid_row, 1, 1)
+        self._appearance_grid.attach(
+            self._candidates_budget_milliseconds_adjustment,
+            1, _appearance_grid_row, 1, 1)
+
         self._preedit_underline_label = Gtk.Label()
         self._preedit_underline_label.set_text(
             # Translators: A combobox to choose the style of
@@ -2548,6 +2671,8 @@ class SetupUI(Gtk.Window): # type: ignore
             'pagesize': self.set_page_size,
             'candidatesdelaymilliseconds':
             self.set_candidates_delay_milliseconds,
+            'candidatesbudgetmilliseconds':
+            self.set_candidates_budget_milliseconds,
             'lookuptableorientation': self.set_lookup_table_orientation,
             'preeditunderline': self.set_preedit_underline,
             'preeditstyleonlywhenlookup':
@@ -2559,6 +2684,10 @@ class SetupUI(Gtk.Window): # type: ignore
             'errorsoundfile': self.set_error_sound_file,
             'soundbackend': self.set_sound_backend,
             'debuglevel': self.set_debug_level,
+            'cachemaxentries': self.set_cache_max_entries,
+            'cachemaxmegabytes': self.set_cache_max_megabytes,
+            'fastcorrectiondictionaries':
+            self.set_fast_correction_dictionaries,
             'shownumberofcandidates': self.set_show_number_of_candidates,
             'showstatusinfoinaux': self.set_show_status_info_in_auxiliary_text,
             'autoselectcandidate': self.set_auto_select_candidate,
@@ -3571,6 +3700,15 @@ class SetupUI(Gtk.Window): # type: ignore
             self._candidates_delay_milliseconds_adjustment.get_value(),
             update_gsettings=True)
 
+    def _on_candidates_budget_milliseconds_adjustment_value_changed(
+            self, _widget: Gtk.SpinButton) -> None:
+        '''
+        The time budget of the candidates has been changed.
+        '''
+        self.set_candidates_budget_milliseconds(
+            self._candidates_budget_milliseconds_adjustment.get_value(),
+            update_gsettings=True)
+
     def _on_lookup_table_orientation_combobox_changed(
             self, widget: Gtk.ComboBox) -> None:
         '''
@@ -3650,6 +3788,32 @@ class SetupUI(Gtk.Window): # type: ignore
             self._debug_level_adjustment.get_value(),
             update_gsettings=True)
 
+    def _on_cache_max_entries_adjustment_value_changed(
+            self, _widget: Gtk.SpinButton) -> None:
+        '''
+        The maximum number of entries per cache has been changed.
+        '''
+        self.set_cache_max_entries(
+            self._cache_max_entries_adjustment.get_value(),
+            update_gsettings=True)
+
+    def _on_cache_max_megabytes_adjustment_value_changed(
+            self, _widget: Gtk.SpinButton) -> None:
+        '''
+        The maximum size per cache in megabytes has been changed.
+        '''
+        self.set_cache_max_megabytes(
+            self._cache_max_megabytes_adjustment.get_value(),
+            update_gsettings=True)
+
+    def _on_fast_correction_dictionaries_entry(
+            self, widget: Gtk.Entry, _property_spec: Any) -> None:
+        '''
+        The list of dictionaries using the correction index has been changed.
+        '''
+        self.set_fast_correction_dictionaries(
+            widget.get_text(), update_gsettings=True)
+
 
     def _on_autosetting_to_add_selected(
             self, _listbox: Gtk.ListBox, listbox_row: Gtk.ListBoxRow) -> None:
@@ -5347,28 +5511,110 @@ class SetupUI(Gtk.Window): # type: ignore
             filename = chooser.get_filename()
         chooser.destroy()
         if filename and os.path.isfile(filename):
-            if self.tabsqlitedb.read_training_data_from_file(filename):
-                dialog = Gtk.MessageDialog(
-                    parent=self,
-                    flags=Gtk.DialogFlags.MODAL,
-                    message_type=Gtk.MessageType.INFO,
-                    buttons=Gtk.ButtonsType.OK,
-                    message_format=(
-                        _("Learned successfully from file %(filename)s.")
-                        %{'filename': filename}))
-            else:
-                dialog = Gtk.MessageDialog(
-                    parent=self,
-                    flags=Gtk.DialogFlags.MODAL,
-                    message_type=Gtk.MessageType.ERROR,
-                    buttons=Gtk.ButtonsType.OK,
-                    message_format=(
-                        _("Learning from file %(filename)s failed.")
-                        %{'filename': filename}))
-            dialog.run()
-            dialog.destroy()
+            self._learn_from_file(filename)
+            return
         self._learn_from_file_button.set_sensitive(True)
 
+    def _learn_from_file(self, filename: str) -> None:
+        '''
+        Learn from a text file in a thread, showing the progress in
+        a dialog which can cancel it.
+        '''
+        progress_dialog = Gtk.Dialog(
+            # Translators: Title of a dialog showing the progress of
+            # learning from a text file
+            title=_('Learning from file ...'),
+            parent=self)
+        # Training holds the database until it is finished, nothing
+        # else using the database should be possible meanwhile:
+        progress_dialog.set_modal(True)
+        self._delete_learned_data_button.set_sensitive(False)
+        progress_dialog.add_button(_('_Cancel'), Gtk.ResponseType.CANCEL)
+        box = progress_dialog.get_content_area()
+        label = Gtk.Label()
+        label.set_text(filename)
+        label.set_max_width_chars(40)
+        label.set_line_wrap(True)
+        label.set_line_wrap_mode(Pango.WrapMode.WORD_CHAR)
+        label.set_xalign(0)
+        progress_bar = Gtk.ProgressBar()
+        progress_bar.set_show_text(True)
+        margin = 10
+        for widget in (label, progress_bar):
+            widget.set_margin_start(margin)
+            widget.set_margin_end(margin)
+            widget.set_margin_top(margin)
+            widget.set_margin_bottom(margin)
+            box.add(widget)
+        cancel_event = threading.Event()
+        progress_dialog.connect(
+            'response', lambda _dialog, _response: cancel_event.set())
+        progress_dialog.show_all()
+
+        def learn() -> None:
+            success = self.tabsqlitedb.read_training_data_from_file(
+                filename,
+                progress_callback=lambda fraction: GLib.idle_add(
+                    progress_bar.set_fraction, fraction),
+                cancel_event=cancel_event)
+            GLib.idle_add(self._on_learn_from_file_finished,
+                          progress_dialog, filename,
+                          success, cancel_event.is_set())
+
+        threading.Thread(target=learn, daemon=True).start()
+
+    def _on_learn_from_file_finished(
+            self,
+            progress_dialog: Gtk.Dialog,
+            filename: str,
+            success: bool,
+            cancelled: bool) -> bool:
+        '''
+        Called in the main loop when learning from a text file
+        has finished, failed, or was cancelled.
+
+        :return: *Must* always return False to avoid that this callback
+                 called by GLib.idle_add() runs again.
+        '''
+        progress_dialog.destroy()
+        if success:
+            dialog = Gtk.MessageDialog(
+                parent=self,
+                flags=Gtk.DialogFlags.MODAL,
+                message_type=Gtk.MessageType.INFO,
+                buttons=Gtk.ButtonsType.OK,
+                message_format=(
+                    _("Learned successfully from file %(filename)s.")
+                    %{'filename': filename}))
+        elif cancelled:
+            dialog = Gtk.MessageDialog(
+                parent=self,
+                flags=Gtk.DialogFlags.MODAL,
+                message_type=Gtk.MessageType.INFO,
+                buttons=Gtk.ButtonsType.OK,
+                message_format=(
+                    # Translators: Shown when the user cancelled
+                    # learning from a text file. What has been
+                    # learned until then is kept.
+                    _("Learning from file %(filename)s was cancelled. "
+                      "Learning from the same file again continues "
+                      "where it stopped.")
+                    %{'filename': filename}))
+        else:
+            dialog = Gtk.MessageDialog(
+                parent=self,
+                flags=Gtk.DialogFlags.MODAL,
+                message_type=Gtk.MessageType.ERROR,
+                buttons=Gtk.ButtonsType.OK,
+                message_format=(
+                    _("Learning from file %(filename)s failed.")
+                    %{'filename': filename}))
+        dialog.run()
+        dialog.destroy()
+        self._learn_from_file_button.set_sensitive(True)
+        self._delete_learned_data_button.set_sensitive(True)
+        return False
+
     def _on_delete_learned_data_clicked(self, _widget: Gtk.Button) -> None:
         '''
         The button requesting to delete all data learned from
@@ -6530,6 +6776,34 @@ class SetupUI(Gtk.Window): # type: ignore
                 self._candidates_delay_milliseconds_adjustment.set_value(
                     int(milliseconds))
 
+    def set_candidates_budget_milliseconds(
+            self,
+            milliseconds: Union[int, Any],
+            update_gsettings: bool = True) -> None:
+        '''Sets the time budget of the candidates in milliseconds
+
+        :param milliseconds: time budget of the candidates in milliseconds
+                             0 <= milliseconds <= itb_util.UINT32_MAX
+        :param update_gsettings: Whether to write the change to Gsettings.
+                                 Set this to False if this method is
+                                 called because the Gsettings key changed
+                                 to avoid endless loops when the Gsettings
+                                 key is changed twice in a short time.
+        '''
+        LOGGER.info(
+            '(%s, update_gsettings = %s)', milliseconds, update_gsettings)
+        milliseconds = int(milliseconds)
+        if 0 <= milliseconds <= itb_util.UINT32_MAX:
+            self._settings_dict[
+                'candidatesbudgetmilliseconds']['user'] = milliseconds
+            if update_gsettings:
+                self._gsettings.set_value(
+                    'candidatesbudgetmilliseconds',
+                    GLib.Variant.new_uint32(milliseconds))
+            else:
+                self._candidates_budget_milliseconds_adjustment.set_value(
+                    int(milliseconds))
+
     def set_lookup_table_orientation(
             self,
             orientation: Union[int, Any],
@@ -6828,6 +7102,89 @@ class SetupUI(Gtk.Window): # type: ignore
                 self._debug_level_adjustment.set_value(
                     int(debug_level))
 
+    def set_cache_max_entries(
+            self,
+            max_entries: Union[int, Any],
+            update_gsettings: bool = True) -> None:
+        '''Sets the maximum number of entries per cache
+
+        :param max_entries: The maximum number of entries
+                            0 <= max_entries <= itb_util.UINT32_MAX
+        :param update_gsettings: Whether to write the change to Gsettings.
+                                 Set this to False if this method is
+                                 called because the Gsettings key changed
+                                 to avoid endless loops when the Gsettings
+                                 key is changed twice in a short time.
+        '''
+        LOGGER.info(
+            '(%s, update_gsettings = %s)', max_entries, update_gsettings)
+        max_entries = int(max_entries)
+        if 0 <= max_entries <= itb_util.UINT32_MAX:
+            self._settings_dict['cachemaxentries']['user'] = max_entries
+            if update_gsettings:
+                self._gsettings.set_value(
+                    'cachemaxentries',
+                    GLib.Variant.new_uint32(max_entries))
+            else:
+                self._cache_max_entries_adjustment.set_value(
+                    int(max_entries))
+
+    def set_cache_max_megabytes(
+            self,
+            megabytes: Union[int, Any],
+            update_gsettings: bool = True) -> None:
+        '''Sets the approximate maximum size per cache in megabytes
+
+        :param megabytes: The approximate maximum size in megabytes
+                          0 <= megabytes <= itb_util.UINT32_MAX
+        :param update_gsettings: Whether to write the change to Gsettings.
+                                 Set this to False if this method is
+                                 called because the Gsettings key changed
+                                 to avoid endless loops when the Gsettings
+                                 key is changed twice in a short time.
+        '''
+        LOGGER.info(
+            '(%s, update_gsettings = %s)', megabytes, update_gsettings)
+        megabytes = int(megabytes)
+        if 0 <= megabytes <= itb_util.UINT32_MAX:
+            self._settings_dict['cachemaxmegabytes']['user'] = megabytes
+            if update_gsettings:
+                self._gsettings.set_value(
+                    'cachemaxmegabytes',
+                    GLib.Variant.new_uint32(megabytes))
+            else:
+                self._cache_max_megabytes_adjustment.set_value(
+                    int(megabytes))
+
+    def set_fast_correction_dictionaries(
+            self,
+            dictionary_names: Union[str, Any],
+            update_gsettings: bool = True) -> None:
+        '''Sets the dictionaries using the correction index
+
+        :param dictionary_names: Comma separated list of names of
+                                 dictionaries, shell style wildcards
+                                 like “*” or “en_*” are allowed
+        :param update_gsettings: Whether to write the change to Gsettings.
+                                 Set this to False if this method is
+                                 called because the Gsettings key changed
+                                 to avoid endless loops when the Gsettings
+                                 key is changed twice in a short time.
+        '''
+        LOGGER.info(
+            '(%s, update_gsettings = %s)', dictionary_names, update_gsettings)
+        if not isinstance(dictionary_names, str):
+            return
+        self._settings_dict[
+            'fastcorrectiondictionaries']['user'] = dictionary_names
+        if update_gsettings:
+            self._gsettings.set_value(
+                'fastcorrectiondictionaries',
+                GLib.Variant.new_string(dictionary_names))
+        else:
+            self._fast_correction_dictionaries_entry.set_text(
+                dictionary_names)
+
     def set_show_number_of_candidates(
             self,
             mode: Union[bool, Any],
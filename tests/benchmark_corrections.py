@@ -0,0 +1,196 @@
+#!/usr/bin/python3
+#
+# ibus-typing-booster - A completion input method for IBus
+#
+# Copyright (c) 2026 Mike FABIAN <mfabian@redhat.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>
+
+'''
+Benchmark the correction index against enchant, pyhunspell or voikko
+
+Makes typos in words sampled from each dictionary (deleting,
+inserting, replacing, or swapping characters) and asks both the
+correction index (Dictionary.correction_suggest()) and the native
+spellchecker (Dictionary.spellcheck_suggest()) for corrections.
+Prints as JSON how long building the index took and, for both, the
+latency percentiles, how often the original word was the first
+suggestion or among the first five, and how often nothing was
+suggested:
+
+    python3 benchmark_corrections.py --dictionaries en_US,fi_FI
+'''
+
+from typing import Any
+from typing import Dict
+from typing import List
+from typing import Tuple
+import sys
+import json
+import random
+import argparse
+import time
+import unicodedata
+
+# pylint: disable=wrong-import-position
+sys.path.insert(0, "../engine")
+# pylint: disable=import-error
+import hunspell_suggest
+import itb_util
+# pylint: enable=import-error
+sys.path.pop(0)
+# pylint: enable=wrong-import-position
+
+# The dictionaries used by the unit tests, fi_FI is included in
+# ibus-typing-booster, the others are used if they are installed:
+DICTIONARIES = ('en_US', 'de_DE', 'fr_FR', 'it_IT', 'es_ES',
+                'cs_CZ', 'sv_SE', 'el_GR', 'fi_FI')
+
+def parse_args() -> Any:
+    '''
+    Parse the command line arguments.
+    '''
+    parser = argparse.ArgumentParser(
+        description=('Benchmark the correction index against enchant, '
+                     'pyhunspell or voikko'))
+    parser.add_argument(
+        '-d', '--dictionaries',
+        dest='dictionaries',
+        type=str,
+        action='store',
+        default=','.join(DICTIONARIES),
+        help=('Comma separated list of the dictionaries to use, '
+              'dictionaries which are not installed are skipped. '
+              'default: "%(default)s"'))
+    parser.add_argument(
+        '-w', '--words',
+        dest='words',
+        type=int,
+        action='store',
+        default=500,
+        help=('Number of misspelled words per dictionary. '
+              'default: %(default)s'))
+    parser.add_argument(
+        '-s', '--seed',
+        dest='seed',
+        type=int,
+        action='store',
+        default=1,
+        help=('Seed for choosing the words and the typos. '
+              'default: %(default)s'))
+    parser.add_argument(
+        '-o', '--output',
+        dest='output',
+        type=str,
+        action='store',
+        default='',
+        help=('Write the results as JSON to this file instead of '
+              'standard output. default: "%(default)s"'))
+    return parser.parse_args()
+
+def make_typo(word: str, generator: random.Random) -> str:
+    '''Returns the word with one random typo'''
+    index = generator.randrange(len(word))
+    replacement = generator.choice(word)
+    kind = generator.randrange(4)
+    if kind == 0:
+        return word[:index] + word[index + 1:]
+    if kind == 1:
+        return word[:index] + replacement + word[index:]
+    if kind == 2 and word[index] != replacement:
+        return word[:index] + replacement + word[index + 1:]
+    if index < len(word) - 1 and word[index] != word[index + 1]:
+        return word[:index] + word[index + 1] + word[index] + word[index + 2:]
+    return word + replacement
+
+def misspelled_words(dictionary: hunspell_suggest.Dictionary,
+                     count: int,
+                     generator: random.Random) -> List[Tuple[str, str]]:
+    '''Returns pairs of words of the dictionary and typos of them
+
+    Typos which happen to be words of the dictionary are skipped.
+    '''
+    words = set(dictionary.words)
+    candidates = sorted(
+        word for word in words
+        if len(unicodedata.normalize('NFC', word)) >= 4)
+    pairs: List[Tuple[str, str]] = []
+    while candidates and len(pairs) < count:
+        word = generator.choice(candidates)
+        # Make the typos in NFC, like typing does:
+        typo = unicodedata.normalize(
+            itb_util.NORMALIZATION_FORM_INTERNAL,
+            make_typo(unicodedata.normalize('NFC', word), generator))
+        if typo not in words:
+            pairs.append((word, typo))
+    return pairs
+
+def measure(suggest: Any, pairs: List[Tuple[str, str]]) -> Dict[str, Any]:
+    '''Asks for corrections of all typos and rates the results'''
+    records = []
+    first = top5 = empty = 0
+    for (word, typo) in pairs:
+        time_start = time.perf_counter()
+        suggestions = suggest(typo)
+        records.append(
+            {'stages': {'suggest': (time.perf_counter() - time_start) * 1000}})
+        first += bool(suggestions) and suggestions[0] == word
+        top5 += word in suggestions[:5]
+        empty += not suggestions
+    return {
+        'latency_ms': itb_util.keystroke_trace_percentiles(
+            records).get('suggest', {}),
+        'first': first / len(pairs),
+        'top5': top5 / len(pairs),
+        'empty': empty / len(pairs),
+    }
+
+def main() -> int:
+    '''Runs the benchmark'''
+    args = parse_args()
+    results: Dict[str, Any] = {
+        'enchant': hunspell_suggest.IMPORT_ENCHANT_SUCCESSFUL,
+        'pyhunspell': hunspell_suggest.IMPORT_HUNSPELL_SUCCESSFUL,
+        'voikko': hunspell_suggest.IMPORT_LIBVOIKKO_SUCCESSFUL,
+        'words': args.words,
+        'seed': args.seed,
+        'dictionaries': {},
+    }
+    for name in args.dictionaries.split(','):
+        dictionary = hunspell_suggest.Dictionary(name)
+        if not dictionary.words:
+            print(f'Skipping {name}, not installed.', file=sys.stderr)
+            continue
+        time_start = time.perf_counter()
+        dictionary.build_correction_index()
+        result: Dict[str, Any] = {
+            'index_build_seconds': time.perf_counter() - time_start,
+            'index_deletions': len(dictionary.correction_index),
+        }
+        pairs = misspelled_words(
+            dictionary, args.words, random.Random(args.seed))
+        result['index'] = measure(dictionary.correction_suggest, pairs)
+        if dictionary.has_spellchecking():
+            result['native'] = measure(dictionary.spellcheck_suggest, pairs)
+        results['dictionaries'][name] = result
+    output = json.dumps(results, indent=4, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w', encoding='UTF-8') as output_file:
+            output_file.write(output + '\n')
+    else:
+        print(output)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
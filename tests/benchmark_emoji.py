@@ -0,0 +1,163 @@
+#!/usr/bin/python3
+#
+# ibus-typing-booster - A completion input method for IBus
+#
+# Copyright (c) 2026 Mike FABIAN <mfabian@redhat.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>
+
+'''
+Benchmark the emoji candidates with and without the label word index
+
+Asks EmojiMatchers built with and without the index of the label
+words (see EmojiMatcher(label_index=...)) for the candidates of the
+same queries with both match algorithms. Prints as JSON the queries
+per second and the latency percentiles of each, and whether the
+results were identical:
+
+    python3 benchmark_emoji.py --languages en_US,de_DE
+'''
+
+from typing import Any
+from typing import Dict
+from typing import List
+import sys
+import json
+import argparse
+import time
+
+# pylint: disable=wrong-import-position
+sys.path.insert(0, "../engine")
+# pylint: disable=import-error
+import itb_emoji
+import itb_util
+# pylint: enable=import-error
+sys.path.pop(0)
+# pylint: enable=wrong-import-position
+
+LANGUAGES = ('en_US', 'de_DE', 'fr_FR', 'ja_JP')
+
+# Typical queries: complete and incomplete words, several words,
+# queries in other languages, a code point and queries matching
+# nothing:
+QUERIES = ('cat', 'hou', 'house', 'smiling face', 'heart red',
+           'latin small letter', 'katze', 'cœur', 'ねこ', 'flag de',
+           'grinning', 'xyzq', '1f600', 'ho')
+
+MATCH_ALGORITHMS = ('classic', 'rapidfuzz')
+
+def parse_args() -> Any:
+    '''
+    Parse the command line arguments.
+    '''
+    parser = argparse.ArgumentParser(
+        description=('Benchmark the emoji candidates with and without '
+                     'the label word index'))
+    parser.add_argument(
+        '-l', '--languages',
+        dest='languages',
+        type=str,
+        action='store',
+        default=','.join(LANGUAGES),
+        help=('Comma separated list of the languages of the '
+              'EmojiMatchers. default: "%(default)s"'))
+    parser.add_argument(
+        '-r', '--repeat',
+        dest='repeat',
+        type=int,
+        action='store',
+        default=3,
+        help=('How often to ask for the candidates of all queries. '
+              'default: %(default)s'))
+    parser.add_argument(
+        '-o', '--output',
+        dest='output',
+        type=str,
+        action='store',
+        default='',
+        help=('Write the results as JSON to this file instead of '
+              'standard output. default: "%(default)s"'))
+    return parser.parse_args()
+
+def measure(matcher: itb_emoji.EmojiMatcher,
+            repeat: int) -> Dict[str, Any]:
+    '''Asks for the candidates of all queries and times them
+
+    The candidate cache and the caches of the match functions are
+    cleared before each query. Otherwise only the first round would
+    be measured and the matcher measured second would profit from
+    the matches cached for the first one.
+    '''
+    # Once to load what is loaded lazily:
+    for query in QUERIES:
+        matcher.candidates(query + ' ')
+    records = []
+    results: List[Any] = []
+    time_total = 0.0
+    for _ in range(repeat):
+        results = []
+        for query in QUERIES:
+            matcher._candidate_cache.clear() # pylint: disable=protected-access
+            itb_emoji._match_classic.cache_clear() # type: ignore # pylint: disable=protected-access
+            itb_emoji._match_rapidfuzz.cache_clear() # type: ignore # pylint: disable=protected-access
+            time_start = time.perf_counter()
+            results.append(matcher.candidates(query))
+            milliseconds = (time.perf_counter() - time_start) * 1000
+            time_total += milliseconds / 1000
+            records.append({'stages': {'candidates': milliseconds}})
+    return {
+        'queries_per_second': len(records) / time_total if time_total else 0.0,
+        'latency_ms': itb_util.keystroke_trace_percentiles(
+            records).get('candidates', {}),
+        'results': results,
+    }
+
+def main() -> int:
+    '''Runs the benchmark'''
+    args = parse_args()
+    languages = args.languages.split(',')
+    results: Dict[str, Any] = {
+        'rapidfuzz': itb_emoji.IMPORT_RAPIDFUZZ_SUCCESSFUL,
+        'languages': languages,
+        'queries': len(QUERIES),
+        'repeat': args.repeat,
+        'match_algorithms': {},
+    }
+    matchers = {
+        label_index: itb_emoji.EmojiMatcher(
+            languages=languages, label_index=label_index)
+        for label_index in (False, True)}
+    for match_algorithm in MATCH_ALGORITHMS:
+        result: Dict[str, Any] = {}
+        candidates = {}
+        for label_index, matcher in matchers.items():
+            matcher.set_match_algorithm(match_algorithm)
+            measured = measure(matcher, args.repeat)
+            candidates[label_index] = measured.pop('results')
+            result['with_index' if label_index else 'without_index'] = (
+                measured)
+        # The index must only make it faster, the results must be
+        # the same:
+        result['identical'] = candidates[False] == candidates[True]
+        results['match_algorithms'][match_algorithm] = result
+    output = json.dumps(results, indent=4, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w', encoding='UTF-8') as output_file:
+            output_file.write(output + '\n')
+    else:
+        print(output)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
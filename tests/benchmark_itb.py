@@ -0,0 +1,474 @@
+#!/usr/bin/python3
+#
+# ibus-typing-booster - A completion input method for IBus
+#
+# Copyright (c) 2026 Mike FABIAN <mfabian@redhat.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>
+
+'''
+Benchmark typing with ibus-typing-booster
+
+Types recorded or synthetic text into TypingBoosterEngine using the
+mock IBus classes of the unit tests, for several setups of input
+methods, dictionaries and emoji predictions, with a prefilled user
+database opened like the engine factory opens it. Prints keystrokes
+per second and latency percentiles per keystroke and per stage (see
+itb_util.KeystrokeTracer) as JSON, so the results of different
+commits can be compared:
+
+    python3 benchmark_itb.py --output before.json
+    (change something)
+    python3 benchmark_itb.py --compare before.json
+
+Each setup is typed in two modes. “asynchronous” is what the engine
+does in production: the candidates are computed in the worker thread
+within the time budget, the emoji matcher is loaded in the background,
+and the user database is written behind by a timer. The GLib main
+context is run after each keystroke until the complete candidates
+have arrived. “synchronous” is the unit test mode of the engine, it
+computes everything while processing the key event.
+'''
+
+from typing import Any
+from typing import Dict
+from typing import List
+from typing import NamedTuple
+import os
+import sys
+import json
+import random
+import shutil
+import argparse
+import tempfile
+import importlib
+import subprocess
+import time
+import unicodedata
+from unittest import mock
+
+# pylint: disable=wrong-import-position
+from gi import require_version # type: ignore
+require_version('IBus', '1.0')
+from gi.repository import IBus # type: ignore
+require_version('GLib', '2.0')
+from gi.repository import GLib
+# pylint: enable=wrong-import-position
+
+# pylint: disable=import-error
+from mock_engine import MockEngine
+from mock_engine import MockLookupTable
+from mock_engine import MockProperty
+from mock_engine import MockPropList
+# pylint: enable=import-error
+
+# pylint: disable=wrong-import-order
+sys.path.insert(0, "../engine")
+# pylint: disable=import-error
+import hunspell_table
+import tabsqlitedb
+import itb_util
+import m17n_translit
+# pylint: enable=import-error
+sys.path.pop(0)
+# pylint: enable=wrong-import-order
+
+class BenchmarkSetup(NamedTuple):
+    '''Input methods, dictionaries, and options typed with
+
+    name: str                The name of the setup in the results
+    imes: List[str]          The input methods
+    dictionaries: List[str]  The dictionaries
+    emoji_predictions: bool  Whether emoji predictions are on
+    text: str                Synthetic text typed if no text file is given
+    '''
+    name: str
+    imes: List[str]
+    dictionaries: List[str]
+    emoji_predictions: bool
+    text: str
+
+MODES = ('asynchronous', 'synchronous')
+
+# Give up waiting for the candidates of a keystroke after that many seconds:
+CANDIDATES_TIMEOUT_SECONDS = 10.0
+
+SETUPS = (
+    BenchmarkSetup(
+        name='en_US',
+        imes=['NoIME'],
+        dictionaries=['en_US'],
+        emoji_predictions=False,
+        text=('two roads diverged in a yellow wood and sorry i could '
+              'not travel both and be one traveler long i stood ')),
+    BenchmarkSetup(
+        name='en_US-emoji',
+        imes=['NoIME'],
+        dictionaries=['en_US'],
+        emoji_predictions=True,
+        text=('the cat is smiling at the red heart and the house '
+              'with a flag is next to the grinning face ')),
+    BenchmarkSetup(
+        name='de_DE',
+        imes=['NoIME'],
+        dictionaries=['de_DE'],
+        emoji_predictions=False,
+        text=('zwei wege trennten sich im gelben wald und leider '
+              'konnte ich nicht beide gehen ')),
+    BenchmarkSetup(
+        name='hi-itrans',
+        imes=['hi-itrans'],
+        dictionaries=['hi_IN'],
+        emoji_predictions=False,
+        text='namaste bhaarata kaa sabase bad.aa shahara kauna hai '),
+    BenchmarkSetup(
+        name='ko-romaja',
+        imes=['ko-romaja'],
+        dictionaries=['ko_KR'],
+        emoji_predictions=False,
+        text='annyeonghaseyo jeoneun hangugeoreul gongbuhamnida '),
+)
+
+def parse_args() -> Any:
+    '''
+    Parse the command line arguments.
+    '''
+    parser = argparse.ArgumentParser(
+        description='Benchmark typing with ibus-typing-booster')
+    parser.add_argument(
+        '-s', '--setups',
+        dest='setups',
+        type=str,
+        action='store',
+        default=','.join(setup.name for setup in SETUPS),
+        help=('Comma separated list of the setups to run. '
+              'default: "%(default)s"'))
+    parser.add_argument(
+        '-m', '--modes',
+        dest='modes',
+        type=str,
+        action='store',
+        default=','.join(MODES),
+        help=('Comma separated list of the modes to type in, '
+              'see the description above. default: "%(default)s"'))
+    parser.add_argument(
+        '-t', '--text-file',
+        dest='text_file',
+        type=str,
+        action='store',
+        default='',
+        help=('Type the text from this file instead of the synthetic '
+              'text of each setup. default: "%(default)s"'))
+    parser.add_argument(
+        '-k', '--keystrokes',
+        dest='keystrokes',
+        type=int,
+        action='store',
+        default=2000,
+        help=('Number of keystrokes to type per setup, the text is '
+              'repeated if it is shorter. default: %(default)s'))
+    parser.add_argument(
+        '-r', '--user-db-rows',
+        dest='user_db_rows',
+        type=int,
+        action='store',
+        default=20000,
+        help=('Number of rows to prefill the user database with. '
+              'default: %(default)s'))
+    parser.add_argument(
+        '-o', '--output',
+        dest='output',
+        type=str,
+        action='store',
+        default='',
+        help=('Write the results as JSON to this file instead of '
+              'standard output. default: "%(default)s"'))
+    parser.add_argument(
+        '-c', '--compare',
+        dest='compare',
+        type=str,
+        action='store',
+        default='',
+        help=('Compare the results with the results in this JSON file '
+              'and exit with status 1 if a setup got slower by more than '
+              'the tolerance in one of the modes. default: "%(default)s"'))
+    parser.add_argument(
+        '--tolerance',
+        dest='tolerance',
+        type=float,
+        action='store',
+        default=0.2,
+        help=('Allowed slowdown of the keystrokes per second when '
+              'comparing, 0.2 means 20%%. default: %(default)s'))
+    return parser.parse_args()
+
+def open_database(user_db_file: str) -> tabsqlitedb.TabSqliteDb:
+    '''Opens a user database the same way as engine/factory.py does'''
+    return tabsqlitedb.TabSqliteDb(
+        user_db_file=user_db_file,
+        write_behind=True,
+        ngram_model=True)
+
+def prefill_user_db(user_db_file: str, rows: int, text: str) -> None:
+    '''Creates a user database with that many synthetic rows
+
+    The rows are trigrams of the words of the text and of variants
+    of these words, so that completions and n-gram lookups have
+    something to find.
+    '''
+    database = open_database(user_db_file)
+    words = [unicodedata.normalize('NFD', word)
+             for word in text.split() if word.isalpha()] or ['word']
+    rng = random.Random(4711)
+    now = time.time()
+    sqlite_rows: Dict[Any, Any] = {}
+    attempts = 0
+    while len(sqlite_rows) < rows and attempts < 20 * rows:
+        attempts += 1
+        word = rng.choice(words)
+        if rng.random() < 0.7:
+            word += ''.join(rng.choice('abcdefghijklmnopqrstuvwxyz')
+                            for _ in range(rng.randint(1, 4)))
+        input_phrase = itb_util.remove_accents(word.lower())
+        p_phrase = itb_util.remove_accents(rng.choice(words).lower())
+        pp_phrase = itb_util.remove_accents(rng.choice(words).lower())
+        # Unique like the index of the phrases table:
+        sqlite_rows[(input_phrase, p_phrase, pp_phrase, word)] = (
+            input_phrase, word, p_phrase, pp_phrase,
+            rng.randint(1, 20), now - rng.random() * 3600 * 24 * 365)
+    database.database.executemany(
+        'INSERT INTO user_db.phrases '
+        '(input_phrase, phrase, p_phrase, pp_phrase, user_freq, timestamp) '
+        'VALUES (?, ?, ?, ?, ?, ?);', list(sqlite_rows.values()))
+    database.database.commit()
+    database.database.close()
+
+def keyvals_for_text(text: str) -> List[int]:
+    '''Returns the keyvals to type a text'''
+    keyvals = []
+    for character in text:
+        if character == '\n':
+            keyvals.append(IBus.KEY_Return)
+        elif character.isspace():
+            keyvals.append(IBus.KEY_space)
+        else:
+            keyval = IBus.unicode_to_keyval(character)
+            if keyval:
+                keyvals.append(keyval)
+    return keyvals
+
+def candidates_pending(engine: hunspell_table.TypingBoosterEngine) -> bool:
+    '''Whether the engine still waits for the delay of the candidates,
+    for candidates computed in the worker thread, or for the emoji
+    matcher loading in the background'''
+    # pylint: disable=protected-access
+    return bool(engine._timeout_source_id
+                or engine._candidates_request is not None
+                or engine._emoji_matcher_future is not None)
+    # pylint: enable=protected-access
+
+def wait_for_candidates(engine: hunspell_table.TypingBoosterEngine) -> None:
+    '''Runs the GLib main context until the candidates have arrived'''
+    context = GLib.MainContext.default()
+    deadline = time.perf_counter() + CANDIDATES_TIMEOUT_SECONDS
+    while candidates_pending(engine) and time.perf_counter() < deadline:
+        if not context.iteration(False):
+            # Nothing to dispatch yet, the worker thread is busy:
+            time.sleep(0.0002)
+    # Run what is due without waiting, for example flushing the
+    # pending updates of the user database:
+    while context.iteration(False):
+        pass
+
+def type_keyvals(engine: hunspell_table.TypingBoosterEngine,
+                 keyvals: List[int],
+                 asynchronous: bool) -> List[float]:
+    '''Types the keyvals
+
+    :return: The milliseconds from each key press until the complete
+             candidates are there
+    '''
+    latencies = []
+    for keyval in keyvals:
+        time_start = time.perf_counter()
+        engine.do_process_key_event(keyval, 0, 0)
+        engine.do_process_key_event(
+            keyval, 0, IBus.ModifierType.RELEASE_MASK)
+        if asynchronous:
+            wait_for_candidates(engine)
+        latencies.append((time.perf_counter() - time_start) * 1000)
+    return latencies
+
+def run_setup(setup: BenchmarkSetup,
+              user_db_file: str,
+              keystrokes: int,
+              text: str,
+              mode: str) -> Dict[str, Any]:
+    '''Types the text with one setup in one mode and returns the results'''
+    for ime in setup.imes:
+        if ime == 'NoIME':
+            continue
+        try:
+            m17n_translit.Transliterator(ime)
+        except ValueError as error:
+            return {'skipped': f'{ime}: {error}'}
+    asynchronous = mode == 'asynchronous'
+    database = open_database(user_db_file)
+    engine = hunspell_table.TypingBoosterEngine(
+        IBus.Bus(),
+        '/com/redhat/IBus/engines/typing_booster/typing_booster/engine/0',
+        database,
+        engine_name='typing-booster',
+        unit_test=True)
+    # pylint: disable=protected-access
+    for key in engine._settings_dict:
+        if 'set_function' in engine._settings_dict[key]:
+            engine._settings_dict[key]['set_function'](
+                engine._settings_dict[key]['default'],
+                update_gsettings=False)
+    if asynchronous:
+        # Like in production. Not only the candidates, also the
+        # emoji matcher and writing the user database behave
+        # differently in unit test mode:
+        engine._unit_test = False
+        # The delay before showing the candidates is only waiting,
+        # measure how long it takes to compute them:
+        engine.set_candidates_delay_milliseconds(0, update_gsettings=False)
+    # pylint: enable=protected-access
+    engine.set_current_imes(setup.imes, update_gsettings=False)
+    engine.set_dictionary_names(setup.dictionaries, update_gsettings=False)
+    engine.set_emoji_prediction_mode(
+        setup.emoji_predictions, update_gsettings=False)
+    keyvals = keyvals_for_text(text or setup.text)
+    keyvals = (keyvals * (keystrokes // max(len(keyvals), 1) + 1))[:keystrokes]
+    # Type a few words to load everything which is loaded lazily:
+    type_keyvals(engine, keyvals[:50], asynchronous)
+    itb_util.KEYSTROKE_TRACER.enable()
+    time_start = time.perf_counter()
+    latencies = type_keyvals(engine, keyvals, asynchronous)
+    seconds = time.perf_counter() - time_start
+    stages = itb_util.KEYSTROKE_TRACER.percentiles()
+    itb_util.KEYSTROKE_TRACER.enable(enabled=False)
+    database.flush_pending_updates()
+    database.database.close()
+    del engine
+    return {
+        'keystrokes': len(keyvals),
+        'seconds': seconds,
+        'keystrokes_per_second': len(keyvals) / seconds if seconds else 0.0,
+        # From the key press until the complete candidates are shown.
+        # In the synchronous mode that is the “process_key_event”
+        # stage, in the asynchronous mode that stage is only the
+        # time the key event blocks the main loop:
+        'latency_ms': itb_util.keystroke_trace_percentiles(
+            [{'stages': {'keystroke': milliseconds}}
+             for milliseconds in latencies]).get('keystroke', {}),
+        'stages_ms': stages,
+    }
+
+def git_commit() -> str:
+    '''Returns the git commit of the source tree if available'''
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', 'HEAD'],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+
+def compare(results: Dict[str, Any],
+            baseline: Dict[str, Any],
+            tolerance: float) -> bool:
+    '''Prints the change of each setup compared to a baseline
+
+    :return: True if no setup got slower than the tolerance allows
+    '''
+    success = True
+    for name, modes in results['setups'].items():
+        for mode, result in modes.items():
+            old = baseline.get('setups', {}).get(name, {}).get(mode, {})
+            if ('keystrokes_per_second' not in result
+                or not old.get('keystrokes_per_second')):
+                continue
+            ratio = (result['keystrokes_per_second']
+                     / old['keystrokes_per_second'])
+            slower = ratio < 1.0 - tolerance
+            success &= not slower
+            print(f'{name:15} {mode:12} '
+                  f'{old["keystrokes_per_second"]:9.1f} -> '
+                  f'{result["keystrokes_per_second"]:9.1f} keystrokes/s '
+                  f'({ratio:6.1%}){" SLOWER" if slower else ""}',
+                  file=sys.stderr)
+    return success
+
+def main() -> int:
+    '''Runs the benchmark'''
+    args = parse_args()
+    text = ''
+    if args.text_file:
+        with open(args.text_file, encoding='UTF-8') as text_file:
+            text = text_file.read()
+    setups = [setup for setup in SETUPS
+              if setup.name in args.setups.split(',')]
+    patchers = [mock.patch.object(IBus, 'Engine', new=MockEngine),
+                mock.patch.object(IBus, 'LookupTable', new=MockLookupTable),
+                mock.patch.object(IBus, 'Property', new=MockProperty),
+                mock.patch.object(IBus, 'PropList', new=MockPropList)]
+    for patcher in patchers:
+        patcher.start()
+    # Reload the hunspell_table module so that the patches
+    # are applied to TypingBoosterEngine:
+    sys.path.insert(0, "../engine")
+    importlib.reload(hunspell_table)
+    sys.path.pop(0)
+    results: Dict[str, Any] = {
+        'commit': git_commit(),
+        'time': time.time(),
+        'python': sys.version.split()[0],
+        'keystrokes': args.keystrokes,
+        'user_db_rows': args.user_db_rows,
+        'text_file': args.text_file,
+        'modes': args.modes.split(','),
+        'setups': {},
+    }
+    with tempfile.TemporaryDirectory() as tempdir:
+        prefilled_user_db = os.path.join(tempdir, 'prefilled.db')
+        prefill_user_db(prefilled_user_db, args.user_db_rows,
+                        text or ' '.join(setup.text for setup in SETUPS))
+        for setup in setups:
+            results['setups'][setup.name] = {}
+            for mode in args.modes.split(','):
+                # Each run starts with the same database, what was
+                # learned while typing in another run must not count:
+                user_db_file = os.path.join(
+                    tempdir, f'{setup.name}-{mode}.db')
+                shutil.copy(prefilled_user_db, user_db_file)
+                results['setups'][setup.name][mode] = run_setup(
+                    setup, user_db_file, args.keystrokes, text, mode)
+    for patcher in patchers:
+        patcher.stop()
+    output = json.dumps(results, indent=4, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w', encoding='UTF-8') as output_file:
+            output_file.write(output + '\n')
+    else:
+        print(output)
+    if args.compare:
+        with open(args.compare, encoding='UTF-8') as baseline_file:
+            if not compare(results, json.load(baseline_file), args.tolerance):
+                return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -29,6 +29,7 @@ import tempfile
 import logging
 import locale
 import unittest
+import unittest.mock
 
 # pylint: disable=wrong-import-position
 from gi import require_version # type: ignore
@@ -1002,6 +1003,107 @@ class ComposeSequencesTestCase(unittest.TestCase):
                  IBus.KEY_KP_1],
                 keypad_fallback=False))
 
+    def test_find_compose_completions_cached(self) -> None:
+        keyvals = [IBus.KEY_Multi_key, IBus.KEY_e]
+        available_keyvals = {IBus.KEY_e, IBus.KEY_m, IBus.KEY_p,
+                             IBus.KEY_t, IBus.KEY_y, IBus.KEY_KP_1}
+        completions = self._compose_sequences.find_compose_completions(
+            keyvals, available_keyvals)
+        completions.append([IBus.KEY_y]) # must not change the cache
+        completions = self._compose_sequences.find_compose_completions(
+            keyvals, available_keyvals)
+        self.assertNotIn([IBus.KEY_y], completions)
+        self.assertEqual(completions, sorted(completions,
+                                             key=lambda x: (len(x), x)))
+        # Adding a sequence invalidates the cached completions:
+        # pylint: disable=protected-access
+        self._compose_sequences._add_compose_sequence(
+            '<Multi_key> <e> <m> <p> <t> <y>', '∅')
+        self._compose_sequences._add_compose_sequence(
+            '<Multi_key> <e> <KP_1>', '①')
+        completions = self._compose_sequences.find_compose_completions(
+            keyvals, available_keyvals)
+        self.assertIn(
+            [IBus.KEY_m, IBus.KEY_p, IBus.KEY_t, IBus.KEY_y], completions)
+        self.assertNotIn([IBus.KEY_KP_1], completions)
+        self.assertIn(
+            [IBus.KEY_KP_1],
+            self._compose_sequences.find_compose_completions(
+                keyvals, available_keyvals,
+                omit_sequences_involving_keypad=False))
+        # Not possible with the available key values of another layout:
+        self.assertEqual(
+            [],
+            self._compose_sequences.find_compose_completions(
+                keyvals, {IBus.KEY_a}))
+
+    def test_find_compose_completions_keyvals_index(self) -> None:
+        keyvals = [IBus.KEY_Multi_key]
+        all_completions = self._compose_sequences.find_compose_completions(
+            keyvals, None, omit_sequences_involving_keypad=False)
+        available_keyvals = frozenset(
+            (IBus.KEY_a, IBus.KEY_e, IBus.KEY_o, IBus.KEY_minus,
+             IBus.KEY_apostrophe, IBus.KEY_quotedbl, IBus.KEY_KP_1))
+        self.assertEqual(
+            [completion for completion in all_completions
+             if available_keyvals.issuperset(completion)],
+            self._compose_sequences.find_compose_completions(
+                keyvals, available_keyvals,
+                omit_sequences_involving_keypad=False))
+        self.assertEqual(
+            [completion for completion in all_completions
+             if available_keyvals.issuperset(completion)
+             and IBus.KEY_KP_1 not in completion],
+            self._compose_sequences.find_compose_completions(
+                keyvals, available_keyvals))
+
+    def test_compiled_cache(self) -> None:
+        with tempfile.TemporaryDirectory() as cache_home, \
+             unittest.mock.patch.dict(
+                 os.environ, {'XDG_CACHE_HOME': cache_home}):
+            parsed = itb_util.ComposeSequences(cache=False)
+            self.assertFalse(parsed.load_cache())
+            # Reads the compose files because there is no cache yet
+            # and writes the cache:
+            itb_util.ComposeSequences()
+            cached = itb_util.ComposeSequences()
+            self.assertTrue(cached.load_cache())
+            sequences = parsed.list_compose_sequences(
+                0, omit_sequences_involving_keypad=False)
+            self.assertTrue(sequences)
+            self.assertEqual(
+                sorted(sequences),
+                sorted(cached.list_compose_sequences(
+                    0, omit_sequences_involving_keypad=False)))
+            prefixes = set()
+            for sequence in sequences:
+                self.assertEqual(parsed.compose(sequence),
+                                 cached.compose(sequence))
+                prefixes.update(tuple(sequence[:length])
+                                for length in range(1, len(sequence)))
+            for prefix in prefixes:
+                self.assertEqual(
+                    parsed.find_compose_completions(list(prefix)),
+                    cached.find_compose_completions(list(prefix)))
+            # Adding to a cached instance works as well:
+            cached._add_compose_sequence( # pylint: disable=protected-access
+                '<Multi_key> <e> <m> <p> <t> <y>', '∅')
+            self.assertEqual(
+                '∅',
+                cached.compose(
+                    [IBus.KEY_Multi_key, IBus.KEY_e, IBus.KEY_m,
+                     IBus.KEY_p, IBus.KEY_t, IBus.KEY_y]))
+            # The cache is outdated when a compose file changes:
+            xcomposefile = os.environ['XCOMPOSEFILE']
+            stat = os.stat(xcomposefile)
+            try:
+                os.utime(xcomposefile,
+                         ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+                self.assertFalse(cached.load_cache())
+            finally:
+                os.utime(xcomposefile,
+                         ns=(stat.st_atime_ns, stat.st_mtime_ns))
+
 if __name__ == '__main__':
     LOG_HANDLER = logging.StreamHandler(stream=sys.stderr)
     LOGGER.setLevel(logging.DEBUG)
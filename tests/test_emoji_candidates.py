@@ -22,8 +22,11 @@ This file implements test cases for emoji candidates
 '''
 
 import sys
+import os
+import tempfile
 import logging
 import unittest
+import unittest.mock
 
 LOGGER = logging.getLogger('ibus-typing-booster')
 
@@ -1199,6 +1202,72 @@ class EmojiCandidatesTestCase(unittest.TestCase):
         self.assertEqual(first_match.phrase, '🐈')
         self.assertEqual(first_match.comment, 'ネコ “ねこ”')
 
+    def test_candidates_label_index(self) -> None:
+        # The index of the label words must not change the results,
+        # only make getting them faster (see benchmark_emoji.py):
+        queries = ['cat', 'hou', 'house', 'smiling face', 'heart red',
+                   'latin small letter', 'katze', 'cœur', 'ねこ', 'flag de',
+                   'grinning', 'xyzq', '1f600', 'ho']
+        languages = ['en_US', 'de_DE', 'fr_FR', 'ja_JP']
+        mq_index = itb_emoji.EmojiMatcher(
+            languages=languages, label_index=True)
+        mq_no_index = itb_emoji.EmojiMatcher(
+            languages=languages, label_index=False)
+        for match_algorithm in ('classic', 'rapidfuzz'):
+            mq_index.set_match_algorithm(match_algorithm)
+            mq_no_index.set_match_algorithm(match_algorithm)
+            for query in queries:
+                self.assertEqual(mq_index.candidates(query),
+                                 mq_no_index.candidates(query))
+
+    def test_candidates_short_circuited(self) -> None:
+        mq = itb_emoji.EmojiMatcher(languages=['en_US', 'de_DE'])
+        self.assertEqual(mq.query_statistics(), (0, 0))
+        # No label word contains “xyzzyq”, nothing is searched:
+        self.assertEqual(mq.candidates('xyzzyq'), [])
+        self.assertEqual(mq.candidates('cat xyzzyq'), [])
+        self.assertEqual(mq.query_statistics(), (2, 2))
+        # These can match and must be searched:
+        for query in ('cat', 'katze', 'ca', 'smiling face', '1f600',
+                      '😺', '_cat_'):
+            self.assertNotEqual(mq.candidates(query), [])
+        self.assertEqual(mq.query_statistics(), (9, 2))
+        # Unchanged results compared to searching everything:
+        mq_no_index = itb_emoji.EmojiMatcher(
+            languages=['en_US', 'de_DE'], label_index=False)
+        for query in ('xyzzyq', 'hou', 'heart red', 'cœur', 'qqq'):
+            self.assertEqual(mq.candidates(query),
+                             mq_no_index.candidates(query))
+        self.assertEqual(mq_no_index.query_statistics(), (5, 0))
+
+    def test_candidates_snapshot(self) -> None:
+        with tempfile.TemporaryDirectory() as cache_home, \
+             unittest.mock.patch.dict(
+                 os.environ, {'XDG_CACHE_HOME': cache_home}):
+            # Loads the data files because there is no snapshot yet
+            # and writes the snapshot:
+            mq_loaded = itb_emoji.EmojiMatcher(languages=['en_US', 'de_DE'])
+            mq_restored = itb_emoji.EmojiMatcher(languages=['en_US', 'de_DE'])
+            self.assertTrue(mq_restored.load_snapshot())
+            for query in ('cat', 'katze', 'smiling face', '1f600', '😺',
+                          'xyzzyq'):
+                self.assertEqual(mq_loaded.candidates(query),
+                                 mq_restored.candidates(query))
+            self.assertEqual(mq_loaded.query_statistics(),
+                             mq_restored.query_statistics())
+            self.assertEqual(mq_loaded.unicode_block('☺'),
+                             mq_restored.unicode_block('☺'))
+            self.assertEqual(mq_loaded.cldr_order('😺'),
+                             mq_restored.cldr_order('😺'))
+            # A snapshot for other languages is not used:
+            self.assertFalse(
+                itb_emoji.EmojiMatcher(
+                    languages=['en_US'], snapshot=False).load_snapshot())
+            # An outdated snapshot is not used:
+            with unittest.mock.patch.object(
+                    itb_emoji, 'EMOJI_SNAPSHOT_VERSION', 0):
+                self.assertFalse(mq_restored.load_snapshot())
+
 if __name__ == '__main__':
     LOG_HANDLER = logging.StreamHandler(stream=sys.stderr)
     LOGGER.setLevel(logging.DEBUG)
@@ -22,7 +22,12 @@ This file implements test cases for suggestions from hunspell dictionaries
 '''
 
 import sys
+import os
+import re
+import tempfile
+import unicodedata
 import unittest
+import unittest.mock
 
 # pylint: disable=wrong-import-position
 sys.path.insert(0, "../engine")
@@ -150,6 +155,52 @@ class HunspellSuggestTestCase(unittest.TestCase):
             h.suggest('filosofičtějš')[0],
             ('filosofic\u030Cte\u030Cjs\u030Ci\u0301', 0))
 
+    def test_spellcheck_match_lists_memo(self) -> None:
+        h = hunspell_suggest.Hunspell(['en_US', 'de_DE'])
+        checked = []
+        def spellcheck(dictionary: hunspell_suggest.Dictionary,
+                       word: str) -> bool:
+            checked.append((dictionary.name, word))
+            return dictionary.name[:2] in word
+        with unittest.mock.patch.object(
+                hunspell_suggest.Dictionary, 'spellcheck',
+                autospec=True, side_effect=spellcheck):
+            self.assertEqual(
+                h.spellcheck_match_lists(['foo_en', 'bar_de', 'foo_en', ' ']),
+                {'foo_en': ['en_US'], 'bar_de': ['de_DE'], ' ': []})
+            self.assertEqual(len(checked), 4)
+            self.assertEqual(h.spellcheck_match_list('en_de'),
+                             ['en_US', 'de_DE'])
+            # Remembered, no spellchecking needed:
+            self.assertEqual(h.spellcheck_match_list('foo_en'), ['en_US'])
+            self.assertEqual(
+                h.spellcheck_match_lists(['bar_de']), {'bar_de': ['de_DE']})
+            self.assertEqual(len(checked), 6)
+            # Changing the order of the dictionaries forgets the results:
+            h.set_dictionary_names(['de_DE', 'en_US'])
+            self.assertEqual(h.spellcheck_match_list('en_de'),
+                             ['de_DE', 'en_US'])
+            self.assertEqual(len(checked), 8)
+
+    def test_dictionaries_replaced_not_changed(self) -> None:
+        # The worker thread computing the candidates may iterate over
+        # the old list of dictionaries while they are changed:
+        h = hunspell_suggest.Hunspell(['en_US', 'de_DE'])
+        dictionaries_old = h._dictionaries # pylint: disable=protected-access
+        h.set_dictionary_names(['fr_FR'])
+        self.assertEqual([dictionary.name for dictionary in dictionaries_old],
+                         ['en_US', 'de_DE'])
+        self.assertEqual(
+            [dictionary.name
+             for dictionary in h._dictionaries], # pylint: disable=protected-access
+            ['fr_FR'])
+        dictionaries_old = h._dictionaries # pylint: disable=protected-access
+        h.init_dictionaries()
+        self.assertEqual([dictionary.name for dictionary in dictionaries_old],
+                         ['fr_FR'])
+        self.assertIsNot(
+            h._dictionaries, dictionaries_old) # pylint: disable=protected-access
+
     @unittest.skipUnless(
         itb_util.get_hunspell_dictionary_wordlist('it_IT')[0],
         'Skipping because no Italian hunspell dictionary could be found.')
@@ -239,6 +290,97 @@ class HunspellSuggestTestCase(unittest.TestCase):
              ('kissajuttu', 0),
              ('kissamaiseksi',0)])
 
+    def test_fi_FI_prefix_completions(self) -> None:
+        # The sorted prefix index must give exactly the same
+        # results as matching a regular expression against every
+        # accent stripped word of the dictionary:
+        d = hunspell_suggest.Dictionary('fi_FI')
+        for prefix in ('kissa', 'KISSA', 'ä', 'Ä', 'a', 'å', 'sana', 'x'):
+            prefix = unicodedata.normalize(
+                itb_util.NORMALIZATION_FORM_INTERNAL, prefix)
+            prefix_no_accents = itb_util.remove_accents(
+                prefix, keep=itb_util.ACCENT_LANGUAGES['fi'])
+            pattern = re.compile(re.escape(prefix_no_accents), re.IGNORECASE)
+            self.assertEqual(
+                sorted(d.prefix_completions(prefix)),
+                sorted(word for (word, key) in d.word_pairs
+                       if pattern.match(key)))
+
+    def test_fi_FI_dictionary_cache(self) -> None:
+        with tempfile.TemporaryDirectory() as cache_home, \
+             unittest.mock.patch.dict(
+                 os.environ, {'XDG_CACHE_HOME': cache_home}):
+            d = hunspell_suggest.Dictionary('fi_FI')
+            # Parses the .dic file because the cache is empty and
+            # writes the cache file:
+            d.load_dictionary()
+            parsed = (list(d.words), list(d.word_pairs),
+                      list(d.prefix_keys), list(d.prefix_indexes),
+                      d.max_word_len, d.encoding)
+            self.assertTrue(d.load_from_cache(d.dic_path))
+            cached = (list(d.words), list(d.word_pairs),
+                      list(d.prefix_keys), list(d.prefix_indexes),
+                      d.max_word_len, d.encoding)
+            self.assertEqual(parsed, cached)
+            # A cache file which does not match the .dic file anymore
+            # is not used:
+            with unittest.mock.patch.object(
+                    hunspell_suggest, 'DICTIONARY_CACHE_VERSION', 0):
+                self.assertFalse(d.load_from_cache(d.dic_path))
+
+    def test_fi_FI_correction_index(self) -> None:
+        d = hunspell_suggest.Dictionary('fi_FI')
+        d.build_correction_index()
+        self.assertEqual(
+            d.correction_suggest('kisssa')[0:3],
+            ['kissa', 'kissaa', 'kisassa'])
+        # Accent insensitive:
+        self.assertEqual(
+            d.correction_suggest(unicodedata.normalize(
+                itb_util.NORMALIZATION_FORM_INTERNAL,
+                'Pariisin-suurlähettila')),
+            [unicodedata.normalize(
+                itb_util.NORMALIZATION_FORM_INTERNAL,
+                'Pariisin-suurlähettiläs')])
+        # Finds the same words as comparing with every word:
+        for typo in ('ksisa', 'talossamme', 'sanakirjaa', 'Suomme'):
+            key = itb_util.remove_accents(
+                typo, keep=itb_util.ACCENT_LANGUAGES['fi']).casefold()
+            expected = sorted(
+                word for (word, match_key) in d.word_pairs
+                if hunspell_suggest.edit_distance(
+                    key, match_key.casefold(), 2) <= 2)
+            suggestions = d.correction_suggest(typo)
+            if len(expected) < hunspell_suggest.CORRECTION_MAX_RESULTS:
+                self.assertEqual(sorted(suggestions), expected)
+            else:
+                self.assertTrue(set(suggestions) <= set(expected))
+        self.assertEqual(d.correction_suggest('xyzxyzxyzxyz'), [])
+        # Not more than CORRECTION_MAX_CANDIDATES words are verified,
+        # even if a group has more. More than 100 words start with
+        # “kirjoit”:
+        with unittest.mock.patch.object(
+                hunspell_suggest, 'CORRECTION_MAX_CANDIDATES', 3), \
+             unittest.mock.patch.object(
+                 hunspell_suggest, 'edit_distance',
+                 wraps=hunspell_suggest.edit_distance) as edit_distance:
+            self.assertEqual(d.correction_suggest('kirjoita'),
+                             ['kirjoita', 'kirjoitan', 'kirjoitat'])
+            self.assertEqual(edit_distance.call_count, 3)
+        h = hunspell_suggest.Hunspell(['fi_FI'])
+        with unittest.mock.patch.object(
+                hunspell_suggest.Dictionary, 'spellcheck_suggest',
+                autospec=True, return_value=['native']) as native:
+            self.assertEqual(h.suggest('kisssa'), [('native', -1)])
+            h.set_fast_correction_dictionaries(['fi_*'])
+            self.assertEqual(h.suggest('kisssa')[0:3],
+                             [('kissa', -1), ('kissaa', -2), ('kisassa', -3)])
+            self.assertEqual(native.call_count, 1)
+            # The native suggestions are the fallback if the index
+            # finds nothing:
+            self.assertEqual(h.suggest('xyzxyzxyzxyz'), [('native', -1)])
+            self.assertEqual(native.call_count, 2)
+
     @unittest.skipUnless(
         testutils.get_libvoikko_version() >= '4.3',
         "Skipping, requires python3-libvoikko version >= 4.3.")
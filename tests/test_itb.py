@@ -76,6 +76,7 @@ sys.path.insert(0, "../engine")
 # pylint: disable=import-error
 import hunspell_table
 import tabsqlitedb
+import hunspell_suggest
 import itb_util
 import m17n_translit
 # pylint: enable=import-error
@@ -853,6 +854,178 @@ class ItbTestCase(unittest.TestCase):
         self.engine.do_process_key_event(IBus.KEY_F1, 0, 0)
         self.assertEqual(self.engine.mock_committed_text, 'cerulean ')
 
+    def test_candidates_worker_drops_stale_results(self) -> None:
+        self.engine.set_current_imes(
+            ['NoIME', 't-latn-post'], update_gsettings=False)
+        self.engine.set_dictionary_names(
+            ['en_US'], update_gsettings=False)
+        self.engine.do_process_key_event(IBus.KEY_c, 0, 0)
+        self.engine.do_process_key_event(IBus.KEY_e, 0, 0)
+        self.engine.do_process_key_event(IBus.KEY_r, 0, 0)
+        self.engine.do_process_key_event(IBus.KEY_u, 0, 0)
+        # Simulate a request in flight in the worker thread:
+        request = self.engine._new_candidates_request()
+        result = self.engine._compute_candidates(request)
+        self.assertIsNotNone(result)
+        assert result is not None # for mypy
+        self.engine._candidates_request = request
+        # A newer key stroke cancels it and its result is dropped:
+        self.engine.do_process_key_event(IBus.KEY_l, 0, 0)
+        self.assertTrue(request.cancel_event.is_set())
+        candidates_before = self.engine._candidates[:]
+        self.engine._candidates_computed(request, result)
+        self.assertEqual(self.engine._candidates, candidates_before)
+        # A cancelled request stops computing:
+        self.assertIsNone(self.engine._compute_candidates(request))
+        # A result matching the current input is shown:
+        request = self.engine._new_candidates_request()
+        self.engine._candidates_request = request
+        self.engine._candidates_computed(
+            request, ([itb_util.PredictionCandidate(phrase='curly')], True))
+        self.assertEqual(self.engine._candidates[0].phrase, 'curly')
+        self.assertIsNone(self.engine._candidates_request)
+
+    @unittest.skipUnless(
+        itb_util.get_hunspell_dictionary_wordlist('en_US')[0],
+        'Skipping because no US English hunspell dictionary could be found.')
+    def test_candidates_time_budget(self) -> None:
+        self.engine.set_current_imes(
+            ['NoIME', 't-latn-post'], update_gsettings=False)
+        self.engine.set_dictionary_names(
+            ['en_US'], update_gsettings=False)
+        self.engine.do_process_key_event(IBus.KEY_c, 0, 0)
+        self.engine.do_process_key_event(IBus.KEY_e, 0, 0)
+        self.engine.do_process_key_event(IBus.KEY_r, 0, 0)
+        self.engine.do_process_key_event(IBus.KEY_u, 0, 0)
+        fast = ([itb_util.PredictionCandidate(phrase='fast')], True)
+        slow = ([itb_util.PredictionCandidate(phrase='slow')], True)
+        # The fast candidates are not shown while the budget is not over:
+        request = self.engine._new_candidates_request()
+        self.engine._candidates_request = request
+        self.engine._candidates_partially_computed(request, fast)
+        self.assertNotEqual(self.engine._candidates[0].phrase, 'fast')
+        self.engine._candidates_budget_expired(request)
+        self.assertEqual(self.engine._candidates[0].phrase, 'fast')
+        # Showing them does not cancel computing the complete candidates:
+        self.assertIs(self.engine._candidates_request, request)
+        self.assertFalse(request.cancel_event.is_set())
+        # The complete candidates replace them:
+        self.engine._candidates_computed(request, slow)
+        self.assertEqual(self.engine._candidates[0].phrase, 'slow')
+        # The fast candidates are shown as soon as they are ready if
+        # the budget is over already:
+        request = self.engine._new_candidates_request()
+        self.engine._candidates_request = request
+        self.engine._candidates_budget_expired(request)
+        self.engine._candidates_partially_computed(request, fast)
+        self.assertEqual(self.engine._candidates[0].phrase, 'fast')
+        self.assertIs(self.engine._candidates_request, request)
+        # But they are not replaced anymore when the user started
+        # selecting one of them:
+        self.engine._lookup_table.set_cursor_visible(True)
+        self.engine._candidates_computed(request, slow)
+        self.assertEqual(self.engine._candidates[0].phrase, 'fast')
+        # Without the slow sources, there are no spellchecking
+        # suggestions from enchant. Adding them later does not select
+        # the words again:
+        request = self.engine._new_candidates_request()
+        select_words = mock.Mock(wraps=self.engine.database.select_words)
+        with mock.patch.object(
+                hunspell_suggest.Dictionary, 'spellcheck_suggest',
+                autospec=True,
+                return_value=['cure']) as spellcheck_suggest:
+            with mock.patch.object(
+                    self.engine.database, 'select_words', select_words):
+                self.engine.database.hunspell_obj.init_dictionaries()
+                fast_result = self.engine._compute_candidates(
+                    request, slow_sources=False)
+                self.assertEqual(spellcheck_suggest.call_count, 0)
+                select_words_call_count = select_words.call_count
+                self.assertTrue(select_words_call_count)
+                result = self.engine._compute_candidates(request)
+                self.assertEqual(spellcheck_suggest.call_count, 1)
+                self.assertEqual(
+                    select_words.call_count, select_words_call_count)
+        assert fast_result is not None # for mypy
+        assert result is not None # for mypy
+        self.assertNotIn('cure', [x.phrase for x in fast_result[0]])
+        self.assertIn('cure', [x.phrase for x in result[0]])
+        self.assertIn('select_words_without_native_suggestions',
+                      request.timings)
+        self.assertIn('native_suggestions', request.timings)
+        self.assertNotIn('select_words', request.timings)
+
+    def test_emoji_matcher_background_loading(self) -> None:
+        self.engine.set_emoji_prediction_mode(True, update_gsettings=False)
+        self.engine.set_dictionary_names(['en_US'], update_gsettings=False)
+        emoji_matcher_en = self.engine.emoji_matcher
+        self.assertIsNotNone(emoji_matcher_en)
+        self.engine._unit_test = False
+        try:
+            self.engine.set_dictionary_names(
+                ['de_DE'], update_gsettings=False)
+            future_de = self.engine._emoji_matcher_future
+            self.assertIsNotNone(future_de)
+            assert future_de is not None # for mypy
+            # While loading, the old emoji matcher is still used:
+            self.assertIs(self.engine.emoji_matcher, emoji_matcher_en)
+            # The languages change again before loading is finished,
+            # the emoji matcher for de_DE is then not used anymore:
+            self.engine.set_dictionary_names(
+                ['fr_FR'], update_gsettings=False)
+            future_fr = self.engine._emoji_matcher_future
+            self.assertIsNot(future_fr, future_de)
+            assert future_fr is not None # for mypy
+            future_de.result()
+            self.engine._emoji_matcher_loaded(future_de)
+            self.assertIs(self.engine.emoji_matcher, emoji_matcher_en)
+            future_fr.result()
+            self.engine._emoji_matcher_loaded(future_fr)
+            assert self.engine.emoji_matcher is not None # for mypy
+            self.assertEqual(
+                self.engine.emoji_matcher.get_languages(), ['fr_FR'])
+            self.assertIsNone(self.engine._emoji_matcher_future)
+        finally:
+            self.engine._unit_test = True
+
+    def test_emoji_matcher_kept_warm(self) -> None:
+        self.engine.set_emoji_prediction_mode(True, update_gsettings=False)
+        self.engine.set_dictionary_names(['en_US'], update_gsettings=False)
+        emoji_matcher_en = self.engine.emoji_matcher
+        self.assertIsNotNone(emoji_matcher_en)
+        self.engine.set_dictionary_names(['de_DE'], update_gsettings=False)
+        self.assertIsNot(self.engine.emoji_matcher, emoji_matcher_en)
+        # Switching back does not load it again:
+        self.engine.set_dictionary_names(['en_US'], update_gsettings=False)
+        self.assertIs(self.engine.emoji_matcher, emoji_matcher_en)
+
+    def test_autosettings_profiles(self) -> None:
+        self.engine.set_current_imes(['NoIME'], update_gsettings=False)
+        self.engine.set_autosettings(
+            [('inputmethod', 't-latn-post', 'gedit'),
+             ('emojipredictions', 'false', 'gedit'),
+             ('inputmethod', 'NoIME', '[invalid')],
+            update_gsettings=False)
+        # The invalid regular expression is skipped:
+        self.assertEqual(2, len(self.engine._autosettings_rules))
+        im_client = 'xim:gedit:Document 1'
+        self.engine._im_client = im_client
+        self.engine._apply_autosettings()
+        self.assertEqual(['t-latn-post'], self.engine.get_current_imes())
+        self.assertIn(im_client, self.engine._autosettings_profiles)
+        transliterator = self.engine._transliterators['t-latn-post']
+        self.engine._revert_autosettings()
+        self.assertEqual(['NoIME'], self.engine.get_current_imes())
+        self.assertIn('t-latn-post', self.engine._warm_transliterators)
+        # Focusing the same window again reuses the transliterator:
+        self.engine._apply_autosettings()
+        self.assertIs(
+            transliterator, self.engine._transliterators['t-latn-post'])
+        self.engine._revert_autosettings()
+        # Changing the autosettings forgets the profiles:
+        self.engine.set_autosettings([], update_gsettings=False)
+        self.assertNotIn(im_client, self.engine._autosettings_profiles)
+
     def test_ascii_digits(self) -> None:
         self.engine.set_current_imes(
             ['hi-itrans', 'NoIME'], update_gsettings=False)
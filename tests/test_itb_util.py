@@ -21,9 +21,15 @@
 This file implements test cases for miscellaneous stuff in itb_util.py.
 '''
 
+from typing import Dict
+from typing import List
 import sys
 import os
+import json
 import logging
+import tempfile
+import threading
+import concurrent.futures
 import unittest
 import unicodedata
 
@@ -179,6 +185,171 @@ class ItbUtilTestCase(unittest.TestCase):
                     keep=unicodedata.normalize('NFD', 'åÅÖö'))),
             'alkoholförgiftning')
 
+    def test_lru_cache(self) -> None:
+        cache = itb_util.LruCache(
+            'test', max_entries=3, invalidate_on=('dictionaries',))
+        for index in range(5):
+            cache.put(index, str(index))
+        self.assertEqual(len(cache), 3)
+        self.assertEqual(cache.get(0), None)
+        self.assertEqual(cache.get(2), '2')
+        # 2 is now the most recently used entry and survives:
+        cache.put(5, '5')
+        self.assertEqual(cache.get(3), None)
+        self.assertEqual(cache.get(2), '2')
+        info = cache.cache_info()
+        self.assertEqual(
+            (info.hits, info.misses, info.evictions, info.entries),
+            (2, 2, 3, 3))
+        # Byte limit:
+        cache.set_limits(max_entries=100, max_bytes=1000)
+        for index in range(100):
+            cache.put(index, 'x' * 100)
+        info = cache.cache_info()
+        self.assertLessEqual(info.approximate_bytes, 1000)
+        self.assertGreater(info.entries, 0)
+        self.assertLess(info.entries, 10)
+        # A value bigger than the whole cache is not stored:
+        cache.put('big', 'x' * 2000)
+        self.assertNotIn('big', cache)
+        # Invalidation hooks only clear the subscribed caches:
+        itb_util.invalidate_caches('languages')
+        self.assertGreater(len(cache), 0)
+        itb_util.invalidate_caches('dictionaries')
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(cache.cache_info().approximate_bytes, 0)
+
+    def test_lru_cache_decorator(self) -> None:
+        calls = []
+        @itb_util.lru_cache('test_decorator')
+        def double(value: int) -> int:
+            calls.append(value)
+            return 2 * value
+        self.assertEqual([double(x % 4) for x in range(8)],
+                         [0, 2, 4, 6, 0, 2, 4, 6])
+        self.assertEqual(calls, [0, 1, 2, 3])
+        # Caches created without explicit limits follow the global ones:
+        old_limits = (itb_util.CACHE_MAX_ENTRIES_DEFAULT,
+                      itb_util.CACHE_MAX_BYTES_DEFAULT)
+        try:
+            itb_util.set_cache_limits(max_entries=2)
+            self.assertEqual(double.cache_info().max_entries, 2)
+            self.assertEqual(double.cache_info().entries, 2)
+        finally:
+            itb_util.set_cache_limits(*old_limits)
+        self.assertEqual(double.cache_info().max_entries, old_limits[0])
+
+    def test_functools_lru_cache(self) -> None:
+        calls = []
+        @itb_util.functools_lru_cache(
+            'test_functools', 100, invalidate_on=('dictionaries',))
+        def double(value: int) -> int:
+            calls.append(value)
+            return 2 * value
+        self.assertEqual([double(x % 4) for x in range(8)],
+                         [0, 2, 4, 6, 0, 2, 4, 6])
+        self.assertEqual(calls, [0, 1, 2, 3])
+        info = double.cache_info()
+        self.assertEqual(
+            (info.hits, info.misses, info.evictions, info.entries,
+             info.approximate_bytes),
+            (4, 4, 0, 4, 400))
+        # It follows the global limits, the byte limit is turned
+        # into a limit of entries:
+        old_limits = (itb_util.CACHE_MAX_ENTRIES_DEFAULT,
+                      itb_util.CACHE_MAX_BYTES_DEFAULT)
+        try:
+            itb_util.set_cache_limits(max_bytes=300)
+            self.assertEqual(double.cache_info().max_entries, 3)
+            self.assertEqual([double(x) for x in range(5)],
+                             [0, 2, 4, 6, 8])
+            info = double.cache_info()
+            self.assertEqual((info.entries, info.evictions), (3, 2))
+            # The statistics survive the change of the limits:
+            self.assertEqual((info.hits, info.misses), (4, 9))
+        finally:
+            itb_util.set_cache_limits(*old_limits)
+        self.assertEqual(double.cache_info().max_entries, old_limits[0])
+        double(1)
+        itb_util.invalidate_caches('languages')
+        self.assertEqual(double.cache_info().entries, 1)
+        itb_util.invalidate_caches('dictionaries')
+        self.assertEqual(double.cache_info().entries, 0)
+
+    def test_keystroke_tracer(self) -> None:
+        tracer = itb_util.KeystrokeTracer(max_records=10, write_batch=8)
+        with tempfile.TemporaryDirectory() as tempdir:
+            trace_file = os.path.join(tempdir, 'trace.jsonl')
+            tracer.enable(trace_file=trace_file)
+            for _ in range(20):
+                tracer.begin_keystroke()
+                with tracer.stage('process_key_event'):
+                    with tracer.stage('transliteration'):
+                        pass
+            # Only complete batches have been written so far, wait
+            # until the writer thread is done with them:
+            concurrent.futures.wait(
+                [tracer._writer.submit(lambda: None)]) # type: ignore # pylint: disable=protected-access
+            with open(trace_file, encoding='UTF-8') as trace:
+                self.assertEqual(len(trace.readlines()), 16)
+            # Stages of a worker thread go to the attached record:
+            record = tracer.begin_keystroke()
+            def worker() -> None:
+                tracer.attach(record)
+                with tracer.stage('select_words'):
+                    pass
+            thread = threading.Thread(target=worker)
+            thread.start()
+            thread.join()
+            tracer.flush()
+            records = tracer.records()
+            self.assertEqual(len(records), 10)
+            self.assertEqual(list(records[-1]['stages']), ['select_words'])
+            with open(trace_file, encoding='UTF-8') as trace:
+                written = [json.loads(line) for line in trace]
+            self.assertEqual(len(written), 21)
+            self.assertEqual(written[-10:], records)
+            percentiles = itb_util.keystroke_trace_percentiles(written)
+            self.assertEqual(percentiles['transliteration']['count'], 20)
+            self.assertEqual(percentiles['select_words']['count'], 1)
+            self.assertLessEqual(percentiles['transliteration']['p50'],
+                                 percentiles['transliteration']['p99'])
+            tracer.enable(enabled=False)
+            self.assertIsNone(tracer.begin_keystroke())
+            self.assertEqual(tracer.records(), [])
+
+    def test_shared_instance_registry(self) -> None:
+        registry = itb_util.SharedInstanceRegistry()
+        created = []
+        def factory() -> Dict[str, List[str]]:
+            created.append(1)
+            return {'a': ['b' * 100]}
+        first = registry.acquire(('test', 'a'), factory)
+        second = registry.acquire(('test', 'a'), factory)
+        other = registry.acquire(('test', 'b'), factory)
+        self.assertIs(first, second)
+        self.assertIsNot(first, other)
+        self.assertEqual(len(created), 2)
+        self.assertEqual(registry.refcount(('test', 'a')), 2)
+        # Without measuring, the sizes are unknown:
+        self.assertEqual(
+            [(info.size, info.saved_bytes)
+             for info in registry.info(measure=False)],
+            [(-1, 0), (-1, 0)])
+        infos = {info.key: info for info in registry.info()}
+        self.assertEqual(infos[('test', 'a')].saved_bytes,
+                         infos[('test', 'a')].size)
+        self.assertEqual(infos[('test', 'b')].saved_bytes, 0)
+        registry.release(first)
+        registry.release(second)
+        registry.release(second) # releasing too often does nothing
+        registry.release(None)
+        self.assertEqual(registry.refcount(('test', 'a')), 0)
+        self.assertEqual(registry.refcount(('test', 'b')), 1)
+        # After the last release, a new instance is created:
+        self.assertIsNot(registry.acquire(('test', 'a'), factory), first)
+        self.assertEqual(len(created), 3)
+
     def test_msymbol_for_return_and_escape(self) -> None:
         '''
         Return: https://github.com/mike-fabian/ibus-typing-booster/issues/457
@@ -83,6 +83,19 @@ class KeyvalsToKeycodesTestCase(unittest.TestCase):
         self.assertEqual([], self._keyvals_to_keycodes.ibus_keycodes(0))
         self.assertEqual(0, self._keyvals_to_keycodes.ibus_keycode(0))
 
+    def test_shared_instance(self) -> None:
+        keyvals_to_keycodes = itb_util.get_keyvals_to_keycodes()
+        self.assertIs(keyvals_to_keycodes, itb_util.get_keyvals_to_keycodes())
+        self.assertIs(keyvals_to_keycodes.keyvals(),
+                      keyvals_to_keycodes.keyvals())
+        self.assertEqual(self._keyvals_to_keycodes.keyvals_to_keycodes,
+                         keyvals_to_keycodes.keyvals_to_keycodes)
+        # After the keymap changed, it is computed again:
+        # pylint: disable=protected-access
+        itb_util._on_keys_changed(itb_util.KeyvalsToKeycodes.keymap())
+        self.assertIsNot(keyvals_to_keycodes,
+                         itb_util.get_keyvals_to_keycodes())
+
     def test_print_stuff_to_test_log(self) -> None:
         # Print information about the keval <-> keycode mapping to the
         # test log:
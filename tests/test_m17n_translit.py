@@ -29,6 +29,7 @@ import glob
 import shutil
 import locale
 import tempfile
+import time
 import logging
 import unittest
 
@@ -1066,6 +1067,50 @@ class M17nTranslitTestCase(unittest.TestCase):
             trans.transliterate(['j', 'd', 'G-1', '/']).encode('utf-8'),
             b'\xe0\xa4\xb0\xe0\xa5\x8d\xe2\x80\x8d\xe0\xa4\xaf')
 
+    def test_transliterate_incremental(self) -> None:
+        # Type words key by key like the engine does, with some
+        # deletions at the end and one edit in the middle, and check
+        # that the incremental transliteration gives exactly the same
+        # results as replaying the whole input on each key:
+        inputs = {
+            'hi-itrans': list('namaste duniyaa. aapa kaise hai.n? '),
+            'ko-romaja': list('annyeonghaseyo mannaseo bangapseumnida '),
+            't-latn-post': list('gru"n a"rger u"berma"ssig Sto"rung '),
+        }
+        for ime, msymbols in inputs.items():
+            trans_full = m17n_translit.Transliterator(ime)
+            trans_incremental = m17n_translit.Transliterator(ime)
+            keystrokes = [msymbols[:i] for i in range(len(msymbols) + 1)]
+            keystrokes += [msymbols[:-3], msymbols[:-1]]
+            keystrokes += [msymbols[:2] + msymbols[3:], msymbols]
+            for typed in keystrokes:
+                self.assertEqual(
+                    trans_incremental.transliterate_parts_incremental(typed),
+                    trans_full.transliterate_parts(typed))
+            for typed in keystrokes:
+                self.assertEqual(
+                    trans_incremental.transliterate_incremental(typed),
+                    trans_full.transliterate(typed))
+            # Log how long typing the input key by key takes, only
+            # for information, timings are too unreliable on busy
+            # machines to assert anything about them:
+            repeat = 5
+            time_start = time.perf_counter()
+            for _ in range(repeat):
+                for typed in keystrokes:
+                    trans_full.transliterate(typed)
+            time_full = time.perf_counter() - time_start
+            time_start = time.perf_counter()
+            for _ in range(repeat):
+                for typed in keystrokes:
+                    trans_incremental.transliterate_incremental(typed)
+            time_incremental = time.perf_counter() - time_start
+            LOGGER.info(
+                '%s: %s keys: full replay %.4f s, incremental %.4f s, '
+                'speedup %.1f',
+                ime, len(msymbols), time_full, time_incremental,
+                time_full / max(time_incremental, 1e-9))
+
     def test_t_latn_post(self) -> None:
         trans = m17n_translit.Transliterator('t-latn-post')
         self.assertEqual(trans.transliterate(list('gru"n')), 'grün')
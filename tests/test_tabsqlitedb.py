@@ -29,8 +29,13 @@ from typing import Any
 import sys
 import os
 import gzip
+import time
+import random
+import threading
+import tempfile
 import logging
 import unittest
+from unittest import mock
 
 LOGGER = logging.getLogger('ibus-typing-booster')
 
@@ -158,6 +163,385 @@ class TabSqliteDbTestCase(unittest.TestCase):
     def test_dummy(self) -> None:
         self.assertEqual(True, True)
 
+    def test_select_words_ngrams(self) -> None:
+        self.init_database(user_db_file=':memory:', dictionary_names=[])
+        for (input_phrase, phrase, p_phrase, pp_phrase, user_freq) in (
+                ('colou', 'colour', 'green', 'nice', 1),
+                ('col', 'colour', 'yellow', 'ugly', 2),
+                ('co', 'colour', 'green', 'awesome', 1),
+                ('co', 'cold', '', '', 1),
+                ('conspirac', 'conspiracy', '', '', 5),
+                ('conspi', 'conspiracy', '', '', 1),
+                ('c', 'conspiracy', '', '', 1)):
+            self.database.add_phrase(
+                input_phrase=input_phrase, phrase=phrase,
+                p_phrase=p_phrase, pp_phrase=pp_phrase, user_freq=user_freq)
+        self.assertEqual(
+            [(candidate.phrase, candidate.user_freq)
+             for candidate in self.database.select_words('co')],
+            [('conspiracy', 6/11), ('colour', 4/11), ('cold', 1/11)])
+        self.assertEqual(
+            [(candidate.phrase, candidate.user_freq)
+             for candidate in self.database.select_words(
+                 'co', p_phrase='green')],
+            [('colour', 0.5 * 2/2 + 0.5 * 4/11),
+             ('conspiracy', 6/11), ('cold', 1/11)])
+        self.assertEqual(
+            [(candidate.phrase, candidate.user_freq)
+             for candidate in self.database.select_words(
+                 'co', p_phrase='green', pp_phrase='nice')],
+            [('colour', 0.5 * 1/1 + 0.5 * (0.5 * 2/2 + 0.5 * 4/11)),
+             ('conspiracy', 6/11), ('cold', 1/11)])
+        self.assertEqual(
+            [(candidate.phrase, candidate.user_freq)
+             for candidate in self.database.select_words('cons')],
+            [('conspiracy', 1.0)])
+        self.assertEqual([], self.database.select_words('cx'))
+        # “%” and “_” in the input are not wildcards:
+        self.assertEqual([], self.database.select_words('c%'))
+        self.assertEqual([], self.database.select_words('co_'))
+        self.database.add_phrase(
+            input_phrase='100%', phrase='100%', user_freq=1)
+        self.assertEqual(
+            ['100%'],
+            [candidate.phrase
+             for candidate in self.database.select_words('100%')])
+
+    def test_write_behind(self) -> None:
+        database = tabsqlitedb.TabSqliteDb(user_db_file=':memory:')
+        database_write_behind = tabsqlitedb.TabSqliteDb(
+            user_db_file=':memory:', write_behind=True)
+        for (input_phrase, phrase, p_phrase, pp_phrase) in (
+                ('colou', 'colour', 'green', 'nice'),
+                ('col', 'colour', 'yellow', 'ugly'),
+                ('co', 'colour', 'green', 'nice'),
+                ('co', 'cold', 'green', 'nice'),
+                ('conspi', 'conspiracy', '', ''),
+                ('conspi', 'conspiracy', '', '')):
+            for test_database in (database, database_write_behind):
+                test_database.check_phrase_and_update_frequency(
+                    input_phrase=input_phrase, phrase=phrase,
+                    p_phrase=p_phrase, pp_phrase=pp_phrase)
+        # Nothing has been written yet but the pending updates
+        # are used as if they had been written:
+        self.assertEqual(
+            0, len(database_write_behind.database.execute(
+                'SELECT * FROM phrases;').fetchall()))
+        for (input_phrase, p_phrase, pp_phrase) in (
+                ('co', '', ''),
+                ('co', 'green', ''),
+                ('co', 'green', 'nice'),
+                ('colo', 'yellow', 'ugly')):
+            self.assertEqual(
+                database.select_words(
+                    input_phrase, p_phrase=p_phrase, pp_phrase=pp_phrase),
+                database_write_behind.select_words(
+                    input_phrase, p_phrase=p_phrase, pp_phrase=pp_phrase))
+        self.assertEqual(
+            database.select_words_empty_input('green', 'nice'),
+            database_write_behind.select_words_empty_input('green', 'nice'))
+        self.assertEqual(3, database_write_behind.phrase_exists('colour'))
+        self.assertEqual(2, database_write_behind.phrase_exists('conspiracy'))
+        self.assertTrue(database_write_behind.flush_pending_updates())
+        self.assertEqual(
+            sorted(database.database.execute(
+                'SELECT input_phrase, phrase, p_phrase, pp_phrase, user_freq '
+                'FROM phrases;').fetchall()),
+            sorted(database_write_behind.database.execute(
+                'SELECT input_phrase, phrase, p_phrase, pp_phrase, user_freq '
+                'FROM phrases;').fetchall()))
+        self.assertEqual(3, database_write_behind.phrase_exists('colour'))
+
+    def test_ngram_model(self) -> None:
+        with tempfile.TemporaryDirectory() as tempdir:
+            user_db_file = os.path.join(tempdir, 'user.db')
+            database = tabsqlitedb.TabSqliteDb(user_db_file=user_db_file)
+            rng = random.Random(42)
+            syllables = ('co', 'lo', 'ur', 'ld', 'ns', 'pi', 'ra', 'cy',
+                         'ke', 'ma', 'ti', 'on', 'be', 'st')
+            words = sorted({
+                ''.join(rng.choice(syllables)
+                        for _ in range(rng.randint(1, 5)))
+                for _ in range(3000)})
+            rows = {}
+            for _ in range(50000):
+                phrase = rng.choice(words)
+                input_phrase = phrase[:rng.randint(1, len(phrase))]
+                p_phrase = rng.choice(('',) + tuple(words[:30]))
+                pp_phrase = rng.choice(('',) + tuple(words[:5]))
+                rows[(input_phrase, phrase, p_phrase, pp_phrase)] = (
+                    rng.randint(1, 10))
+            database.database.executemany(
+                'INSERT INTO user_db.phrases (input_phrase, phrase, '
+                'p_phrase, pp_phrase, user_freq, timestamp) '
+                'VALUES (?, ?, ?, ?, ?, 0);',
+                [key + (user_freq,) for key, user_freq in rows.items()])
+            database.database.commit()
+            database.database.close()
+            database_model = tabsqlitedb.TabSqliteDb(
+                user_db_file=user_db_file, ngram_model=True)
+            database = tabsqlitedb.TabSqliteDb(user_db_file=user_db_file)
+            queries = [
+                (word[:length], rng.choice(words[:30]), rng.choice(words[:5]))
+                for word in rng.sample(words, 200)
+                for length in (1, 2, 4)]
+            queries += [('', p_phrase, pp_phrase)
+                        for (_, p_phrase, pp_phrase) in queries[:100]]
+            for (input_phrase, p_phrase, pp_phrase) in queries:
+                self.assertEqual(
+                    database.select_words(
+                        input_phrase, p_phrase=p_phrase, pp_phrase=pp_phrase),
+                    database_model.select_words(
+                        input_phrase, p_phrase=p_phrase, pp_phrase=pp_phrase))
+            for (name, test_database) in (('sqlite', database),
+                                          ('ngram model', database_model)):
+                time_start = time.perf_counter()
+                for (input_phrase, p_phrase, pp_phrase) in queries:
+                    test_database.select_words(
+                        input_phrase, p_phrase=p_phrase, pp_phrase=pp_phrase)
+                LOGGER.info(
+                    'select_words() with %s: %.3f ms per call',
+                    name,
+                    1000 * (time.perf_counter() - time_start) / len(queries))
+            # Changes made through the database with the model are
+            # written to the database and seen by the model:
+            database_model.check_phrase_and_update_frequency(
+                input_phrase='colo', phrase='colour',
+                p_phrase=words[0], pp_phrase=words[1])
+            database_model.add_phrase(
+                input_phrase='colo', phrase='colony', user_freq=3)
+            database_model.define_user_shortcut(
+                input_phrase='co', phrase='corporation')
+            database_model.remove_phrase(phrase=words[-1])
+            database_model.remove_phrase(
+                input_phrase=words[-2][:2], phrase=words[-2])
+            for (input_phrase, p_phrase, pp_phrase) in (
+                    ('co', words[0], words[1]),
+                    ('colo', words[0], ''),
+                    (words[-1][:2], '', ''),
+                    (words[-2][:1], '', ''),
+                    (words[-2][:2], '', ''),
+                    ('', words[0], words[1])):
+                self.assertEqual(
+                    database.select_words(
+                        input_phrase, p_phrase=p_phrase, pp_phrase=pp_phrase),
+                    database_model.select_words(
+                        input_phrase, p_phrase=p_phrase, pp_phrase=pp_phrase))
+            # Changes made through a different connection, for example
+            # by the setup tool, are seen by the model as well:
+            database.remove_phrase(input_phrase='colo', phrase='colony')
+            self.assertEqual(
+                database.select_words('colo', p_phrase=words[0]),
+                database_model.select_words('colo', p_phrase=words[0]))
+            self.assertNotIn(
+                'colony',
+                [x.phrase for x in database_model.select_words('colo')])
+            database.remove_all_phrases()
+            self.assertEqual([], database_model.select_words('co'))
+            self.assertEqual(
+                [], database_model.select_words('', p_phrase=words[0],
+                                                pp_phrase=words[1]))
+            database.database.close()
+            database_model.database.close()
+
+    def test_cleanup_database(self) -> None:
+        self.init_database(user_db_file=':memory:', dictionary_names=[])
+        rows = []
+        for i in range(150):
+            # Every 10th row is a shortcut, the others alternate
+            # between user_freq 1 and 4. Higher ids are newer:
+            user_freq = 1 + 3 * (i % 2)
+            if i % 10 == 9:
+                user_freq = itb_util.SHORTCUT_USER_FREQ
+            rows.append((f'in{i}', f'phrase{i}', '', '', user_freq, float(i)))
+        self.database.database.executemany(
+            'INSERT INTO user_db.phrases (input_phrase, phrase, '
+            'p_phrase, pp_phrase, user_freq, timestamp) '
+            'VALUES (?, ?, ?, ?, ?, ?);', rows)
+        self.database.database.commit()
+        with mock.patch.object(tabsqlitedb, 'CLEANUP_MAX_ROWS', 100):
+            self.database.cleanup_database(thread=False)
+        remaining = {
+            phrase: user_freq
+            for (phrase, user_freq) in self.database.database.execute(
+                'SELECT phrase, user_freq FROM phrases;').fetchall()}
+        # 1st pass: the 50 rows with the lowest user_freq and the
+        # oldest timestamps are deleted, these are the rows with
+        # user_freq 1 and i < 100:
+        for i in range(0, 100, 2):
+            self.assertNotIn(f'phrase{i}', remaining)
+        # Shortcuts are never deleted:
+        for i in range(9, 150, 10):
+            self.assertEqual(
+                itb_util.SHORTCUT_USER_FREQ, remaining[f'phrase{i}'])
+        # 2nd pass: Of the 100 remaining rows, only the oldest one is
+        # decayed (0.1% of CLEANUP_MAX_ROWS=100 is 0.1, rounded up
+        # to 1 row):
+        self.assertEqual(2, remaining['phrase1'])
+        self.assertEqual(4, remaining['phrase3'])
+        self.assertEqual(100, len(remaining))
+
+    def test_cleanup_database_decay_boundary(self) -> None:
+        # How many of the oldest rows the 2nd pass of the cleanup
+        # decays, 0.1% of CLEANUP_MAX_ROWS rounded up:
+        for (max_rows, decayed) in ((1, 1), (999, 1), (1000, 1),
+                                    (1001, 2), (2000, 2), (2001, 3)):
+            self.init_database(user_db_file=':memory:', dictionary_names=[])
+            self.database.database.executemany(
+                'INSERT INTO user_db.phrases (input_phrase, phrase, '
+                'p_phrase, pp_phrase, user_freq, timestamp) '
+                'VALUES (?, ?, ?, ?, ?, ?);',
+                [(f'in{i}', f'phrase{i}', '', '', 4, float(i))
+                 for i in range(max_rows)])
+            self.database.database.commit()
+            with mock.patch.object(tabsqlitedb, 'CLEANUP_MAX_ROWS', max_rows):
+                self.database.cleanup_database(thread=False)
+            self.assertEqual(
+                [(f'phrase{i}', 2) for i in range(decayed)],
+                self.database.database.execute(
+                    'SELECT phrase, user_freq FROM phrases '
+                    'WHERE user_freq != 4 ORDER BY id;').fetchall(),
+                f'max_rows={max_rows}')
+
+    def test_read_training_data_streaming(self) -> None:
+        self.init_database(user_db_file=':memory:', dictionary_names=[])
+        rng = random.Random(4711)
+        words = ['Two', 'roads', 'diverged', 'grün', 'Straße', '(wood)']
+        with tempfile.TemporaryDirectory() as tempdir:
+            training_file = os.path.join(tempdir, 'training.txt.gz')
+            with gzip.open(training_file, 'wt', encoding='UTF-8') as text:
+                for _ in range(2000):
+                    text.write(' '.join(rng.choice(words)
+                                        for _ in range(rng.randint(0, 9))))
+                    text.write('\n')
+            # The n-grams counted over the whole text, the context
+            # continues across lines and chunks:
+            expected: Dict[Any, int] = {}
+            p_token = pp_token = ''
+            with gzip.open(training_file, 'rt', encoding='UTF-8') as text:
+                for line in text:
+                    for token in itb_util.tokenize(line):
+                        key = (itb_util.remove_accents(token.lower()),
+                               itb_util.remove_accents(p_token.lower()),
+                               itb_util.remove_accents(pp_token.lower()))
+                        expected[key] = expected.get(key, 0) + 1
+                        (pp_token, p_token) = (p_token, token)
+            def rows() -> Dict[Any, int]:
+                return {
+                    (input_phrase, p_phrase, pp_phrase): user_freq
+                    for (input_phrase, p_phrase, pp_phrase, user_freq)
+                    in self.database.database.execute(
+                        'SELECT input_phrase, p_phrase, pp_phrase, '
+                        'user_freq FROM phrases;').fetchall()}
+            cancel_event = threading.Event()
+            progress = []
+            def progress_callback(fraction: float) -> None:
+                progress.append(fraction)
+                if len(progress) == 5:
+                    cancel_event.set()
+            with mock.patch.object(
+                    tabsqlitedb, 'TRAINING_CHUNK_BYTES', 1000), \
+                 mock.patch.object(
+                     tabsqlitedb, 'TRAINING_MAX_NGRAMS', 50):
+                # Cancelled, what has been learned so far is kept:
+                self.assertFalse(
+                    self.database.read_training_data_from_file(
+                        training_file,
+                        progress_callback=progress_callback,
+                        cancel_event=cancel_event,
+                        processes=2))
+                partial = rows()
+                self.assertGreater(len(partial), 0)
+                self.assertLess(sum(partial.values()), sum(expected.values()))
+                # Training again continues where it stopped:
+                cancel_event.clear()
+                self.assertTrue(
+                    self.database.read_training_data_from_file(
+                        training_file,
+                        progress_callback=progress_callback,
+                        cancel_event=cancel_event,
+                        processes=2))
+                self.assertEqual(expected, rows())
+                self.assertEqual(1.0, progress[-1])
+                # Training from the file once more adds to the counts:
+                self.assertTrue(
+                    self.database.read_training_data_from_file(
+                        training_file, processes=1))
+                self.assertEqual(
+                    {key: 2 * count for key, count in expected.items()},
+                    rows())
+
+    def test_indexes_not_redundant(self) -> None:
+        self.init_database(user_db_file=':memory:', dictionary_names=[])
+        # An older version created a covering index duplicating
+        # the columns of the UNIQUE index, it is dropped:
+        self.database.database.execute(
+            'CREATE INDEX user_db.phrases_index_covering ON phrases '
+            '(input_phrase, p_phrase, pp_phrase, phrase, user_freq);')
+        self.assertTrue(self.database.create_indexes())
+        indexes = {
+            name: [row[2] for row in self.database.database.execute(
+                f'PRAGMA user_db.index_info({name});').fetchall()]
+            for (name,) in self.database.database.execute(
+                "SELECT name FROM user_db.sqlite_master WHERE type = 'index' "
+                "AND tbl_name = 'phrases' AND sql IS NOT NULL "
+                "AND sql NOT LIKE '%WHERE%';").fetchall()}
+        self.assertNotIn('phrases_index_covering', indexes)
+        self.assertEqual(['input_phrase', 'p_phrase', 'pp_phrase', 'phrase'],
+                         indexes['phrases_index_unique'])
+        # No index is only a longer version of another one:
+        for (name, columns) in indexes.items():
+            for (other_name, other_columns) in indexes.items():
+                if name != other_name:
+                    self.assertNotEqual(
+                        columns[:len(other_columns)], other_columns,
+                        f'{name} {columns} {other_name} {other_columns}')
+        # The range scans of select_words() use the UNIQUE index:
+        plan = ' '.join(
+            row[-1] for row in self.database.database.execute(
+                'EXPLAIN QUERY PLAN SELECT phrase, sum(user_freq) '
+                'FROM user_db.phrases WHERE input_phrase >= ? '
+                'AND input_phrase < ? GROUP BY phrase;',
+                ('co', 'cp')).fetchall())
+        self.assertIn('phrases_index_unique', plan)
+
+    @unittest.skipUnless(
+        sys.version_info >= (3, 11),
+        'Skipping, the trace callback needs to get the expanded SQL.')
+    def test_query_plans_without_full_table_scans(self) -> None:
+        self.init_database(user_db_file=':memory:', dictionary_names=[])
+        for i in range(100):
+            self.database.add_phrase(
+                input_phrase=f'word{i}', phrase=f'word{i}',
+                p_phrase=f'p{i % 7}', pp_phrase=f'pp{i % 5}', user_freq=i)
+        self.database.define_user_shortcut(
+            input_phrase='xyz', phrase='shortcut')
+        statements = []
+        self.database.database.set_trace_callback(statements.append)
+        self.database.select_words('word1', p_phrase='p1', pp_phrase='pp1')
+        self.database.select_words_empty_input('p1', 'pp1')
+        self.database.select_shortcuts('xy')
+        self.database.list_user_shortcuts()
+        self.database.check_phrase_and_update_frequency(
+            input_phrase='word1', phrase='word1',
+            p_phrase='p1', pp_phrase='pp1')
+        self.database.database.set_trace_callback(None)
+        statements = [
+            statement for statement in statements
+            if statement.split()[0].upper() in ('SELECT', 'INSERT', 'UPDATE')]
+        self.assertTrue(statements)
+        for statement in statements:
+            plan = [
+                row[-1] for row in self.database.database.execute(
+                    f'EXPLAIN QUERY PLAN {statement}').fetchall()]
+            for detail in plan:
+                if not detail.startswith('SCAN'):
+                    continue
+                # Scanning only the rows of the partial index
+                # for the shortcuts is OK:
+                self.assertIn('phrases_index_shortcuts', detail,
+                              f'{statement} {plan}')
+
     @unittest.skipUnless(
         itb_util.get_hunspell_dictionary_wordlist('en_US')[0],
         'Skipping because no en_US hunspell dictionary could be found.')